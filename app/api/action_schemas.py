@@ -200,3 +200,14 @@ VIDEOS_REMIX_BODY = _json_body(
         "additionalProperties": True,
     }
 )
+
+# --- binary uploads ----------------------------------------------------------
+# The `:raw` siblings of the base64 upload wrappers take the bytes themselves.
+# They are not in the Actions document (ChatGPT cannot send a binary body); the
+# schema is for /docs and for agents that can.
+OCTET_STREAM_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/octet-stream": {"schema": {"type": "string", "format": "binary"}}},
+    }
+}
@@ -0,0 +1,295 @@
+# app/api/archive_stream.py
+"""Stream many upstream files to the client as one zip or tar archive.
+
+Why this exists
+---------------
+Getting every output of a code-interpreter run meant one list call, then one
+content request per file, one after another. The archive routes
+(GET /v1/containers/{id}/files:archive and GET /v1/files:archive) do it all
+in one response:
+
+- Entries are downloaded ARCHIVE_CONCURRENCY at a time. Each one goes into
+  its own spool, which stays in memory up to UPLOAD_SPOOL_MEMORY_BYTES and
+  then spills to disk. The archive is never staged as a whole.
+- Entries are written in the order their downloads finish, so the client
+  receives bytes while the slower files are still downloading. The queue
+  between downloads and writer is bounded, so a slow client holds the
+  downloads back rather than filling the disk.
+- zip entries are written with the stdlib zipfile in streaming mode: STORED
+  with data descriptors, and ZIP64 when an entry needs it. Tar is ustar/PAX.
+  Entry names are made relative, `..` is dropped, and duplicates get a
+  ` (n)` suffix.
+- The status line goes out before any entry is fetched, so a file that
+  cannot be fetched (upstream error, refused by a guard) cannot fail the
+  response. It is left out of the archive and listed in a final
+  `_archive_errors.json` entry.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import posixpath
+import tarfile
+import time
+import zipfile
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import httpx
+from fastapi import HTTPException
+from starlette.responses import StreamingResponse
+
+from app.api.forward_openai import _get_timeout_seconds, build_outbound_headers, build_upstream_url
+from app.api.upload_stream import _new_spool
+from app.core.config import get_settings
+from app.core.http_client import get_async_httpx_client
+
+FORMATS = {"zip": "application/zip", "tar": "application/x-tar"}
+ERRORS_ENTRY = "_archive_errors.json"
+
+_CHUNK = 256 * 1024
+# Inbound headers that must not reach the per-entry downloads.
+_DROP_HEADERS = {"range", "if-range", "accept", "if-none-match", "if-modified-since"}
+
+
+class EntryError(Exception):
+    """This entry cannot be included; the message goes into the errors entry."""
+
+
+@dataclass
+class ArchiveJob:
+    """One archive entry. `resolve` returns (entry name, upstream content path) or raises EntryError."""
+
+    label: str
+    resolve: Callable[[], Awaitable[Tuple[str, str]]]
+
+
+@dataclass
+class _Fetched:
+    name: str
+    spool: Any
+    size: int
+
+
+@dataclass
+class _Failed:
+    label: str
+    error: str
+
+
+def archive_format(value: Optional[str]) -> str:
+    fmt = (value or "zip").lower()
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(FORMATS)}")
+    return fmt
+
+
+def max_files() -> int:
+    return max(int(getattr(get_settings(), "ARCHIVE_MAX_FILES", 500)), 1)
+
+
+def safe_name(name: str) -> str:
+    parts = [p for p in posixpath.normpath("/" + name.replace("\\", "/")).split("/") if p not in ("", ".", "..")]
+    return "/".join(parts) or "file"
+
+
+class _UniqueNames:
+    def __init__(self) -> None:
+        self._taken: set[str] = set()
+
+    def take(self, name: str) -> str:
+        candidate, n = name, 0
+        stem, ext = posixpath.splitext(name)
+        while candidate in self._taken:
+            n += 1
+            candidate = f"{stem} ({n}){ext}"
+        self._taken.add(candidate)
+        return candidate
+
+
+# --- writers ---------------------------------------------------------------------
+
+
+class _Sink:
+    """Unseekable file object for zipfile; written bytes are collected for the next yield."""
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buf += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+
+class _ZipWriter:
+    def __init__(self) -> None:
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True)  # type: ignore[arg-type]
+        self._entry: Any = None
+
+    def start(self, name: str, size: int) -> bytes:
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.file_size = size
+        info.external_attr = 0o644 << 16
+        self._entry = self._zip.open(info, "w")
+        return self._sink.drain()
+
+    def data(self, chunk: bytes) -> bytes:
+        self._entry.write(chunk)
+        return self._sink.drain()
+
+    def end(self) -> bytes:
+        self._entry.close()
+        self._entry = None
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        self._zip.close()
+        return self._sink.drain()
+
+
+class _TarWriter:
+    def __init__(self) -> None:
+        self._size = 0
+
+    def start(self, name: str, size: int) -> bytes:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self._size = size
+        return info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8", errors="surrogateescape")
+
+    def data(self, chunk: bytes) -> bytes:
+        return chunk
+
+    def end(self) -> bytes:
+        return b"\0" * (-self._size % tarfile.BLOCKSIZE)
+
+    def close(self) -> bytes:
+        return b"\0" * (2 * tarfile.BLOCKSIZE)
+
+
+# --- downloads -------------------------------------------------------------------
+
+
+async def _download(job: ArchiveJob, inbound_headers: Mapping[str, str]) -> Union[_Fetched, _Failed]:
+    try:
+        name, upstream_path = await job.resolve()
+    except EntryError as exc:
+        return _Failed(job.label, str(exc))
+    except HTTPException as exc:
+        return _Failed(job.label, str(exc.detail))
+
+    headers = {k: v for k, v in inbound_headers.items() if k.lower() not in _DROP_HEADERS}
+    client = get_async_httpx_client()
+    req = client.build_request(
+        "GET",
+        build_upstream_url(upstream_path),
+        headers=build_outbound_headers(headers, path_hint=upstream_path),
+        timeout=_get_timeout_seconds(get_settings()),
+    )
+    spool = _new_spool()
+    size = 0
+    try:
+        async with contextlib.aclosing(await client.send(req, stream=True)) as upstream:
+            if upstream.status_code != 200:
+                await upstream.aread()
+                spool.close()
+                return _Failed(job.label, f"upstream HTTP {upstream.status_code}")
+            async for chunk in upstream.aiter_bytes(_CHUNK):
+                size += len(chunk)
+                await asyncio.to_thread(spool.write, chunk)
+    except httpx.HTTPError as exc:
+        spool.close()
+        return _Failed(job.label, f"{type(exc).__name__}: {exc}")
+    except BaseException:
+        spool.close()
+        raise
+    return _Fetched(name, spool, size)
+
+
+async def _entries(
+    jobs: Sequence[ArchiveJob], inbound_headers: Mapping[str, str], concurrency: int
+) -> AsyncIterator[Union[_Fetched, _Failed]]:
+    """Download results in completion order; at most `concurrency` in flight plus `concurrency` queued."""
+    queue: asyncio.Queue[Union[_Fetched, _Failed]] = asyncio.Queue(maxsize=concurrency)
+    gate = asyncio.Semaphore(concurrency)
+
+    async def run(job: ArchiveJob) -> None:
+        async with gate:
+            try:
+                result = await _download(job, inbound_headers)
+            except Exception as exc:  # one bad entry must not stall the archive
+                result = _Failed(job.label, f"{type(exc).__name__}: {exc}")
+            try:
+                await queue.put(result)
+            except BaseException:
+                if isinstance(result, _Fetched):
+                    result.spool.close()
+                raise
+
+    tasks = [asyncio.create_task(run(job)) for job in jobs]
+    try:
+        for _ in jobs:
+            yield await queue.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        while not queue.empty():
+            leftover = queue.get_nowait()
+            if isinstance(leftover, _Fetched):
+                leftover.spool.close()
+
+
+async def _archive_bytes(
+    jobs: Sequence[ArchiveJob], inbound_headers: Mapping[str, str], fmt: str, concurrency: int
+) -> AsyncIterator[bytes]:
+    writer: Union[_ZipWriter, _TarWriter] = _ZipWriter() if fmt == "zip" else _TarWriter()
+    names = _UniqueNames()
+    errors: List[Dict[str, str]] = []
+    # aclosing: a client that disconnects cancels the downloads still running.
+    async with contextlib.aclosing(_entries(jobs, inbound_headers, concurrency)) as entries:
+        async for item in entries:
+            if isinstance(item, _Failed):
+                errors.append({"entry": item.label, "error": item.error})
+                continue
+            try:
+                yield writer.start(names.take(item.name), item.size)
+                item.spool.seek(0)
+                while chunk := await asyncio.to_thread(item.spool.read, _CHUNK):
+                    yield writer.data(chunk)
+                yield writer.end()
+            finally:
+                item.spool.close()
+    if errors:
+        report = json.dumps({"errors": errors}, indent=2).encode()
+        yield writer.start(names.take(ERRORS_ENTRY), len(report))
+        yield writer.data(report)
+        yield writer.end()
+    yield writer.close()
+
+
+def archive_response(
+    jobs: Sequence[ArchiveJob], *, inbound_headers: Mapping[str, str], fmt: str, filename: str
+) -> StreamingResponse:
+    """A streamed zip/tar of `jobs` (see the module docstring)."""
+    if len(jobs) > max_files():
+        raise HTTPException(status_code=400, detail=f"Archive would hold {len(jobs)} files; the limit is {max_files()}")
+    concurrency = max(int(getattr(get_settings(), "ARCHIVE_CONCURRENCY", 4)), 1)
+    return StreamingResponse(
+        _archive_bytes(jobs, inbound_headers, fmt, concurrency),
+        media_type=FORMATS[fmt],
+        headers={"content-disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
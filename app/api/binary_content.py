@@ -0,0 +1,262 @@
+# app/api/binary_content.py
+"""Streaming binary downloads with HTTP Range support.
+
+Why this exists
+---------------
+The three content routes (/v1/files/{id}/content, /v1/videos/{id}/content,
+/v1/containers/{cid}/files/{fid}/content) forwarded `Range` upstream, but
+they buffered the response or reset its headers. They never advertised
+`Accept-Ranges`. A video player that seeks, or a downloader that resumes,
+fetched the whole file every time. The containers route also built its
+response headers with `filter_upstream_headers`. That is the *outbound*
+header builder, so every container download sent the upstream API key back
+to the caller as `Authorization`.
+
+The routes now share this module:
+
+- `open_upstream_content()` sends the GET with `Range` and `If-Range` forwarded
+  and returns the unread streaming response. A transport failure is a 424, as
+  in forward_openai_request.
+- `content_response()` turns it into the relay's response:
+  - an upstream 206, single- or multi-range, passes through with its
+    Content-Range, Content-Length and Accept-Ranges;
+  - if upstream ignored the Range and sent a 200 of known length, the relay
+    cuts the requested ranges out of the stream itself. It returns a 206 or a
+    multipart/byteranges 206, or a 416 when nothing is satisfiable. The
+    upstream connection is closed as soon as the last range has been sent, so
+    seeking near the start of a large video does not download the rest;
+  - upstream errors are read and returned with their own status.
+
+Requests carrying If-Range are not cut locally: the relay cannot check the
+validator, and sending the full 200 is always correct.
+"""
+
+from __future__ import annotations
+
+import secrets
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException, Request
+from starlette.background import BackgroundTask
+from starlette.responses import Response, StreamingResponse
+
+from app.api.forward_openai import (
+    _filter_response_headers,
+    _get_timeout_seconds,
+    build_outbound_headers,
+    build_upstream_url,
+)
+from app.core.http_client import get_async_httpx_client
+from app.core.settings import get_settings
+
+# More ranges than this is treated as no Range at all (whole file), as RFC 9110 allows.
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    def __init__(self, size: int) -> None:
+        super().__init__(f"no satisfiable range in {size} bytes")
+        self.size = size
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """Parse a `Range: bytes=...` header against a body of `size` bytes.
+
+    Returns (start, end) pairs, end exclusive, sorted and with overlapping or
+    adjacent ranges merged. Returns None when there is no header, or when it is
+    malformed or not in bytes; the caller then serves the whole body. Raises
+    RangeNotSatisfiable when the header is valid but no range falls inside the
+    body.
+    """
+    if not header:
+        return None
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges: List[Tuple[int, int]] = []
+    for part in spec.split(","):
+        first, sep, last = part.strip().partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or not (first or last):
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = min(int(last) + 1, size) if last else size
+                if start < 0 or (last and int(last) < start):
+                    return None
+            else:
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                start, end = max(size - suffix, 0), size
+        except ValueError:
+            return None
+        if start < end:
+            ranges.append((start, end))
+    if len(ranges) > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable(size)
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+async def open_upstream_content(
+    request: Request,
+    upstream_path: str,
+    *,
+    client: Optional[httpx.AsyncClient] = None,
+    base_url: Optional[str] = None,
+    whole: bool = False,
+) -> httpx.Response:
+    """GET `upstream_path` with the caller's query, Range and If-Range; the body is left unread.
+
+    With whole=True the Range headers are dropped and the full body is requested
+    (the content cache fills this way). The caller owns the response and must
+    close it, normally by handing it to content_response().
+    """
+    s = get_settings()
+    client = client or get_async_httpx_client()
+    inbound = request.headers
+    if whole:
+        inbound = {k: v for k, v in request.headers.items() if k.lower() not in ("range", "if-range")}
+    req = client.build_request(
+        "GET",
+        build_upstream_url(upstream_path, request=request, base_url=base_url),
+        headers=build_outbound_headers(inbound, forward_accept=True, path_hint=upstream_path),
+        timeout=_get_timeout_seconds(s),
+    )
+    try:
+        return await client.send(req, stream=True)
+    except httpx.HTTPError as exc:
+        raise HTTPException(status_code=424, detail=f"Upstream request failed: {type(exc).__name__}: {exc}") from exc
+
+
+def _known_length(upstream: httpx.Response) -> Optional[int]:
+    # aiter_bytes() decodes any content-encoding, so only an identity body has a usable length.
+    if upstream.headers.get("content-encoding", "identity").lower() != "identity":
+        return None
+    try:
+        return int(upstream.headers["content-length"])
+    except (KeyError, ValueError):
+        return None
+
+
+async def _select(
+    chunks: AsyncIterator[bytes],
+    ranges: List[Tuple[int, int]],
+    part_head: Optional[Callable[[int, int], bytes]] = None,
+    closing: bytes = b"",
+) -> AsyncIterator[bytes]:
+    """Yield only the bytes of `ranges` from a body stream, framed by part_head when multipart.
+
+    Stops reading as soon as the last range is complete.
+    """
+    pos = 0
+    i = 0
+    async for chunk in chunks:
+        chunk_end = pos + len(chunk)
+        while i < len(ranges):
+            start, end = ranges[i]
+            if start >= chunk_end:
+                break
+            lo, hi = max(start, pos), min(end, chunk_end)
+            if part_head is not None and lo == start:
+                yield part_head(start, end)
+            yield chunk[lo - pos : hi - pos]
+            if end > chunk_end:
+                break
+            if part_head is not None:
+                yield b"\r\n"
+            i += 1
+        pos = chunk_end
+        if i == len(ranges):
+            break
+    if closing:
+        yield closing
+
+
+async def content_response(request: Request, upstream: httpx.Response) -> Response:
+    """The relay's response for an opened upstream download (see the module docstring)."""
+    status = upstream.status_code
+    headers = _filter_response_headers(upstream.headers)
+    media_type = upstream.headers.get("content-type")
+    # Passed as media_type instead; a copied header would override the multipart type.
+    for key in [k for k in headers if k.lower() == "content-type"]:
+        headers.pop(key)
+
+    # IMPORTANT: never raise_for_status(); propagate upstream responses.
+    if status >= 400:
+        try:
+            content = await upstream.aread()
+        finally:
+            await upstream.aclose()
+        return Response(content=content, status_code=status, headers=headers, media_type=media_type)
+
+    size = _known_length(upstream)
+    if size is not None:
+        headers["Content-Length"] = str(size)
+
+    ranges = None
+    if status == 200 and size is not None:
+        headers["Accept-Ranges"] = "bytes"
+        if "if-range" not in request.headers:
+            try:
+                ranges = parse_range(request.headers.get("range"), size)
+            except RangeNotSatisfiable:
+                await upstream.aclose()
+                return Response(
+                    status_code=416,
+                    headers={"Content-Range": f"bytes */{size}", "Accept-Ranges": "bytes"},
+                )
+    elif status == 206:
+        headers.setdefault("Accept-Ranges", "bytes")
+
+    close = BackgroundTask(upstream.aclose)
+    if ranges is None:
+        return StreamingResponse(
+            upstream.aiter_bytes(), status_code=status, headers=headers, media_type=media_type, background=close
+        )
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        headers["Content-Length"] = str(end - start)
+        return StreamingResponse(
+            _select(upstream.aiter_bytes(), ranges),
+            status_code=206,
+            headers=headers,
+            media_type=media_type,
+            background=close,
+        )
+
+    boundary = secrets.token_hex(16)
+    part_type = media_type or "application/octet-stream"
+
+    def part_head(start: int, end: int) -> bytes:
+        return (
+            f"--{boundary}\r\nContent-Type: {part_type}\r\nContent-Range: bytes {start}-{end - 1}/{size}\r\n\r\n"
+        ).encode("latin-1")
+
+    closing = f"--{boundary}--\r\n".encode("latin-1")
+    headers["Content-Length"] = str(
+        sum(len(part_head(s, e)) + (e - s) + 2 for s, e in ranges) + len(closing)
+    )
+    return StreamingResponse(
+        _select(upstream.aiter_bytes(), ranges, part_head, closing),
+        status_code=206,
+        headers=headers,
+        media_type=f"multipart/byteranges; boundary={boundary}",
+        background=close,
+    )
+
@@ -0,0 +1,516 @@
+# app/api/content_cache.py
+"""Opt-in disk cache for immutable binary downloads.
+
+Why this exists
+---------------
+Generated videos, container files and uploaded or batch-output files never
+change once they exist. Every download through the content routes still
+streamed them from upstream again, and repeated video previews made up a
+large share of egress. With CONTENT_CACHE_ENABLED, the routes keep a copy on
+disk and serve it with Starlette's FileResponse. That uses zero-copy sendfile
+when the server supports it, and handles Range, multi-range and If-Range
+itself.
+
+- Key: the resource (e.g. `videos/video_123`), the query string (the videos
+  `variant`) and the credential fingerprint from file_dedup. One project
+  never gets another project's bytes.
+- Writes are atomic. The body is streamed into a `.part` temp file in the
+  cache directory, in a worker thread, and hashed as it goes. It is renamed
+  into place only when it is complete and matches the upstream
+  Content-Length. The JSON sidecar, which records size and SHA-256, is
+  written the same way after that.
+- Integrity: every hit checks the blob's size. Entries found on disk at
+  startup have their SHA-256 re-checked once, on first use. A mismatch drops
+  the entry and the download goes upstream.
+- Eviction is least-recently-used by total size (CONTENT_CACHE_MAX_BYTES).
+  A blob is not unlinked while a response is sending it; eviction catches up
+  when the send ends.
+- Singleflight: concurrent misses for one key share a single upstream
+  download. Plain GETs stream it from the temp file as it is written, so the
+  first bytes go out as soon as upstream sends them. A Range request on a
+  miss is relayed upstream directly (app/api/binary_content.py) so a seeking
+  player is not held up. It starts the fill in the background, so later
+  seeks are served locally.
+- Objects larger than CONTENT_CACHE_MAX_OBJECT_BYTES are never stored. They
+  still stream through the temp file to the clients already reading it,
+  which is deleted afterwards; nothing is downloaded twice. A fill that
+  nobody is reading stops as soon as it is over the limit.
+- Upstream errors are never cached. The fill reads the error once and every
+  waiting client gets it as it is.
+- Several workers may share CONTENT_CACHE_DIR. At startup a worker removes
+  temp files and unindexed blobs only once they are stale, so it does not
+  destroy another worker's fills in progress.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Mapping, Optional, Set
+
+import httpx
+from fastapi import HTTPException, Request
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+from app.api.binary_content import _known_length, content_response, open_upstream_content
+from app.api.file_dedup import credential_fingerprint
+from app.core.config import get_settings
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_HASH_CHUNK = 1024 * 1024
+_READ_CHUNK = 256 * 1024
+
+# Temp files and unindexed blobs younger than this may belong to another worker
+# sharing CONTENT_CACHE_DIR (a fill in progress, or one between its rename and
+# its sidecar), so startup leaves them alone.
+_ORPHAN_GRACE_SECONDS = 3600.0
+
+Opener = Callable[[], Awaitable[httpx.Response]]
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    resource: str
+    size: int
+    sha256: str
+    media_type: Optional[str]
+    content_disposition: Optional[str]
+    stored_at: float
+    verified: bool = True
+
+
+class ContentCache:
+    """Blobs `<key>.bin` plus sidecars `<key>.json` in one directory; LRU index in memory."""
+
+    def __init__(self, root: str, *, max_bytes: int, max_object_bytes: int) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._total = 0
+        self._inflight: Dict[str, "_Fill"] = {}
+        # Keys being sent with FileResponse, and dropped keys whose files wait for those sends.
+        self._serving: Dict[str, int] = {}
+        self._doomed: Set[str] = set()
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def blob_path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.bin")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.json")
+
+    # --- index --------------------------------------------------------------
+
+    def _load(self) -> None:
+        """Rebuild the index from sidecars; stale half-written or orphaned files are removed."""
+        found = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith(".part"):
+                _unlink_stale(path)
+            elif name.endswith(".json"):
+                try:
+                    with open(path, encoding="utf-8") as fh:
+                        entry = CacheEntry(**{**json.load(fh), "verified": False})
+                    if os.path.getsize(self.blob_path(entry.key)) == entry.size:
+                        found.append(entry)
+                        continue
+                except (OSError, ValueError, TypeError):
+                    pass
+                _unlink(path)
+        for entry in sorted(found, key=lambda e: e.stored_at):
+            self._entries[entry.key] = entry
+            self._total += entry.size
+        for name in os.listdir(self.root):
+            if name.endswith(".bin") and name[: -len(".bin")] not in self._entries:
+                _unlink_stale(os.path.join(self.root, name))
+        self._evict()
+
+    def _drop(self, key: str) -> None:
+        # Caller holds the lock.
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total -= entry.size
+            _unlink(self._meta_path(key))
+            if key in self._serving:
+                self._doomed.add(key)
+            else:
+                _unlink(self.blob_path(key))
+
+    def _evict(self) -> None:
+        # Caller holds the lock (or is __init__). Blobs being served are evicted later.
+        for key in [k for k in self._entries if k not in self._serving]:
+            if self._total <= self.max_bytes:
+                break
+            self._drop(key)
+
+    def pin(self, key: str) -> bool:
+        """Keep `key`'s blob on disk while a response sends it; False if it is already gone."""
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._serving[key] = self._serving.get(key, 0) + 1
+            return True
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            left = self._serving.pop(key, 1) - 1
+            if left > 0:
+                self._serving[key] = left
+                return
+            if key in self._doomed:
+                self._doomed.discard(key)
+                _unlink(self.blob_path(key))
+            self._evict()
+
+    def _touch(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            try:
+                intact = os.path.getsize(self.blob_path(key)) == entry.size
+            except OSError:
+                intact = False
+            if not intact:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        """The entry for `key` if its blob is intact; marks it most recently used."""
+        entry = self._touch(key)
+        if entry is not None and not entry.verified:
+            digest = await asyncio.to_thread(_sha256_file, self.blob_path(key))
+            if digest != entry.sha256:
+                logger.warning("content cache: %s failed its integrity check; dropped", entry.resource)
+                with self._lock:
+                    self._drop(key)
+                return None
+            entry.verified = True
+        return entry
+
+    def forget_resource(self, resource: str) -> None:
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e.resource == resource]:
+                self._drop(key)
+
+    # --- fills --------------------------------------------------------------
+
+    def start_fill(self, key: str, resource: str, opener: Opener) -> "_Fill":
+        """The in-flight download for `key`, starting one if there is none (singleflight)."""
+        fill = self._inflight.get(key)
+        if fill is None or fill.finished:
+            fill = _Fill()
+            fill.task = asyncio.create_task(self._download(key, resource, opener, fill))
+            self._inflight[key] = fill
+            fill.task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        return fill
+
+    async def _download(self, key: str, resource: str, opener: Opener, fill: "_Fill") -> Optional[CacheEntry]:
+        entry: Optional[CacheEntry] = None
+        try:
+            try:
+                upstream = await opener()
+            except (HTTPException, httpx.HTTPError):
+                return None
+            try:
+                if upstream.status_code != 200:
+                    # Read once and shared with everyone waiting, so an error is not fetched per client.
+                    await upstream.aread()
+                    fill.rejected = upstream
+                    return None
+                entry = await self._pump(key, resource, upstream, fill)
+                return entry
+            except (OSError, httpx.HTTPError) as exc:
+                logger.warning("content cache: fill of %s failed: %s", resource, exc)
+                return None
+            finally:
+                await upstream.aclose()
+        finally:
+            fill.entry = entry
+            fill.finished = True
+            fill.notify()
+
+    async def _pump(self, key: str, resource: str, upstream: httpx.Response, fill: "_Fill") -> Optional[CacheEntry]:
+        declared = _known_length(upstream)
+        keep = declared is None or declared <= self.max_object_bytes
+        if not keep and not fill.readers:
+            return None
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".part")
+        fill.path, fill.size, fill.keep = tmp, declared, keep
+        fill.media_type = upstream.headers.get("content-type")
+        fill.content_disposition = upstream.headers.get("content-disposition")
+        fill.notify()
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                async for chunk in upstream.aiter_bytes():
+                    await asyncio.to_thread(_append, fh, chunk, digest if keep else None)
+                    size += len(chunk)
+                    fill.written = size
+                    fill.notify()
+                    if keep and size > self.max_object_bytes:
+                        logger.info("content cache: %s is over %d bytes; not cached", resource, self.max_object_bytes)
+                        keep = fill.keep = False
+                    if not keep and not fill.readers:
+                        return None
+            if not keep:
+                return None
+            if declared is not None and size != declared:
+                logger.warning("content cache: %s ended at %d of %d bytes; not cached", resource, size, declared)
+                return None
+            entry = CacheEntry(
+                key=key,
+                resource=resource,
+                size=size,
+                sha256=digest.hexdigest(),
+                media_type=fill.media_type,
+                content_disposition=fill.content_disposition,
+                stored_at=time.time(),
+            )
+            committed = await asyncio.to_thread(self._commit, entry, tmp)
+            tmp = None
+            return committed
+        finally:
+            if tmp is not None:
+                _unlink(tmp)
+
+    def _commit(self, entry: CacheEntry, tmp: str) -> Optional[CacheEntry]:
+        with self._lock:
+            self._drop(entry.key)
+            os.replace(tmp, self.blob_path(entry.key))
+            _write_atomic(
+                self._meta_path(entry.key), json.dumps({k: v for k, v in asdict(entry).items() if k != "verified"})
+            )
+            self._doomed.discard(entry.key)
+            self._entries[entry.key] = entry
+            self._total += entry.size
+            self._evict()
+            return self._entries.get(entry.key)
+
+
+class _Fill:
+    """One download into the cache. Clients read it from its temp file while it is being written."""
+
+    def __init__(self) -> None:
+        self.task: Optional[asyncio.Task] = None
+        self.path: Optional[str] = None
+        self.size: Optional[int] = None
+        self.media_type: Optional[str] = None
+        self.content_disposition: Optional[str] = None
+        self.keep = True
+        self.written = 0
+        self.readers = 0
+        self.finished = False
+        self.entry: Optional[CacheEntry] = None
+        self.rejected: Optional[httpx.Response] = None
+        self._changed = asyncio.Event()
+
+    def notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def open_reader(self) -> Optional[int]:
+        """A file descriptor on the temp file, or None if there is nothing (left) to follow."""
+        self.readers += 1
+        try:
+            while self.path is None and not self.finished:
+                await self._changed.wait()
+            if self.path is None or (not self.keep and self.finished):
+                fd = None
+            else:
+                # The descriptor keeps the bytes readable after the file is renamed or unlinked.
+                fd = await asyncio.to_thread(os.open, self.path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        except FileNotFoundError:
+            fd = None
+        if fd is None:
+            self.readers -= 1
+        return fd
+
+    async def follow(self, fd: int) -> AsyncIterator[bytes]:
+        """The body as it arrives; stops early if upstream breaks off."""
+        pos = 0
+        try:
+            while True:
+                changed = self._changed
+                if pos < self.written:
+                    chunk = await asyncio.to_thread(_read_at, fd, pos, min(self.written - pos, _READ_CHUNK))
+                    if not chunk:
+                        return
+                    pos += len(chunk)
+                    yield chunk
+                elif self.finished:
+                    return
+                else:
+                    await changed.wait()
+        finally:
+            self.readers -= 1
+            os.close(fd)
+
+
+def _unlink(path: str) -> None:
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+
+
+def _unlink_stale(path: str) -> None:
+    with contextlib.suppress(FileNotFoundError):
+        if time.time() - os.path.getmtime(path) > _ORPHAN_GRACE_SECONDS:
+            os.unlink(path)
+
+
+def _append(fh: Any, chunk: bytes, digest: Any) -> None:
+    fh.write(chunk)
+    fh.flush()
+    if digest is not None:
+        digest.update(chunk)
+
+
+def _read_at(fd: int, pos: int, size: int) -> bytes:
+    os.lseek(fd, pos, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+def _write_atomic(path: str, text: str) -> None:
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    with os.fdopen(fd, "w", encoding="utf-8") as fh:
+        fh.write(text)
+    os.replace(tmp, path)
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while chunk := fh.read(_HASH_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_cache: Optional[ContentCache] = None
+
+
+def enabled() -> bool:
+    return bool(getattr(get_settings(), "CONTENT_CACHE_ENABLED", False))
+
+
+def get_content_cache() -> ContentCache:
+    """The process-wide cache, reopened if any CONTENT_CACHE_* setting changes."""
+    global _cache
+    s = get_settings()
+    root = getattr(s, "CONTENT_CACHE_DIR", None) or os.path.join(tempfile.gettempdir(), "relay-content-cache")
+    max_bytes = int(getattr(s, "CONTENT_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+    max_object = int(getattr(s, "CONTENT_CACHE_MAX_OBJECT_BYTES", 512 * 1024 * 1024))
+    if _cache is None or (_cache.root, _cache.max_bytes, _cache.max_object_bytes) != (root, max_bytes, max_object):
+        _cache = ContentCache(root, max_bytes=max_bytes, max_object_bytes=max_object)
+    return _cache
+
+
+def cache_key(resource: str, variant: str, inbound_headers: Mapping[str, str]) -> str:
+    material = "\0".join((resource, variant, credential_fingerprint(inbound_headers)))
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+def forget(resource: str) -> None:
+    if enabled():
+        get_content_cache().forget_resource(resource)
+
+
+class _PinnedFileResponse(FileResponse):
+    """A FileResponse that unpins its cache blob once it has been sent, or the client has gone."""
+
+    def __init__(self, cache: ContentCache, key: str, **kwargs: Any) -> None:
+        super().__init__(cache.blob_path(key), **kwargs)
+        self._cache = cache
+        self._key = key
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._cache.release(self._key)
+
+
+def _serve(cache: ContentCache, entry: CacheEntry, outcome: str) -> Optional[Response]:
+    if not cache.pin(entry.key):
+        return None
+    headers = {"etag": f'"{entry.sha256}"', "x-relay-cache": outcome}
+    if entry.content_disposition:
+        headers["content-disposition"] = entry.content_disposition
+    return _PinnedFileResponse(cache, entry.key, headers=headers, media_type=entry.media_type)
+
+
+def _follow(fill: _Fill, fd: int) -> Response:
+    headers = {"x-relay-cache": "miss"} if fill.keep else {}
+    if fill.size is not None:
+        headers["content-length"] = str(fill.size)
+    if fill.content_disposition:
+        headers["content-disposition"] = fill.content_disposition
+    return StreamingResponse(fill.follow(fd), headers=headers, media_type=fill.media_type)
+
+
+async def cached_content(
+    request: Request,
+    *,
+    resource: str,
+    upstream_path: str,
+    client: Optional[httpx.AsyncClient] = None,
+    base_url: Optional[str] = None,
+) -> Response:
+    """Serve a binary download from the cache, filling it on a miss (see the module docstring)."""
+
+    async def relay() -> Response:
+        upstream = await open_upstream_content(request, upstream_path, client=client, base_url=base_url)
+        return await content_response(request, upstream)
+
+    if not enabled():
+        return await relay()
+
+    cache = get_content_cache()
+    key = cache_key(resource, request.url.query, request.headers)
+    entry = await cache.get(key)
+    if entry is not None:
+        hit = _serve(cache, entry, "hit")
+        if hit is not None:
+            return hit
+
+    async def opener() -> httpx.Response:
+        return await open_upstream_content(request, upstream_path, client=client, base_url=base_url, whole=True)
+
+    fill = cache.start_fill(key, resource, opener)
+    if "range" in request.headers:
+        return await relay()
+
+    fd = await fill.open_reader()
+    if fd is not None:
+        return _follow(fill, fd)
+    if fill.task is not None and not fill.finished:
+        # The temp file was just renamed into place; the entry is moments away.
+        await asyncio.shield(fill.task)
+    if fill.rejected is not None:
+        return await content_response(request, fill.rejected)
+    if fill.entry is not None:
+        done = _serve(cache, fill.entry, "miss")
+        if done is not None:
+            return done
+    return await relay()
@@ -0,0 +1,186 @@
+# app/api/embedding_batcher.py
+"""Coalesce concurrent small /v1/embeddings requests into one upstream call.
+
+Why this exists
+---------------
+The search front-end sends many single-query embeddings requests at the same
+time. Each one used a whole upstream request, and with it a slot of the
+requests-per-minute limit, although one request may carry up to 2048 inputs.
+With EMBEDDINGS_COALESCE_ENABLED, `post_embeddings` holds a request for
+EMBEDDINGS_COALESCE_WINDOW_MS and merges it with the other requests that
+arrive in that window:
+
+- Requests are merged only when everything except `input` is identical
+  (model, dimensions, encoding_format, user) and they carry the same
+  credential (file_dedup.credential_fingerprint). A batch is sent early once
+  it reaches EMBEDDINGS_COALESCE_MAX_INPUTS inputs. A request that is that
+  large on its own is never held back.
+- Each caller gets an ordinary list response with only its own embeddings,
+  indexed from 0. Upstream bills the batch as a whole, so its `usage` is
+  split across the callers in proportion to their estimated token counts.
+  The shares add up exactly to what upstream billed.
+- Errors stay with the request that caused them. When upstream rejects a
+  merged batch with a 4xx (one empty or oversized input is enough), each
+  request in it is sent again on its own and gets its own answer. Rate limits,
+  5xx and transport failures are not caused by any one request. Every caller
+  gets that same error.
+
+The merged calls are counted in app/utils/metrics.py
+(`embeddings.coalesce.requests` vs `embeddings.coalesce.upstream_calls`). A
+coalesced response carries `x-relay-coalesced: <requests in the batch>`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional, Set
+
+import httpx
+from fastapi import HTTPException
+
+from app.api.embedding_payloads import apportion, estimate_tokens, list_body, split_inputs, upstream_vectors
+from app.api.embedding_split import post_split
+from app.api.file_dedup import credential_fingerprint
+from app.core.config import get_settings
+from app.utils import metrics
+
+_DEFAULT_MAX_INPUTS = 2048
+
+
+@dataclass
+class _Pending:
+    body: Dict[str, Any]
+    inputs: List[Any]
+    future: asyncio.Future
+
+
+@dataclass
+class _Batch:
+    key: str
+    inbound_headers: Mapping[str, str]
+    items: List[_Pending] = field(default_factory=list)
+    size: int = 0
+    full: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+_open: Dict[str, _Batch] = {}
+# Strong references to the batch senders; the event loop only keeps weak ones.
+_running: Set[asyncio.Task] = set()
+
+
+def enabled() -> bool:
+    return bool(getattr(get_settings(), "EMBEDDINGS_COALESCE_ENABLED", False))
+
+
+def _window_seconds() -> float:
+    return max(int(getattr(get_settings(), "EMBEDDINGS_COALESCE_WINDOW_MS", 5)), 0) / 1000
+
+
+def _max_inputs() -> int:
+    return max(int(getattr(get_settings(), "EMBEDDINGS_COALESCE_MAX_INPUTS", _DEFAULT_MAX_INPUTS)), 1)
+
+
+def _batch_key(body: Mapping[str, Any], inputs: List[Any], inbound_headers: Mapping[str, str]) -> str:
+    options = {k: v for k, v in body.items() if k != "input"}
+    kind = "text" if isinstance(inputs[0], str) else "tokens"
+    return json.dumps([credential_fingerprint(inbound_headers), kind, options], sort_keys=True, default=str)
+
+
+async def post_embeddings(body: Dict[str, Any], *, inbound_headers: Mapping[str, str]) -> httpx.Response:
+    """embedding_split.post_split, merged with concurrent compatible requests when coalescing is on."""
+    if not enabled():
+        return await post_split(body, inbound_headers=inbound_headers)
+    inputs = split_inputs(body)
+    limit = _max_inputs()
+    if inputs is None or not isinstance(body.get("model"), str) or len(inputs) >= limit:
+        return await post_split(body, inbound_headers=inbound_headers)
+
+    key = _batch_key(body, inputs, inbound_headers)
+    batch = _open.get(key)
+    if batch is not None and batch.size + len(inputs) > limit:
+        batch.full.set()
+        batch = None
+    if batch is None:
+        batch = _Batch(key, inbound_headers)
+        _open[key] = batch
+        task = asyncio.create_task(_run(batch))
+        _running.add(task)
+        task.add_done_callback(_running.discard)
+    pending = _Pending(body, inputs, asyncio.get_running_loop().create_future())
+    batch.items.append(pending)
+    batch.size += len(inputs)
+    if batch.size >= limit:
+        batch.full.set()
+    return await pending.future
+
+
+def _settle(pending: _Pending, result: Any) -> None:
+    if pending.future.done():  # the caller went away
+        return
+    if isinstance(result, BaseException):
+        pending.future.set_exception(result)
+    else:
+        pending.future.set_result(result)
+
+
+async def _run(batch: _Batch) -> None:
+    with contextlib.suppress(asyncio.TimeoutError):
+        await asyncio.wait_for(batch.full.wait(), _window_seconds())
+    if _open.get(batch.key) is batch:
+        del _open[batch.key]
+    items = [p for p in batch.items if not p.future.done()]
+    if not items:
+        return
+    metrics.incr("embeddings.coalesce.requests", len(items))
+    try:
+        if len(items) == 1:
+            metrics.incr("embeddings.coalesce.upstream_calls")
+            _settle(items[0], await post_split(items[0].body, inbound_headers=batch.inbound_headers))
+            return
+        await _send_merged(batch, items)
+    except Exception as exc:
+        for pending in items:
+            _settle(pending, exc)
+
+
+async def _send_merged(batch: _Batch, items: List[_Pending]) -> None:
+    merged = {**items[0].body, "input": [item for p in items for item in p.inputs]}
+    metrics.incr("embeddings.coalesce.upstream_calls")
+    resp = await post_split(merged, inbound_headers=batch.inbound_headers)
+
+    if 400 <= resp.status_code < 500 and resp.status_code != 429:
+        # Some request in the batch is bad; let each one find out for itself.
+        metrics.incr("embeddings.coalesce.upstream_calls", len(items))
+        results = await asyncio.gather(
+            *(post_split(p.body, inbound_headers=batch.inbound_headers) for p in items),
+            return_exceptions=True,
+        )
+        for pending, result in zip(items, results, strict=True):
+            _settle(pending, result)
+        return
+    if resp.status_code != 200:
+        for pending in items:
+            _settle(pending, resp)
+        return
+
+    try:
+        payload = resp.json()
+    except ValueError:
+        raise HTTPException(status_code=502, detail="Upstream embeddings response is not JSON") from None
+    vectors = [json.dumps(v, separators=(",", ":")).encode() for v in upstream_vectors(payload, len(merged["input"]))]
+    usage = payload.get("usage") if isinstance(payload.get("usage"), dict) else {}
+    weights = [sum(estimate_tokens(i) for i in p.inputs) for p in items]
+    shares: Dict[str, List[int]] = {
+        name: apportion(int(value), weights) for name, value in usage.items() if isinstance(value, int)
+    }
+    headers = {"content-type": "application/json", "x-relay-coalesced": str(len(items))}
+    model: Optional[Any] = payload.get("model") or merged.get("model")
+    offset = 0
+    for n, pending in enumerate(items):
+        own = vectors[offset : offset + len(pending.inputs)]
+        offset += len(pending.inputs)
+        own_usage = {name: parts[n] for name, parts in shares.items()}
+        _settle(pending, httpx.Response(200, headers=headers, content=list_body(own, model=model, usage=own_usage)))
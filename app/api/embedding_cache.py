@@ -0,0 +1,223 @@
+# app/api/embedding_cache.py
+"""Per-input cache for POST /v1/embeddings: memory LRU over a sqlite store.
+
+Why this exists
+---------------
+Our RAG pipelines embed the same chunks and the same queries again and again.
+Without a cache, every one of those inputs is sent upstream and billed each
+time. With EMBEDDINGS_CACHE_ENABLED, the route looks up every input on its
+own before anything goes upstream:
+
+- Key: (model, dimensions, encoding_format, sha256 of the input), where the
+  input is either a string or a token array. The vector depends only on those
+  four things, so the entries are shared by every caller of the relay.
+- Two tiers. First an in-process LRU bounded by EMBEDDINGS_CACHE_MEMORY_BYTES.
+  Behind it a sqlite store that survives restarts, trimmed least-recently-used
+  first to EMBEDDINGS_CACHE_DISK_MAX_BYTES. A disk hit is promoted to memory.
+- Only the missed inputs go upstream, each one once even if it is repeated in
+  the request. The results are merged back in input order, with the original
+  indexes. `usage` is upstream's usage for those misses, i.e. what was
+  actually billed, and is zero when every input was a hit.
+- Values are stored as the exact JSON upstream returned for that embedding.
+  The route always asks for base64 (app/api/embedding_formats.py), so that is
+  a compact string. The response is assembled from those bytes, so a hit is
+  never parsed or re-serialised.
+- Upstream errors are relayed unchanged and nothing is cached from them.
+  Requests the cache cannot split per input (no model, empty or mixed input)
+  are forwarded as they are.
+
+Per-input hits, misses and the embedding bytes served from the cache are
+counted in app/utils/metrics.py (GET /v1/metrics). Each response says what it
+was in `x-relay-cache`: hit, partial or miss.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Sequence
+
+import httpx
+from fastapi import HTTPException
+
+from app.api.embedding_batcher import post_embeddings
+from app.api.embedding_payloads import list_body, split_inputs, upstream_vectors
+from app.core.config import get_settings
+from app.utils import metrics
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key     TEXT PRIMARY KEY,
+    value   BLOB NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS embeddings_by_use ON embeddings (used_at);
+"""
+
+# Trimming the disk store frees this much headroom below the limit, so it does not run on every put.
+_TRIM_TO = 0.9
+
+
+class EmbeddingCache:
+    """cache key -> embedding JSON bytes. Thread-safe; callers run it off the event loop."""
+
+    def __init__(self, path: str, *, memory_bytes: int, disk_max_bytes: int) -> None:
+        self.path = path
+        self.memory_bytes = memory_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_used = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._disk_used = int(self._db.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM embeddings").fetchone()[0])
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _remember(self, key: str, value: bytes) -> None:
+        if len(value) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_used -= len(old)
+        self._memory[key] = value
+        self._memory_used += len(value)
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        found: Dict[str, bytes] = {}
+        with self._lock:
+            from_disk = []
+            for key in keys:
+                value = self._memory.get(key)
+                if value is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = value
+                    continue
+                row = self._db.execute("SELECT value FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    found[key] = bytes(row[0])
+                    self._remember(key, found[key])
+                    from_disk.append(key)
+            if from_disk:
+                now = time.time()
+                self._db.executemany("UPDATE embeddings SET used_at = ? WHERE key = ?", [(now, k) for k in from_disk])
+        return found
+
+    def put_many(self, items: Mapping[str, bytes]) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for key, value in items.items():
+                    self._remember(key, value)
+                    cur = self._db.execute("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)", (key, value, now))
+                    self._disk_used += len(value) * cur.rowcount
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            if self._disk_used > self.disk_max_bytes:
+                self._trim()
+
+    def _trim(self) -> None:
+        target = int(self.disk_max_bytes * _TRIM_TO)
+        while self._disk_used > target:
+            rows = self._db.execute(
+                "SELECT key, LENGTH(value) FROM embeddings ORDER BY used_at LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self._disk_used = 0
+                return
+            doomed = []
+            for key, size in rows:
+                doomed.append((key,))
+                self._disk_used -= size
+                if self._disk_used <= target:
+                    break
+            self._db.executemany("DELETE FROM embeddings WHERE key = ?", doomed)
+
+
+_cache: Optional[EmbeddingCache] = None
+
+
+def enabled() -> bool:
+    return bool(getattr(get_settings(), "EMBEDDINGS_CACHE_ENABLED", False))
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """The process-wide cache, reopened if any EMBEDDINGS_CACHE_* setting changes."""
+    global _cache
+    s = get_settings()
+    path = getattr(s, "EMBEDDINGS_CACHE_PATH", None) or os.path.join(
+        tempfile.gettempdir(), "relay-embeddings-cache.sqlite3"
+    )
+    memory_bytes = int(getattr(s, "EMBEDDINGS_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+    disk_max_bytes = int(getattr(s, "EMBEDDINGS_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024))
+    if _cache is None or (_cache.path, _cache.memory_bytes, _cache.disk_max_bytes) != (
+        path,
+        memory_bytes,
+        disk_max_bytes,
+    ):
+        if _cache is not None:
+            _cache.close()
+        _cache = EmbeddingCache(path, memory_bytes=memory_bytes, disk_max_bytes=disk_max_bytes)
+    return _cache
+
+
+def cache_key(body: Mapping[str, Any], item: Any) -> str:
+    if isinstance(item, str):
+        digest = hashlib.sha256(item.encode("utf-8")).hexdigest()
+    else:
+        digest = "tokens:" + hashlib.sha256(json.dumps(item).encode()).hexdigest()
+    material = [body.get("model"), body.get("dimensions"), body.get("encoding_format") or "float", digest]
+    return hashlib.sha256(json.dumps(material).encode()).hexdigest()
+
+
+async def create_cached(body: Dict[str, Any], *, inbound_headers: Mapping[str, str]) -> httpx.Response:
+    """POST /v1/embeddings with the misses sent upstream and the hits answered locally."""
+    inputs = split_inputs(body)
+    if inputs is None or not isinstance(body.get("model"), str):
+        return await post_embeddings(body, inbound_headers=inbound_headers)
+
+    keys = [cache_key(body, item) for item in inputs]
+    cache = get_embedding_cache()
+    found = await asyncio.to_thread(cache.get_many, list(dict.fromkeys(keys)))
+    pending = {k: item for k, item in zip(keys, inputs, strict=True) if k not in found}
+
+    model: Any = body["model"]
+    usage: Any = {"prompt_tokens": 0, "total_tokens": 0}
+    if pending:
+        resp = await post_embeddings({**body, "input": list(pending.values())}, inbound_headers=inbound_headers)
+        if resp.status_code != 200:
+            return resp
+        try:
+            payload = resp.json()
+        except ValueError:
+            raise HTTPException(status_code=502, detail="Upstream embeddings response is not JSON") from None
+        vectors = upstream_vectors(payload, len(pending))
+        fresh = {k: json.dumps(v, separators=(",", ":")).encode() for k, v in zip(pending, vectors, strict=True)}
+        await asyncio.to_thread(cache.put_many, fresh)
+        found.update(fresh)
+        model = payload.get("model") or model
+        usage = payload.get("usage") or usage
+
+    hits = [k for k in keys if k not in pending]
+    metrics.incr("embeddings.cache.hits", len(hits))
+    metrics.incr("embeddings.cache.misses", len(keys) - len(hits))
+    metrics.incr("embeddings.cache.bytes_saved", sum(len(found[k]) for k in hits))
+    outcome = "miss" if not hits else "hit" if len(hits) == len(keys) else "partial"
+    headers = {"content-type": "application/json", "x-relay-cache": outcome}
+    return httpx.Response(200, headers=headers, content=list_body([found[k] for k in keys], model=model, usage=usage))
@@ -0,0 +1,145 @@
+# app/api/embedding_formats.py
+"""Compact embeddings transport: base64 from upstream, the client's format out.
+
+Why this exists
+---------------
+Float arrays in JSON are the most expensive way to move embeddings. A batch of
+3072-dimension vectors is megabytes of decimal text. Upstream printed it, the
+relay parsed it into Python lists on the event loop, and JSONResponse printed
+it again. The route now always asks upstream for `encoding_format: base64`,
+which is little-endian float32 and about a quarter of the size, and
+`render_embeddings` turns that into what the client asked for:
+
+- `encoding_format: "base64"` (and a JSON Accept): upstream's body is relayed
+  byte for byte, with no parse at all.
+- `encoding_format: "float"` or unset, the OpenAI default: the base64 is
+  decoded with NumPy and written with orjson. orjson prints float32 in its
+  shortest form, the same numbers upstream's float output has.
+- `Accept: application/octet-stream`: the raw little-endian matrix, row per
+  input, in input order.
+- `Accept: application/x-npy`: the same matrix as a `.npy` file, which
+  `numpy.load` opens directly.
+
+Binary outputs take `?dtype=float32` (default), `float16` or `int8`. int8 is
+symmetric with a fixed scale of 127. OpenAI embeddings are unit-length, so
+every component is in [-1, 1]; divide by `x-embeddings-scale` to get it back.
+Binary responses carry the shape, dtype, model and usage in `x-embeddings-*`
+headers, since there is no JSON envelope to hold them.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import io
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional
+
+import httpx
+import numpy as np
+import orjson
+from fastapi import HTTPException
+from starlette.responses import Response
+
+from app.api.forward_openai import embeddings_response
+
+NPY_MEDIA_TYPE = "application/x-npy"
+BINARY_MEDIA_TYPES = ("application/octet-stream", NPY_MEDIA_TYPE)
+DTYPES = {"float32": "<f4", "float16": "<f2", "int8": "i1"}
+INT8_SCALE = 127
+
+# Decoding a response larger than this runs in a worker thread, off the event loop.
+_INLINE_BYTES = 256 * 1024
+
+
+@dataclass(frozen=True)
+class Output:
+    kind: str  # "float" | "base64" | one of BINARY_MEDIA_TYPES
+    dtype: str = "float32"
+
+
+def requested_output(body: Mapping[str, Any], accept: Optional[str], dtype: Optional[str]) -> Output:
+    """What the client asked for, from `encoding_format`, the Accept header and `?dtype=`; 400 if invalid."""
+    encoding = body.get("encoding_format") or "float"
+    if encoding not in ("float", "base64"):
+        raise HTTPException(status_code=400, detail="encoding_format must be 'float' or 'base64'")
+    accepted = [part.split(";")[0].strip().lower() for part in (accept or "").split(",")]
+    kind = next((m for m in accepted if m in BINARY_MEDIA_TYPES), encoding)
+    if dtype is not None and (kind not in BINARY_MEDIA_TYPES or dtype not in DTYPES):
+        raise HTTPException(
+            status_code=400,
+            detail=f"dtype applies to {' and '.join(BINARY_MEDIA_TYPES)} responses and must be one of: {', '.join(DTYPES)}",
+        )
+    return Output(kind, dtype or "float32")
+
+
+def upstream_body(body: Mapping[str, Any]) -> Dict[str, Any]:
+    """The request as sent upstream: always base64, whatever the client will get."""
+    return {**body, "encoding_format": "base64"}
+
+
+def decode_matrix(data: List[Any]) -> np.ndarray:
+    """(n, d) float32 from the `data` items of a list response; base64 or float embeddings."""
+    rows = []
+    for item in sorted(data, key=lambda d: d.get("index", 0)):
+        value = item.get("embedding")
+        if isinstance(value, str):
+            rows.append(np.frombuffer(base64.b64decode(value), dtype="<f4"))
+        else:
+            rows.append(np.asarray(value, dtype="<f4"))
+    if not rows:
+        return np.zeros((0, 0), dtype="<f4")
+    if len({row.shape for row in rows}) != 1:
+        raise HTTPException(status_code=502, detail="Upstream embeddings have differing dimensions")
+    return np.stack(rows)
+
+
+def _convert(matrix: np.ndarray, dtype: str) -> np.ndarray:
+    if dtype == "int8":
+        return np.clip(np.rint(matrix * INT8_SCALE), -INT8_SCALE, INT8_SCALE).astype(DTYPES[dtype])
+    return matrix.astype(DTYPES[dtype], copy=False)
+
+
+def _render(content: bytes, output: Output, relay_headers: Dict[str, str]) -> Response:
+    try:
+        payload = orjson.loads(content)
+        matrix = decode_matrix(payload["data"])
+    except (orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=502, detail="Upstream embeddings response could not be decoded") from None
+    model = payload.get("model")
+    usage = payload.get("usage") or {}
+
+    if output.kind == "float":
+        data = [{"object": "embedding", "index": i, "embedding": row} for i, row in enumerate(matrix)]
+        doc = {"object": "list", "data": data, "model": model, "usage": usage}
+        return Response(
+            orjson.dumps(doc, option=orjson.OPT_SERIALIZE_NUMPY), media_type="application/json", headers=relay_headers
+        )
+
+    out = _convert(matrix, output.dtype)
+    if output.kind == NPY_MEDIA_TYPE:
+        buf = io.BytesIO()
+        np.save(buf, out, allow_pickle=False)
+        body = buf.getvalue()
+    else:
+        body = out.tobytes()
+    headers = {
+        **relay_headers,
+        "x-embeddings-shape": ",".join(str(n) for n in out.shape),
+        "x-embeddings-dtype": output.dtype,
+        "x-embeddings-model": str(model or ""),
+        **{f"x-embeddings-usage-{k.replace('_', '-')}": str(v) for k, v in usage.items() if isinstance(v, int)},
+    }
+    if output.dtype == "int8":
+        headers["x-embeddings-scale"] = str(INT8_SCALE)
+    return Response(body, media_type=output.kind, headers=headers)
+
+
+async def render_embeddings(resp: httpx.Response, output: Output) -> Response:
+    """The client's response from an upstream (or cache-built) base64 list response."""
+    if resp.status_code != 200 or output.kind == "base64":
+        return embeddings_response(resp)
+    relay_headers = {k: v for k, v in resp.headers.items() if k.lower().startswith("x-relay-")}
+    if len(resp.content) > _INLINE_BYTES:
+        return await asyncio.to_thread(_render, resp.content, output, relay_headers)
+    return _render(resp.content, output, relay_headers)
@@ -0,0 +1,237 @@
+# app/api/embedding_local.py
+"""Model aliases on /v1/embeddings that are served by a local encoder.
+
+Why this exists
+---------------
+examples/bifl/embed_bge_m3.py embeds the BIFL corpus with bge-m3 locally,
+but /v1/embeddings could only forward to OpenAI. Query vectors in the same
+space as the Chroma collection therefore had to come from a separate script.
+EMBEDDINGS_LOCAL_MODELS maps model aliases to local backends, as
+comma-separated `alias=spec` pairs:
+
+- `local/bge-m3=BAAI/bge-m3`: an in-process SentenceTransformer, by model
+  name or path. Needs the `local-embeddings` extra. The model loads on first
+  use on EMBEDDINGS_LOCAL_DEVICE (auto when empty) and runs in its own
+  worker thread; torch releases the GIL while it encodes.
+- `local/bge-m3=http://10.0.0.5:7997/v1/embeddings#BAAI/bge-m3`: a sidecar
+  that speaks the OpenAI embeddings API (text-embeddings-inference,
+  infinity, ...). The request is forwarded there, with the model after `#`
+  (or the alias itself) in place of the alias.
+- `local/custom=py:package.module:factory`: any object with
+  `encode(list[str]) -> (n, d) array`, built by calling `factory()`.
+
+In-process encoders batch dynamically. Concurrent requests for one alias are
+collected for up to EMBEDDINGS_LOCAL_BATCH_WAIT_MS, or until
+EMBEDDINGS_LOCAL_MAX_BATCH texts, and encoded in a single call. Each
+request then gets its own rows back.
+
+Responses keep the OpenAI shape, so every output format of
+embedding_formats.py works unchanged. Vectors are unit-length, as OpenAI's
+are. `dimensions` truncates and renormalises, the way the text-embedding-3
+models do. `usage` holds the local token estimate; nothing is billed.
+Every other model goes through `dispatch` to the cache, coalescer and
+upstream as before.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import importlib
+import importlib.util
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+import httpx
+import numpy as np
+from fastapi import HTTPException
+
+from app.api import embedding_cache
+from app.api.embedding_batcher import post_embeddings
+from app.api.embedding_payloads import estimate_tokens, list_body, split_inputs
+from app.api.forward_openai import _get_timeout_seconds
+from app.core.config import get_settings
+from app.core.http_client import get_async_httpx_client
+from app.utils import metrics
+
+
+def sentence_transformers_available() -> bool:
+    return importlib.util.find_spec("sentence_transformers") is not None
+
+
+def parse_aliases(value: Optional[str]) -> Dict[str, str]:
+    """`alias=spec,alias=spec` -> {alias: spec}; blank entries are ignored."""
+    aliases: Dict[str, str] = {}
+    for entry in (value or "").split(","):
+        alias, sep, spec = entry.partition("=")
+        if sep and alias.strip() and spec.strip():
+            aliases[alias.strip()] = spec.strip()
+    return aliases
+
+
+def _sentence_transformer(spec: str) -> Any:
+    if not sentence_transformers_available():
+        raise HTTPException(
+            status_code=503,
+            detail=f"Local model {spec!r} needs sentence-transformers (pip install .[local-embeddings])",
+        )
+    from sentence_transformers import SentenceTransformer
+
+    device = getattr(get_settings(), "EMBEDDINGS_LOCAL_DEVICE", None) or None
+    model = SentenceTransformer(spec, device=device)
+
+    class _Encoder:
+        def encode(self, texts: List[str]) -> np.ndarray:
+            # One merged batch can be far larger than a forward pass should be; the
+            # model splits it into passes of at most EMBEDDINGS_LOCAL_MAX_BATCH rows.
+            batch_size = max(int(getattr(get_settings(), "EMBEDDINGS_LOCAL_MAX_BATCH", 64)), 1)
+            return model.encode(
+                texts, batch_size=batch_size, normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False
+            )
+
+    return _Encoder()
+
+
+def _factory(spec: str) -> Any:
+    module_name, _, attr = spec[len("py:") :].partition(":")
+    return getattr(importlib.import_module(module_name), attr)()
+
+
+class LocalEncoder:
+    """One in-process model: loaded on first use, fed by a dynamic batcher, run in its own thread."""
+
+    def __init__(self, spec: str, load: Callable[[str], Any]) -> None:
+        self.spec = spec
+        self._load = load
+        self._model: Any = None
+        self._load_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-embeddings")
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        with self._load_lock:
+            if self._model is None:
+                self._model = self._load(self.spec)
+        matrix = np.asarray(self._model.encode(texts), dtype="<f4")
+        if matrix.ndim != 2 or matrix.shape[0] != len(texts):
+            raise HTTPException(status_code=500, detail=f"Local model {self.spec!r} returned shape {matrix.shape}")
+        return matrix
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            # A new event loop (tests, reloads) gets its own queue and worker.
+            self._loop, self._queue = loop, asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        future: asyncio.Future = loop.create_future()
+        await self._queue.put((texts, future))  # type: ignore[union-attr]
+        return await future
+
+    async def _run(self) -> None:
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        s = get_settings()
+        max_batch = max(int(getattr(s, "EMBEDDINGS_LOCAL_MAX_BATCH", 64)), 1)
+        wait = max(int(getattr(s, "EMBEDDINGS_LOCAL_BATCH_WAIT_MS", 5)), 0) / 1000
+        while queue is not None:
+            batch = [await queue.get()]
+            size, deadline = len(batch[0][0]), loop.time() + wait
+            while size < max_batch and (remaining := deadline - loop.time()) > 0:
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+                size += len(batch[-1][0])
+            texts = [t for item_texts, _ in batch for t in item_texts]
+            metrics.incr("embeddings.local.batches")
+            try:
+                matrix = await loop.run_in_executor(self._executor, self._encode, texts)
+            except Exception as exc:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            offset = 0
+            for item_texts, future in batch:
+                if not future.done():
+                    future.set_result(matrix[offset : offset + len(item_texts)])
+                offset += len(item_texts)
+
+
+_encoders: Dict[str, LocalEncoder] = {}
+_encoders_lock = threading.Lock()
+
+
+def _encoder(spec: str) -> LocalEncoder:
+    with _encoders_lock:
+        encoder = _encoders.get(spec)
+        if encoder is None:
+            encoder = LocalEncoder(spec, _factory if spec.startswith("py:") else _sentence_transformer)
+            _encoders[spec] = encoder
+        return encoder
+
+
+def backend_for(model: Any) -> Optional[str]:
+    """The local spec serving `model`, or None when it goes upstream."""
+    if not isinstance(model, str):
+        return None
+    return parse_aliases(getattr(get_settings(), "EMBEDDINGS_LOCAL_MODELS", None)).get(model)
+
+
+def _sidecar(spec: str, alias: str) -> Tuple[str, str]:
+    url, _, model = spec.partition("#")
+    return url, model or alias
+
+
+async def _post_sidecar(body: Dict[str, Any], spec: str, inbound_headers: Mapping[str, str]) -> httpx.Response:
+    url, model = _sidecar(spec, body["model"])
+    # The OpenAI key and the caller's credentials stay with the relay.
+    headers = {"Content-Type": "application/json"}
+    request_id = inbound_headers.get("x-request-id")
+    if request_id:
+        headers["X-Request-ID"] = request_id
+    try:
+        return await get_async_httpx_client().post(
+            url, headers=headers, json={**body, "model": model}, timeout=_get_timeout_seconds(get_settings())
+        )
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=424, detail=f"Local embeddings sidecar failed: {type(e).__name__}: {e}") from e
+
+
+def _fit_dimensions(matrix: np.ndarray, dimensions: Any) -> np.ndarray:
+    if dimensions is None:
+        return matrix
+    if not isinstance(dimensions, int) or not 0 < dimensions <= matrix.shape[1]:
+        raise HTTPException(status_code=400, detail=f"dimensions must be between 1 and {matrix.shape[1]}")
+    cut = matrix[:, :dimensions]
+    norms = np.linalg.norm(cut, axis=1, keepdims=True)
+    return np.divide(cut, norms, out=np.zeros_like(cut), where=norms > 0)
+
+
+async def create_local(body: Dict[str, Any], spec: str, *, inbound_headers: Mapping[str, str]) -> httpx.Response:
+    """The alias's embeddings as an OpenAI list response with base64 float32 vectors."""
+    if spec.startswith(("http://", "https://")):
+        return await _post_sidecar(body, spec, inbound_headers)
+    inputs = split_inputs(body)
+    if inputs is None or not all(isinstance(i, str) for i in inputs):
+        raise HTTPException(status_code=400, detail="Local embedding models take a string or an array of strings")
+    matrix = _fit_dimensions(await _encoder(spec).encode(inputs), body.get("dimensions"))
+    values = [json.dumps(base64.b64encode(row.astype("<f4").tobytes()).decode()).encode() for row in matrix]
+    tokens = sum(estimate_tokens(i) for i in inputs)
+    content = list_body(values, model=body["model"], usage={"prompt_tokens": tokens, "total_tokens": tokens})
+    headers = {"content-type": "application/json", "x-relay-backend": "local"}
+    return httpx.Response(200, headers=headers, content=content)
+
+
+async def dispatch(body: Dict[str, Any], *, inbound_headers: Mapping[str, str]) -> httpx.Response:
+    """Every /v1/embeddings call: local alias, else cache, coalescer, splitter and upstream."""
+    spec = backend_for(body.get("model"))
+    if spec is not None:
+        return await create_local(body, spec, inbound_headers=inbound_headers)
+    if embedding_cache.enabled():
+        return await embedding_cache.create_cached(body, inbound_headers=inbound_headers)
+    return await post_embeddings(body, inbound_headers=inbound_headers)
@@ -0,0 +1,76 @@
+# app/api/embedding_payloads.py
+"""Request and response shapes shared by the /v1/embeddings pipeline.
+
+The cache (embedding_cache.py) and the coalescer (embedding_batcher.py) both
+take a request apart into its inputs, send some of them upstream, and put a
+list response back together. These are the helpers for those steps. Nothing
+here does I/O.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+from typing import Any, List, Mapping, Optional, Sequence
+
+from fastapi import HTTPException
+
+
+def _is_tokens(value: Any) -> bool:
+    return isinstance(value, list) and bool(value) and all(type(t) is int for t in value)
+
+
+def split_inputs(body: Mapping[str, Any]) -> Optional[List[Any]]:
+    """The request's inputs one by one (strings or token arrays), or None if it cannot be split."""
+    raw = body.get("input")
+    if isinstance(raw, str) or _is_tokens(raw):
+        return [raw]
+    if isinstance(raw, list) and raw and (all(isinstance(x, str) for x in raw) or all(_is_tokens(x) for x in raw)):
+        return list(raw)
+    return None
+
+
+def estimate_tokens(item: Any) -> int:
+    """Cheap token estimate: exact for token arrays, about four UTF-8 bytes per token for text."""
+    if isinstance(item, str):
+        return max(1, math.ceil(len(item.encode("utf-8")) / 4))
+    return len(item)
+
+
+def apportion(total: int, weights: Sequence[int]) -> List[int]:
+    """Split `total` in proportion to `weights` (largest remainder), so the parts add up exactly."""
+    weight_sum = sum(weights)
+    if not weights:
+        return []
+    if weight_sum <= 0:
+        weights, weight_sum = [1] * len(weights), len(weights)
+    shares = [total * w / weight_sum for w in weights]
+    parts = [math.floor(s) for s in shares]
+    by_remainder = sorted(range(len(shares)), key=lambda i: shares[i] - parts[i], reverse=True)
+    for i in by_remainder[: total - sum(parts)]:
+        parts[i] += 1
+    return parts
+
+
+def upstream_vectors(payload: Any, count: int) -> List[Any]:
+    """The `embedding` values of an upstream list response, by index; 502 if any is missing."""
+    data = payload.get("data") if isinstance(payload, dict) else None
+    vectors: List[Any] = [None] * count
+    for item in data if isinstance(data, list) else []:
+        index = item.get("index") if isinstance(item, dict) else None
+        if isinstance(index, int) and 0 <= index < count:
+            vectors[index] = item.get("embedding")
+    if any(v is None for v in vectors):
+        raise HTTPException(status_code=502, detail="Upstream embeddings response is missing entries")
+    return vectors
+
+
+def list_body(values: Sequence[bytes], *, model: Any, usage: Any) -> bytes:
+    """An embeddings list document built from each embedding's JSON bytes, in order."""
+    items = b",".join(b'{"object":"embedding","index":%d,"embedding":%s}' % (i, v) for i, v in enumerate(values))
+    return b'{"object":"list","data":[%s],"model":%s,"usage":%s}' % (
+        items,
+        json.dumps(model).encode(),
+        json.dumps(usage).encode(),
+    )
+
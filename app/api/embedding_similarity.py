@@ -0,0 +1,172 @@
+# app/api/embedding_similarity.py
+"""Server-side top-k similarity: POST /v1/embeddings:similarity.
+
+Why this exists
+---------------
+ChatGPT Actions and other light clients cannot realistically take embedding
+vectors and compare them. Our tools pulled whole vectors through
+/v1/embeddings just to compute cosine similarity on their side. This endpoint
+takes one or more queries and a set of candidates and returns, for each
+query, the ranked candidate indexes and scores. That is a few bytes per
+match instead of kilobytes per vector.
+
+- Queries and candidate texts are embedded in one call through the normal
+  embeddings path: local model aliases, the cache, the coalescer and the
+  splitter all apply, and the vectors arrive as base64 (embedding_formats.py).
+- Candidates can also be named by `candidate_ids`, the ids this endpoint
+  reports when EMBEDDINGS_CACHE_ENABLED is on. Those vectors come straight
+  from the embedding cache, so a corpus is sent and billed once and ranked
+  many times. An id the cache no longer holds is a 404, and the client sends
+  the text again. An id names its model and dimensions
+  (`<cache key>:<dimensions>:<model>`, 0 for the model's own width). One from
+  another model or width is a 400, even when the widths happen to agree, since
+  those vectors live in a different space.
+- Scoring is cosine similarity. The rows are normalised, then one (queries x
+  candidates) matrix product is taken, and top-k is found with argpartition.
+  Large jobs run in a worker thread, off the event loop.
+
+Candidate indexes count `candidates` first, then `candidate_ids`.
+EMBEDDINGS_SIMILARITY_MAX_CANDIDATES bounds one request.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import orjson
+from fastapi import HTTPException
+from starlette.responses import Response
+
+from app.api import embedding_cache
+from app.api.embedding_formats import decode_matrix, upstream_body
+from app.api.embedding_local import backend_for, dispatch
+from app.api.forward_openai import embeddings_response
+from app.core.config import get_settings
+
+# Score matrices with more cells than this are computed in a worker thread.
+_INLINE_CELLS = 256 * 1024
+
+
+def _unit(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def top_k(queries: np.ndarray, candidates: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Cosine top-k: (indexes, scores), each (queries, k), best match first."""
+    scores = _unit(queries) @ _unit(candidates).T
+    k = min(k, scores.shape[1])
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def _max_candidates() -> int:
+    return max(int(getattr(get_settings(), "EMBEDDINGS_SIMILARITY_MAX_CANDIDATES", 10_000)), 1)
+
+
+def _decode(data: Any) -> np.ndarray:
+    try:
+        return decode_matrix(data)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        raise HTTPException(status_code=502, detail="Upstream embeddings response could not be decoded") from None
+
+
+def _candidate_id(key: str, model: str, dimensions: Any) -> str:
+    return f"{key}:{dimensions or 0}:{model}"
+
+
+def _cache_keys(ids: Sequence[str], model: str, dimensions: Any) -> List[str]:
+    """The cache keys behind `ids`, which must all be for this model and width."""
+    keys = []
+    for candidate_id in ids:
+        key, _, rest = candidate_id.partition(":")
+        width, _, id_model = rest.partition(":")
+        if not id_model:
+            raise HTTPException(status_code=400, detail=f"Not a candidate id from this endpoint: {candidate_id!r}")
+        if (id_model, width) != (model, str(dimensions or 0)):
+            raise HTTPException(
+                status_code=400,
+                detail=f"candidate_ids must come from model {model!r} with dimensions {dimensions or 'default'}; "
+                f"{candidate_id!r} does not",
+            )
+        keys.append(key)
+    return keys
+
+
+async def _stored(ids: Sequence[str], model: str, dimensions: Any) -> np.ndarray:
+    if not embedding_cache.enabled():
+        raise HTTPException(status_code=400, detail="candidate_ids need the embedding cache (EMBEDDINGS_CACHE_ENABLED)")
+    keys = _cache_keys(ids, model, dimensions)
+    found = await asyncio.to_thread(embedding_cache.get_embedding_cache().get_many, list(dict.fromkeys(keys)))
+    missing = [i for i, k in zip(ids, keys, strict=True) if k not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Unknown or evicted candidate_ids: {', '.join(missing[:10])}")
+    return _decode([{"embedding": orjson.loads(found[k])} for k in keys])
+
+
+async def similarity(
+    *,
+    model: str,
+    queries: List[str],
+    candidates: List[str],
+    candidate_ids: List[str],
+    k: int,
+    options: Mapping[str, Any],
+    inbound_headers: Mapping[str, str],
+) -> Response:
+    """Rank candidates against each query; see the module docstring."""
+    total = len(candidates) + len(candidate_ids)
+    if not queries or total == 0:
+        raise HTTPException(status_code=400, detail="Need at least one query and one candidate")
+    if total > _max_candidates():
+        raise HTTPException(status_code=400, detail=f"At most {_max_candidates()} candidates per request")
+
+    body = upstream_body({**options, "model": model, "input": queries + candidates})
+    resp = await dispatch(body, inbound_headers=inbound_headers)
+    if resp.status_code != 200:
+        return embeddings_response(resp)
+    try:
+        payload = orjson.loads(resp.content)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=502, detail="Upstream embeddings response is not JSON") from None
+    matrix = _decode(payload.get("data"))
+    query_matrix, candidate_matrix = matrix[: len(queries)], matrix[len(queries) :]
+    if candidate_ids:
+        stored = await _stored(candidate_ids, model, body.get("dimensions"))
+        if stored.shape[1] != query_matrix.shape[1]:
+            raise HTTPException(status_code=400, detail="candidate_ids refer to vectors of a different dimension")
+        candidate_matrix = np.vstack([candidate_matrix, stored])
+
+    if query_matrix.shape[0] * candidate_matrix.shape[0] > _INLINE_CELLS:
+        indexes, scores = await asyncio.to_thread(top_k, query_matrix, candidate_matrix, k)
+    else:
+        indexes, scores = top_k(query_matrix, candidate_matrix, k)
+
+    ids: Optional[List[str]] = None
+    # Locally served vectors never enter the cache, so they get no ids.
+    if embedding_cache.enabled() and backend_for(model) is None:
+        ids = [
+            _candidate_id(embedding_cache.cache_key(body, text), model, body.get("dimensions")) for text in candidates
+        ] + list(candidate_ids)
+    data = []
+    for q, (row_indexes, row_scores) in enumerate(zip(indexes.tolist(), scores.tolist(), strict=True)):
+        matches = []
+        for index, score in zip(row_indexes, row_scores, strict=True):
+            match: Dict[str, Any] = {"index": index, "score": round(score, 6)}
+            if ids is not None:
+                match["id"] = ids[index]
+            matches.append(match)
+        data.append({"object": "similarity", "query_index": q, "matches": matches})
+    doc = {
+        "object": "list",
+        "metric": "cosine",
+        "data": data,
+        "model": payload.get("model") or model,
+        "usage": payload.get("usage") or {},
+    }
+    headers = {k: v for k, v in resp.headers.items() if k.lower().startswith("x-relay-")}
+    return Response(orjson.dumps(doc), media_type="application/json", headers=headers)
@@ -0,0 +1,119 @@
+# app/api/embedding_split.py
+"""Split oversized /v1/embeddings requests into parallel upstream sub-requests.
+
+Why this exists
+---------------
+Upstream caps a single embeddings request at 2048 inputs and a total token
+budget. A client sending a large corpus in one call got a 400. A call just
+under the caps still ran as one long request. `post_split` sits below the
+cache and the coalescer, right before the upstream call:
+
+- It estimates every input's tokens locally (embedding_payloads.estimate_tokens:
+  exact for token arrays, about four UTF-8 bytes per token for text). A
+  request within EMBEDDINGS_SPLIT_MAX_INPUTS and EMBEDDINGS_SPLIT_MAX_TOKENS
+  goes upstream unchanged.
+- A larger request is cut into the fewest sub-requests that fit both limits,
+  and the sub-requests are balanced in size, so 2100 inputs become two calls
+  of 1050, not 2048 and 52. Any single input over the token budget is sent
+  on its own, and upstream decides about it.
+- Sub-requests run EMBEDDINGS_SPLIT_CONCURRENCY at a time. Their results are
+  stitched back into one list response: indexes in input order, usage summed.
+- If any sub-request fails, the whole request fails with that upstream
+  answer, as the unsplit request would have. Sub-requests not yet started
+  are skipped.
+
+Lower the two limits to trade requests-per-minute for latency: smaller
+sub-requests finish sooner, and there are more of them running in parallel.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+from app.api.embedding_payloads import estimate_tokens, list_body, split_inputs, upstream_vectors
+from app.api.forward_openai import forward_embeddings_create
+from app.core.config import get_settings
+from app.utils import metrics
+
+# Soft per-chunk token target above the even share, so granularity does not add a chunk.
+_TOKEN_SLACK = 1.25
+
+
+def plan_chunks(sizes: Sequence[int], *, max_inputs: int, max_tokens: int) -> List[Tuple[int, int]]:
+    """[start, end) ranges over inputs with these token `sizes`: few, balanced, within both limits."""
+    total = sum(sizes)
+    n = max(math.ceil(len(sizes) / max_inputs), math.ceil(total / max_tokens), 1)
+    if n == 1:
+        return [(0, len(sizes))]
+    inputs_cap = math.ceil(len(sizes) / n)
+    tokens_cap = min(max_tokens, math.ceil(_TOKEN_SLACK * total / n))
+    chunks: List[Tuple[int, int]] = []
+    start = tokens = 0
+    for i, size in enumerate(sizes):
+        if i > start and (i - start >= inputs_cap or tokens + size > tokens_cap):
+            chunks.append((start, i))
+            start, tokens = i, 0
+        tokens += size
+    chunks.append((start, len(sizes)))
+    return chunks
+
+
+def _limits() -> Tuple[int, int, int]:
+    s = get_settings()
+    return (
+        max(int(getattr(s, "EMBEDDINGS_SPLIT_MAX_INPUTS", 2048)), 1),
+        max(int(getattr(s, "EMBEDDINGS_SPLIT_MAX_TOKENS", 250_000)), 1),
+        max(int(getattr(s, "EMBEDDINGS_SPLIT_CONCURRENCY", 4)), 1),
+    )
+
+
+async def post_split(body: Dict[str, Any], *, inbound_headers: Mapping[str, str]) -> httpx.Response:
+    """forward_embeddings_create, as parallel sub-requests when `body` is over the limits."""
+    inputs = split_inputs(body)
+    if inputs is None:
+        return await forward_embeddings_create(body, inbound_headers=inbound_headers)
+    max_inputs, max_tokens, concurrency = _limits()
+    chunks = plan_chunks([estimate_tokens(i) for i in inputs], max_inputs=max_inputs, max_tokens=max_tokens)
+    if len(chunks) == 1:
+        return await forward_embeddings_create(body, inbound_headers=inbound_headers)
+
+    metrics.incr("embeddings.split.requests")
+    gate = asyncio.Semaphore(concurrency)
+    failure: Optional[httpx.Response] = None
+
+    async def send(start: int, end: int) -> Optional[httpx.Response]:
+        nonlocal failure
+        async with gate:
+            if failure is not None:
+                return None
+            metrics.incr("embeddings.split.sub_requests")
+            resp = await forward_embeddings_create({**body, "input": inputs[start:end]}, inbound_headers=inbound_headers)
+            if resp.status_code != 200 and failure is None:
+                failure = resp
+            return resp
+
+    results = await asyncio.gather(*(send(start, end) for start, end in chunks))
+    if failure is not None:
+        return failure
+
+    values: List[bytes] = []
+    usage: Dict[str, int] = {}
+    model: Any = body.get("model")
+    for (start, end), resp in zip(chunks, results, strict=True):
+        try:
+            payload = resp.json()  # type: ignore[union-attr]
+        except ValueError:
+            raise HTTPException(status_code=502, detail="Upstream embeddings response is not JSON") from None
+        values.extend(json.dumps(v, separators=(",", ":")).encode() for v in upstream_vectors(payload, end - start))
+        for name, value in (payload.get("usage") or {}).items():
+            if isinstance(value, int):
+                usage[name] = usage.get(name, 0) + value
+        model = payload.get("model") or model
+    headers = {"content-type": "application/json", "x-relay-split": str(len(chunks))}
+    return httpx.Response(200, headers=headers, content=list_body(values, model=model, usage=usage))
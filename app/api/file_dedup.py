@@ -0,0 +1,176 @@
+# app/api/file_dedup.py
+"""Opt-in content-addressed reuse of uploaded files.
+
+Why this exists
+---------------
+Pipelines upload the same PDFs and JSONL batch inputs over and over. Every
+upload transferred the bytes again and created a new upstream File, which
+counts against the storage quota. With FILES_DEDUP_ENABLED, the upload routes
+(POST /v1/files and the /v1/actions/files/upload wrappers) hash the file as
+they read it. They then look up (sha256, purpose, credential) in a small
+sqlite index. On a hit the existing File object is returned and nothing is
+uploaded.
+
+- A hit is only trusted after a GET /v1/files/{id} shows the file still
+  exists. That check is cached for FILES_DEDUP_VERIFY_SECONDS.
+- A 404 on that check drops the entry and the upload proceeds.
+- Deleting a file through the relay drops its entry too.
+- The credential part of the key is a fingerprint of the headers upstream
+  actually sees: key, organization, project. Two projects never share a
+  file id.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse, Response
+
+from app.api.forward_openai import build_outbound_headers, forward_openai_method_path
+from app.core.config import get_settings
+
+_CREDENTIAL_HEADERS = ("authorization", "openai-organization", "openai-project")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    sha256      TEXT NOT NULL,
+    purpose     TEXT NOT NULL,
+    credential  TEXT NOT NULL,
+    file_id     TEXT NOT NULL,
+    file_json   TEXT NOT NULL,
+    verified_at REAL NOT NULL,
+    PRIMARY KEY (sha256, purpose, credential)
+);
+CREATE INDEX IF NOT EXISTS files_by_id ON files (file_id);
+"""
+
+
+def credential_fingerprint(inbound_headers: Mapping[str, str]) -> str:
+    """Short hash of the upstream credential headers this request would carry."""
+    out = build_outbound_headers(inbound_headers)
+    lowered = {k.lower(): v for k, v in out.items()}
+    material = "\0".join(lowered.get(h, "") for h in _CREDENTIAL_HEADERS)
+    return hashlib.sha256(material.encode()).hexdigest()[:32]
+
+
+class DedupIndex:
+    """(sha256, purpose, credential) -> File object. Thread-safe, one statement per call.
+
+    The methods block on sqlite and the lock; async callers run them with
+    asyncio.to_thread.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def get(self, sha256: str, purpose: str, credential: str) -> Optional[tuple[Dict[str, Any], float]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT file_json, verified_at FROM files WHERE sha256 = ? AND purpose = ? AND credential = ?",
+                (sha256, purpose, credential),
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, sha256: str, purpose: str, credential: str, file_obj: Dict[str, Any]) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (sha256, purpose, credential, file_obj["id"], json.dumps(file_obj), time.time()),
+            )
+
+    def forget(self, file_id: str) -> int:
+        with self._lock:
+            return self._db.execute("DELETE FROM files WHERE file_id = ?", (file_id,)).rowcount
+
+
+_index: Optional[DedupIndex] = None
+
+
+def enabled() -> bool:
+    return bool(getattr(get_settings(), "FILES_DEDUP_ENABLED", False))
+
+
+def get_dedup_index() -> DedupIndex:
+    """The process-wide index, reopened if FILES_DEDUP_PATH changes."""
+    global _index
+    path = getattr(get_settings(), "FILES_DEDUP_PATH", None) or os.path.join(
+        tempfile.gettempdir(), "relay-files-dedup.sqlite3"
+    )
+    if _index is None or _index.path != path:
+        if _index is not None:
+            _index.close()
+        _index = DedupIndex(path)
+    return _index
+
+
+def _file_object(resp: Response) -> Optional[Dict[str, Any]]:
+    if resp.status_code >= 400:
+        return None
+    try:
+        obj = json.loads(resp.body or b"null")
+    except ValueError:
+        return None
+    return obj if isinstance(obj, dict) and obj.get("id") else None
+
+
+async def lookup(sha256: str, purpose: str, inbound_headers: Mapping[str, str]) -> Optional[Response]:
+    """The existing File for these bytes, if upstream still has it; else None."""
+    index = get_dedup_index()
+    credential = credential_fingerprint(inbound_headers)
+    hit = await asyncio.to_thread(index.get, sha256, purpose, credential)
+    if hit is None:
+        return None
+    file_obj, verified_at = hit
+
+    ttl = float(getattr(get_settings(), "FILES_DEDUP_VERIFY_SECONDS", 300))
+    if time.time() - verified_at >= ttl:
+        try:
+            check = await forward_openai_method_path(
+                "GET", f"/v1/files/{file_obj['id']}", inbound_headers=inbound_headers
+            )
+        except HTTPException:
+            # Transport failure (424): the upload goes ahead, as on an upstream error.
+            return None
+        if check.status_code == 404:
+            await asyncio.to_thread(index.forget, file_obj["id"])
+            return None
+        fresh = _file_object(check)
+        if fresh is None:
+            # Could not confirm (upstream error): upload rather than hand out a dead id.
+            return None
+        file_obj = fresh
+        await asyncio.to_thread(index.put, sha256, purpose, credential, file_obj)
+
+    return JSONResponse(file_obj, headers={"x-relay-dedup": "hit"})
+
+
+async def remember(sha256: str, purpose: str, inbound_headers: Mapping[str, str], resp: Response) -> Response:
+    """Index the File an upload just created; returns `resp`, marked as a miss."""
+    file_obj = _file_object(resp)
+    if file_obj is not None:
+        credential = credential_fingerprint(inbound_headers)
+        await asyncio.to_thread(get_dedup_index().put, sha256, purpose, credential, file_obj)
+        resp.headers["x-relay-dedup"] = "miss"
+    return resp
+
+
+async def forget(file_id: str) -> None:
+    if enabled():
+        await asyncio.to_thread(get_dedup_index().forget, file_id)
@@ -0,0 +1,130 @@
+# app/api/file_meta.py
+"""Short-lived cache of File objects seen passing through the relay.
+
+Why this exists
+---------------
+GET /v1/files/{id}/content refuses files whose purpose is `user_data`. The
+guard used to make a GET /v1/files/{id} before every download. It then checked
+`isinstance(meta, dict)` against the Response that call returns, so it never
+matched anything. It cost a full round trip and protected nothing.
+
+File objects already flow through the relay in list, retrieve and create
+responses. `observe()` records them here, keyed by file id. The guard reads the
+purpose from this cache, so a download after a listing or an upload needs no
+metadata request. On a miss the route fetches the metadata itself, alongside
+opening the content stream, and that response is recorded too.
+
+- Only `purpose` is consulted. It is fixed when a File is created, so a cached
+  value cannot go stale; the TTL (FILES_META_CACHE_SECONDS) just bounds how
+  long an entry is kept.
+- Entries expire lazily on lookup, and the oldest go first once
+  FILES_META_CACHE_MAX_ENTRIES is reached.
+- Deleting a file through the relay drops its entry.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from starlette.responses import Response
+
+from app.core.config import get_settings
+
+
+class FileMetaCache:
+    """file id -> (File object, stored at). Thread-safe, bounded, insertion-ordered."""
+
+    def __init__(self, *, ttl_seconds: float, max_entries: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[Dict[str, Any], float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, file_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] >= self.ttl_seconds:
+                del self._entries[file_id]
+                return None
+            return entry[0]
+
+    def put(self, file_obj: Dict[str, Any]) -> None:
+        if self.ttl_seconds <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries.pop(file_obj["id"], None)
+            self._entries[file_obj["id"]] = (file_obj, time.monotonic())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, file_id: str) -> None:
+        with self._lock:
+            self._entries.pop(file_id, None)
+
+
+_cache: Optional[FileMetaCache] = None
+
+
+def get_file_meta_cache() -> FileMetaCache:
+    """The process-wide cache; picks up changes to its two settings."""
+    global _cache
+    s = get_settings()
+    ttl = float(getattr(s, "FILES_META_CACHE_SECONDS", 600))
+    max_entries = int(getattr(s, "FILES_META_CACHE_MAX_ENTRIES", 4096))
+    if _cache is None or (_cache.ttl_seconds, _cache.max_entries) != (ttl, max_entries):
+        _cache = FileMetaCache(ttl_seconds=ttl, max_entries=max_entries)
+    return _cache
+
+
+def _is_file_object(obj: Any) -> bool:
+    return isinstance(obj, dict) and obj.get("object") == "file" and isinstance(obj.get("id"), str)
+
+
+def _json_payload(resp: Response) -> Any:
+    body = getattr(resp, "body", None)
+    if resp.status_code >= 400 or not body:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def file_object(resp: Response) -> Optional[Dict[str, Any]]:
+    """The File object in a buffered 2xx response, if that is what it holds."""
+    obj = _json_payload(resp)
+    return obj if _is_file_object(obj) else None
+
+
+def observe(resp: Response) -> Response:
+    """Record the File object(s) in a 2xx JSON response: a single File or a list page.
+
+    Returns `resp` unchanged. Streaming responses and anything that is not a File are ignored.
+    """
+    obj = _json_payload(resp)
+    cache = get_file_meta_cache()
+    if _is_file_object(obj):
+        cache.put(obj)
+    elif isinstance(obj, dict) and isinstance(obj.get("data"), list):
+        for item in obj["data"]:
+            if _is_file_object(item):
+                cache.put(item)
+    return resp
+
+
+def cached_purpose(file_id: str) -> Optional[str]:
+    meta = get_file_meta_cache().get(file_id)
+    return None if meta is None else str(meta.get("purpose", ""))
+
+
+def forget(file_id: str) -> None:
+    get_file_meta_cache().forget(file_id)
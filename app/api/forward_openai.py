@@ -195,8 +195,15 @@ def build_outbound_headers(
     return out
 
 
+def inherited_headers(request: Request) -> Dict[str, str]:
+    """The caller's headers for calls made on its behalf, minus the ones describing its own body."""
+    return {k: v for k, v in request.headers.items() if k.lower() not in {"accept", "content-type", "content-length"}}
+
+
 def filter_upstream_headers(inbound_headers: Mapping[str, str]) -> Dict[str, str]:
-    # Backwards-compatible name used by containers.py
+    # Backwards-compatible alias of build_outbound_headers: it builds *request*
+    # headers and adds the upstream Authorization. Never use it on a response
+    # (use _filter_response_headers); containers.py once did and leaked the key.
     return build_outbound_headers(inbound_headers)
 
 
@@ -401,15 +408,57 @@ async def forward_openai_method_path(
     )
 
 
+async def open_upstream_stream(
+    method: str,
+    path: str,
+    *,
+    json_body: Optional[Any] = None,
+    inbound_headers: Optional[Mapping[str, str]] = None,
+    query: Optional[Mapping[str, str]] = None,
+    upstream_timeout: Optional[httpx.Timeout | float] = None,
+) -> httpx.Response:
+    """
+    Send a request upstream and return the response with its body unread.
+
+    The caller owns the response and must `aclose()` it. This is the shared entry
+    point for everything that consumes an upstream SSE stream itself (replay
+    buffers, aggregation) rather than handing it straight to a StreamingResponse.
+    Transport failures become 424, like every other forwarding path.
+    """
+    settings = get_settings()
+    url = build_upstream_url(path, query=query)
+    headers = build_outbound_headers(inbound_headers or {}, path_hint=path)
+
+    body_bytes = b""
+    if json_body is not None:
+        body_bytes = json.dumps(json_body).encode("utf-8")
+        if not (headers.get("Content-Type") or headers.get("content-type")):
+            headers["Content-Type"] = "application/json"
+
+    client = get_async_httpx_client()
+    req = client.build_request(
+        method.upper(),
+        url,
+        headers=headers,
+        content=body_bytes,
+        timeout=upstream_timeout if upstream_timeout is not None else _get_timeout_seconds(settings),
+    )
+    try:
+        return await client.send(req, stream=True)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=424, detail=f"Upstream request failed: {type(e).__name__}: {e}") from e
+
+
 async def forward_embeddings_create(
     body: Dict[str, Any],
     *,
     inbound_headers: Optional[Mapping[str, str]] = None,
-) -> Dict[str, Any]:
+) -> httpx.Response:
     """
-    Convenience helper used by /v1/embeddings route.
+    POST `body` to upstream /v1/embeddings and return the (fully read) response.
 
-    Returns JSON dict; raises HTTPException on upstream transport failures.
+    Callers decide what to do with non-2xx answers; `embeddings_response` relays
+    one as it is. Raises HTTPException(424) on upstream transport failures.
     """
     settings = get_settings()
     headers = build_outbound_headers(inbound_headers or {}, path_hint="/v1/embeddings")
@@ -420,15 +469,19 @@ async def forward_embeddings_create(
 
     try:
         url = build_upstream_url("/v1/embeddings")
-        resp = await client.post(url, headers=headers, json=body, timeout=timeout_s)
+        return await client.post(url, headers=headers, json=body, timeout=timeout_s)
     except httpx.HTTPError as e:
         raise HTTPException(status_code=424, detail=f"Upstream request failed: {type(e).__name__}: {e}") from e
 
-    # Even for non-2xx, OpenAI returns JSON error bodies; pass through as dict when possible.
-    try:
-        return resp.json()
-    except Exception:
-        return {"status_code": resp.status_code, "body": resp.text}
+
+def embeddings_response(resp: httpx.Response) -> Response:
+    """Relay an upstream embeddings response: status, body and headers unchanged."""
+    return Response(
+        content=resp.content,
+        status_code=resp.status_code,
+        headers=_filter_response_headers(resp.headers),
+        media_type=resp.headers.get("content-type"),
+    )
 
 
 # Back-compat/private aliases referenced by older SSE wiring (avoid import-time crashes).
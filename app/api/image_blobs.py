@@ -0,0 +1,406 @@
+# app/api/image_blobs.py
+"""Offload `b64_json` image payloads to local blobs served from signed URLs.
+
+Why this exists
+---------------
+With `response_format=b64_json` (and always for gpt-image models), image
+responses are JSON documents several megabytes in size. ChatGPT Actions and
+mobile clients are slow to receive and parse them, and often go over the
+Action response size limit. With IMAGES_BLOBS_ENABLED the images routes stream
+the upstream JSON through `_Rewriter`:
+
+- Every `"b64_json": "..."` value is base64-decoded on the fly into a blob
+  file. The relay never holds the encoded string in memory.
+- In the response, that member is replaced by `"url": "<signed relay URL>"`.
+  Everything else in the document is passed through byte for byte, and the
+  body shrinks to a few hundred bytes.
+- Blobs are content-addressed (`<sha256>.<ext>`). Files older than
+  IMAGES_BLOBS_TTL_SECONDS are swept.
+- A URL carries `expires` and an HMAC `sig` over the blob id and expiry. That
+  signature is the only credential GET /v1/images/blobs/{blob_id} checks, so
+  a browser or an Action can open the link without the relay key. Responses
+  are immutable and cacheable until the link expires.
+
+Decoding, blob writes and the sweep touch the disk, so each upstream chunk is
+fed to the rewriter in a worker thread, never on the event loop.
+
+Streaming (SSE) requests, errors and non-JSON responses are relayed unchanged.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import contextlib
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+from typing import Callable, List, Optional
+
+import httpx
+from fastapi import HTTPException, Request
+from starlette.responses import FileResponse, Response
+
+from app.api.forward_openai import (
+    _detect_wants_stream,
+    _filter_response_headers,
+    _get_timeout_seconds,
+    build_outbound_headers,
+    build_upstream_url,
+    forward_openai_request,
+)
+from app.core.config import get_settings
+from app.core.http_client import get_async_httpx_client
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+BLOB_ID_RE = re.compile(r"^[0-9a-f]{64}\.(png|jpeg|webp|gif|bin)$")
+
+_MEDIA_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp", "gif": "image/gif"}
+_KEY = b"b64_json"
+_WHITESPACE = b" \t\r\n"
+
+
+class PayloadError(ValueError):
+    """The upstream JSON could not be rewritten (malformed base64 or string)."""
+
+
+def _sniff_ext(head: bytes) -> str:
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return "bin"
+
+
+class BlobStore:
+    """Content-addressed image files in one directory, swept by age."""
+
+    def __init__(self, root: str, *, ttl_seconds: int) -> None:
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, blob_id: str) -> str:
+        return os.path.join(self.root, blob_id)
+
+    def open_writer(self) -> "_BlobWriter":
+        self.sweep()
+        return _BlobWriter(self)
+
+    def sweep(self, *, force: bool = False) -> None:
+        """Remove blobs past the TTL (and stale temp files); at most once a minute."""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_sweep < 60:
+                return
+            self._last_sweep = now
+        cutoff = now - self.ttl_seconds
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            with contextlib.suppress(OSError):
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+
+
+class _BlobWriter:
+    """Incremental base64 decoder writing into a temp file; commit() names it by hash."""
+
+    def __init__(self, store: BlobStore) -> None:
+        self._store = store
+        fd, self._tmp = tempfile.mkstemp(dir=store.root, suffix=".part")
+        self._fh = os.fdopen(fd, "wb")
+        self._digest = hashlib.sha256()
+        self._pending = b""
+        self._head = b""
+
+    def feed(self, text: bytes) -> None:
+        data = self._pending + text
+        cut = len(data) - len(data) % 4
+        self._pending = data[cut:]
+        if cut:
+            self._write(data[:cut])
+
+    def _write(self, encoded: bytes) -> None:
+        try:
+            raw = base64.b64decode(encoded, validate=True)
+        except ValueError as exc:
+            raise PayloadError(f"invalid base64 in b64_json: {exc}") from None
+        if len(self._head) < 16:
+            self._head += raw[: 16 - len(self._head)]
+        self._digest.update(raw)
+        self._fh.write(raw)
+
+    def commit(self) -> str:
+        if self._pending:
+            raise PayloadError("truncated base64 in b64_json")
+        self._fh.close()
+        blob_id = f"{self._digest.hexdigest()}.{_sniff_ext(self._head)}"
+        final = self._store.path(blob_id)
+        os.replace(self._tmp, final)
+        os.utime(final)  # an identical image re-offloaded gets a fresh TTL
+        return blob_id
+
+    def abort(self) -> None:
+        self._fh.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self._tmp)
+
+
+class _Rewriter:
+    """Streaming JSON rewriter: `"b64_json": "<base64>"` -> `"url": "<signed URL>"`.
+
+    Outside base64 values it tokenises strings byte by byte, so a `b64_json`
+    inside some other string is never mistaken for the key. Inside a value the
+    base64 is handed to the blob writer in bulk, so multi-megabyte payloads
+    cost one slice per chunk.
+
+    feed() and abort() run in worker threads; a lock keeps an abort from
+    racing a feed still in flight after its awaiting task was cancelled.
+    """
+
+    def __init__(self, store: BlobStore, url_for: Callable[[str], str]) -> None:
+        self._store = store
+        self._url_for = url_for
+        self.out = bytearray()
+        self.blob_ids: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._token = bytearray()
+        self._token_start = 0
+        self._last_string: Optional[bytes] = None
+        self._last_start = 0
+        self._key_start = -1
+        self._await_value = False
+        self._writer: Optional[_BlobWriter] = None
+        self._value_escape = False
+        self._lock = threading.Lock()
+
+    def feed(self, chunk: bytes) -> None:
+        with self._lock:
+            self._feed(chunk)
+
+    def _feed(self, chunk: bytes) -> None:
+        i, n = 0, len(chunk)
+        while i < n:
+            if self._writer is not None:
+                i = self._feed_value(self._writer, chunk, i)
+                continue
+            c = chunk[i]
+            i += 1
+            if self._in_string:
+                self.out.append(c)
+                if self._escape:
+                    self._escape = False
+                elif c == 0x5C:  # backslash
+                    self._escape = True
+                elif c == 0x22:  # closing quote
+                    self._in_string = False
+                    self._last_string = bytes(self._token)
+                    self._last_start = self._token_start
+                    continue
+                if len(self._token) <= len(_KEY):
+                    self._token.append(c)
+            elif c == 0x22:
+                if self._await_value:
+                    self._writer = self._store.open_writer()
+                    continue
+                self._in_string = True
+                self._token.clear()
+                self._token_start = len(self.out)
+                self.out.append(c)
+            elif c == 0x3A:  # colon
+                self.out.append(c)
+                if self._last_string == _KEY:
+                    self._await_value = True
+                    self._key_start = self._last_start
+                self._last_string = None
+            else:
+                self.out.append(c)
+                if c not in _WHITESPACE:
+                    self._await_value = False
+                    self._last_string = None
+
+    def _feed_value(self, writer: _BlobWriter, chunk: bytes, i: int) -> int:
+        if self._value_escape:
+            self._value_escape = False
+            esc = chunk[i : i + 1]
+            if esc == b"/":
+                writer.feed(b"/")
+            elif esc not in (b"n", b"r", b"t"):
+                raise PayloadError("unexpected escape in b64_json")
+            return i + 1
+        quote = chunk.find(b'"', i)
+        slash = chunk.find(b"\\", i)
+        stop = min(p for p in (quote, slash, len(chunk)) if p >= 0)
+        if stop > i:
+            writer.feed(chunk[i:stop])
+        if stop == len(chunk):
+            return stop
+        if stop == slash:
+            self._value_escape = True
+            return stop + 1
+        self._finish_value(writer)
+        return stop + 1
+
+    def _finish_value(self, writer: _BlobWriter) -> None:
+        blob_id = writer.commit()
+        self._writer = None
+        self.blob_ids.append(blob_id)
+        del self.out[self._key_start :]
+        self.out += b'"url": ' + json.dumps(self._url_for(blob_id)).encode()
+        self._await_value = False
+
+    def finish(self) -> bytes:
+        if self._writer is not None or self._in_string:
+            raise PayloadError("upstream JSON ended inside a string")
+        return bytes(self.out)
+
+    def abort(self) -> None:
+        with self._lock:
+            if self._writer is not None:
+                self._writer.abort()
+                self._writer = None
+
+
+class UrlFor:
+    def __init__(self, base_url: str, ttl_seconds: int) -> None:
+        self._base = base_url.rstrip("/")
+        self._expires = int(time.time()) + ttl_seconds
+
+    def __call__(self, blob_id: str) -> str:
+        return f"{self._base}/v1/images/blobs/{blob_id}?expires={self._expires}&sig={sign(blob_id, self._expires)}"
+
+
+_store: Optional[BlobStore] = None
+_ephemeral_key = secrets.token_bytes(32)
+
+
+def enabled() -> bool:
+    return bool(getattr(get_settings(), "IMAGES_BLOBS_ENABLED", False))
+
+
+def _ttl() -> int:
+    return max(int(getattr(get_settings(), "IMAGES_BLOBS_TTL_SECONDS", 3600)), 1)
+
+
+def get_blob_store() -> BlobStore:
+    """The process-wide store, reopened if IMAGES_BLOBS_DIR or the TTL changes."""
+    global _store
+    s = get_settings()
+    root = getattr(s, "IMAGES_BLOBS_DIR", None) or os.path.join(tempfile.gettempdir(), "relay-image-blobs")
+    if _store is None or (_store.root, _store.ttl_seconds) != (root, _ttl()):
+        _store = BlobStore(root, ttl_seconds=_ttl())
+    return _store
+
+
+def _signing_key() -> bytes:
+    s = get_settings()
+    explicit = getattr(s, "IMAGES_BLOBS_SIGNING_KEY", None)
+    if explicit:
+        return explicit.encode()
+    relay_key = getattr(s, "RELAY_KEY", None)
+    if relay_key:
+        return hashlib.sha256(b"relay-image-blobs\0" + relay_key.encode()).digest()
+    # Only valid for this process: links break on restart and across workers.
+    return _ephemeral_key
+
+
+def sign(blob_id: str, expires: int) -> str:
+    mac = hmac.new(_signing_key(), f"{blob_id}\n{expires}".encode(), hashlib.sha256)
+    return mac.hexdigest()
+
+
+def _public_base(request: Request) -> str:
+    return getattr(get_settings(), "IMAGES_BLOBS_PUBLIC_BASE_URL", None) or str(request.base_url)
+
+
+async def offload_response(request: Request, upstream: httpx.Response) -> Response:
+    """Relay an unread upstream images response, offloading its b64_json values; closes `upstream`."""
+    media_type = upstream.headers.get("content-type")
+    headers = _filter_response_headers(upstream.headers)
+    headers.pop("content-type", None)
+    try:
+        if upstream.status_code != 200 or not (media_type or "").startswith("application/json"):
+            return Response(await upstream.aread(), status_code=upstream.status_code, headers=headers, media_type=media_type)
+        rewriter = _Rewriter(get_blob_store(), UrlFor(_public_base(request), _ttl()))
+        try:
+            async for chunk in upstream.aiter_bytes():
+                await asyncio.to_thread(rewriter.feed, chunk)
+            body = rewriter.finish()
+        except PayloadError as exc:
+            await asyncio.to_thread(rewriter.abort)
+            logger.warning("image blobs: could not rewrite upstream response: %s", exc)
+            raise HTTPException(status_code=502, detail=f"Upstream image payload could not be offloaded: {exc}") from None
+        except BaseException:
+            await asyncio.to_thread(rewriter.abort)
+            raise
+    except httpx.HTTPError as exc:
+        raise HTTPException(status_code=424, detail=f"Upstream request failed: {type(exc).__name__}: {exc}") from exc
+    finally:
+        await upstream.aclose()
+    headers["x-relay-image-blobs"] = str(len(rewriter.blob_ids))
+    return Response(body, status_code=200, headers=headers, media_type=media_type)
+
+
+async def forward_offloaded(request: Request, *, upstream_path: Optional[str] = None) -> Response:
+    """forward_openai_request() with b64_json offloaded; SSE requests are forwarded as they are."""
+    body = await request.body()
+    if _detect_wants_stream(
+        accept_header=request.headers.get("accept", ""),
+        content_type=request.headers.get("content-type"),
+        body_bytes=body,
+    ):
+        return await forward_openai_request(request, upstream_path=upstream_path)
+
+    path = upstream_path or request.url.path
+    client = get_async_httpx_client()
+    req = client.build_request(
+        request.method,
+        build_upstream_url(path, request=request),
+        headers=build_outbound_headers(request.headers, path_hint=path),
+        content=body,
+        timeout=_get_timeout_seconds(get_settings()),
+    )
+    try:
+        upstream = await client.send(req, stream=True)
+    except httpx.HTTPError as exc:
+        raise HTTPException(status_code=424, detail=f"Upstream request failed: {type(exc).__name__}: {exc}") from exc
+    return await offload_response(request, upstream)
+
+
+def serve_blob(blob_id: str, expires: str, sig: str) -> Response:
+    """The blob behind a signed URL; 403 for a bad signature, 410 once expired."""
+    if not BLOB_ID_RE.match(blob_id):
+        raise HTTPException(status_code=404, detail="No such image blob")
+    try:
+        expires_at = int(expires)
+    except ValueError:
+        raise HTTPException(status_code=403, detail="Invalid image link signature") from None
+    if not hmac.compare_digest(sign(blob_id, expires_at), sig):
+        raise HTTPException(status_code=403, detail="Invalid image link signature")
+    remaining = expires_at - int(time.time())
+    if remaining <= 0:
+        raise HTTPException(status_code=410, detail="Image link has expired")
+    path = get_blob_store().path(blob_id)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Image blob is no longer available")
+    ext = blob_id.rsplit(".", 1)[1]
+    headers = {
+        "cache-control": f"private, max-age={remaining}, immutable",
+        "etag": f'"{blob_id.split(".")[0]}"',
+    }
+    return FileResponse(path, headers=headers, media_type=_MEDIA_TYPES.get(ext, "application/octet-stream"))
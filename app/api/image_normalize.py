@@ -0,0 +1,258 @@
+# app/api/image_normalize.py
+"""Server-side normalisation of image edit and variation inputs.
+
+Why this exists
+---------------
+The images JSON wrappers only accepted PNGs of at most 4 MB. ChatGPT users
+mostly send JPEG or WebP photos straight from a phone, usually larger than
+that. Those requests failed, or the user had to re-encode and upload again.
+With Pillow installed (the `images` extra) and IMAGES_NORMALIZE_ENABLED,
+every input is made acceptable before it is sent upstream:
+
+- Converted from any format Pillow reads to RGBA PNG, with EXIF rotation
+  applied.
+- Square where the model needs it (variations, dall-e-2 edits). The image is
+  centre-cropped and snapped down to 256, 512 or 1024, or to the requested
+  `size`. Other edits are only fitted inside the requested or largest size.
+- A mask without transparency gets an alpha mask generated from its
+  luminance: white marks the area to edit and becomes transparent. The mask
+  is resized to the image's final size.
+- Recompressed to fit the 4 MB upstream limit. The relay tries optimised
+  PNG, then a 256-colour palette, then steps the resolution down.
+
+The work is CPU-bound, so it runs in a process pool (IMAGES_NORMALIZE_WORKERS)
+and never on the event loop. Images with more than IMAGES_NORMALIZE_MAX_PIXELS
+pixels are refused from their header, before anything is decoded. If a worker
+dies anyway (OOM killer, a crash in a codec), the broken pool is replaced and
+the job retried once; a second crash refuses the image. Results are cached by (input SHA-256,
+parameters) up to IMAGES_NORMALIZE_CACHE_BYTES. Retrying an edit with the
+same photo therefore costs nothing. Without Pillow the wrappers keep the old
+PNG-only check.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import importlib.util
+import io
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Optional, Tuple
+
+from app.core.config import get_settings
+
+# Upstream's limit for edit and variation inputs.
+UPSTREAM_MAX_BYTES = 4 * 1024 * 1024
+
+_SQUARE_SIDES = (256, 512, 1024)
+_MAX_SIDE = 1536
+_RESCALE_STEPS = 4
+
+Size = Tuple[int, int]
+
+
+class ImageRejected(ValueError):
+    """The input cannot be turned into an acceptable PNG; the message says why."""
+
+
+def pillow_available() -> bool:
+    return importlib.util.find_spec("PIL") is not None
+
+
+def enabled() -> bool:
+    return bool(getattr(get_settings(), "IMAGES_NORMALIZE_ENABLED", True)) and pillow_available()
+
+
+def max_input_bytes() -> int:
+    return int(getattr(get_settings(), "IMAGES_NORMALIZE_MAX_INPUT_BYTES", 20 * 1024 * 1024))
+
+
+def target_side(size: Optional[str], *, square: bool) -> int:
+    """Longest side allowed for an output, from the request's `size` (e.g. "512x512")."""
+    try:
+        width, height = (int(v) for v in (size or "").lower().split("x"))
+        requested = max(width, height)
+    except ValueError:
+        requested = 0
+    if square:
+        return requested if requested in _SQUARE_SIDES else _SQUARE_SIDES[-1]
+    return requested if 0 < requested <= _MAX_SIDE else _MAX_SIDE
+
+
+# --- worker side (runs in the process pool) ----------------------------------
+
+
+def _mask_alpha(img: Any) -> Any:
+    from PIL import Image
+
+    has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+    if has_alpha:
+        rgba = img.convert("RGBA")
+        if rgba.getextrema()[3][0] < 255:
+            return rgba
+    # No transparency: white (bright) marks the area to edit.
+    luminance = img.convert("L")
+    alpha = luminance.point(lambda v: 0 if v >= 128 else 255)
+    out = Image.new("RGBA", img.size, (0, 0, 0, 255))
+    out.putalpha(alpha)
+    return out
+
+
+def _png(img: Any) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def normalize_image(
+    data: bytes,
+    *,
+    square: bool,
+    max_side: int,
+    max_bytes: int = UPSTREAM_MAX_BYTES,
+    is_mask: bool = False,
+    match_size: Optional[Size] = None,
+    max_pixels: Optional[int] = None,
+) -> Tuple[bytes, Size]:
+    """Decode, shape and re-encode one input; returns (PNG bytes, (width, height)).
+
+    Pure and picklable: this is what the process pool runs.
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        if max_pixels is not None and img.width * img.height > max_pixels:
+            raise ImageRejected(f"is too large ({img.width}x{img.height}; at most {max_pixels} pixels)")
+        img.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as exc:
+        raise ImageRejected(f"is not a readable image ({exc})") from None
+    img = ImageOps.exif_transpose(img)
+    img = _mask_alpha(img) if is_mask else img.convert("RGBA")
+
+    if match_size is not None:
+        if img.size != match_size:
+            img = img.resize(match_size, Image.Resampling.LANCZOS)
+    else:
+        if square and img.width != img.height:
+            side = min(img.size)
+            left, top = (img.width - side) // 2, (img.height - side) // 2
+            img = img.crop((left, top, left + side, top + side))
+        if square:
+            fitting = [s for s in _SQUARE_SIDES if s <= min(img.width, max_side)]
+            side = fitting[-1] if fitting else img.width
+            if side != img.width:
+                img = img.resize((side, side), Image.Resampling.LANCZOS)
+        elif max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+    for _ in range(_RESCALE_STEPS):
+        out = _png(img)
+        if len(out) <= max_bytes:
+            return out, img.size
+        out = _png(img.quantize(colors=256, method=Image.Quantize.FASTOCTREE))
+        if len(out) <= max_bytes:
+            return out, img.size
+        if match_size is not None:
+            break
+        img = img.resize((max(img.width * 3 // 4, 1), max(img.height * 3 // 4, 1)), Image.Resampling.LANCZOS)
+    raise ImageRejected(f"cannot be compressed under {max_bytes} bytes")
+
+
+# --- relay side ----------------------------------------------------------------
+
+
+class _ResultCache:
+    """(input hash, parameters) -> (PNG, size); LRU bounded by total PNG bytes."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Tuple[Any, ...], Tuple[bytes, Size]] = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: Tuple[Any, ...]) -> Optional[Tuple[bytes, Size]]:
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                self._entries.move_to_end(key)
+            return hit
+
+    def put(self, key: Tuple[Any, ...], value: Tuple[bytes, Size], max_bytes: int) -> None:
+        if len(value[0]) > max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = value
+            self._bytes += len(value[0])
+            while self._bytes > max_bytes:
+                _, (png, _) = self._entries.popitem(last=False)
+                self._bytes -= len(png)
+
+
+_results = _ResultCache()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    workers = max(int(getattr(get_settings(), "IMAGES_NORMALIZE_WORKERS", 2)), 1)
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        # spawn: the relay process has threads (anyio, httpx); forking it is unsafe.
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _pool_workers = workers
+    return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a pool whose worker died; the next _get_pool() starts a fresh one."""
+    global _pool
+    if _pool is pool:
+        _pool = None
+    pool.shutdown(wait=False)
+
+
+async def normalize(
+    data: bytes,
+    *,
+    square: bool,
+    max_side: int,
+    is_mask: bool = False,
+    match_size: Optional[Size] = None,
+) -> Tuple[bytes, Size]:
+    """normalize_image() in the process pool, through the result cache. Raises ImageRejected."""
+    params = (square, max_side, is_mask, match_size)
+    key = (hashlib.sha256(data).hexdigest(), *params)
+    hit = _results.get(key)
+    if hit is not None:
+        return hit
+    max_pixels = int(getattr(get_settings(), "IMAGES_NORMALIZE_MAX_PIXELS", 40_000_000))
+    job = partial(
+        normalize_image,
+        data,
+        square=square,
+        max_side=max_side,
+        is_mask=is_mask,
+        match_size=match_size,
+        max_pixels=max_pixels,
+    )
+    for attempt in range(2):
+        pool = _get_pool()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(pool, job)
+            break
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            if attempt:
+                raise ImageRejected("could not be processed (the image worker crashed)") from None
+    _results.put(key, result, int(getattr(get_settings(), "IMAGES_NORMALIZE_CACHE_BYTES", 64 * 1024 * 1024)))
+    return result
@@ -0,0 +1,166 @@
+# app/api/job_wait.py
+"""Long-poll `/wait` for async jobs, backed by one shared poller per job.
+
+Why this exists
+---------------
+Videos, batches, vector-store file batches and background responses finish
+asynchronously. Clients, scripts/batch_download_test.sh and the examples
+included, poll GET /v1/<job> in a loop through the relay. Every client pays
+its own upstream poll each time, and only learns of completion on its next
+tick. `GET …/wait?timeout=N` holds the request open instead:
+
+- Every waiter on the same job and credential joins one `JobPoller`. That
+  poller is the only thing polling upstream, so poll volume grows with the
+  number of jobs, not the number of clients.
+- Polling is adaptive. It starts at JOB_WAIT_POLL_MIN_MS and doubles while the
+  job document is unchanged, up to JOB_WAIT_POLL_MAX_MS. Any change drops it
+  back to the minimum, so a job that is moving is followed closely.
+- When the job reaches a terminal status, or upstream answers with a
+  non-retryable error, every waiter is released at once with that document.
+  A waiter whose timeout runs out first gets the latest document instead.
+  The `x-relay-wait` header says which of the two happened.
+- A poller stops as soon as it has no waiters left. Nothing keeps polling a
+  job nobody is waiting on.
+
+The response body is exactly what GET /v1/<job> returned, so a client can
+switch from its polling loop to /wait without other changes.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import math
+from typing import Dict, FrozenSet, Mapping, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from starlette.responses import Response
+
+from app.api.file_dedup import credential_fingerprint
+from app.api.forward_openai import forward_openai_method_path
+from app.core.config import get_settings
+
+VIDEO_TERMINAL = frozenset({"completed", "failed"})
+BATCH_TERMINAL = frozenset({"completed", "failed", "expired", "cancelled"})
+FILE_BATCH_TERMINAL = frozenset({"completed", "failed", "cancelled"})
+RESPONSE_TERMINAL = frozenset({"completed", "failed", "incomplete", "cancelled"})
+
+_DEFAULT_TIMEOUT_SECONDS = 30
+# Headers that would change what upstream sends back (SSE, compression).
+_DROP_HEADERS = {"accept", "accept-encoding", "range", "if-range", "if-none-match", "if-modified-since"}
+
+
+class JobPoller:
+    """Polls one upstream job document until it is terminal or nobody is waiting."""
+
+    def __init__(self, upstream_path: str, inbound_headers: Mapping[str, str], terminal: FrozenSet[str]) -> None:
+        self.upstream_path = upstream_path
+        self.terminal = terminal
+        self._headers = {k: v for k, v in inbound_headers.items() if k.lower() not in _DROP_HEADERS}
+        self.latest: Optional[Response] = None
+        self.error: Optional[HTTPException] = None
+        self.polls = 0
+        self.waiters = 0
+        self.first = asyncio.Event()
+        self.done = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def _is_final(self, resp: Response) -> bool:
+        if resp.status_code >= 400:
+            # Rate limits and upstream faults are worth waiting out; anything else will not change.
+            return resp.status_code != 429 and resp.status_code < 500
+        try:
+            status = json.loads(resp.body).get("status")
+        except (ValueError, AttributeError):
+            return True
+        return status in self.terminal
+
+    async def run(self) -> None:
+        try:
+            await self._poll()
+        finally:
+            # Never leave a waiter blocked on a poller that died.
+            self.first.set()
+
+    async def _poll(self) -> None:
+        s = get_settings()
+        min_delay = max(int(getattr(s, "JOB_WAIT_POLL_MIN_MS", 500)), 1) / 1000
+        max_delay = max(int(getattr(s, "JOB_WAIT_POLL_MAX_MS", 8000)), 1) / 1000
+        delay = min_delay
+        last_digest = None
+        while True:
+            self.polls += 1
+            try:
+                resp = await forward_openai_method_path("GET", self.upstream_path, inbound_headers=self._headers)
+            except HTTPException as exc:
+                self.error = exc
+                digest = None
+            else:
+                self.latest, self.error = resp, None
+                if self._is_final(resp):
+                    self.first.set()
+                    self.done.set()
+                    return
+                digest = hashlib.sha256(resp.body).digest()
+            self.first.set()
+            if self.waiters == 0:
+                return
+            delay = min_delay if digest != last_digest else min(delay * 2, max_delay)
+            last_digest = digest
+            await asyncio.sleep(delay)
+
+
+_pollers: Dict[Tuple[str, str], JobPoller] = {}
+
+
+def _poller_for(request: Request, upstream_path: str, terminal: FrozenSet[str]) -> JobPoller:
+    key = (credential_fingerprint(request.headers), upstream_path)
+    poller = _pollers.get(key)
+    if poller is None or poller.task is None or poller.task.done():
+        poller = JobPoller(upstream_path, request.headers, terminal)
+        _pollers[key] = poller
+        poller.task = asyncio.create_task(poller.run())
+
+        def _unregister(_task: asyncio.Task, key: Tuple[str, str] = key, poller: JobPoller = poller) -> None:
+            if _pollers.get(key) is poller:
+                del _pollers[key]
+
+        poller.task.add_done_callback(_unregister)
+    return poller
+
+
+def _timeout(request: Request) -> float:
+    cap = max(int(getattr(get_settings(), "JOB_WAIT_MAX_SECONDS", 60)), 0)
+    raw = request.query_params.get("timeout")
+    if raw is None:
+        return float(min(_DEFAULT_TIMEOUT_SECONDS, cap))
+    try:
+        value = float(raw)
+    except ValueError:
+        value = math.nan
+    # nan would survive the clamp below and make wait_for wait forever.
+    if not math.isfinite(value):
+        raise HTTPException(status_code=400, detail="timeout must be a number of seconds")
+    return min(max(value, 0.0), float(cap))
+
+
+async def wait_for_job(request: Request, *, upstream_path: str, terminal: FrozenSet[str]) -> Response:
+    """Long-poll `upstream_path` until its status is in `terminal` or `?timeout=` runs out."""
+    timeout = _timeout(request)
+    poller = _poller_for(request, upstream_path, terminal)
+    poller.waiters += 1
+    try:
+        await asyncio.wait_for(poller.done.wait(), timeout)
+        outcome = "terminal"
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+    finally:
+        poller.waiters -= 1
+    # timeout=0 (or a very short one) still answers with one real poll.
+    await poller.first.wait()
+    if poller.latest is None:
+        raise poller.error or HTTPException(status_code=502, detail="Job status unavailable")
+    latest = poller.latest
+    headers = {"x-relay-wait": outcome}
+    return Response(latest.body, status_code=latest.status_code, headers=headers, media_type=latest.media_type)
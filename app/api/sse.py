@@ -2,26 +2,27 @@ from __future__ import annotations
 
 from typing import Any, Dict, cast
 
-from fastapi import APIRouter, Request, Response
+from fastapi import APIRouter, HTTPException, Request, Response
+from starlette.responses import StreamingResponse
 
 from app.api.action_schemas import RESPONSES_STREAM_BODY
 from app.api.forward_openai import forward_openai_method_path
+from app.api.stream_replay import get_replay_store, last_event_id, replay_enabled, stream_responses_create
 
 router = APIRouter(prefix="/v1", tags=["sse"])
 actions_router = APIRouter(prefix="/v1/actions/responses", tags=["responses_actions"])
 
 
-@router.post("/responses:stream")
-async def responses_stream(request: Request) -> Response:
-    """
-    Map POST /v1/responses:stream -> upstream POST /v1/responses with stream enabled.
-    """
+async def _stream_responses(request: Request) -> Response:
     body: Any = await request.json()
     if not isinstance(body, dict):
         body = {"input": body}
 
     body.setdefault("stream", True)
 
+    if body.get("stream") is True and replay_enabled():
+        return await stream_responses_create(cast(Dict[str, Any], body), inbound_headers=request.headers)
+
     return await forward_openai_method_path(
         request=request,
         method="POST",
@@ -31,6 +32,39 @@ async def responses_stream(request: Request) -> Response:
     )
 
 
+@router.post("/responses:stream")
+async def responses_stream(request: Request) -> Response:
+    """
+    Map POST /v1/responses:stream -> upstream POST /v1/responses with stream enabled.
+    """
+    return await _stream_responses(request)
+
+
+@router.get("/responses:stream/{response_id}")
+async def responses_stream_resume(response_id: str, request: Request) -> Response:
+    """
+    Resume a /v1/responses stream the relay is serving (or served recently).
+
+    Replays every frame after Last-Event-ID from the relay's replay buffer, then
+    follows the stream live. No upstream request is made.
+    """
+    after = last_event_id(request)
+    buf = get_replay_store().get(response_id)
+    if buf is None:
+        raise HTTPException(
+            status_code=404,
+            detail=(
+                f"No replay buffer for {response_id}; it expired or was never streamed through this relay. "
+                "Background responses can be resumed upstream with GET /v1/responses/{id}?stream=true&starting_after=N."
+            ),
+        )
+    return StreamingResponse(
+        buf.frames_after(after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
 @actions_router.post(
     "/stream",
     operation_id="actionsResponsesStream",
@@ -43,16 +77,4 @@ async def actions_responses_stream(request: Request) -> Response:
 
     Accepts JSON input and forwards to /v1/responses with stream enabled.
     """
-    body: Any = await request.json()
-    if not isinstance(body, dict):
-        body = {"input": body}
-
-    body.setdefault("stream", True)
-
-    return await forward_openai_method_path(
-        request=request,
-        method="POST",
-        path="/v1/responses",
-        inbound_headers=request.headers,
-        json_body=cast(Dict[str, Any], body),
-    )
\ No newline at end of file
+    return await _stream_responses(request)
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import codecs
+import json
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+
+@dataclass
+class SSEEvent:
+    """
+    One server-sent event, as framed upstream.
+
+    `lines` keeps the original field lines (minus any `id:`) so re-encoding is
+    byte-for-byte what upstream sent, apart from the id the relay stamps on.
+    """
+
+    lines: List[str]
+    event: Optional[str] = None
+    data: str = ""
+
+    def json(self) -> Optional[Dict[str, Any]]:
+        """The `data:` payload as a JSON object, or None for `[DONE]` and non-JSON data."""
+        if not self.data or self.data == "[DONE]":
+            return None
+        try:
+            obj = json.loads(self.data)
+        except json.JSONDecodeError:
+            return None
+        return obj if isinstance(obj, dict) else None
+
+    def encode(self, *, event_id: Optional[int | str] = None) -> bytes:
+        head = [f"id: {event_id}"] if event_id is not None else []
+        return ("\n".join(head + self.lines) + "\n\n").encode("utf-8")
+
+
+# Each carries the full response object; which one arrives depends on how the
+# generation ended, and all three are what a non-stream call would return.
+TERMINAL_RESPONSE_EVENTS = frozenset({"response.completed", "response.incomplete", "response.failed"})
+
+
+class ResponseSnapshot:
+    """
+    The latest state of one response object, folded from its stream events.
+
+    `response.*` lifecycle events carry the whole object; output items finish
+    in between them. `current()` is the newest object with the finished items
+    filled in when the object itself does not list them yet.
+    """
+
+    def __init__(self) -> None:
+        self.response: Optional[Dict[str, Any]] = None
+        self.error: Optional[Dict[str, Any]] = None
+        self.terminal = False
+        self._items: Dict[int, Any] = {}
+
+    def update(self, payload: Dict[str, Any], event: Optional[str] = None) -> None:
+        etype = payload.get("type") or event
+        if etype == "response.output_item.done" and isinstance(payload.get("output_index"), int):
+            self._items[payload["output_index"]] = payload.get("item")
+        elif etype == "error":
+            self.error = payload
+        elif isinstance(etype, str) and etype.startswith("response.") and isinstance(payload.get("response"), dict):
+            self.response = payload["response"]
+            self.terminal = self.terminal or etype in TERMINAL_RESPONSE_EVENTS
+
+    def current(self) -> Optional[Dict[str, Any]]:
+        if self.response is None:
+            return None
+        if not self.response.get("output") and self._items:
+            return {**self.response, "output": [self._items[i] for i in sorted(self._items)]}
+        return self.response
+
+
+def parse_sse_block(block: str) -> Optional[SSEEvent]:
+    lines: List[str] = []
+    event: Optional[str] = None
+    data: List[str] = []
+
+    for line in block.split("\n"):
+        if not line:
+            continue
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "id":
+            continue
+        lines.append(line)
+        if field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
+
+    if not lines:
+        return None
+    return SSEEvent(lines=lines, event=event, data="\n".join(data))
+
+
+async def iter_sse_events(chunks: AsyncIterator[bytes]) -> AsyncIterator[SSEEvent]:
+    """
+    Re-frame an arbitrary byte stream into SSE events.
+
+    Upstream chunk boundaries carry no meaning: one chunk can hold several events
+    or a fraction of one (or of a multi-byte character), so blocks are only
+    emitted once their blank-line terminator has arrived. A trailing block
+    without one is flushed at EOF.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending = (pending + decoder.decode(chunk)).replace("\r\n", "\n")
+        while "\n\n" in pending:
+            block, pending = pending.split("\n\n", 1)
+            ev = parse_sse_block(block)
+            if ev is not None:
+                yield ev
+
+    ev = parse_sse_block(pending + decoder.decode(b"", final=True))
+    if ev is not None:
+        yield ev
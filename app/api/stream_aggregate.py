@@ -0,0 +1,105 @@
+"""Stream upstream, aggregate downstream, for non-stream POST /v1/responses.
+
+A non-stream call to a slow reasoning model holds a silent upstream connection
+for the whole generation, so it trips RELAY_TIMEOUT (and any intermediary idle
+timeout) while the tokens are still billed. With RESPONSES_AGGREGATE_STREAM on,
+eligible calls go upstream with stream=true instead. The relay consumes the
+events itself and answers with the final response object — the same JSON the
+caller would have received — and the only timeout that applies is the gap
+between two events (RESPONSES_STREAM_IDLE_TIMEOUT).
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Mapping, Optional
+
+import httpx
+from fastapi import HTTPException
+from starlette.responses import JSONResponse, Response
+
+from app.api.forward_openai import _filter_response_headers, open_upstream_stream
+from app.api.sse_events import ResponseSnapshot, iter_sse_events
+from app.api.stream_replay import is_event_stream, read_whole
+from app.core.config import get_settings
+
+_CONNECT_TIMEOUT_SECONDS = 10.0
+
+
+def aggregate_enabled() -> bool:
+    return bool(getattr(get_settings(), "RESPONSES_AGGREGATE_STREAM", False))
+
+
+def is_aggregate_eligible(body: Any) -> bool:
+    """
+    Only plain non-stream creates qualify. A caller that asked for a stream gets
+    one, and a background create already returns immediately.
+    """
+    if not isinstance(body, dict):
+        return False
+    if body.get("stream") is True or body.get("background") is True:
+        return False
+    return aggregate_enabled()
+
+
+def _idle_timeout() -> httpx.Timeout:
+    idle = float(getattr(get_settings(), "RESPONSES_STREAM_IDLE_TIMEOUT", 120) or 120)
+    return httpx.Timeout(idle, connect=min(_CONNECT_TIMEOUT_SECONDS, idle))
+
+
+def _error_payload(event: Dict[str, Any]) -> Dict[str, Any]:
+    nested = event.get("error")
+    src = nested if isinstance(nested, dict) else event
+    return {
+        "error": {
+            "message": src.get("message") or "Upstream stream reported an error",
+            "type": src.get("type") if src is nested else "server_error",
+            "param": src.get("param"),
+            "code": src.get("code"),
+        }
+    }
+
+
+async def aggregate_response_stream(
+    body: Dict[str, Any],
+    *,
+    inbound_headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    """
+    POST /v1/responses upstream as a stream; return the final response object.
+
+    - Non-SSE upstream answers (validation errors, auth errors) pass through whole.
+    - The terminal event's `response` is returned as-is. If it arrives without
+      `output`, the items are rebuilt from `response.output_item.done` events.
+    - An `error` event becomes a 500 carrying upstream's error object, which is
+      what the non-stream call reports for a generation that fails mid-way.
+    """
+    upstream = await open_upstream_stream(
+        "POST",
+        "/v1/responses",
+        json_body={**body, "stream": True},
+        inbound_headers=inbound_headers,
+        upstream_timeout=_idle_timeout(),
+    )
+    if not is_event_stream(upstream):
+        return await read_whole(upstream)
+
+    headers = {k: v for k, v in _filter_response_headers(upstream.headers).items() if k.lower() != "content-type"}
+    snapshot = ResponseSnapshot()
+
+    try:
+        async for ev in iter_sse_events(upstream.aiter_bytes()):
+            payload = ev.json()
+            if payload is not None:
+                snapshot.update(payload, ev.event)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=424, detail=f"Upstream request failed: {type(e).__name__}: {e}") from e
+    finally:
+        await upstream.aclose()
+
+    if snapshot.terminal:
+        return JSONResponse(content=snapshot.current(), status_code=200, headers=headers)
+
+    if snapshot.error is not None:
+        return JSONResponse(content=_error_payload(snapshot.error), status_code=500, headers=headers)
+
+    raise HTTPException(status_code=502, detail="Upstream stream ended without a terminal response event")
@@ -0,0 +1,152 @@
+"""One upstream stream per response id, shared by every subscriber.
+
+Tools watching the same background response, or a dashboard mirroring a
+user's stream, each used to open their own `GET /v1/responses/{id}?stream=true`
+upstream, or poll `GET /v1/responses/{id}`. The hub makes the first subscriber
+open the upstream stream into a replay buffer (app/api/stream_replay.py). Later
+subscribers attach to that buffer: they are served the history from their
+`starting_after` / Last-Event-ID, then follow live.
+
+Subscribers never block one another. The upstream stream is pumped by its own
+task and every subscriber is an independent reader of the buffer, so a slow one
+only falls behind. Past RESPONSE_HUB_MAX_LAG events behind, it is disconnected
+and resumes with Last-Event-ID. Plain polls of a response the hub holds are
+answered from the stream's latest snapshot.
+
+A stream that upstream cut off before its terminal event is not reused: the
+next subscriber or poll drops it and goes to upstream again.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Dict, Mapping, Optional, Union
+
+from fastapi import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from app.api.forward_openai import open_upstream_stream
+from app.api.stream_replay import (
+    ReplayBuffer,
+    get_replay_store,
+    is_event_stream,
+    last_event_id,
+    read_whole,
+    start_replay,
+)
+from app.core.config import get_settings
+
+# Resume cursors belong to the subscriber, not to the shared upstream stream,
+# which always starts from the beginning so every later subscriber has history.
+_CURSOR_PARAMS = {"stream", "starting_after", "last_event_id"}
+
+# Subscriptions whose upstream stream is being opened right now. Concurrent
+# first subscribers wait on the same future instead of each opening one.
+_opening: Dict[str, "asyncio.Future[Union[ReplayBuffer, Response]]"] = {}
+
+
+def _max_lag() -> Optional[int]:
+    lag = int(getattr(get_settings(), "RESPONSE_HUB_MAX_LAG", 1000) or 0)
+    return lag if lag > 0 else None
+
+
+def _reusable(buf: Optional[ReplayBuffer]) -> bool:
+    """Still streaming, or finished with a terminal event; a cut-off stream is not."""
+    if buf is None or buf.closed:
+        return False
+    return not buf.done or buf.snapshot.terminal or buf.snapshot.error is not None
+
+
+def _stored(response_id: str) -> Optional[ReplayBuffer]:
+    """The hub's buffer for `response_id`. A stream upstream cut short is dropped here."""
+    store = get_replay_store()
+    buf = store.get(response_id)
+    if buf is not None and not _reusable(buf):
+        store.discard(buf)
+        return None
+    return buf
+
+
+def is_stream_request(request: Request) -> bool:
+    return (request.query_params.get("stream") or "").lower() in {"1", "true", "yes", "on"}
+
+
+async def _open(response_id: str, inbound_headers: Mapping[str, str], query: Dict[str, str]) -> Union[ReplayBuffer, Response]:
+    upstream = await open_upstream_stream(
+        "GET",
+        f"/v1/responses/{response_id}",
+        inbound_headers=inbound_headers,
+        query={**query, "stream": "true"},
+    )
+    if not is_event_stream(upstream):
+        return await read_whole(upstream)
+    return start_replay(upstream, key=response_id)
+
+
+async def attach(
+    response_id: str,
+    *,
+    inbound_headers: Mapping[str, str],
+    query: Optional[Mapping[str, str]] = None,
+) -> Union[ReplayBuffer, Response]:
+    """
+    The shared buffer for `response_id`, opening the upstream stream if nobody has.
+
+    An upstream answer that is not a stream (404 for an unknown id, 400 for a
+    response that was not created with background=true) is returned as a
+    Response and is not cached, so the next subscriber asks again.
+    """
+    buf = _stored(response_id)
+    if buf is not None:
+        return buf
+
+    pending = _opening.get(response_id)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    fut: "asyncio.Future[Union[ReplayBuffer, Response]]" = asyncio.get_running_loop().create_future()
+    _opening[response_id] = fut
+    try:
+        upstream_query = {k: v for k, v in (query or {}).items() if k not in _CURSOR_PARAMS}
+        result = await _open(response_id, inbound_headers, upstream_query)
+        fut.set_result(result)
+        return result
+    except Exception as exc:
+        fut.set_exception(exc)
+        fut.exception()  # mark retrieved; waiters re-raise it themselves
+        raise
+    finally:
+        if not fut.done():
+            fut.cancel()
+        _opening.pop(response_id, None)
+
+
+async def subscribe(response_id: str, request: Request) -> Response:
+    """GET /v1/responses/{id}?stream=true through the hub."""
+    after = last_event_id(request)
+    opened = await attach(response_id, inbound_headers=request.headers, query=dict(request.query_params))
+    if isinstance(opened, Response):
+        return opened
+    return StreamingResponse(
+        opened.frames_after(after, max_lag=_max_lag()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+def poll_snapshot(response_id: str, request: Request) -> Optional[Response]:
+    """
+    A plain GET poll answered from the hub, or None to forward it upstream.
+
+    Only bare polls qualify: query params such as `include[]` change what
+    upstream returns, and the stream's snapshot cannot honour them.
+    """
+    if not bool(getattr(get_settings(), "RESPONSE_HUB_POLL_SNAPSHOTS", True)) or request.query_params:
+        return None
+    buf = _stored(response_id)
+    if buf is None:
+        return None
+    current = buf.snapshot.current()
+    if current is None:
+        return None
+    return JSONResponse(content=current, headers={"Cache-Control": "no-cache"})
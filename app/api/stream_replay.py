@@ -0,0 +1,498 @@
+"""Replay buffers for /v1/responses streams.
+
+A client that loses its connection mid-stream used to lose the generation with
+it: the upstream stream was tied to the client socket, so the only recovery was
+a new request (and a second bill). Here the upstream stream is pumped by a task
+of its own into a `ReplayBuffer`, and every client — the original one and any
+that reconnect — is just a reader of that buffer. Each frame is stamped with
+`id: <sequence_number>`, so a reconnect sends `Last-Event-ID` and is served the
+frames it missed, then follows the stream live, with no new upstream request.
+
+Buffers are kept in memory, spill to disk per stream past a threshold, stay
+resumable for a short TTL after the stream ends, and are bounded as a whole by
+`RESPONSE_REPLAY_MAX_BYTES` with LRU eviction.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import contextlib
+import os
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+
+import httpx
+from fastapi import HTTPException, Request
+from starlette.responses import Response, StreamingResponse
+
+from app.api.forward_openai import _filter_response_headers, open_upstream_stream
+from app.api.sse_events import ResponseSnapshot, SSEEvent, iter_sse_events
+from app.core.config import get_settings
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_PENDING_PREFIX = "pending:"
+
+# Upper bound on frames pulled from a spill file in one read, so a reader that
+# is far behind does not load a whole spilled stream back into memory at once.
+_DISK_READ_BATCH = 256
+
+
+def _read_spans(path: str, spans: List[Tuple[int, int]]) -> List[bytes]:
+    """Read contiguous frames from a spill file (runs in a worker thread)."""
+    start = spans[0][0]
+    end = spans[-1][0] + spans[-1][1]
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        blob = fh.read(end - start)
+    return [blob[off - start : off - start + length] for off, length in spans]
+
+
+def _new_spill_file(spill_dir: Optional[str]) -> str:
+    fd, path = tempfile.mkstemp(prefix="relay-replay-", suffix=".sse", dir=spill_dir)
+    os.close(fd)
+    return path
+
+
+def _append_frames(path: str, frames: List[bytes]) -> None:
+    """Append frames to a spill file (runs in a worker thread)."""
+    with open(path, "ab") as fh:
+        fh.writelines(frames)
+
+
+class ReplayBuffer:
+    """
+    The SSE frames of one upstream stream, addressable by sequence number.
+
+    Frames stay in memory until the stream holds more than `spill_bytes`, then
+    the in-memory run is appended to a spill file and only its offsets are kept.
+    Disk therefore always holds a prefix of the stream and memory the tail, so a
+    reader walks disk, then memory, and never has to merge the two.
+
+    The file is written by a task of the buffer's own, in a worker thread, so
+    the upstream pump never blocks the event loop on disk. Frames on their way
+    to disk stay readable from memory until the write lands; they no longer
+    count in `mem_bytes`.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        *,
+        spill_bytes: int,
+        spill_dir: Optional[str] = None,
+        on_grow: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.key = key
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.last_seq = -1
+        self.mem_bytes = 0
+        self.pump: Optional[asyncio.Task[None]] = None
+        self.snapshot = ResponseSnapshot()
+        self.headers: Dict[str, str] = {}
+
+        self._spill_bytes = spill_bytes
+        self._spill_dir = spill_dir
+        self._on_grow = on_grow
+
+        self._mem_seqs: List[int] = []
+        self._mem_frames: List[bytes] = []
+        self._disk_seqs: List[int] = []
+        self._disk_spans: List[Tuple[int, int]] = []
+        self._spill_path: Optional[str] = None
+        self._spill_size = 0
+        # The first `_flushing` in-memory frames are handed to the spill writer.
+        self._flushing = 0
+        self._spill_task: Optional[asyncio.Task[None]] = None
+
+        self._changed = asyncio.Event()
+        self._readers = 0
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def readers(self) -> int:
+        return self._readers
+
+    @property
+    def spilled(self) -> bool:
+        return bool(self._disk_seqs) or self._flushing > 0
+
+    def append(self, event: SSEEvent, seq: Optional[int] = None) -> int:
+        """
+        Add one event and wake readers. Returns the sequence number it was stored under.
+
+        Upstream `sequence_number`s are used as-is when they increase; anything
+        else (missing, repeated, non-Responses streams) gets the next integer, so
+        ids are always strictly increasing and Last-Event-ID is unambiguous.
+        """
+        if seq is None or seq <= self.last_seq:
+            seq = self.last_seq + 1
+        frame = event.encode(event_id=seq)
+
+        self._mem_seqs.append(seq)
+        self._mem_frames.append(frame)
+        self.mem_bytes += len(frame)
+        self.last_seq = seq
+
+        if self.mem_bytes > self._spill_bytes:
+            self.spill()
+        self._notify()
+        if self._on_grow is not None:
+            self._on_grow()
+        return seq
+
+    def finish(self) -> None:
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def spill(self) -> None:
+        """Hand the in-memory tail to the spill writer."""
+        if self._closed or self._flushing == len(self._mem_frames):
+            return
+        self._flushing = len(self._mem_frames)
+        self.mem_bytes = 0
+        if self._spill_task is None:
+            self._spill_task = asyncio.get_running_loop().create_task(self._write_spill())
+
+    async def _write_spill(self) -> None:
+        try:
+            while self._flushing and not self._closed:
+                count = self._flushing
+                frames = self._mem_frames[:count]
+                if self._spill_path is None:
+                    self._spill_path = await asyncio.to_thread(_new_spill_file, self._spill_dir)
+                await asyncio.to_thread(_append_frames, self._spill_path, frames)
+                for seq, frame in zip(self._mem_seqs[:count], frames, strict=True):
+                    self._disk_seqs.append(seq)
+                    self._disk_spans.append((self._spill_size, len(frame)))
+                    self._spill_size += len(frame)
+                del self._mem_seqs[:count]
+                del self._mem_frames[:count]
+                self._flushing -= count
+        except OSError as exc:
+            # The frames stay in memory; the buffer is just not bounded any more.
+            logger.warning("Replay spill for %s failed: %s: %s", self.key, type(exc).__name__, exc)
+            self.mem_bytes += sum(len(f) for f in self._mem_frames[: self._flushing])
+            self._flushing = 0
+        finally:
+            self._spill_task = None
+            if self._closed and self._readers == 0:
+                self._release()
+
+    def close(self) -> None:
+        """
+        Stop being resumable. Readers already attached finish what is buffered;
+        storage is released when the last of them leaves.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self.pump is not None and not self.pump.done():
+            self.pump.cancel()
+        self._notify()
+        if self._readers == 0:
+            self._release()
+
+    async def frames_after(self, after: int = -1, *, max_lag: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        Yield every frame with a sequence number above `after`, then follow live.
+
+        With `max_lag`, a reader that falls more than that many events behind a
+        live stream is cut loose: it gets an SSE comment naming its position and
+        the stream ends, so it can reconnect with Last-Event-ID instead of
+        pinning the buffer while it trails.
+        """
+        self._readers += 1
+        try:
+            cursor = after
+            while True:
+                if max_lag is not None and not self.done and self.last_seq - cursor > max_lag:
+                    yield f": lagged {self.last_seq - cursor} events; reconnect with Last-Event-ID: {cursor}\n\n".encode()
+                    return
+                # Taken before reading, so an append that lands while the read is
+                # in flight still wakes this reader.
+                waiter = self._changed
+                batch = await self._read_after(cursor)
+                if batch:
+                    for _seq, frame in batch:
+                        yield frame
+                    cursor = batch[-1][0]
+                    continue
+                if self.done or self._closed:
+                    return
+                await waiter.wait()
+        finally:
+            self._readers -= 1
+            if self._closed and self._readers == 0:
+                self._release()
+
+    async def _read_after(self, after: int) -> List[Tuple[int, bytes]]:
+        i = bisect.bisect_right(self._disk_seqs, after)
+        if i < len(self._disk_seqs) and self._spill_path is not None:
+            seqs = self._disk_seqs[i : i + _DISK_READ_BATCH]
+            spans = self._disk_spans[i : i + _DISK_READ_BATCH]
+            try:
+                frames = await asyncio.to_thread(_read_spans, self._spill_path, spans)
+            except OSError:
+                return []
+            return list(zip(seqs, frames, strict=True))
+
+        j = bisect.bisect_right(self._mem_seqs, after)
+        return list(zip(self._mem_seqs[j:], self._mem_frames[j:], strict=True))
+
+    def _notify(self) -> None:
+        ev, self._changed = self._changed, asyncio.Event()
+        ev.set()
+
+    def _release(self) -> None:
+        if self._spill_task is not None:
+            # The writer releases when its current write lands.
+            return
+        self._flushing = 0
+        self._mem_seqs = []
+        self._mem_frames = []
+        self.mem_bytes = 0
+        if self._spill_path is not None:
+            with contextlib.suppress(OSError):
+                os.remove(self._spill_path)
+            self._spill_path = None
+
+
+class ReplayStore:
+    """
+    Replay buffers by response id, bounded in time and in memory.
+
+    - A finished stream stays resumable for `ttl_seconds`.
+    - When the in-memory total exceeds `max_bytes`, buffers are visited least
+      recently used first: finished ones are dropped, live ones are spilled to
+      disk (they stay resumable; they just stop costing memory).
+    """
+
+    def __init__(
+        self,
+        *,
+        max_bytes: int,
+        spill_bytes: int,
+        ttl_seconds: float,
+        spill_dir: Optional[str] = None,
+    ) -> None:
+        self._max_bytes = max_bytes
+        self._spill_bytes = spill_bytes
+        self._ttl = ttl_seconds
+        self._spill_dir = spill_dir
+        self._buffers: "OrderedDict[str, ReplayBuffer]" = OrderedDict()
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(buf.mem_bytes for buf in self._buffers.values())
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+    def create(self, key: Optional[str] = None) -> ReplayBuffer:
+        """
+        A new buffer. Without a key it is held under a placeholder until the
+        stream reveals its response id (see `rekey`).
+        """
+        self._sweep()
+        buf = ReplayBuffer(
+            key or f"{_PENDING_PREFIX}{uuid.uuid4().hex}",
+            spill_bytes=self._spill_bytes,
+            spill_dir=self._spill_dir,
+            on_grow=self._enforce_memory,
+        )
+        self._insert(buf)
+        return buf
+
+    def rekey(self, buf: ReplayBuffer, key: str) -> None:
+        if self._buffers.get(buf.key) is buf:
+            del self._buffers[buf.key]
+        buf.key = key
+        self._insert(buf)
+
+    def get(self, key: str) -> Optional[ReplayBuffer]:
+        self._sweep()
+        buf = self._buffers.get(key)
+        if buf is not None:
+            self._buffers.move_to_end(key)
+        return buf
+
+    def discard(self, buf: ReplayBuffer) -> None:
+        """Close `buf` and forget it, e.g. when its only client cancelled it."""
+        if self._buffers.get(buf.key) is buf:
+            del self._buffers[buf.key]
+        buf.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "streams": len(self._buffers),
+            "live": sum(1 for buf in self._buffers.values() if not buf.done),
+            "subscribers": sum(buf.readers for buf in self._buffers.values()),
+            "memory_bytes": self.memory_bytes,
+            "max_bytes": self._max_bytes,
+        }
+
+    def _insert(self, buf: ReplayBuffer) -> None:
+        old = self._buffers.pop(buf.key, None)
+        if old is not None and old is not buf:
+            old.close()
+        self._buffers[buf.key] = buf
+
+    def _drop(self, key: str) -> None:
+        buf = self._buffers.pop(key, None)
+        if buf is not None:
+            buf.close()
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        for key, buf in list(self._buffers.items()):
+            if buf.done and buf.finished_at is not None and now - buf.finished_at > self._ttl:
+                self._drop(key)
+
+    def _enforce_memory(self) -> None:
+        if self.memory_bytes <= self._max_bytes:
+            return
+        self._sweep()
+        for key, buf in list(self._buffers.items()):
+            if self.memory_bytes <= self._max_bytes:
+                return
+            if buf.done:
+                self._drop(key)
+            else:
+                buf.spill()
+
+
+_store: Optional[ReplayStore] = None
+
+
+def get_replay_store() -> ReplayStore:
+    """Process-wide replay store, built from Settings on first use."""
+    global _store
+    if _store is None:
+        s = get_settings()
+        _store = ReplayStore(
+            max_bytes=int(getattr(s, "RESPONSE_REPLAY_MAX_BYTES", 64 * 1024 * 1024)),
+            spill_bytes=int(getattr(s, "RESPONSE_REPLAY_SPILL_BYTES", 1024 * 1024)),
+            ttl_seconds=float(getattr(s, "RESPONSE_REPLAY_TTL_SECONDS", 300)),
+            spill_dir=getattr(s, "RESPONSE_REPLAY_DIR", None) or None,
+        )
+    return _store
+
+
+def replay_enabled() -> bool:
+    s = get_settings()
+    return bool(getattr(s, "ENABLE_STREAM", True)) and bool(getattr(s, "RESPONSE_REPLAY_ENABLED", True))
+
+
+def last_event_id(request: Request) -> int:
+    """
+    Where a resumed stream picks up: the standard Last-Event-ID header, or the
+    same value as a query param for clients that cannot set headers.
+    `starting_after` is accepted too, because that is upstream's name for it.
+    """
+    raw: Optional[str] = (
+        request.headers.get("last-event-id")
+        or request.query_params.get("last_event_id")
+        or request.query_params.get("starting_after")
+    )
+    if raw is None or raw.strip() == "":
+        return -1
+    try:
+        return int(raw.strip())
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Last-Event-ID must be an integer sequence number") from exc
+
+
+def _response_id(payload: Dict[str, Any]) -> Optional[str]:
+    resp = payload.get("response")
+    if isinstance(resp, dict) and isinstance(resp.get("id"), str):
+        return resp["id"]
+    return None
+
+
+async def _pump(upstream: httpx.Response, buf: ReplayBuffer, store: ReplayStore) -> None:
+    """Copy upstream events into `buf` until upstream ends, independent of any client."""
+    try:
+        async for ev in iter_sse_events(upstream.aiter_bytes()):
+            payload = ev.json()
+            seq: Optional[int] = None
+            if payload is not None:
+                buf.snapshot.update(payload, ev.event)
+                if buf.key.startswith(_PENDING_PREFIX):
+                    rid = _response_id(payload)
+                    if rid:
+                        store.rekey(buf, rid)
+                raw_seq = payload.get("sequence_number")
+                if isinstance(raw_seq, int) and not isinstance(raw_seq, bool):
+                    seq = raw_seq
+            buf.append(ev, seq)
+    except httpx.HTTPError as exc:
+        logger.warning("Upstream stream for %s ended early: %s: %s", buf.key, type(exc).__name__, exc)
+    finally:
+        await upstream.aclose()
+        buf.finish()
+
+
+def is_event_stream(upstream: httpx.Response) -> bool:
+    ctype = (upstream.headers.get("content-type") or "").lower()
+    return upstream.status_code < 400 and "text/event-stream" in ctype
+
+
+async def read_whole(upstream: httpx.Response) -> Response:
+    """Return a non-stream upstream answer (usually an error) as a plain Response."""
+    try:
+        content = await upstream.aread()
+    finally:
+        await upstream.aclose()
+    return Response(
+        content=content,
+        status_code=upstream.status_code,
+        headers=_filter_response_headers(upstream.headers),
+        media_type=upstream.headers.get("content-type"),
+    )
+
+
+def start_replay(upstream: httpx.Response, *, key: Optional[str] = None) -> ReplayBuffer:
+    """Begin pumping an open upstream SSE response into a new replay buffer."""
+    store = get_replay_store()
+    buf = store.create(key)
+    buf.pump = asyncio.create_task(_pump(upstream, buf, store))
+    return buf
+
+
+async def open_responses_stream(body: Dict[str, Any], *, inbound_headers: Any) -> Union[ReplayBuffer, Response]:
+    """
+    POST /v1/responses with stream=true, pumped into a new replay buffer.
+
+    Non-SSE answers (errors, or a body upstream refused to stream) come back as
+    a plain Response with upstream's status instead.
+    """
+    upstream = await open_upstream_stream("POST", "/v1/responses", json_body=body, inbound_headers=inbound_headers)
+    if not is_event_stream(upstream):
+        return await read_whole(upstream)
+    buf = start_replay(upstream)
+    buf.headers = _filter_response_headers(upstream.headers)
+    return buf
+
+
+async def stream_responses_create(body: Dict[str, Any], *, inbound_headers: Any) -> Response:
+    """POST /v1/responses with stream=true, served through a replay buffer."""
+    opened = await open_responses_stream(body, inbound_headers=inbound_headers)
+    if isinstance(opened, Response):
+        return opened
+    return StreamingResponse(
+        opened.frames_after(),
+        headers=opened.headers,
+        media_type="text/event-stream",
+    )
@@ -31,9 +31,12 @@ def _build_manifest() -> Dict[str, Any]:
         "images_actions": ["/v1/actions/images/edits", "/v1/actions/images/variations"],
         "files": ["/v1/files", "/v1/files/{file_id}", "/v1/files/{file_id}/content"],
         "files_actions": ["/v1/actions/files/upload"],
+        # Binary bodies: not offered to ChatGPT, listed for agents that can send them.
+        "binary_uploads": ["/v1/actions/files/upload:raw", "/v1/actions/uploads/{upload_id}/parts:raw"],
         "uploads_actions": [
             "/v1/actions/uploads",
             "/v1/actions/uploads/{upload_id}/parts",
+            "/v1/actions/uploads/{upload_id}/status",
             "/v1/actions/uploads/{upload_id}/complete",
             "/v1/actions/uploads/{upload_id}/cancel",
         ],
@@ -44,6 +47,7 @@ def _build_manifest() -> Dict[str, Any]:
         ],
         "uploads": [
             "/v1/uploads",
+            "/v1/uploads:stream",
             "/v1/uploads/{upload_id}",
             "/v1/uploads/{upload_id}/parts",
             "/v1/uploads/{upload_id}/complete",
@@ -0,0 +1,229 @@
+# app/api/upload_ledger.py
+"""Local record of the parts the Actions upload wrappers have forwarded.
+
+Why this exists
+---------------
+When an upload through `/v1/actions/uploads/{id}/parts` was interrupted, the
+client could not tell which parts the relay had already sent upstream. OpenAI
+has no "list parts" call, so the client started over. The ledger is a small
+sqlite database that records, for each Upload, every part's upstream id, byte
+offset, size, SHA-256 and status.
+
+- `GET /v1/actions/uploads/{id}/status` reports the parts and `next_offset`,
+  the first byte no uploaded part covers. A client resumes from there.
+- `/complete` without `part_ids` is assembled from the ledger in offset order.
+
+Uploads expire upstream (an hour by default), and a ledger row is useless
+after that. Expired rows are swept lazily, at most once per
+UPLOAD_LEDGER_SWEEP_SECONDS, by whichever ledger call comes next. This is the
+same arrangement as the replay store's TTL sweep.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from app.core.config import get_settings
+
+# OpenAI's default Upload lifetime; used when the create response is not seen.
+_DEFAULT_EXPIRY_SECONDS = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    upload_id  TEXT PRIMARY KEY,
+    bytes      INTEGER,
+    filename   TEXT,
+    purpose    TEXT,
+    status     TEXT NOT NULL DEFAULT 'pending',
+    expires_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parts (
+    upload_id  TEXT NOT NULL,
+    "offset"   INTEGER NOT NULL,
+    bytes      INTEGER NOT NULL,
+    sha256     TEXT,
+    part_id    TEXT,
+    status     TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (upload_id, "offset")
+);
+"""
+
+
+class UploadLedger:
+    """sqlite-backed part ledger. Thread-safe; every method is one short transaction."""
+
+    def __init__(self, path: str, *, sweep_seconds: float = 60.0) -> None:
+        self.path = path
+        self._sweep_seconds = sweep_seconds
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    # --- writes -------------------------------------------------------------
+
+    def record_upload(self, upload: Dict[str, Any]) -> None:
+        """Remember an Upload object as returned by POST /v1/uploads."""
+        now = time.time()
+        expires_at = upload.get("expires_at") or now + _DEFAULT_EXPIRY_SECONDS
+        with self._lock:
+            self._maybe_sweep(now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO uploads (upload_id, bytes, filename, purpose, status, expires_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    upload["id"],
+                    upload.get("bytes"),
+                    upload.get("filename"),
+                    upload.get("purpose"),
+                    upload.get("status") or "pending",
+                    float(expires_at),
+                    now,
+                ),
+            )
+
+    def reserve_part(self, upload_id: str, size: int, offset: Optional[int] = None) -> int:
+        """Claim the byte range for a part about to be sent; returns its offset.
+
+        Without an explicit offset the part is appended after every part already
+        recorded, failed ones excepted. Reserving under the lock keeps concurrent
+        appends from claiming the same range. An explicit offset that already
+        holds an uploaded part is a 409: its upstream part id is kept.
+        """
+        now = time.time()
+        with self._lock:
+            self._maybe_sweep(now)
+            self._ensure_upload(upload_id, now)
+            if offset is None:
+                row = self._db.execute(
+                    'SELECT COALESCE(MAX("offset" + bytes), 0) FROM parts WHERE upload_id = ? AND status != ?',
+                    (upload_id, "failed"),
+                ).fetchone()
+                offset = int(row[0])
+            else:
+                taken = self._db.execute(
+                    'SELECT part_id FROM parts WHERE upload_id = ? AND "offset" = ? AND status = ?',
+                    (upload_id, offset, "uploaded"),
+                ).fetchone()
+                if taken is not None:
+                    raise HTTPException(
+                        status_code=409, detail=f"Offset {offset} of {upload_id} is already uploaded as {taken[0]}"
+                    )
+            self._db.execute(
+                'INSERT OR REPLACE INTO parts (upload_id, "offset", bytes, sha256, part_id, status, updated_at) '
+                "VALUES (?, ?, ?, NULL, NULL, 'pending', ?)",
+                (upload_id, offset, size, now),
+            )
+        return offset
+
+    def finish_part(self, upload_id: str, offset: int, *, part_id: Optional[str], sha256: Optional[str]) -> None:
+        """Mark a reserved part uploaded (with its upstream id) or, with part_id None, failed."""
+        with self._lock:
+            self._db.execute(
+                'UPDATE parts SET part_id = ?, sha256 = ?, status = ?, updated_at = ? WHERE upload_id = ? AND "offset" = ?',
+                (part_id, sha256, "uploaded" if part_id else "failed", time.time(), upload_id, offset),
+            )
+
+    def set_status(self, upload_id: str, status: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE uploads SET status = ?, updated_at = ? WHERE upload_id = ?", (status, time.time(), upload_id)
+            )
+
+    # --- reads --------------------------------------------------------------
+
+    def status(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        """The ledger's view of an Upload, or None if it has never seen it."""
+        with self._lock:
+            self._maybe_sweep(time.time())
+            up = self._db.execute("SELECT * FROM uploads WHERE upload_id = ?", (upload_id,)).fetchone()
+            if up is None:
+                return None
+            rows = self._db.execute(
+                'SELECT "offset", bytes, sha256, part_id, status FROM parts WHERE upload_id = ? ORDER BY "offset"',
+                (upload_id,),
+            ).fetchall()
+        parts = [dict(r) for r in rows]
+        chain = _contiguous(parts)
+        next_offset = sum(p["bytes"] for p in chain)
+        total = up["bytes"]
+        return {
+            "object": "relay.upload_ledger",
+            "upload_id": upload_id,
+            "status": up["status"],
+            "bytes": total,
+            "filename": up["filename"],
+            "purpose": up["purpose"],
+            "expires_at": int(up["expires_at"]),
+            "next_offset": next_offset,
+            "complete": total is not None and next_offset >= total,
+            "part_ids": [p["part_id"] for p in chain],
+            "parts": parts,
+        }
+
+    # --- internals ----------------------------------------------------------
+
+    def _ensure_upload(self, upload_id: str, now: float) -> None:
+        # Parts for an Upload created elsewhere still get recorded; its size is unknown.
+        self._db.execute(
+            "INSERT OR IGNORE INTO uploads (upload_id, status, expires_at, updated_at) VALUES (?, 'pending', ?, ?)",
+            (upload_id, now + _DEFAULT_EXPIRY_SECONDS, now),
+        )
+
+    def _maybe_sweep(self, now: float) -> None:
+        if now - self._last_sweep < self._sweep_seconds:
+            return
+        self._last_sweep = now
+        self._db.execute(
+            "DELETE FROM parts WHERE upload_id IN (SELECT upload_id FROM uploads WHERE expires_at < ?)", (now,)
+        )
+        self._db.execute("DELETE FROM uploads WHERE expires_at < ?", (now,))
+
+
+def _contiguous(parts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Uploaded parts that tile the file from byte 0 with no gap, in offset order."""
+    chain: List[Dict[str, Any]] = []
+    pos = 0
+    for p in parts:
+        if p["status"] != "uploaded" or p["offset"] != pos:
+            if p["offset"] >= pos:
+                break
+            continue
+        chain.append(p)
+        pos += p["bytes"]
+    return chain
+
+
+_ledger: Optional[UploadLedger] = None
+
+
+def ledger_enabled() -> bool:
+    return bool(getattr(get_settings(), "UPLOAD_LEDGER_ENABLED", True))
+
+
+def get_upload_ledger() -> UploadLedger:
+    """The process-wide ledger, reopened if UPLOAD_LEDGER_PATH changes."""
+    global _ledger
+    s = get_settings()
+    path = getattr(s, "UPLOAD_LEDGER_PATH", None) or os.path.join(tempfile.gettempdir(), "relay-upload-ledger.sqlite3")
+    if _ledger is None or _ledger.path != path:
+        if _ledger is not None:
+            _ledger.close()
+        _ledger = UploadLedger(path, sweep_seconds=float(getattr(s, "UPLOAD_LEDGER_SWEEP_SECONDS", 60)))
+    return _ledger
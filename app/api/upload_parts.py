@@ -0,0 +1,223 @@
+# app/api/upload_parts.py
+"""One streamed body in, one OpenAI Upload out: parts sent concurrently.
+
+Why this exists
+---------------
+Getting a large file in through the Uploads API took the client three kinds
+of call — create, N sequential `/parts`, complete — each relayed one at a time.
+`stream_upload()` takes the whole file as a single request body, creates the
+Upload, cuts the body into UPLOAD_STREAM_PART_BYTES parts as it arrives and
+sends up to UPLOAD_STREAM_CONCURRENCY of them at once. Reading the inbound
+body waits whenever that many parts are in flight, so memory stays at about
+(concurrency + 1) parts however large the file is.
+
+A part that fails with a transport error, 429 or 5xx is retried on its own
+(UPLOAD_STREAM_PART_RETRIES times, with backoff). MD5 and SHA-256 are computed
+over the body as it passes; the MD5 goes to `/complete` so upstream verifies
+the assembled file. If anything fails for good, the Upload is cancelled
+upstream instead of being left to expire.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import io
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional
+
+import httpx
+from fastapi import HTTPException, Request
+from starlette.responses import JSONResponse, Response
+
+from app.api.forward_openai import forward_openai_method_path
+from app.api.upload_stream import SpooledUpload, send_multipart
+from app.core.config import get_settings
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Statuses worth another attempt at the same part.
+_RETRYABLE = {408, 409, 429, 500, 502, 503, 504}
+_BACKOFF_BASE = 0.5
+
+
+class PartFailed(Exception):
+    def __init__(self, index: int, status: Optional[int], detail: str) -> None:
+        super().__init__(f"part {index} failed: {detail}")
+        self.index = index
+        self.status = status
+
+
+@dataclass
+class StreamUploadOptions:
+    part_bytes: int
+    concurrency: int
+    retries: int
+
+    @classmethod
+    def from_settings(cls) -> "StreamUploadOptions":
+        s = get_settings()
+        return cls(
+            part_bytes=max(int(getattr(s, "UPLOAD_STREAM_PART_BYTES", 8 * 1024 * 1024)), 1),
+            concurrency=max(int(getattr(s, "UPLOAD_STREAM_CONCURRENCY", 4)), 1),
+            retries=max(int(getattr(s, "UPLOAD_STREAM_PART_RETRIES", 3)), 0),
+        )
+
+
+def _json(resp: Response) -> Dict[str, Any]:
+    try:
+        out = json.loads(resp.body or b"{}")
+    except ValueError:
+        return {}
+    return out if isinstance(out, dict) else {}
+
+
+async def _send_part(
+    upload_id: str,
+    index: int,
+    data: bytes,
+    *,
+    inbound_headers: Mapping[str, str],
+    filename: str,
+    retries: int,
+) -> str:
+    """Upload one part, retrying transient failures; returns the part id."""
+    part = SpooledUpload(file=io.BytesIO(data), size=len(data))
+    attempt = 0
+    while True:
+        status: Optional[int] = None
+        try:
+            resp = await send_multipart(
+                f"/v1/uploads/{upload_id}/parts",
+                part,
+                inbound_headers=inbound_headers,
+                file_field="data",
+                filename=f"{filename}.part{index}",
+                mime_type="application/octet-stream",
+            )
+            status = resp.status_code
+            if resp.is_success:
+                part_id = resp.json().get("id")
+                if part_id:
+                    return str(part_id)
+                detail = "upstream returned no part id"
+            else:
+                detail = f"upstream {status}: {resp.text[:200]}"
+        except httpx.HTTPError as exc:
+            detail = f"{type(exc).__name__}: {exc}"
+
+        transient = status is None or status in _RETRYABLE
+        if not transient or attempt >= retries:
+            raise PartFailed(index, status, detail)
+        attempt += 1
+        logger.warning("upload %s part %d attempt %d failed (%s); retrying", upload_id, index, attempt, detail)
+        await asyncio.sleep(_BACKOFF_BASE * 2 ** (attempt - 1))
+
+
+async def _cancel(upload_id: str, inbound_headers: Mapping[str, str]) -> None:
+    try:
+        await forward_openai_method_path(
+            "POST", f"/v1/uploads/{upload_id}/cancel", json_body={}, inbound_headers=inbound_headers
+        )
+    except Exception:  # best effort; the Upload expires upstream anyway
+        logger.warning("could not cancel upload %s", upload_id)
+
+
+async def stream_upload(
+    request: Request,
+    *,
+    purpose: str,
+    filename: str,
+    mime_type: str,
+    total_bytes: int,
+    inbound_headers: Mapping[str, str],
+    options: Optional[StreamUploadOptions] = None,
+) -> Response:
+    """Create an Upload, stream `request`'s body into it as parts, complete it.
+
+    Returns the File object of the completed Upload, with the Upload id and
+    both checksums in `x-relay-upload-*` headers. Upstream errors on create
+    or complete are relayed as they came.
+    """
+    opts = options or StreamUploadOptions.from_settings()
+    created = await forward_openai_method_path(
+        "POST",
+        "/v1/uploads",
+        json_body={"purpose": purpose, "filename": filename, "bytes": total_bytes, "mime_type": mime_type},
+        inbound_headers=inbound_headers,
+    )
+    upload_id = _json(created).get("id")
+    if created.status_code >= 400 or not upload_id:
+        return created
+
+    # MD5 because it is the checksum /complete accepts.
+    md5, sha256 = hashlib.md5(usedforsecurity=False), hashlib.sha256()
+    gate = asyncio.Semaphore(opts.concurrency)
+    tasks: List[asyncio.Task] = []
+    received = 0
+    buf = bytearray()
+
+    async def run(index: int, data: bytes) -> str:
+        try:
+            return await _send_part(
+                upload_id, index, data, inbound_headers=inbound_headers, filename=filename, retries=opts.retries
+            )
+        finally:
+            gate.release()
+
+    async def dispatch(data: bytes) -> None:
+        await gate.acquire()
+        for t in tasks:
+            if t.done() and t.exception() is not None:
+                gate.release()
+                raise t.exception()  # type: ignore[misc]
+        tasks.append(asyncio.create_task(run(len(tasks), data)))
+
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > total_bytes:
+                raise HTTPException(status_code=400, detail=f"Body is longer than the declared {total_bytes} bytes")
+            md5.update(chunk)
+            sha256.update(chunk)
+            buf += chunk
+            while len(buf) >= opts.part_bytes:
+                data = bytes(buf[: opts.part_bytes])
+                del buf[: opts.part_bytes]
+                await dispatch(data)
+        if buf:
+            await dispatch(bytes(buf))
+            buf.clear()
+        if received != total_bytes:
+            raise HTTPException(
+                status_code=400, detail=f"Body ended after {received} of the declared {total_bytes} bytes"
+            )
+        part_ids = await asyncio.gather(*tasks)
+    except BaseException as exc:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await _cancel(upload_id, inbound_headers)
+        if isinstance(exc, PartFailed):
+            raise HTTPException(status_code=502, detail=f"Upload {upload_id} cancelled: {exc}") from exc
+        raise
+
+    completed = await forward_openai_method_path(
+        "POST",
+        f"/v1/uploads/{upload_id}/complete",
+        json_body={"part_ids": list(part_ids), "md5": md5.hexdigest()},
+        inbound_headers=inbound_headers,
+    )
+    if completed.status_code >= 400:
+        return completed
+
+    upload = _json(completed)
+    headers = {
+        "x-relay-upload-id": str(upload_id),
+        "x-relay-upload-parts": str(len(part_ids)),
+        "x-relay-upload-md5": md5.hexdigest(),
+        "x-relay-upload-sha256": sha256.hexdigest(),
+    }
+    return JSONResponse(upload.get("file") or upload, status_code=completed.status_code, headers=headers)
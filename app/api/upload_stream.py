@@ -0,0 +1,491 @@
+# app/api/upload_stream.py
+"""Spool upload bodies to disk and stream them upstream as multipart.
+
+Why this exists
+---------------
+The Actions upload wrappers (`/v1/actions/files/upload`,
+`/v1/actions/uploads/{upload_id}/parts`) used to take the whole base64 string
+through pydantic, decode it with one `base64.b64decode`, then let httpx build
+the multipart body in memory: three copies of the file per request, which is
+why both carried a hard 10 MiB cap.
+
+Here the JSON body is read from `request.stream()` and scanned incrementally.
+The base64 field is decoded quantum by quantum into a SpooledTemporaryFile
+(memory up to UPLOAD_SPOOL_MEMORY_BYTES, disk after that), the small fields
+are collected as they pass, and the multipart body is generated from the spool
+with an exact Content-Length. The `:raw` siblings skip base64 altogether and
+spool an `application/octet-stream` body as-is.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import binascii
+import hashlib
+import json
+import re
+import secrets
+from dataclasses import dataclass, field
+from tempfile import SpooledTemporaryFile
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import httpx
+from fastapi import HTTPException, Request
+from starlette.responses import Response
+
+from app.api.forward_openai import _filter_response_headers, build_outbound_headers, build_upstream_url
+from app.core.config import get_settings
+from app.core.http_client import get_async_httpx_client
+
+_B64_INVALID = re.compile(rb"[^A-Za-z0-9+/=]")
+_STRING_STOP = re.compile(rb'["\\]')
+_WS = b" \t\r\n"
+_ESCAPES = {b'"': b'"', b"\\": b"\\", b"/": b"/", b"b": b"\b", b"f": b"\f", b"n": b"\n", b"r": b"\r", b"t": b"\t"}
+
+# JSON text of every field other than the streamed one is buffered; this bounds it.
+_MAX_SMALL_FIELD = 64 * 1024
+_READ_CHUNK = 256 * 1024
+
+
+class Base64Decoder:
+    """Incremental `base64.b64decode(..., validate=True)`.
+
+    Input may be split anywhere; the partial quantum is carried to the next
+    call. Anything outside the base64 alphabet, padding before the end, or a
+    dangling partial quantum raises ValueError.
+    """
+
+    def __init__(self) -> None:
+        self._carry = b""
+        self._padded = False
+
+    def feed(self, chunk: bytes) -> bytes:
+        if not chunk:
+            return b""
+        if self._padded:
+            raise ValueError("data after base64 padding")
+        if _B64_INVALID.search(chunk):
+            raise ValueError("non-base64 character")
+        data = self._carry + chunk
+        cut = len(data) - len(data) % 4
+        self._carry, block = data[cut:], data[:cut]
+        if b"=" in block:
+            self._padded = True
+            if self._carry:
+                raise ValueError("data after base64 padding")
+        try:
+            return binascii.a2b_base64(block, strict_mode=True)
+        except binascii.Error as exc:
+            raise ValueError(str(exc)) from exc
+
+    def close(self) -> None:
+        if self._carry:
+            raise ValueError("incomplete base64 quantum (missing padding?)")
+
+
+class JsonFieldScanner:
+    """Scan a top-level JSON object, streaming one string field out of it.
+
+    `feed(chunk)` returns the raw bytes of `stream_field`'s value that arrived
+    in that chunk, with JSON escapes resolved. Every other member is buffered
+    (up to 64 KiB each), parsed with `json.loads`, and left in `fields`.
+    Malformed JSON raises ValueError.
+    """
+
+    def __init__(self, stream_field: str) -> None:
+        self.stream_field = stream_field
+        self.fields: Dict[str, Any] = {}
+        self.seen = False
+        self._state = "start"
+        self._pending = b""
+        self._key = ""
+        self._raw = bytearray()
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+
+    def feed(self, chunk: bytes) -> bytes:
+        data = self._pending + chunk
+        self._pending = b""
+        out: List[bytes] = []
+        i, n = 0, len(data)
+        while i < n:
+            state = self._state
+            if state == "string":
+                m = _STRING_STOP.search(data, i)
+                if m is None:
+                    out.append(data[i:])
+                    break
+                out.append(data[i : m.start()])
+                i = m.start()
+                if data[i : i + 1] == b'"':
+                    self._state = "after_value"
+                    i += 1
+                    continue
+                esc = data[i + 1 : i + 2]
+                if not esc or (esc == b"u" and n - i < 6):
+                    self._pending = data[i:]
+                    break
+                if esc == b"u":
+                    out.append(chr(int(data[i + 2 : i + 6], 16)).encode())
+                    i += 6
+                elif esc in _ESCAPES:
+                    out.append(_ESCAPES[esc])
+                    i += 2
+                else:
+                    raise ValueError(f"invalid escape \\{esc.decode(errors='replace')}")
+                continue
+
+            b = data[i : i + 1]
+            i += 1
+            if state == "value":
+                i = self._scan_value(data, i - 1)
+                continue
+            if state == "key":
+                self._raw += b
+                if self._esc:
+                    self._esc = False
+                elif b == b"\\":
+                    self._esc = True
+                elif b == b'"':
+                    self._key = json.loads(bytes(self._raw))
+                    self._raw.clear()
+                    self._state = "colon"
+                if len(self._raw) > _MAX_SMALL_FIELD:
+                    raise ValueError("object key too long")
+                continue
+            if b in _WS:
+                continue
+            if state == "start":
+                self._expect(b, b"{")
+                self._state = "key_or_end"
+            elif state == "key_or_end":
+                if b == b"}":
+                    self._state = "done"
+                else:
+                    self._expect(b, b'"')
+                    self._raw = bytearray(b'"')
+                    self._state = "key"
+            elif state == "colon":
+                self._expect(b, b":")
+                self._state = "value_start"
+            elif state == "value_start":
+                if b == b'"' and self._key == self.stream_field:
+                    if self.seen:
+                        raise ValueError(f"duplicate field {self.stream_field!r}")
+                    self.seen = True
+                    self._state = "string"
+                else:
+                    self._state = "value"
+                    self._raw = bytearray()
+                    self._depth, self._in_str, self._esc = 0, False, False
+                    i -= 1
+            elif state == "after_value":
+                if b == b",":
+                    self._state = "next_key"
+                else:
+                    self._expect(b, b"}")
+                    self._state = "done"
+            elif state == "next_key":
+                self._expect(b, b'"')
+                self._raw = bytearray(b'"')
+                self._state = "key"
+            else:
+                raise ValueError("trailing data after JSON object")
+        return b"".join(out)
+
+    def _scan_value(self, data: bytes, i: int) -> int:
+        """Buffer one non-streamed value; returns the index after what was consumed."""
+        raw = self._raw
+        n = len(data)
+        while i < n:
+            b = data[i : i + 1]
+            if self._in_str:
+                raw += b
+                if self._esc:
+                    self._esc = False
+                elif b == b"\\":
+                    self._esc = True
+                elif b == b'"':
+                    self._in_str = False
+                    if self._depth == 0:
+                        return self._finish_value(i + 1)
+            elif b == b'"':
+                self._in_str = True
+                raw += b
+            elif b in (b"{", b"["):
+                self._depth += 1
+                raw += b
+            elif b in (b"}", b"]") and self._depth:
+                self._depth -= 1
+                raw += b
+                if self._depth == 0:
+                    return self._finish_value(i + 1)
+            elif self._depth == 0 and (b in (b",", b"}") or b in _WS):
+                return self._finish_value(i)
+            else:
+                raw += b
+            if len(raw) > _MAX_SMALL_FIELD:
+                raise ValueError(f"field {self._key!r} is too large")
+            i += 1
+        return i
+
+    def _finish_value(self, i: int) -> int:
+        self.fields[self._key] = json.loads(bytes(self._raw))
+        self._raw = bytearray()
+        self._state = "after_value"
+        return i
+
+    def close(self) -> None:
+        if self._state != "done":
+            raise ValueError("truncated JSON body")
+
+    @staticmethod
+    def _expect(got: bytes, want: bytes) -> None:
+        if got != want:
+            raise ValueError(f"expected {want.decode()!r}, got {got.decode(errors='replace')!r}")
+
+
+@dataclass
+class SpooledUpload:
+    """Decoded upload bytes in a spool, plus any JSON fields that came with them."""
+
+    file: Any
+    size: int = 0
+    fields: Dict[str, Any] = field(default_factory=dict)
+    digest: Any = field(default_factory=hashlib.sha256)
+
+    async def write(self, data: bytes, max_bytes: int, too_large: str) -> None:
+        """Append to the spool, keeping size and SHA-256 current; 413 past `max_bytes`.
+
+        The write runs in a worker thread: past its memory threshold the spool
+        is a file on disk.
+        """
+        self.size += len(data)
+        if self.size > max_bytes:
+            raise HTTPException(status_code=413, detail=too_large)
+        await asyncio.to_thread(self._append, data)
+
+    def _append(self, data: bytes) -> None:
+        self.digest.update(data)
+        self.file.write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self.digest.hexdigest()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _new_spool() -> Any:
+    threshold = int(getattr(get_settings(), "UPLOAD_SPOOL_MEMORY_BYTES", 1024 * 1024) or 0)
+    return SpooledTemporaryFile(max_size=max(threshold, 0))
+
+
+def _check_declared_length(request: Request, limit: int, detail: str) -> None:
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        raise HTTPException(status_code=413, detail=detail)
+
+
+async def spool_base64_field(request: Request, field_name: str, *, max_bytes: int, label: str) -> SpooledUpload:
+    """Read a JSON body, decoding `field_name` (base64) into a spool as it arrives.
+
+    `label` names the thing in error details ("file upload", "upload part").
+    The other members end up in `.fields`; `field_name` maps to "" when present.
+    """
+    too_large = f"{label.capitalize()} too large (>{max_bytes} bytes)"
+    # base64 is 4/3 of the payload; allow headroom for the other JSON fields.
+    _check_declared_length(request, max_bytes * 4 // 3 + 4 + _MAX_SMALL_FIELD, too_large)
+
+    scanner = JsonFieldScanner(field_name)
+    decoder = Base64Decoder()
+    upload = SpooledUpload(file=_new_spool())
+    try:
+        async for chunk in request.stream():
+            try:
+                text = scanner.feed(chunk)
+            except ValueError as exc:
+                raise HTTPException(status_code=400, detail=f"Malformed JSON body: {exc}") from exc
+            try:
+                decoded = decoder.feed(text)
+            except ValueError as exc:
+                raise HTTPException(status_code=400, detail=f"Invalid base64 in {field_name}: {exc}") from exc
+            if decoded:
+                await upload.write(decoded, max_bytes, too_large)
+        try:
+            scanner.close()
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=f"Malformed JSON body: {exc}") from exc
+        try:
+            decoder.close()
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid base64 in {field_name}: {exc}") from exc
+    except BaseException:
+        upload.close()
+        raise
+
+    upload.fields = dict(scanner.fields)
+    if scanner.seen:
+        upload.fields[field_name] = ""
+        if upload.size == 0:
+            upload.close()
+            raise HTTPException(status_code=400, detail=f"Empty {label} is not allowed")
+    return upload
+
+
+async def spool_raw_body(request: Request, *, max_bytes: int, label: str) -> SpooledUpload:
+    """Spool an `application/octet-stream` body as-is, enforcing `max_bytes`."""
+    too_large = f"{label.capitalize()} too large (>{max_bytes} bytes)"
+    _check_declared_length(request, max_bytes, too_large)
+
+    upload = SpooledUpload(file=_new_spool())
+    try:
+        async for chunk in request.stream():
+            await upload.write(chunk, max_bytes, too_large)
+    except BaseException:
+        upload.close()
+        raise
+    if upload.size == 0:
+        upload.close()
+        raise HTTPException(status_code=400, detail=f"Empty {label} is not allowed")
+    return upload
+
+
+def _quote(value: str) -> str:
+    # Same escaping httpx applies to multipart names and filenames.
+    return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "").replace("\n", "")
+
+
+def multipart_from_spools(
+    files: Sequence[Tuple[str, str, str, SpooledUpload]],
+    data: Optional[Mapping[str, str]] = None,
+) -> Tuple[Dict[str, str], AsyncIterator[bytes]]:
+    """Return (headers, body iterator) for a multipart/form-data request.
+
+    `files` holds (field, filename, mime type, spool) tuples. The form fields in
+    `data` come first, then each spooled file in order. The headers carry an
+    exact Content-Length, so the upstream sees an ordinary non-chunked upload.
+    """
+    boundary = secrets.token_hex(16)
+    head = bytearray()
+    for name, value in (data or {}).items():
+        head += f'--{boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'.encode()
+        head += str(value).encode() + b"\r\n"
+    part_heads = [
+        (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{_quote(file_field)}"; '
+            f'filename="{_quote(filename)}"\r\nContent-Type: {mime_type or "application/octet-stream"}\r\n\r\n'
+        ).encode()
+        for file_field, filename, mime_type, _ in files
+    ]
+    tail = f"--{boundary}--\r\n".encode()
+
+    async def body() -> AsyncIterator[bytes]:
+        yield bytes(head)
+        for part_head, (_, _, _, upload) in zip(part_heads, files, strict=True):
+            yield part_head
+            upload.file.seek(0)
+            while True:
+                chunk = await asyncio.to_thread(upload.file.read, _READ_CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+            yield b"\r\n"
+        yield tail
+
+    length = len(head) + sum(len(h) + f[3].size + 2 for h, f in zip(part_heads, files, strict=True)) + len(tail)
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(length),
+    }
+    return headers, body()
+
+
+def multipart_from_spool(
+    upload: SpooledUpload,
+    *,
+    file_field: str,
+    filename: str,
+    mime_type: str,
+    data: Optional[Mapping[str, str]] = None,
+) -> Tuple[Dict[str, str], AsyncIterator[bytes]]:
+    """multipart_from_spools() for a single file."""
+    return multipart_from_spools([(file_field, filename, mime_type, upload)], data)
+
+
+async def send_multipart(
+    upstream_path: str,
+    upload: SpooledUpload,
+    *,
+    inbound_headers: Mapping[str, str],
+    file_field: str,
+    filename: str,
+    mime_type: str,
+    data: Optional[Mapping[str, str]] = None,
+) -> httpx.Response:
+    """POST the spool to `upstream_path` as multipart and return the read response.
+
+    Leaves the spool open (the body is rebuilt from it on every call, so a
+    caller may retry) and lets httpx errors propagate.
+    """
+    # No inbound query: the wrapper's own query parameters are not for upstream.
+    upstream_url = build_upstream_url(upstream_path)
+    form_headers, body = multipart_from_spool(
+        upload, file_field=file_field, filename=filename, mime_type=mime_type, data=data
+    )
+    # content_type replaces the caller's (JSON or octet-stream) Content-Type;
+    # left as None, build_outbound_headers would forward it next to ours.
+    headers = build_outbound_headers(
+        inbound_headers=inbound_headers,
+        content_type=form_headers["Content-Type"],
+        forward_accept=True,
+        path_hint=upstream_path,
+    )
+    headers["Content-Length"] = form_headers["Content-Length"]
+
+    timeout_s = float(getattr(get_settings(), "timeout_seconds", 60.0) or 60.0)
+    client = get_async_httpx_client(timeout=timeout_s)
+    return await client.post(upstream_url, headers=headers, content=body)
+
+
+async def post_multipart_upload(
+    request: Request,
+    upstream_path: str,
+    upload: SpooledUpload,
+    *,
+    file_field: str,
+    filename: str,
+    mime_type: str,
+    data: Optional[Mapping[str, str]] = None,
+    what: str = "uploading file",
+) -> Response:
+    """POST the spooled upload to `upstream_path` as multipart; relay the answer.
+
+    Closes the spool. Timeouts map to 504 and other transport errors to 502,
+    as the in-memory wrappers did.
+    """
+    try:
+        resp = await send_multipart(
+            upstream_path,
+            upload,
+            inbound_headers=request.headers,
+            file_field=file_field,
+            filename=filename,
+            mime_type=mime_type,
+            data=data,
+        )
+    except httpx.TimeoutException as exc:
+        raise HTTPException(status_code=504, detail=f"Upstream timeout while {what}") from exc
+    except httpx.HTTPError as exc:
+        raise HTTPException(status_code=502, detail=f"Upstream HTTP error while {what}: {exc!r}") from exc
+    finally:
+        upload.close()
+
+    return Response(
+        content=resp.content,
+        status_code=resp.status_code,
+        media_type=resp.headers.get("content-type"),
+        headers=_filter_response_headers(resp.headers),
+    )
@@ -0,0 +1,284 @@
+"""Many /v1/responses streams over one WebSocket.
+
+Browsers cap HTTP/1.1 connections per host, so tools that run several SSE
+streams through `/v1/responses:stream` at once are throttled by the browser,
+not by the relay. `WS /v1/responses:ws` carries any number of streams (up to
+RESPONSES_WS_MAX_STREAMS) over one authenticated socket. Only the transport
+is new: every stream is the same upstream SSE stream in a replay buffer that
+the HTTP endpoints use, so a stream started here can be resumed over
+`GET /v1/responses:stream/{id}` and vice versa.
+
+Client -> relay (JSON text frames, every one naming a client-chosen `stream_id`):
+
+    {"type": "response.create", "stream_id": "a", "body": {...}, "credit": 16}
+    {"type": "response.resume", "stream_id": "b", "response_id": "resp_...", "after": 41}
+    {"type": "stream.credit", "stream_id": "a", "credit": 16}
+    {"type": "stream.cancel", "stream_id": "a"}
+    {"type": "ping"}
+
+`credit` is optional. Without it a stream is not flow-controlled, and
+`stream.credit` messages for it are ignored. With it the relay sends that many
+events and then waits for more credit. Cancelling a
+stream this socket created also stops the upstream generation; cancelling a
+resumed one only detaches from it.
+
+Relay -> client:
+
+    {"type": "event", "stream_id": "a", "id": 7, "event": "response.output_text.delta", "data": {...}}
+    {"type": "stream.end" | "stream.cancelled", "stream_id": "a"}
+    {"type": "stream.error", "stream_id": "a", "status": 400, "error": {...}}
+    {"type": "error", "error": {"message": "..."}}
+    {"type": "pong"}
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+from typing import Any, Dict, Optional, Union
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from starlette.responses import Response
+from starlette.websockets import WebSocketState
+
+from app.api import stream_hub
+from app.api.sse_events import parse_sse_block
+from app.api.stream_replay import ReplayBuffer, get_replay_store, open_responses_stream, replay_enabled
+from app.core.config import get_settings
+from app.middleware.relay_auth import websocket_auth_error
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+router = APIRouter(prefix="/v1", tags=["sse"])
+
+# RFC 6455 close codes.
+_CLOSE_POLICY_VIOLATION = 1008
+_CLOSE_INTERNAL_ERROR = 1011
+
+
+class _Stream:
+    """One multiplexed stream: its delivery task and its flow-control window."""
+
+    def __init__(self, credit: Optional[int]) -> None:
+        self.credit = credit
+        self.owned: Optional[ReplayBuffer] = None
+        self.task: Optional[asyncio.Task[None]] = None
+        self._granted = asyncio.Event()
+
+    def grant(self, n: int) -> None:
+        # A stream opened without credit stays unlimited; a late grant must not cap it.
+        if self.credit is None:
+            return
+        self.credit += n
+        self._granted.set()
+
+    async def take(self) -> None:
+        while self.credit is not None and self.credit <= 0:
+            self._granted.clear()
+            await self._granted.wait()
+        if self.credit is not None:
+            self.credit -= 1
+
+
+def _event_message(stream_id: str, frame: bytes) -> Optional[Dict[str, Any]]:
+    """A replay-buffer frame as a tagged JSON message (None for SSE comments)."""
+    head, _, rest = frame.decode("utf-8", errors="replace").partition("\n")
+    if not head.startswith("id:"):
+        return None
+    ev = parse_sse_block(rest)
+    if ev is None:
+        return None
+    payload = ev.json()
+    return {
+        "type": "event",
+        "stream_id": stream_id,
+        "id": int(head[3:].strip()),
+        "event": ev.event,
+        "data": payload if payload is not None else ev.data,
+    }
+
+
+def _error_body(resp: Response) -> Any:
+    try:
+        return json.loads(bytes(resp.body))
+    except (ValueError, UnicodeDecodeError):
+        return {"message": bytes(resp.body).decode("utf-8", errors="replace")}
+
+
+class _Mux:
+    def __init__(self, websocket: WebSocket) -> None:
+        self.ws = websocket
+        self.streams: Dict[str, _Stream] = {}
+        self._send_lock = asyncio.Lock()
+        # Upstream gets the caller's headers minus the handshake's own.
+        self.inbound_headers = {
+            k: v for k, v in websocket.headers.items() if not k.lower().startswith("sec-websocket")
+        }
+
+    def _connected(self) -> bool:
+        return self.ws.client_state == self.ws.application_state == WebSocketState.CONNECTED
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        """Send one frame; a socket that has gone away raises WebSocketDisconnect."""
+        async with self._send_lock:
+            if not self._connected():
+                raise WebSocketDisconnect()
+            try:
+                await self.ws.send_text(json.dumps(message))
+            except RuntimeError:
+                # Starlette's "send after close": the socket closed while this waited.
+                if self._connected():
+                    raise
+                raise WebSocketDisconnect() from None
+
+    async def error(self, message: str, stream_id: Optional[str] = None) -> None:
+        out: Dict[str, Any] = {"type": "error", "error": {"message": message}}
+        if stream_id is not None:
+            out["stream_id"] = stream_id
+        await self.send(out)
+
+    async def handle(self, msg: Dict[str, Any]) -> None:
+        mtype = msg.get("type")
+        if mtype == "ping":
+            await self.send({"type": "pong"})
+            return
+
+        sid = msg.get("stream_id")
+        if not isinstance(sid, str) or not sid:
+            await self.error("Every stream message needs a non-empty string stream_id")
+            return
+
+        if mtype in {"response.create", "response.resume"}:
+            await self._start(sid, msg)
+        elif mtype == "stream.credit":
+            st = self.streams.get(sid)
+            credit = msg.get("credit")
+            if st is not None and isinstance(credit, int) and credit > 0:
+                st.grant(credit)
+        elif mtype == "stream.cancel":
+            await self._cancel(sid)
+        else:
+            await self.error(f"Unknown message type: {mtype!r}", sid)
+
+    async def _start(self, sid: str, msg: Dict[str, Any]) -> None:
+        if sid in self.streams:
+            await self.error(f"stream_id {sid!r} is already in use on this socket", sid)
+            return
+        limit = int(getattr(get_settings(), "RESPONSES_WS_MAX_STREAMS", 32) or 32)
+        if len(self.streams) >= limit:
+            await self.error(f"At most {limit} concurrent streams per socket", sid)
+            return
+        credit = msg.get("credit")
+        st = _Stream(credit if isinstance(credit, int) and credit >= 0 else None)
+        self.streams[sid] = st
+        st.task = asyncio.create_task(self._run(sid, st, msg))
+
+    async def _open(self, st: _Stream, msg: Dict[str, Any]) -> tuple[Union[ReplayBuffer, Response], int]:
+        if msg["type"] == "response.create":
+            body = msg.get("body")
+            if not isinstance(body, dict):
+                raise HTTPException(status_code=400, detail="response.create needs a JSON object body")
+            opened = await open_responses_stream({**body, "stream": True}, inbound_headers=self.inbound_headers)
+            if isinstance(opened, ReplayBuffer):
+                st.owned = opened
+            return opened, -1
+
+        response_id = msg.get("response_id")
+        if not isinstance(response_id, str) or not response_id:
+            raise HTTPException(status_code=400, detail="response.resume needs a response_id")
+        after = msg.get("after")
+        opened = await stream_hub.attach(response_id, inbound_headers=self.inbound_headers)
+        return opened, after if isinstance(after, int) else -1
+
+    async def _run(self, sid: str, st: _Stream, msg: Dict[str, Any]) -> None:
+        try:
+            opened, after = await self._open(st, msg)
+            if isinstance(opened, Response):
+                await self.send(
+                    {"type": "stream.error", "stream_id": sid, "status": opened.status_code, "error": _error_body(opened)}
+                )
+                return
+            async for frame in opened.frames_after(after):
+                out = _event_message(sid, frame)
+                if out is None:
+                    continue
+                await st.take()
+                await self.send(out)
+            await self.send({"type": "stream.end", "stream_id": sid})
+        except HTTPException as exc:
+            await self.send(
+                {"type": "stream.error", "stream_id": sid, "status": exc.status_code, "error": {"message": exc.detail}}
+            )
+        except WebSocketDisconnect:
+            # The socket went away mid-send; the receive loop tears the rest down.
+            pass
+        except Exception as exc:
+            logger.exception("WebSocket stream %s failed", sid)
+            with contextlib.suppress(WebSocketDisconnect):
+                await self.send(
+                    {
+                        "type": "stream.error",
+                        "stream_id": sid,
+                        "status": 500,
+                        "error": {"message": f"Relay error: {type(exc).__name__}"},
+                    }
+                )
+        finally:
+            if self.streams.get(sid) is st:
+                del self.streams[sid]
+
+    async def _cancel(self, sid: str) -> None:
+        st = self.streams.pop(sid, None)
+        if st is None:
+            return
+        if st.task is not None:
+            st.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await st.task
+        if st.owned is not None:
+            get_replay_store().discard(st.owned)
+        await self.send({"type": "stream.cancelled", "stream_id": sid})
+
+    async def detach_all(self) -> None:
+        """Socket closed: stop delivering. Upstream streams keep running and stay resumable."""
+        tasks = [st.task for st in self.streams.values() if st.task is not None]
+        self.streams.clear()
+        for task in tasks:
+            task.cancel()
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error("WebSocket stream task failed while detaching", exc_info=result)
+
+
+@router.websocket("/responses:ws")
+async def responses_ws(websocket: WebSocket) -> None:
+    """Multiplex /v1/responses streams over one WebSocket (see module docstring)."""
+    refused = websocket_auth_error(websocket)
+    if refused is not None:
+        code = _CLOSE_INTERNAL_ERROR if refused.startswith("Relay auth misconfigured") else _CLOSE_POLICY_VIOLATION
+        await websocket.close(code=code, reason=refused)
+        return
+    if not replay_enabled():
+        await websocket.close(code=_CLOSE_POLICY_VIOLATION, reason="Streaming is disabled on this relay")
+        return
+
+    await websocket.accept()
+    mux = _Mux(websocket)
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                msg = json.loads(raw)
+            except json.JSONDecodeError:
+                await mux.error("Messages must be JSON objects")
+                continue
+            if not isinstance(msg, dict):
+                await mux.error("Messages must be JSON objects")
+                continue
+            await mux.handle(msg)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await mux.detach_all()
@@ -121,11 +121,107 @@ class Settings:
     RELAY_NAME: str
     RELAY_TIMEOUT: int
     PROXY_TIMEOUT: int
+    PROXY_BATCH_MAX_ITEMS: int
+    PROXY_BATCH_CONCURRENCY: int
     PYTHON_VERSION: str
 
     # Streaming / orchestration
     ENABLE_STREAM: bool
     CHAIN_WAIT_MODE: str
+    CHAIN_MAX_STEPS: int
+    CHAIN_MAX_WAIT_SECONDS: int
+
+    # Resumable /v1/responses streams (app/api/stream_replay.py)
+    RESPONSE_REPLAY_ENABLED: bool
+    RESPONSE_REPLAY_MAX_BYTES: int
+    RESPONSE_REPLAY_SPILL_BYTES: int
+    RESPONSE_REPLAY_TTL_SECONDS: int
+    RESPONSE_REPLAY_DIR: Optional[str]
+    RESPONSE_HUB_MAX_LAG: int
+    RESPONSE_HUB_POLL_SNAPSHOTS: bool
+    RESPONSES_WS_MAX_STREAMS: int
+
+    # Non-stream /v1/responses served from an upstream stream (app/api/stream_aggregate.py)
+    RESPONSES_AGGREGATE_STREAM: bool
+    RESPONSES_STREAM_IDLE_TIMEOUT: int
+
+    # Actions upload wrappers, base64 and :raw (app/api/upload_stream.py)
+    ACTIONS_FILE_MAX_BYTES: int
+    ACTIONS_UPLOAD_PART_MAX_BYTES: int
+    UPLOAD_SPOOL_MEMORY_BYTES: int
+
+    # POST /v1/uploads:stream (app/api/upload_parts.py)
+    UPLOAD_STREAM_PART_BYTES: int
+    UPLOAD_STREAM_CONCURRENCY: int
+    UPLOAD_STREAM_PART_RETRIES: int
+
+    # Part ledger for the Actions upload wrappers (app/api/upload_ledger.py)
+    UPLOAD_LEDGER_ENABLED: bool
+    UPLOAD_LEDGER_PATH: Optional[str]
+    UPLOAD_LEDGER_SWEEP_SECONDS: int
+
+    # Content-addressed reuse of uploaded files (app/api/file_dedup.py)
+    FILES_DEDUP_ENABLED: bool
+    FILES_DEDUP_PATH: Optional[str]
+    FILES_DEDUP_VERIFY_SECONDS: int
+
+    # File purpose/metadata cache for the /content guard (app/api/file_meta.py)
+    FILES_META_CACHE_SECONDS: int
+    FILES_META_CACHE_MAX_ENTRIES: int
+
+    # Disk cache of immutable binary downloads (app/api/content_cache.py)
+    CONTENT_CACHE_ENABLED: bool
+    CONTENT_CACHE_DIR: Optional[str]
+    CONTENT_CACHE_MAX_BYTES: int
+    CONTENT_CACHE_MAX_OBJECT_BYTES: int
+
+    # Image edits/variations input normalisation (app/api/image_normalize.py)
+    IMAGES_NORMALIZE_ENABLED: bool
+    IMAGES_NORMALIZE_WORKERS: int
+    IMAGES_NORMALIZE_MAX_INPUT_BYTES: int
+    IMAGES_NORMALIZE_CACHE_BYTES: int
+    IMAGES_NORMALIZE_MAX_PIXELS: int
+
+    # b64_json image responses offloaded to signed blob URLs (app/api/image_blobs.py)
+    IMAGES_BLOBS_ENABLED: bool
+    IMAGES_BLOBS_DIR: Optional[str]
+    IMAGES_BLOBS_TTL_SECONDS: int
+    IMAGES_BLOBS_SIGNING_KEY: Optional[str]
+    IMAGES_BLOBS_PUBLIC_BASE_URL: Optional[str]
+
+    # Long-poll /wait routes for async jobs (app/api/job_wait.py)
+    JOB_WAIT_MAX_SECONDS: int
+    JOB_WAIT_POLL_MIN_MS: int
+    JOB_WAIT_POLL_MAX_MS: int
+
+    # Streamed zip/tar of container files or file ids (app/api/archive_stream.py)
+    ARCHIVE_CONCURRENCY: int
+    ARCHIVE_MAX_FILES: int
+
+    # Per-input embeddings cache, memory LRU over sqlite (app/api/embedding_cache.py)
+    EMBEDDINGS_CACHE_ENABLED: bool
+    EMBEDDINGS_CACHE_MEMORY_BYTES: int
+    EMBEDDINGS_CACHE_PATH: Optional[str]
+    EMBEDDINGS_CACHE_DISK_MAX_BYTES: int
+
+    # Concurrent /v1/embeddings requests merged into one upstream call (app/api/embedding_batcher.py)
+    EMBEDDINGS_COALESCE_ENABLED: bool
+    EMBEDDINGS_COALESCE_WINDOW_MS: int
+    EMBEDDINGS_COALESCE_MAX_INPUTS: int
+
+    # Oversized /v1/embeddings requests split into parallel sub-requests (app/api/embedding_split.py)
+    EMBEDDINGS_SPLIT_MAX_INPUTS: int
+    EMBEDDINGS_SPLIT_MAX_TOKENS: int
+    EMBEDDINGS_SPLIT_CONCURRENCY: int
+
+    # POST /v1/embeddings:similarity (app/api/embedding_similarity.py)
+    EMBEDDINGS_SIMILARITY_MAX_CANDIDATES: int
+
+    # Local embedding models (app/api/embedding_local.py)
+    EMBEDDINGS_LOCAL_MODELS: Optional[str]
+    EMBEDDINGS_LOCAL_DEVICE: Optional[str]
+    EMBEDDINGS_LOCAL_MAX_BATCH: int
+    EMBEDDINGS_LOCAL_BATCH_WAIT_MS: int
 
     # Auth / secrets
     RELAY_AUTH_ENABLED: bool
@@ -286,10 +382,157 @@ def get_settings() -> Settings:
     relay_name = _get_env("RELAY_NAME", "ChatGPT Team Relay (local dev)") or "ChatGPT Team Relay (local dev)"
     relay_timeout = _get_int("RELAY_TIMEOUT", 120)
     proxy_timeout = _get_int("PROXY_TIMEOUT", 120)
+    # POST /v1/proxy:batch: envelopes per call, and calls in flight per batch.
+    proxy_batch_max_items = _get_int("PROXY_BATCH_MAX_ITEMS", 50)
+    proxy_batch_concurrency = _get_int("PROXY_BATCH_CONCURRENCY", 8)
     python_version = _get_env("PYTHON_VERSION", "") or ""
 
     enable_stream = _get_bool("ENABLE_STREAM", True)
+    # POST /v1/proxy:chain (app/routes/proxy_chain.py). CHAIN_WAIT_MODE is the
+    # default schedule: "sequential", or "parallel"/"auto" for independent steps
+    # at once. MAX_WAIT_SECONDS caps any single wait step.
     chain_wait_mode = _get_env("CHAIN_WAIT_MODE", "sequential") or "sequential"
+    chain_max_steps = _get_int("CHAIN_MAX_STEPS", 32)
+    chain_max_wait_seconds = _get_int("CHAIN_MAX_WAIT_SECONDS", 600)
+
+    # Replay buffers hold the SSE frames of every /v1/responses stream the relay
+    # serves, so a client that drops mid-stream can resume with Last-Event-ID.
+    # MAX_BYTES bounds the in-memory total across all streams; a single stream
+    # spills to disk once it holds more than SPILL_BYTES in memory.
+    response_replay_enabled = _get_bool("RESPONSE_REPLAY_ENABLED", True)
+    response_replay_max_bytes = _get_int("RESPONSE_REPLAY_MAX_BYTES", 64 * 1024 * 1024)
+    response_replay_spill_bytes = _get_int("RESPONSE_REPLAY_SPILL_BYTES", 1024 * 1024)
+    response_replay_ttl_seconds = _get_int("RESPONSE_REPLAY_TTL_SECONDS", 300)
+    response_replay_dir = _get_env("RESPONSE_REPLAY_DIR")
+
+    # Shared GET /v1/responses/{id}?stream=true subscriptions (app/api/stream_hub.py).
+    # A subscriber more than MAX_LAG events behind a live stream is disconnected
+    # and resumes with Last-Event-ID (0 = never). With POLL_SNAPSHOTS, plain
+    # GET polls of a response the hub is streaming are answered from the stream.
+    response_hub_max_lag = _get_int("RESPONSE_HUB_MAX_LAG", 1000)
+    response_hub_poll_snapshots = _get_bool("RESPONSE_HUB_POLL_SNAPSHOTS", True)
+
+    # Concurrent streams one /v1/responses:ws socket may carry (app/api/ws_streams.py).
+    responses_ws_max_streams = _get_int("RESPONSES_WS_MAX_STREAMS", 32)
+
+    # Off by default. When on, a non-stream POST /v1/responses is sent upstream as
+    # stream=true and aggregated back into the JSON object the caller asked for,
+    # so a slow reasoning model is bounded by an idle timeout between events
+    # rather than by RELAY_TIMEOUT for the whole generation.
+    responses_aggregate_stream = _get_bool("RESPONSES_AGGREGATE_STREAM", False)
+    responses_stream_idle_timeout = _get_int("RESPONSES_STREAM_IDLE_TIMEOUT", 120)
+
+    # Decoded-size caps for /v1/actions/files/upload and /v1/actions/uploads/{id}/parts
+    # (and their :raw siblings), matching OpenAI's own 512 MB file and 64 MB part
+    # limits. Bodies are spooled: up to SPOOL_MEMORY_BYTES in memory, then to disk.
+    actions_file_max_bytes = _get_int("ACTIONS_FILE_MAX_BYTES", 512 * 1024 * 1024)
+    actions_upload_part_max_bytes = _get_int("ACTIONS_UPLOAD_PART_MAX_BYTES", 64 * 1024 * 1024)
+    upload_spool_memory_bytes = _get_int("UPLOAD_SPOOL_MEMORY_BYTES", 1024 * 1024)
+
+    # POST /v1/uploads:stream cuts one body into parts of PART_BYTES (OpenAI caps a
+    # part at 64 MB) and keeps up to CONCURRENCY of them in flight, so a request
+    # holds about (CONCURRENCY + 1) * PART_BYTES. Each part gets PART_RETRIES retries.
+    upload_stream_part_bytes = _get_int("UPLOAD_STREAM_PART_BYTES", 8 * 1024 * 1024)
+    upload_stream_concurrency = _get_int("UPLOAD_STREAM_CONCURRENCY", 4)
+    upload_stream_part_retries = _get_int("UPLOAD_STREAM_PART_RETRIES", 3)
+
+    # sqlite ledger of the parts /v1/actions/uploads/{id}/parts has forwarded, so
+    # an interrupted client can resume (GET .../status). PATH defaults to a file
+    # in the temp dir; point it at a volume to survive restarts. Rows of expired
+    # Uploads are swept at most once per SWEEP_SECONDS.
+    upload_ledger_enabled = _get_bool("UPLOAD_LEDGER_ENABLED", True)
+    upload_ledger_path = _get_env("UPLOAD_LEDGER_PATH")
+    upload_ledger_sweep_seconds = _get_int("UPLOAD_LEDGER_SWEEP_SECONDS", 60)
+
+    # Opt-in. POST /v1/files and the Actions file wrappers return the existing File
+    # for bytes already uploaded with the same purpose and credential, once a
+    # GET shows it still exists upstream (re-checked after VERIFY_SECONDS).
+    files_dedup_enabled = _get_bool("FILES_DEDUP_ENABLED", False)
+    files_dedup_path = _get_env("FILES_DEDUP_PATH")
+    files_dedup_verify_seconds = _get_int("FILES_DEDUP_VERIFY_SECONDS", 300)
+
+    # File objects seen in list/retrieve/create responses, kept so the user_data
+    # guard on GET /v1/files/{id}/content does not need its own upstream lookup.
+    # 0 seconds disables the cache (every download looks the purpose up).
+    files_meta_cache_seconds = _get_int("FILES_META_CACHE_SECONDS", 600)
+    files_meta_cache_max_entries = _get_int("FILES_META_CACHE_MAX_ENTRIES", 4096)
+
+    # Opt-in. Video, container-file and file downloads are kept on disk (LRU by
+    # total size) and served from there, Range requests included. DIR defaults to
+    # a directory in the temp dir; objects over MAX_OBJECT_BYTES are never cached.
+    content_cache_enabled = _get_bool("CONTENT_CACHE_ENABLED", False)
+    content_cache_dir = _get_env("CONTENT_CACHE_DIR")
+    content_cache_max_bytes = _get_int("CONTENT_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+    content_cache_max_object_bytes = _get_int("CONTENT_CACHE_MAX_OBJECT_BYTES", 512 * 1024 * 1024)
+
+    # Needs the `images` extra (Pillow); without it the wrappers stay PNG-only.
+    # Inputs up to MAX_INPUT_BYTES in any format Pillow reads are converted to PNG,
+    # fitted to a supported size and recompressed under 4 MB, in a pool of WORKERS
+    # processes. Results are cached by input hash up to CACHE_BYTES. Images over
+    # MAX_PIXELS are refused before they are decoded (a 20 MB PNG can unpack to GBs).
+    images_normalize_enabled = _get_bool("IMAGES_NORMALIZE_ENABLED", True)
+    images_normalize_workers = _get_int("IMAGES_NORMALIZE_WORKERS", 2)
+    images_normalize_max_input_bytes = _get_int("IMAGES_NORMALIZE_MAX_INPUT_BYTES", 20 * 1024 * 1024)
+    images_normalize_cache_bytes = _get_int("IMAGES_NORMALIZE_CACHE_BYTES", 64 * 1024 * 1024)
+    images_normalize_max_pixels = _get_int("IMAGES_NORMALIZE_MAX_PIXELS", 40_000_000)
+
+    # Off by default: clients that expect b64_json would get `url` instead. The
+    # signed URLs are valid for TTL_SECONDS and are the only credential the blob
+    # route checks. SIGNING_KEY defaults to one derived from RELAY_KEY. Set
+    # PUBLIC_BASE_URL when the relay sits behind a proxy that rewrites the host.
+    images_blobs_enabled = _get_bool("IMAGES_BLOBS_ENABLED", False)
+    images_blobs_dir = _get_env("IMAGES_BLOBS_DIR")
+    images_blobs_ttl_seconds = _get_int("IMAGES_BLOBS_TTL_SECONDS", 3600)
+    images_blobs_signing_key = _get_env("IMAGES_BLOBS_SIGNING_KEY")
+    images_blobs_public_base_url = _get_env("IMAGES_BLOBS_PUBLIC_BASE_URL")
+
+    # A `?timeout=` on the /wait routes is capped at MAX_SECONDS. The shared
+    # poller for each job starts at POLL_MIN_MS between upstream GETs, doubles
+    # while nothing changes, and stops doubling at POLL_MAX_MS.
+    job_wait_max_seconds = _get_int("JOB_WAIT_MAX_SECONDS", 60)
+    job_wait_poll_min_ms = _get_int("JOB_WAIT_POLL_MIN_MS", 500)
+    job_wait_poll_max_ms = _get_int("JOB_WAIT_POLL_MAX_MS", 8000)
+
+    # Archive downloads fetch CONCURRENCY entries at a time, each into its own
+    # spool (UPLOAD_SPOOL_MEMORY_BYTES in memory, then disk). An archive may
+    # hold at most MAX_FILES entries.
+    archive_concurrency = _get_int("ARCHIVE_CONCURRENCY", 4)
+    archive_max_files = _get_int("ARCHIVE_MAX_FILES", 500)
+
+    # /v1/embeddings answers each input from the cache when it can and sends
+    # only the misses upstream. MEMORY_BYTES bounds the in-process LRU; the
+    # sqlite store at PATH (temp dir when unset) is trimmed, least recently
+    # used first, to DISK_MAX_BYTES.
+    embeddings_cache_enabled = _get_bool("EMBEDDINGS_CACHE_ENABLED", False)
+    embeddings_cache_memory_bytes = _get_int("EMBEDDINGS_CACHE_MEMORY_BYTES", 64 * 1024 * 1024)
+    embeddings_cache_path = _get_env("EMBEDDINGS_CACHE_PATH")
+    embeddings_cache_disk_max_bytes = _get_int("EMBEDDINGS_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024)
+
+    # Embeddings requests that differ only in `input` and arrive within
+    # WINDOW_MS of each other go upstream as one call of up to MAX_INPUTS
+    # inputs (the API's per-request maximum is 2048).
+    embeddings_coalesce_enabled = _get_bool("EMBEDDINGS_COALESCE_ENABLED", False)
+    embeddings_coalesce_window_ms = _get_int("EMBEDDINGS_COALESCE_WINDOW_MS", 5)
+    embeddings_coalesce_max_inputs = _get_int("EMBEDDINGS_COALESCE_MAX_INPUTS", 2048)
+
+    # An embeddings request over MAX_INPUTS inputs or MAX_TOKENS estimated
+    # tokens is split into balanced sub-requests, CONCURRENCY at a time. The
+    # token default leaves headroom under upstream's 300k per-request budget
+    # for the estimate's error.
+    embeddings_split_max_inputs = _get_int("EMBEDDINGS_SPLIT_MAX_INPUTS", 2048)
+    embeddings_split_max_tokens = _get_int("EMBEDDINGS_SPLIT_MAX_TOKENS", 250_000)
+    embeddings_split_concurrency = _get_int("EMBEDDINGS_SPLIT_CONCURRENCY", 4)
+
+    # Candidates (texts plus cache ids) one similarity request may rank.
+    embeddings_similarity_max_candidates = _get_int("EMBEDDINGS_SIMILARITY_MAX_CANDIDATES", 10_000)
+
+    # `alias=spec` pairs served locally instead of upstream, e.g. local/bge-m3=BAAI/bge-m3.
+    # Device for in-process models (cpu, cuda, mps); empty lets sentence-transformers pick.
+    # Texts per encode call, and how long the batcher waits for more requests.
+    embeddings_local_models = _get_env("EMBEDDINGS_LOCAL_MODELS")
+    embeddings_local_device = _get_env("EMBEDDINGS_LOCAL_DEVICE")
+    embeddings_local_max_batch = _get_int("EMBEDDINGS_LOCAL_MAX_BATCH", 64)
+    embeddings_local_batch_wait_ms = _get_int("EMBEDDINGS_LOCAL_BATCH_WAIT_MS", 5)
 
     relay_key = os.getenv("RELAY_KEY") or None
 
@@ -330,9 +573,71 @@ def get_settings() -> Settings:
         RELAY_NAME=relay_name,
         RELAY_TIMEOUT=relay_timeout,
         PROXY_TIMEOUT=proxy_timeout,
+        PROXY_BATCH_MAX_ITEMS=proxy_batch_max_items,
+        PROXY_BATCH_CONCURRENCY=proxy_batch_concurrency,
         PYTHON_VERSION=python_version,
         ENABLE_STREAM=enable_stream,
         CHAIN_WAIT_MODE=chain_wait_mode,
+        CHAIN_MAX_STEPS=chain_max_steps,
+        CHAIN_MAX_WAIT_SECONDS=chain_max_wait_seconds,
+        RESPONSE_REPLAY_ENABLED=response_replay_enabled,
+        RESPONSE_REPLAY_MAX_BYTES=response_replay_max_bytes,
+        RESPONSE_REPLAY_SPILL_BYTES=response_replay_spill_bytes,
+        RESPONSE_REPLAY_TTL_SECONDS=response_replay_ttl_seconds,
+        RESPONSE_REPLAY_DIR=response_replay_dir,
+        RESPONSE_HUB_MAX_LAG=response_hub_max_lag,
+        RESPONSE_HUB_POLL_SNAPSHOTS=response_hub_poll_snapshots,
+        RESPONSES_WS_MAX_STREAMS=responses_ws_max_streams,
+        RESPONSES_AGGREGATE_STREAM=responses_aggregate_stream,
+        RESPONSES_STREAM_IDLE_TIMEOUT=responses_stream_idle_timeout,
+        ACTIONS_FILE_MAX_BYTES=actions_file_max_bytes,
+        ACTIONS_UPLOAD_PART_MAX_BYTES=actions_upload_part_max_bytes,
+        UPLOAD_SPOOL_MEMORY_BYTES=upload_spool_memory_bytes,
+        UPLOAD_STREAM_PART_BYTES=upload_stream_part_bytes,
+        UPLOAD_STREAM_CONCURRENCY=upload_stream_concurrency,
+        UPLOAD_STREAM_PART_RETRIES=upload_stream_part_retries,
+        UPLOAD_LEDGER_ENABLED=upload_ledger_enabled,
+        UPLOAD_LEDGER_PATH=upload_ledger_path,
+        UPLOAD_LEDGER_SWEEP_SECONDS=upload_ledger_sweep_seconds,
+        FILES_DEDUP_ENABLED=files_dedup_enabled,
+        FILES_DEDUP_PATH=files_dedup_path,
+        FILES_DEDUP_VERIFY_SECONDS=files_dedup_verify_seconds,
+        FILES_META_CACHE_SECONDS=files_meta_cache_seconds,
+        FILES_META_CACHE_MAX_ENTRIES=files_meta_cache_max_entries,
+        CONTENT_CACHE_ENABLED=content_cache_enabled,
+        CONTENT_CACHE_DIR=content_cache_dir,
+        CONTENT_CACHE_MAX_BYTES=content_cache_max_bytes,
+        CONTENT_CACHE_MAX_OBJECT_BYTES=content_cache_max_object_bytes,
+        IMAGES_NORMALIZE_ENABLED=images_normalize_enabled,
+        IMAGES_NORMALIZE_WORKERS=images_normalize_workers,
+        IMAGES_NORMALIZE_MAX_INPUT_BYTES=images_normalize_max_input_bytes,
+        IMAGES_NORMALIZE_CACHE_BYTES=images_normalize_cache_bytes,
+        IMAGES_NORMALIZE_MAX_PIXELS=images_normalize_max_pixels,
+        IMAGES_BLOBS_ENABLED=images_blobs_enabled,
+        IMAGES_BLOBS_DIR=images_blobs_dir,
+        IMAGES_BLOBS_TTL_SECONDS=images_blobs_ttl_seconds,
+        IMAGES_BLOBS_SIGNING_KEY=images_blobs_signing_key,
+        IMAGES_BLOBS_PUBLIC_BASE_URL=images_blobs_public_base_url,
+        JOB_WAIT_MAX_SECONDS=job_wait_max_seconds,
+        JOB_WAIT_POLL_MIN_MS=job_wait_poll_min_ms,
+        JOB_WAIT_POLL_MAX_MS=job_wait_poll_max_ms,
+        ARCHIVE_CONCURRENCY=archive_concurrency,
+        ARCHIVE_MAX_FILES=archive_max_files,
+        EMBEDDINGS_CACHE_ENABLED=embeddings_cache_enabled,
+        EMBEDDINGS_CACHE_MEMORY_BYTES=embeddings_cache_memory_bytes,
+        EMBEDDINGS_CACHE_PATH=embeddings_cache_path,
+        EMBEDDINGS_CACHE_DISK_MAX_BYTES=embeddings_cache_disk_max_bytes,
+        EMBEDDINGS_COALESCE_ENABLED=embeddings_coalesce_enabled,
+        EMBEDDINGS_COALESCE_WINDOW_MS=embeddings_coalesce_window_ms,
+        EMBEDDINGS_COALESCE_MAX_INPUTS=embeddings_coalesce_max_inputs,
+        EMBEDDINGS_SPLIT_MAX_INPUTS=embeddings_split_max_inputs,
+        EMBEDDINGS_SPLIT_MAX_TOKENS=embeddings_split_max_tokens,
+        EMBEDDINGS_SPLIT_CONCURRENCY=embeddings_split_concurrency,
+        EMBEDDINGS_SIMILARITY_MAX_CANDIDATES=embeddings_similarity_max_candidates,
+        EMBEDDINGS_LOCAL_MODELS=embeddings_local_models,
+        EMBEDDINGS_LOCAL_DEVICE=embeddings_local_device,
+        EMBEDDINGS_LOCAL_MAX_BATCH=embeddings_local_max_batch,
+        EMBEDDINGS_LOCAL_BATCH_WAIT_MS=embeddings_local_batch_wait_ms,
         RELAY_AUTH_ENABLED=relay_auth_enabled,
         RELAY_KEY=relay_key,
         CHATGPT_ACTIONS_SECRET=chatgpt_actions_secret,
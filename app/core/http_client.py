@@ -49,3 +49,38 @@ def get_async_httpx_client(*, timeout_seconds: float | None = None, timeout: flo
         _async_httpx_client_loop_id = loop_id
         
     return _async_httpx_client
+
+
+_download_httpx_client: Optional[httpx.AsyncClient] = None
+_download_httpx_client_loop_id: Optional[int] = None
+
+
+def get_download_httpx_client() -> httpx.AsyncClient:
+    """
+    Return a shared httpx.AsyncClient for fetching user files from OpenAI download hosts.
+
+    Kept apart from the upstream API client: different hosts, a shorter timeout,
+    and redirects are never followed (the allow-list in app/routes/images.py
+    only vets the first URL). Pooled, like the API client, so repeated
+    downloads reuse their TCP+TLS connections.
+    """
+    global _download_httpx_client, _download_httpx_client_loop_id
+
+    try:
+        loop_id = id(asyncio.get_running_loop())
+    except RuntimeError:
+        loop_id = None
+
+    if (
+        _download_httpx_client is None
+        or _download_httpx_client.is_closed
+        or _download_httpx_client_loop_id != loop_id
+    ):
+        _download_httpx_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(20.0, connect=10.0),
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+            follow_redirects=False,
+        )
+        _download_httpx_client_loop_id = loop_id
+
+    return _download_httpx_client
@@ -9,6 +9,7 @@ from fastapi.staticfiles import StaticFiles
 from app.api.sse import actions_router as sse_actions_router
 from app.api.sse import router as sse_router
 from app.api.tools_api import router as tools_router
+from app.api.ws_streams import router as ws_streams_router
 from app.core.config import get_settings
 from app.core.logging import configure_logging
 from app.middleware.p4_orchestrator import P4OrchestratorMiddleware
@@ -78,6 +79,7 @@ def create_app() -> FastAPI:
     # SSE streaming endpoints (non-Actions + Actions wrapper)
     app.include_router(sse_router)
     app.include_router(sse_actions_router)
+    app.include_router(ws_streams_router)
 
     # Static assets. RelayAuthMiddleware has always exempted /static/ (relay_auth.py:46)
     # but nothing ever mounted it, so every path under it 404'd — including the plugin
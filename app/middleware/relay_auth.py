@@ -4,7 +4,7 @@ import hmac
 from typing import Optional
 
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.requests import Request
+from starlette.requests import HTTPConnection, Request
 from starlette.responses import JSONResponse, Response
 
 from app.core.config import settings
@@ -26,7 +26,7 @@ _PUBLIC_PATHS = {
 }
 
 
-def _extract_relay_key(request: Request) -> Optional[str]:
+def _extract_relay_key(request: HTTPConnection) -> Optional[str]:
     # Preferred header
     x_key = request.headers.get("X-Relay-Key")
     if x_key:
@@ -40,6 +40,27 @@ def _extract_relay_key(request: Request) -> Optional[str]:
     return None
 
 
+def websocket_auth_error(websocket: HTTPConnection) -> Optional[str]:
+    """
+    Relay auth for WebSocket routes, which BaseHTTPMiddleware never sees.
+
+    Same key, same constant-time compare. Browsers cannot set headers on a
+    WebSocket handshake, so `?relay_key=` is accepted as well. Returns why the
+    connection is refused, or None when it may proceed.
+    """
+    if not settings.RELAY_AUTH_ENABLED:
+        return None
+    expected = settings.RELAY_KEY or ""
+    if not expected:
+        return "Relay auth misconfigured: RELAY_AUTH_ENABLED is true but RELAY_KEY is empty"
+    provided = _extract_relay_key(websocket) or (websocket.query_params.get("relay_key") or "").strip()
+    if not provided:
+        return "Missing relay key"
+    if not hmac.compare_digest(provided.encode("utf-8"), expected.encode("utf-8")):
+        return "Invalid relay key"
+    return None
+
+
 class RelayAuthMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
         # Public endpoints (no auth).
@@ -48,6 +69,8 @@ class RelayAuthMiddleware(BaseHTTPMiddleware):
             or request.url.path.startswith("/static/")
             # Plugin/Actions discovery must be readable before a client has a key.
             or request.url.path.startswith("/.well-known/")
+            # Offloaded images: the HMAC signature in the URL is checked by the route.
+            or request.url.path.startswith("/v1/images/blobs/")
         ):
             return await call_next(request)
 
@@ -3,6 +3,7 @@ from __future__ import annotations
 from fastapi import APIRouter, Request
 from fastapi.responses import Response
 
+from app.api import job_wait
 from app.api.forward_openai import forward_openai_request
 from app.utils.logger import get_logger
 
@@ -22,6 +23,14 @@ async def retrieve_batch(batch_id: str, request: Request) -> Response:
     return await forward_openai_request(request)
 
 
+@router.get("/v1/batches/{batch_id}/wait")
+async def wait_batch(batch_id: str, request: Request) -> Response:
+    logger.info(f"Incoming /v1/batches wait request for batch_id={batch_id}")
+    return await job_wait.wait_for_job(
+        request, upstream_path=f"/v1/batches/{batch_id}", terminal=job_wait.BATCH_TERMINAL
+    )
+
+
 @router.get("/v1/batches")
 async def list_batches(request: Request) -> Response:
     logger.info("Incoming /v1/batches list request")
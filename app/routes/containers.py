@@ -1,17 +1,14 @@
 from __future__ import annotations
 
-import httpx
-from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import Response, StreamingResponse
-from starlette.background import BackgroundTask
-
-from app.api.forward_openai import (
-    _get_timeout_seconds,
-    build_outbound_headers,
-    build_upstream_url,
-    filter_upstream_headers,
-    forward_openai_request,
-)
+import json
+from typing import List, Optional, Union
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
+
+from app.api import archive_stream
+from app.api.content_cache import cached_content
+from app.api.forward_openai import _get_timeout_seconds, forward_openai_method_path, forward_openai_request
 from app.core.config import get_settings
 from app.core.http_client import get_async_httpx_client
 
@@ -41,76 +38,84 @@ async def containers_options(request: Request) -> Response:
 @router.get("/containers/{container_id}/files/{file_id}/content")
 async def containers_file_content(request: Request, container_id: str, file_id: str) -> Response:
     """
-    Stream container file content.
+    Stream container file content, with Range support (app/api/binary_content.py)
+    and, when enabled, the disk cache (app/api/content_cache.py).
 
     Critical behavior for Success Gate D:
       - Do NOT raise on upstream non-2xx.
       - If upstream returns 4xx/5xx, read the body and return it with upstream status
         (avoids relay 500 masking upstream errors).
-      - Stream only on 2xx.
+      - Stream only on 2xx. The upstream response is closed by a BackgroundTask
+        after the body has been written, never before Starlette iterates it.
+      - A transport failure is a 424, as on every other route.
     """
     upstream_path = f"/v1/containers/{container_id}/files/{file_id}/content"
 
     s = get_settings()
     base_url = getattr(s, "openai_base_url", None) or "https://api.openai.com"
+    client = get_async_httpx_client(timeout=_get_timeout_seconds(s))
+
+    return await cached_content(
+        request,
+        resource=f"containers/{container_id}/files/{file_id}",
+        upstream_path=upstream_path,
+        client=client,
+        base_url=base_url,
+    )
 
-    upstream_url = build_upstream_url(upstream_path, request=request, base_url=base_url)
 
-    headers = build_outbound_headers(
-        inbound_headers=request.headers,
-        content_type=None,
-        forward_accept=True,
-        path_hint=upstream_path,
-    )
+@router.head("/containers/{container_id}/files/{file_id}/content", include_in_schema=False)
+async def containers_file_content_head(request: Request, container_id: str, file_id: str) -> Response:
+    return await forward_openai_request(request)
+
 
-    timeout_s = _get_timeout_seconds(s)
-    client = get_async_httpx_client(timeout=timeout_s)
-
-    # Sent manually rather than via `async with client.stream(...)`. That context
-    # manager closes the upstream response when this function returns — which is
-    # *before* Starlette iterates a StreamingResponse — so the 2xx branch used to
-    # answer 200 with an empty body while upstream had sent the file. Closing is
-    # deferred to a BackgroundTask that runs after the body has been written.
-    req = client.build_request("GET", upstream_url, headers=headers)
-    try:
-        upstream = await client.send(req, stream=True)
-    except httpx.HTTPError as exc:
-        # A transport failure (DNS, refused connection, timeout, a proxy rejecting
-        # CONNECT) raises before any status code exists to propagate. Uncaught it
-        # escaped as a bare relay 500 — the very thing this handler exists to
-        # prevent. 424 is what forward_openai_request returns for the same class of
-        # failure, so every route now degrades identically.
-        raise HTTPException(
-            status_code=424,
-            detail=f"Upstream request failed: {type(exc).__name__}: {exc}",
-        ) from exc
-
-    status = upstream.status_code
-    resp_headers = filter_upstream_headers(upstream.headers)
-    media_type = upstream.headers.get("content-type")
-
-    # IMPORTANT: never raise_for_status(); propagate upstream responses.
-    if status >= 400:
-        try:
-            content = await upstream.aread()
-        finally:
-            await upstream.aclose()
-        return Response(
-            content=content,
-            status_code=status,
-            headers=resp_headers,
-            media_type=media_type,
+async def _list_container_files(container_id: str, request: Request) -> Union[List[dict], Response]:
+    """Every file in the container (all pages), or the upstream error response."""
+    files: List[dict] = []
+    after: Optional[str] = None
+    while True:
+        query = {"limit": "100", **({"after": after} if after else {})}
+        resp = await forward_openai_method_path(
+            "GET", f"/v1/containers/{container_id}/files", inbound_headers=request.headers, query=query
         )
+        if resp.status_code >= 400:
+            return resp
+        page = json.loads(resp.body)
+        files.extend(page.get("data") or [])
+        if len(files) > archive_stream.max_files():
+            raise HTTPException(
+                status_code=400,
+                detail=f"Container holds more than {archive_stream.max_files()} files; too many for one archive",
+            )
+        after = page.get("last_id") or (files[-1].get("id") if files else None)
+        if not page.get("has_more") or not after:
+            return files
+
+
+@router.get("/containers/{container_id}/files:archive")
+async def containers_files_archive(
+    request: Request,
+    container_id: str,
+    fmt: str = Query("zip", alias="format", description="zip or tar"),
+) -> Response:
+    """
+    Every file in the container as one streamed zip/tar (app/api/archive_stream.py):
+    listed, downloaded with bounded concurrency and written as each completes.
+    """
+    fmt = archive_stream.archive_format(fmt)
+    listed = await _list_container_files(container_id, request)
+    if isinstance(listed, Response):
+        return listed
 
-    return StreamingResponse(
-        upstream.aiter_bytes(),
-        status_code=status,
-        headers=resp_headers,
-        media_type=media_type,
-        background=BackgroundTask(upstream.aclose),
-    )
+    def job(entry: dict) -> archive_stream.ArchiveJob:
+        file_id = str(entry.get("id"))
+        name = archive_stream.safe_name(str(entry.get("path") or file_id))
 
+        async def resolve() -> tuple[str, str]:
+            return name, f"/v1/containers/{container_id}/files/{file_id}/content"
 
-@router.head("/containers/{container_id}/files/{file_id}/content", include_in_schema=False)
-async def containers_file_content_head(request: Request, container_id: str, file_id: str) -> Response:
-    return await forward_openai_request(request)
+        return archive_stream.ArchiveJob(label=file_id, resolve=resolve)
+
+    return archive_stream.archive_response(
+        [job(entry) for entry in listed], inbound_headers=request.headers, fmt=fmt, filename=container_id
+    )
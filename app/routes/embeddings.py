@@ -1,19 +1,48 @@
 from __future__ import annotations
 
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Union
 
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
 
+from app.api import embedding_formats, embedding_local, embedding_similarity
 from app.api.action_schemas import EMBEDDINGS_BODY
-from app.api.forward_openai import forward_embeddings_create
 
 router = APIRouter(prefix="/v1", tags=["embeddings"])
 
 
 @router.post("/embeddings", openapi_extra=EMBEDDINGS_BODY)
-async def create_embedding(request: Request) -> JSONResponse:
+async def create_embedding(request: Request) -> Response:
     body: Dict[str, Any] = await request.json()
-    resp = await forward_embeddings_create(body)
-    payload = resp.model_dump() if hasattr(resp, "model_dump") else resp
-    return JSONResponse(content=payload)
+    output = embedding_formats.requested_output(body, request.headers.get("accept"), request.query_params.get("dtype"))
+    upstream = embedding_formats.upstream_body(body)
+    resp = await embedding_local.dispatch(upstream, inbound_headers=request.headers)
+    return await embedding_formats.render_embeddings(resp, output)
+
+
+class SimilarityRequest(BaseModel):
+    model: str = Field(..., description="Embedding model ID, e.g. text-embedding-3-small.")
+    query: Union[str, List[str]] = Field(..., description="Query text, or several queries ranked in one call.")
+    candidates: List[str] = Field(default_factory=list, description="Candidate texts to rank.")
+    candidate_ids: List[str] = Field(
+        default_factory=list,
+        description="Ids of candidates embedded before (returned as `id` when the embedding cache is on).",
+    )
+    top_k: int = Field(default=10, ge=1, description="Matches returned per query.")
+    dimensions: Optional[int] = Field(default=None, ge=1)
+    user: Optional[str] = None
+
+
+@router.post("/embeddings:similarity")
+async def embeddings_similarity(req: SimilarityRequest, request: Request) -> Response:
+    """Top-k cosine similarity of candidates to each query: ranked indexes and scores, no vectors."""
+    return await embedding_similarity.similarity(
+        model=req.model,
+        queries=[req.query] if isinstance(req.query, str) else req.query,
+        candidates=req.candidates,
+        candidate_ids=req.candidate_ids,
+        k=req.top_k,
+        options=req.model_dump(include={"dimensions", "user"}, exclude_none=True),
+        inbound_headers=request.headers,
+    )
@@ -1,51 +1,35 @@
 from __future__ import annotations
 
-import base64
-from typing import Dict
+import asyncio
+from typing import Dict, Optional, Tuple
 
-import httpx
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from starlette.datastructures import UploadFile
 from starlette.responses import Response
 
-from app.api.forward_openai import build_outbound_headers, build_upstream_url, forward_openai_method_path, forward_openai_request
-from app.core.http_client import get_async_httpx_client
+from app.api import archive_stream, binary_content, content_cache, file_dedup, file_meta
+from app.api.action_schemas import OCTET_STREAM_BODY, _json_body
+from app.api.forward_openai import forward_openai_method_path, forward_openai_request
+from app.api.upload_stream import SpooledUpload, post_multipart_upload, spool_base64_field, spool_raw_body
 from app.core.settings import get_settings
 
 router = APIRouter(prefix="/v1", tags=["files"])
 
+_HASH_CHUNK = 1024 * 1024
 
-def _filter_response_headers(headers: httpx.Headers) -> Dict[str, str]:
-    """
-    Strip hop-by-hop / conflicting headers to avoid Starlette issues.
-    Keep this local to avoid relying on internal helpers.
-    """
-    strip = {
-        "connection",
-        "keep-alive",
-        "proxy-authenticate",
-        "proxy-authorization",
-        "te",
-        "trailers",
-        "transfer-encoding",
-        "upgrade",
-        "content-length",
-        "content-encoding",
-    }
-    out: Dict[str, str] = {}
-    for k, v in headers.items():
-        if k.lower() in strip:
-            continue
-        out[k] = v
-    return out
-
-
-async def _is_user_data_file(file_id: str, request: Request) -> bool:
+
+def _is_user_data(purpose: Optional[str]) -> bool:
+    return (purpose or "").strip().lower() == "user_data"
+
+
+async def _fetch_purpose(file_id: str, request: Request) -> Optional[str]:
     """
-    Best-effort guardrail:
-    - If we can confirm purpose == 'user_data', block content download.
-    - If we cannot confirm (metadata fetch fails), do not introduce new 5xx.
+    Best-effort metadata lookup for the content guard (recorded in the cache).
+    - If the purpose cannot be confirmed (metadata fetch fails), return None:
+      the guard must not introduce new 5xx.
     """
     try:
         meta = await forward_openai_method_path(
@@ -53,42 +37,177 @@ async def _is_user_data_file(file_id: str, request: Request) -> bool:
             f"/v1/files/{file_id}",
             inbound_headers=request.headers,
         )
-    except HTTPException:
-        return False
     except Exception:
-        return False
-
-    return isinstance(meta, dict) and str(meta.get("purpose", "")).strip().lower() == "user_data"
+        return None
+    file_meta.observe(meta)
+    obj = file_meta.file_object(meta)
+    return None if obj is None else str(obj.get("purpose", ""))
 
 
 @router.get("/files")
 async def list_files(request: Request) -> Response:
-    return await forward_openai_request(request)
+    return file_meta.observe(await forward_openai_request(request))
 
 
 @router.post("/files")
 async def create_file(request: Request) -> Response:
-    return await forward_openai_request(request)
+    if file_dedup.enabled():
+        return await _create_file_deduplicated(request)
+    return file_meta.observe(await forward_openai_request(request))
+
+
+async def _create_file_deduplicated(request: Request) -> Response:
+    """Multipart POST /v1/files through the dedup index (app/api/file_dedup.py).
+
+    The form is parsed (Starlette spools the file part) so the file bytes can
+    be hashed; on a miss the same fields are re-sent as multipart.
+    """
+    form = await request.form()
+    file_part = form.get("file")
+    purpose = form.get("purpose")
+    if not isinstance(file_part, UploadFile) or not isinstance(purpose, str):
+        await form.close()
+        raise HTTPException(status_code=400, detail="multipart fields 'file' and 'purpose' are required")
+
+    upload = SpooledUpload(file=file_part.file)
+    while chunk := await file_part.read(_HASH_CHUNK):
+        upload.size += len(chunk)
+        upload.digest.update(chunk)
+    data = {k: v for k, v in form.multi_items() if isinstance(v, str)}
+    return await _upload_file(
+        request,
+        upload,
+        purpose=purpose,
+        filename=file_part.filename or "file",
+        mime_type=file_part.content_type or "application/octet-stream",
+        data=data,
+    )
+
+
+async def _upload_file(
+    request: Request,
+    upload: SpooledUpload,
+    *,
+    purpose: str,
+    filename: str,
+    mime_type: str,
+    data: Optional[Dict[str, str]] = None,
+) -> Response:
+    """Send a spooled file to POST /v1/files, or reuse an identical one when dedup is on."""
+    if file_dedup.enabled():
+        hit = await file_dedup.lookup(upload.sha256, purpose, request.headers)
+        if hit is not None:
+            upload.close()
+            return file_meta.observe(hit)
+    resp = await post_multipart_upload(
+        request,
+        "/v1/files",
+        upload,
+        file_field="file",
+        filename=filename,
+        mime_type=mime_type,
+        data=data or {"purpose": purpose},
+        what="uploading file",
+    )
+    if file_dedup.enabled():
+        await file_dedup.remember(upload.sha256, purpose, request.headers, resp)
+    return file_meta.observe(resp)
 
 
 @router.get("/files/{file_id}")
 async def retrieve_file(file_id: str, request: Request) -> Response:
-    return await forward_openai_request(request)
+    return file_meta.observe(await forward_openai_request(request))
 
 
 @router.delete("/files/{file_id}")
 async def delete_file(file_id: str, request: Request) -> Response:
-    return await forward_openai_request(request)
+    resp = await forward_openai_request(request)
+    if resp.status_code < 400:
+        await file_dedup.forget(file_id)
+        file_meta.forget(file_id)
+        content_cache.forget(f"files/{file_id}")
+    return resp
 
 
 @router.get("/files/{file_id}/content")
 async def retrieve_file_content(file_id: str, request: Request) -> Response:
-    if await _is_user_data_file(file_id, request):
-        return JSONResponse(
-            status_code=403,
-            content={"detail": "Not allowed to download files with purpose 'user_data' via this relay."},
+    """
+    Stream file content (Range-aware, see app/api/binary_content.py), refusing
+    files with purpose 'user_data'.
+
+    The purpose normally comes from the metadata cache (app/api/file_meta.py).
+    On a miss it is fetched concurrently with opening the content stream, and
+    the stream is closed unread if the guard then refuses. With the content
+    cache on (app/api/content_cache.py) the guard runs first instead.
+    """
+    purpose = file_meta.cached_purpose(file_id)
+    if _is_user_data(purpose):
+        return _user_data_refusal()
+
+    if content_cache.enabled():
+        # Nothing may be written to the cache before the guard has passed.
+        if purpose is None and _is_user_data(await _fetch_purpose(file_id, request)):
+            return _user_data_refusal()
+        return await content_cache.cached_content(
+            request, resource=f"files/{file_id}", upstream_path=f"/v1/files/{file_id}/content"
         )
-    return await forward_openai_request(request)
+
+    lookup = asyncio.create_task(_fetch_purpose(file_id, request)) if purpose is None else None
+    try:
+        upstream = await binary_content.open_upstream_content(request, f"/v1/files/{file_id}/content")
+    except BaseException:
+        if lookup is not None:
+            lookup.cancel()
+        raise
+
+    if lookup is not None and _is_user_data(await lookup):
+        await upstream.aclose()
+        return _user_data_refusal()
+
+    return await binary_content.content_response(request, upstream)
+
+
+@router.get("/files:archive")
+async def files_archive(
+    request: Request,
+    fmt: str = Query("zip", alias="format", description="zip or tar"),
+) -> Response:
+    """
+    The files named by `?ids=` (repeated or comma-separated) as one streamed
+    zip/tar (app/api/archive_stream.py). Files
+    with purpose 'user_data' are refused exactly as on /content, and are listed in
+    the archive's error entry rather than failing the whole download.
+    """
+    fmt = archive_stream.archive_format(fmt)
+    file_ids = list(dict.fromkeys(i.strip() for value in request.query_params.getlist("ids") for i in value.split(",") if i.strip()))
+    if not file_ids:
+        raise HTTPException(status_code=400, detail="ids must name at least one file")
+
+    def job(file_id: str) -> archive_stream.ArchiveJob:
+        async def resolve() -> Tuple[str, str]:
+            meta = file_meta.observe(
+                await forward_openai_method_path("GET", f"/v1/files/{file_id}", inbound_headers=request.headers)
+            )
+            obj = file_meta.file_object(meta)
+            if obj is None:
+                raise archive_stream.EntryError(f"metadata lookup failed (HTTP {meta.status_code})")
+            if _is_user_data(obj.get("purpose")):
+                raise archive_stream.EntryError("refused: purpose 'user_data'")
+            name = archive_stream.safe_name(str(obj.get("filename") or file_id))
+            return name, f"/v1/files/{file_id}/content"
+
+        return archive_stream.ArchiveJob(label=file_id, resolve=resolve)
+
+    return archive_stream.archive_response(
+        [job(file_id) for file_id in file_ids], inbound_headers=request.headers, fmt=fmt, filename="files"
+    )
+
+
+def _user_data_refusal() -> Response:
+    return JSONResponse(
+        status_code=403,
+        content={"detail": "Not allowed to download files with purpose 'user_data' via this relay."},
+    )
 
 
 class ActionsFileUploadRequest(BaseModel):
@@ -105,63 +224,52 @@ class ActionsFileUploadRequest(BaseModel):
     data_base64: str = Field(..., description="Base64-encoded file bytes (no data: prefix)")
 
 
+def _files_actions_max_bytes() -> int:
+    return int(getattr(get_settings(), "ACTIONS_FILE_MAX_BYTES", 512 * 1024 * 1024))
+
+
 @router.post(
     "/actions/files/upload",
     summary="Actions-friendly JSON->multipart wrapper for /v1/files",
     operation_id="actionsFilesUploadV1",
+    openapi_extra=_json_body(ActionsFileUploadRequest.model_json_schema()),
 )
-async def actions_files_upload(payload: ActionsFileUploadRequest, request: Request) -> Response:
+async def actions_files_upload(request: Request) -> Response:
     """
     Wrapper for multipart POST /v1/files:
       - Input: JSON with base64 bytes
       - Output: upstream JSON response (file object) or upstream error
+
+    The body is not parsed into ActionsFileUploadRequest up front: data_base64
+    is decoded as it streams in (app/api/upload_stream.py), and only the small
+    fields are validated against the model afterwards.
     """
-    # Size guard (base64 expands ~4/3). Keep conservative to reduce memory pressure.
-    # You can raise this later if needed.
-    max_bytes = 10 * 1024 * 1024  # 10 MiB decoded
-    try:
-        raw = base64.b64decode(payload.data_base64, validate=True)
-    except Exception as exc:
-        raise HTTPException(status_code=400, detail="Invalid base64 in data_base64") from exc
-
-    if len(raw) == 0:
-        raise HTTPException(status_code=400, detail="Empty file upload is not allowed")
-    if len(raw) > max_bytes:
-        raise HTTPException(status_code=413, detail=f"File too large for Actions wrapper (>{max_bytes} bytes)")
-
-    upstream_path = "/v1/files"
-    upstream_url = build_upstream_url(upstream_path, request=request)
-
-    # Build auth + org/project headers; do NOT set Content-Type (httpx will set multipart boundary)
-    headers = build_outbound_headers(
-        inbound_headers=request.headers,
-        content_type=None,
-        forward_accept=True,
-        path_hint=upstream_path,
+    upload = await spool_base64_field(
+        request, "data_base64", max_bytes=_files_actions_max_bytes(), label="file upload"
     )
+    try:
+        payload = ActionsFileUploadRequest.model_validate(upload.fields)
+    except ValidationError as exc:
+        upload.close()
+        raise RequestValidationError(exc.errors(include_url=False)) from exc
 
-    settings = get_settings()
-    timeout_s = float(getattr(settings, "timeout_seconds", 60.0) or 60.0)
-    client = get_async_httpx_client(timeout=timeout_s)
+    return await _upload_file(
+        request, upload, purpose=payload.purpose, filename=payload.filename, mime_type=payload.mime_type
+    )
 
-    files = {
-        "file": (payload.filename, raw, payload.mime_type),
-    }
-    data = {
-        "purpose": payload.purpose,
-    }
 
-    try:
-        resp = await client.post(upstream_url, headers=headers, data=data, files=files)
-    except httpx.TimeoutException as exc:
-        raise HTTPException(status_code=504, detail="Upstream timeout while uploading file") from exc
-    except httpx.HTTPError as exc:
-        raise HTTPException(status_code=502, detail=f"Upstream HTTP error while uploading file: {exc!r}") from exc
-
-    # Return upstream response as-is (JSON error bodies included)
-    return Response(
-        content=resp.content,
-        status_code=resp.status_code,
-        media_type=resp.headers.get("content-type"),
-        headers=_filter_response_headers(resp.headers),
-    )
+@router.post(
+    "/actions/files/upload:raw",
+    summary="Binary sibling of /v1/actions/files/upload (application/octet-stream body)",
+    operation_id="actionsFilesUploadRawV1",
+    openapi_extra=OCTET_STREAM_BODY,
+)
+async def actions_files_upload_raw(
+    request: Request,
+    purpose: str = Query(..., description="Upstream file purpose (e.g. assistants)"),
+    filename: str = Query(..., description="Original filename (e.g. doc.pdf)"),
+    mime_type: str = Query("application/octet-stream", description="MIME type of the file"),
+) -> Response:
+    """Same upload, with the file bytes as the request body instead of base64 JSON."""
+    upload = await spool_raw_body(request, max_bytes=_files_actions_max_bytes(), label="file upload")
+    return await _upload_file(request, upload, purpose=purpose, filename=filename, mime_type=mime_type)
@@ -6,6 +6,7 @@ from typing import Any, Dict
 from fastapi import APIRouter
 
 from app.core.config import settings
+from app.utils import metrics
 
 router = APIRouter(tags=["health"])
 
@@ -61,3 +62,9 @@ async def health() -> Dict[str, Any]:
 @router.get("/v1/health")
 async def v1_health() -> Dict[str, Any]:
     return _health_payload()
+
+
+@router.get("/v1/metrics")
+async def v1_metrics() -> Dict[str, Any]:
+    """Cumulative relay counters (cache hits, bytes saved, ...) since process start."""
+    return {"object": "metrics", **metrics.snapshot()}
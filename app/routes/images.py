@@ -1,9 +1,11 @@
 # app/api/images.py
 from __future__ import annotations
 
+import asyncio
 import base64
 import json
-from typing import Any, Dict, List, Optional, Tuple
+import os
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import httpx
@@ -11,9 +13,12 @@ from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel, Field
 from starlette.responses import Response
 
+from app.api import image_blobs, image_normalize
 from app.api.action_schemas import IMAGES_GENERATIONS_BODY
 from app.api.forward_openai import build_upstream_url, forward_openai_request
+from app.api.upload_stream import SpooledUpload, _new_spool, multipart_from_spools
 from app.core.config import get_settings
+from app.core.http_client import get_async_httpx_client, get_download_httpx_client
 from app.utils.logger import relay_log as logger
 
 router = APIRouter(prefix="/v1", tags=["images"])
@@ -107,30 +112,138 @@ def _validate_download_url(url: str) -> None:
     raise HTTPException(status_code=400, detail="Refusing to fetch file URL from an untrusted host")
 
 
-async def _download_bytes(url: str) -> bytes:
+async def _download_to_spool(url: str, *, label: str) -> SpooledUpload:
+    """Stream an allow-listed download into a spool on the pooled download client."""
     _validate_download_url(url)
 
-    timeout = httpx.Timeout(20.0, connect=10.0)
-    limits = httpx.Limits(max_keepalive_connections=5, max_connections=10)
+    client = get_download_httpx_client()
+    upload = SpooledUpload(file=_new_spool())
+    try:
+        async with client.stream("GET", url, headers={"Accept": "application/octet-stream"}) as resp:
+            if resp.status_code != 200:
+                raise HTTPException(status_code=400, detail=f"Failed to download file (HTTP {resp.status_code})")
+            async for chunk in resp.aiter_bytes():
+                await _write_image_chunk(upload, chunk)
+    except httpx.HTTPError as exc:
+        upload.close()
+        raise HTTPException(status_code=400, detail=f"Failed to download {label}: {type(exc).__name__}") from exc
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+
+def _input_limit() -> int:
+    # Normalisation recompresses to 4 MB itself, so it can accept larger originals.
+    return image_normalize.max_input_bytes() if image_normalize.enabled() else _MAX_IMAGE_BYTES
+
+
+async def _write_image_chunk(upload: SpooledUpload, chunk: bytes) -> None:
+    upload.size += len(chunk)
+    limit = _input_limit()
+    if upload.size > limit:
+        raise HTTPException(status_code=400, detail=f"Image exceeds {limit // (1024 * 1024)} MB limit")
+    # Past its memory threshold the spool is on disk.
+    await asyncio.to_thread(upload.file.write, chunk)
+
+
+async def _base64_to_spool(value: str, *, field: str) -> SpooledUpload:
+    try:
+        data = base64.b64decode(value, validate=True)
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid {field}: {exc}") from exc
+    upload = SpooledUpload(file=_new_spool())
+    try:
+        await _write_image_chunk(upload, data)
+    except BaseException:
+        upload.close()
+        raise
+    return upload
 
-    async with (
-        httpx.AsyncClient(timeout=timeout, limits=limits, follow_redirects=False) as client,
-        client.stream("GET", url, headers={"Accept": "application/octet-stream"}) as resp,
-    ):
-        if resp.status_code != 200:
-            raise HTTPException(status_code=400, detail=f"Failed to download file (HTTP {resp.status_code})")
 
-        buf = bytearray()
-        async for chunk in resp.aiter_bytes():
-            buf.extend(chunk)
-            if len(buf) > _MAX_IMAGE_BYTES:
-                raise HTTPException(status_code=400, detail="Image exceeds 4 MB limit")
-        return bytes(buf)
+def _ensure_png(upload: SpooledUpload, *, label: str) -> None:
+    upload.file.seek(0)
+    magic = upload.file.read(len(_PNG_MAGIC))
+    if magic != _PNG_MAGIC:
+        raise HTTPException(status_code=400, detail=f"Uploaded {label} must be a PNG")
 
 
-def _ensure_png(data: bytes, *, label: str) -> None:
-    if not data.startswith(_PNG_MAGIC):
-        raise HTTPException(status_code=400, detail=f"Uploaded {label} must be a PNG")
+async def _normalized_spool(upload: SpooledUpload, *, label: str, **params: Any) -> Tuple[SpooledUpload, Tuple[int, int]]:
+    """A new spool holding `upload` normalised to PNG (image_normalize), plus its size."""
+    upload.file.seek(0)
+    data = await asyncio.to_thread(upload.file.read)
+    try:
+        png, dims = await image_normalize.normalize(data, **params)
+    except image_normalize.ImageRejected as exc:
+        raise HTTPException(status_code=400, detail=f"Uploaded {label} {exc}") from None
+    out = SpooledUpload(file=_new_spool(), size=len(png))
+    await asyncio.to_thread(out.file.write, png)
+    return out, dims
+
+
+async def _prepare_inputs(
+    image: SpooledUpload,
+    mask: Optional[SpooledUpload],
+    *,
+    square: bool,
+    size: Optional[str],
+) -> Tuple[SpooledUpload, Optional[SpooledUpload]]:
+    """Make image (and mask) acceptable upstream; the spools passed in are always closed on failure.
+
+    With normalisation off this is the PNG check alone. Otherwise each input is
+    converted in the process pool, and the mask is sized to the final image.
+    """
+    if not image_normalize.enabled():
+        try:
+            _ensure_png(image, label="image")
+            if mask is not None:
+                _ensure_png(mask, label="mask")
+        except HTTPException:
+            for upload in (image, mask):
+                if upload is not None:
+                    upload.close()
+            raise
+        return image, mask
+
+    max_side = image_normalize.target_side(size, square=square)
+    try:
+        new_image, dims = await _normalized_spool(image, label="image", square=square, max_side=max_side)
+    except BaseException:
+        if mask is not None:
+            mask.close()
+        raise
+    finally:
+        image.close()
+    if mask is None:
+        return new_image, None
+    try:
+        new_mask, _ = await _normalized_spool(
+            mask, label="mask", square=square, max_side=max_side, is_mask=True, match_size=dims
+        )
+    except BaseException:
+        new_image.close()
+        raise
+    finally:
+        mask.close()
+    return new_image, new_mask
+
+
+def _png_name(name: str) -> str:
+    return f"{os.path.splitext(name)[0] or 'image'}.png"
+
+
+async def _gather_spools(*sources: Optional[Awaitable[SpooledUpload]]) -> List[Optional[SpooledUpload]]:
+    """Await the given downloads concurrently; on any failure close the rest and re-raise."""
+    pending = [src for src in sources if src is not None]
+    results = await asyncio.gather(*pending, return_exceptions=True)
+    failure = next((r for r in results if isinstance(r, BaseException)), None)
+    if failure is not None:
+        for r in results:
+            if isinstance(r, SpooledUpload):
+                r.close()
+        raise failure
+    it = iter(results)
+    return [None if src is None else next(it) for src in sources]
 
 
 def _as_str_form_value(value: Any) -> str:
@@ -157,56 +270,81 @@ def _upstream_headers() -> Dict[str, str]:
     return headers
 
 
+ImageParts = List[Tuple[str, str, str, SpooledUpload]]
+
+
 async def _post_multipart_to_upstream(
+    request: Request,
     *,
     endpoint_path: str,  # must include /v1/...
-    files: Dict[str, Tuple[str, bytes, str]],
+    files: ImageParts,
     data: Dict[str, str],
 ) -> Response:
+    """POST the spooled images as multipart on the shared upstream client; closes the spools."""
     upstream_url = build_upstream_url(endpoint_path)
-    timeout = httpx.Timeout(60.0, connect=10.0)
-    limits = httpx.Limits(max_keepalive_connections=10, max_connections=20)
-
-    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
-        resp = await client.post(
-            upstream_url,
-            headers=_upstream_headers(),
-            data=data,
-            files=files,
-        )
+    form_headers, body = multipart_from_spools(files, data)
+    headers = {**_upstream_headers(), **form_headers}
+
+    offload = image_blobs.enabled()
+    client = get_async_httpx_client()
+    req = client.build_request(
+        "POST", upstream_url, headers=headers, content=body, timeout=httpx.Timeout(60.0, connect=10.0)
+    )
+    try:
+        resp = await client.send(req, stream=offload)
+    finally:
+        for _, _, _, upload in files:
+            upload.close()
+
+    if offload:
+        return await image_blobs.offload_response(request, resp)
 
     content_type = resp.headers.get("content-type", "application/json")
     return Response(content=resp.content, status_code=resp.status_code, media_type=content_type)
 
 
-async def _build_variations_multipart(payload: ImagesVariationsJSON) -> Tuple[Dict[str, Tuple[str, bytes, str]], Dict[str, str]]:
-    image_bytes: Optional[bytes] = None
+def _image_source(
+    ref: Optional[OpenAIFileIdRef],
+    url: Optional[str],
+    b64: Optional[str],
+    *,
+    label: str,
+) -> Optional[Awaitable[SpooledUpload]]:
+    """The coroutine that produces `label` from the first input given: file ref, URL, then base64."""
+    if ref is not None:
+        if not ref.download_link:
+            return None
+        return _download_to_spool(ref.download_link, label=label)
+    if url:
+        return _download_to_spool(url, label=label)
+    if b64:
+        return _decode_base64(b64, field=f"{label}_base64")
+    return None
+
+
+async def _decode_base64(value: str, *, field: str) -> SpooledUpload:
+    return await _base64_to_spool(value, field=field)
+
+
+async def _build_variations_multipart(payload: ImagesVariationsJSON) -> Tuple[ImageParts, Dict[str, str]]:
     image_name = "image.png"
+    first: Optional[OpenAIFileIdRef] = None
 
     # Prefer Actions file refs
     if payload.openaiFileIdRefs:
         first = payload.openaiFileIdRefs[0]
         if not first.download_link:
             raise HTTPException(status_code=400, detail="openaiFileIdRefs[0].download_link is required")
-        image_bytes = await _download_bytes(first.download_link)
         image_name = first.name or image_name
 
-    # Fallbacks
-    if image_bytes is None and payload.image_url:
-        image_bytes = await _download_bytes(payload.image_url)
-
-    if image_bytes is None and payload.image_base64:
-        try:
-            image_bytes = base64.b64decode(payload.image_base64, validate=True)
-        except Exception as exc:
-            raise HTTPException(status_code=400, detail=f"Invalid image_base64: {exc}") from exc
-
-    if image_bytes is None:
+    (image,) = await _gather_spools(_image_source(first, payload.image_url, payload.image_base64, label="image"))
+    if image is None:
         raise HTTPException(status_code=400, detail="Missing image input")
 
-    _ensure_png(image_bytes, label="image")
+    # Variations exist only for dall-e-2, which takes square inputs.
+    image, _ = await _prepare_inputs(image, None, square=True, size=payload.size)
 
-    files = {"image": (image_name, image_bytes, "image/png")}
+    files: ImageParts = [("image", _png_name(image_name), "image/png", image)]
 
     form: Dict[str, str] = {}
     for k in ["model", "n", "size", "response_format", "user"]:
@@ -217,55 +355,39 @@ async def _build_variations_multipart(payload: ImagesVariationsJSON) -> Tuple[Di
     return files, form
 
 
-async def _build_edits_multipart(payload: ImagesEditsJSON) -> Tuple[Dict[str, Tuple[str, bytes, str]], Dict[str, str]]:
-    image_bytes: Optional[bytes] = None
+async def _build_edits_multipart(payload: ImagesEditsJSON) -> Tuple[ImageParts, Dict[str, str]]:
     image_name = "image.png"
-
-    mask_bytes: Optional[bytes] = None
     mask_name = "mask.png"
+    first: Optional[OpenAIFileIdRef] = None
+    second: Optional[OpenAIFileIdRef] = None
 
     if payload.openaiFileIdRefs:
         first = payload.openaiFileIdRefs[0]
         if not first.download_link:
             raise HTTPException(status_code=400, detail="openaiFileIdRefs[0].download_link is required")
-        image_bytes = await _download_bytes(first.download_link)
         image_name = first.name or image_name
 
-        if len(payload.openaiFileIdRefs) > 1:
+        if len(payload.openaiFileIdRefs) > 1 and payload.openaiFileIdRefs[1].download_link:
             second = payload.openaiFileIdRefs[1]
-            if second.download_link:
-                mask_bytes = await _download_bytes(second.download_link)
-                mask_name = second.name or mask_name
-
-    if image_bytes is None and payload.image_url:
-        image_bytes = await _download_bytes(payload.image_url)
-
-    if image_bytes is None and payload.image_base64:
-        try:
-            image_bytes = base64.b64decode(payload.image_base64, validate=True)
-        except Exception as exc:
-            raise HTTPException(status_code=400, detail=f"Invalid image_base64: {exc}") from exc
-
-    if image_bytes is None:
+            mask_name = second.name or mask_name
+
+    # Image and mask are fetched concurrently: one round trip, not two.
+    image, mask = await _gather_spools(
+        _image_source(first, payload.image_url, payload.image_base64, label="image"),
+        _image_source(second, payload.mask_url, payload.mask_base64, label="mask"),
+    )
+    if image is None:
+        if mask is not None:
+            mask.close()
         raise HTTPException(status_code=400, detail="Missing image input")
 
-    _ensure_png(image_bytes, label="image")
-
-    if mask_bytes is None and payload.mask_url:
-        mask_bytes = await _download_bytes(payload.mask_url)
-
-    if mask_bytes is None and payload.mask_base64:
-        try:
-            mask_bytes = base64.b64decode(payload.mask_base64, validate=True)
-        except Exception as exc:
-            raise HTTPException(status_code=400, detail=f"Invalid mask_base64: {exc}") from exc
-
-    if mask_bytes is not None:
-        _ensure_png(mask_bytes, label="mask")
+    # dall-e-2 (the default edits model) takes square inputs; gpt-image models do not.
+    square = payload.model in (None, "dall-e-2")
+    image, mask = await _prepare_inputs(image, mask, square=square, size=payload.size)
 
-    files: Dict[str, Tuple[str, bytes, str]] = {"image": (image_name, image_bytes, "image/png")}
-    if mask_bytes is not None:
-        files["mask"] = (mask_name, mask_bytes, "image/png")
+    files: ImageParts = [("image", _png_name(image_name), "image/png", image)]
+    if mask is not None:
+        files.append(("mask", _png_name(mask_name), "image/png", mask))
 
     form: Dict[str, str] = {}
     for k in ["prompt", "model", "n", "size", "response_format", "user"]:
@@ -276,6 +398,12 @@ async def _build_edits_multipart(payload: ImagesEditsJSON) -> Tuple[Dict[str, Tu
     return files, form
 
 
+async def _forward_images(request: Request, *, upstream_path: Optional[str] = None) -> Response:
+    if image_blobs.enabled():
+        return await image_blobs.forward_offloaded(request, upstream_path=upstream_path)
+    return await forward_openai_request(request, upstream_path=upstream_path)
+
+
 # --- Standard images routes ---
 
 
@@ -286,7 +414,7 @@ async def _build_edits_multipart(payload: ImagesEditsJSON) -> Tuple[Dict[str, Tu
 )
 async def create_image(request: Request) -> Response:
     logger.info("→ [images] %s %s", request.method, request.url.path)
-    return await forward_openai_request(request)
+    return await _forward_images(request)
 
 
 @router.post(
@@ -308,7 +436,7 @@ async def create_image_legacy(request: Request) -> Response:
     Rewritten to the canonical path, the same way /videos/generations is.
     """
     logger.info("→ [images.legacy] %s %s", request.method, request.url.path)
-    return await forward_openai_request(request, upstream_path="/v1/images/generations")
+    return await _forward_images(request, upstream_path="/v1/images/generations")
 
 
 @router.post(
@@ -326,12 +454,12 @@ async def variations_image(request: Request) -> Response:
     logger.info("→ [images] %s %s", request.method, request.url.path)
 
     if _is_multipart(request):
-        return await forward_openai_request(request)
+        return await _forward_images(request)
 
     body = await request.json()
     payload = ImagesVariationsJSON.model_validate(body)
     files, form = await _build_variations_multipart(payload)
-    return await _post_multipart_to_upstream(endpoint_path="/v1/images/variations", files=files, data=form)
+    return await _post_multipart_to_upstream(request, endpoint_path="/v1/images/variations", files=files, data=form)
 
 
 @router.post(
@@ -349,24 +477,34 @@ async def edit_image(request: Request) -> Response:
     logger.info("→ [images] %s %s", request.method, request.url.path)
 
     if _is_multipart(request):
-        return await forward_openai_request(request)
+        return await _forward_images(request)
 
     body = await request.json()
     payload = ImagesEditsJSON.model_validate(body)
     files, form = await _build_edits_multipart(payload)
-    return await _post_multipart_to_upstream(endpoint_path="/v1/images/edits", files=files, data=form)
+    return await _post_multipart_to_upstream(request, endpoint_path="/v1/images/edits", files=files, data=form)
+
+
+@router.get(
+    "/images/blobs/{blob_id}",
+    summary="Download an offloaded image (signed URL from a b64_json response)",
+    include_in_schema=False,
+)
+def get_image_blob(blob_id: str, expires: str = "", sig: str = "") -> Response:
+    # No relay key needed: the signature in the URL is the credential (see app/api/image_blobs.py).
+    return image_blobs.serve_blob(blob_id, expires, sig)
 
 
 # --- Actions-friendly aliases with clean JSON schemas ---
 
 
 @actions_router.post("/variations", summary="Actions JSON wrapper for image variations")
-async def actions_variations(payload: ImagesVariationsJSON) -> Response:
+async def actions_variations(payload: ImagesVariationsJSON, request: Request) -> Response:
     files, form = await _build_variations_multipart(payload)
-    return await _post_multipart_to_upstream(endpoint_path="/v1/images/variations", files=files, data=form)
+    return await _post_multipart_to_upstream(request, endpoint_path="/v1/images/variations", files=files, data=form)
 
 
 @actions_router.post("/edits", summary="Actions JSON wrapper for image edits")
-async def actions_edits(payload: ImagesEditsJSON) -> Response:
+async def actions_edits(payload: ImagesEditsJSON, request: Request) -> Response:
     files, form = await _build_edits_multipart(payload)
-    return await _post_multipart_to_upstream(endpoint_path="/v1/images/edits", files=files, data=form)
+    return await _post_multipart_to_upstream(request, endpoint_path="/v1/images/edits", files=files, data=form)
@@ -1,12 +1,21 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import re
-from typing import Any, Dict, Optional, Set, Tuple
+from typing import Any, AsyncIterator, Dict, List, Literal, Mapping, Optional, Set, Tuple
 
 from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import AliasChoices, BaseModel, ConfigDict, Field, model_validator
 
-from app.api.forward_openai import forward_openai_method_path
+from app.api.forward_openai import forward_openai_method_path, inherited_headers
+from app.core.config import get_settings
+from app.utils.error_handler import base_error_payload
+from app.utils.logger import get_logger
+from app.utils.path_trie import Decision, PathPolicy
+
+logger = get_logger(__name__)
 
 router = APIRouter(prefix="/v1", tags=["proxy"])
 
@@ -60,104 +69,113 @@ _BLOCKED_PATHS: Set[str] = {
     "/v1/responses:stream",
 }
 
+# Matched against the last path segment.
 _BLOCKED_SUFFIXES: Tuple[str, ...] = (
     "/content",
     "/results",
 )
 
-_BLOCKED_METHOD_PATH_REGEX: Set[Tuple[str, re.Pattern[str]]] = {
-    ("POST", re.compile(r"^/v1/files$")),
-    ("POST", re.compile(r"^/v1/images/(edits|variations)$")),
-    ("POST", re.compile(r"^/v1/videos$")),  # create video is multipart/form-data
-}
+_BLOCKED_METHOD_PATHS: Tuple[Tuple[str, str], ...] = (
+    ("POST", "/v1/files"),
+    ("POST", "/v1/images/edits"),
+    ("POST", "/v1/images/variations"),
+    ("POST", "/v1/videos"),  # create video is multipart/form-data
+)
 
-# Allowlist: (methods, regex)
-_ALLOWLIST: Tuple[Tuple[Set[str], re.Pattern[str]], ...] = (
+# Allowlist: (methods, pattern). `{id}` is one [A-Za-z0-9_-]+ segment and
+# `{seg}` any one non-empty segment (see app/utils/path_trie.py).
+_ALLOWLIST: Tuple[Tuple[Tuple[str, ...], str], ...] = (
     # ---- Responses (JSON) ----
-    ({"POST"}, re.compile(r"^/v1/responses$")),
-    ({"POST"}, re.compile(r"^/v1/responses/compact$")),
-    ({"GET"}, re.compile(r"^/v1/responses/[A-Za-z0-9_-]+$")),
-    ({"DELETE"}, re.compile(r"^/v1/responses/[A-Za-z0-9_-]+$")),
-    ({"POST"}, re.compile(r"^/v1/responses/[A-Za-z0-9_-]+/cancel$")),
-    ({"GET"}, re.compile(r"^/v1/responses/[A-Za-z0-9_-]+/input_items$")),
-    ({"POST"}, re.compile(r"^/v1/responses/input_tokens$")),
+    (("POST",), "/v1/responses"),
+    (("POST",), "/v1/responses/compact"),
+    (("GET", "DELETE"), "/v1/responses/{id}"),
+    (("POST",), "/v1/responses/{id}/cancel"),
+    (("GET",), "/v1/responses/{id}/input_items"),
+    (("POST",), "/v1/responses/input_tokens"),
 
     # ---- Chat Completions (JSON, supports streaming) ----
-    ({"POST"}, re.compile(r"^/v1/chat/completions$")),
+    (("POST",), "/v1/chat/completions"),
 
     # ---- Moderations (JSON) ----
-    ({"POST"}, re.compile(r"^/v1/moderations$")),
+    (("POST",), "/v1/moderations"),
 
     # ---- Embeddings (JSON) ----
-    ({"POST"}, re.compile(r"^/v1/embeddings$")),
+    (("POST",), "/v1/embeddings"),
 
     # ---- Models (JSON) ----
-    ({"GET"}, re.compile(r"^/v1/models$")),
-    ({"GET"}, re.compile(r"^/v1/models/[^/]+$")),
+    (("GET",), "/v1/models"),
+    (("GET",), "/v1/models/{seg}"),
 
     # ---- Images (JSON only: generations) ----
-    ({"POST"}, re.compile(r"^/v1/images/generations$")),
-    ({"POST"}, re.compile(r"^/v1/images$")),
+    (("POST",), "/v1/images/generations"),
+    (("POST",), "/v1/images"),
 
     # ---- Videos (metadata only via proxy; content is binary, create is multipart) ----
-    ({"GET"}, re.compile(r"^/v1/videos$")),
-    ({"GET"}, re.compile(r"^/v1/videos/[^/]+$")),
-    ({"DELETE"}, re.compile(r"^/v1/videos/[^/]+$")),
+    (("GET",), "/v1/videos"),
+    (("GET", "DELETE"), "/v1/videos/{seg}"),
 
     # ---- Vector Stores (JSON) ----
-    ({"GET"}, re.compile(r"^/v1/vector_stores$")),
-    ({"POST"}, re.compile(r"^/v1/vector_stores$")),
-    ({"PUT"}, re.compile(r"^/v1/vector_stores$")),
-    ({"PATCH"}, re.compile(r"^/v1/vector_stores$")),
-    ({"DELETE"}, re.compile(r"^/v1/vector_stores$")),
-    ({"GET"}, re.compile(r"^/v1/vector_stores/[^/]+$")),
-    ({"POST"}, re.compile(r"^/v1/vector_stores/[^/]+$")),
-    ({"DELETE"}, re.compile(r"^/v1/vector_stores/[^/]+$")),
-    ({"POST"}, re.compile(r"^/v1/vector_stores/[^/]+/search$")),
-    ({"PUT"}, re.compile(r"^/v1/vector_stores/[^/]+$")),
-    ({"PATCH"}, re.compile(r"^/v1/vector_stores/[^/]+$")),
-    
+    (("GET", "POST", "PUT", "PATCH", "DELETE"), "/v1/vector_stores"),
+    (("GET", "POST", "PUT", "PATCH", "DELETE"), "/v1/vector_stores/{seg}"),
+    (("POST",), "/v1/vector_stores/{seg}/search"),
+
     # vector store files
-    ({"POST"}, re.compile(r"^/v1/vector_stores/[^/]+/files$")),
-    ({"GET"}, re.compile(r"^/v1/vector_stores/[^/]+/files$")),
-    ({"GET"}, re.compile(r"^/v1/vector_stores/[^/]+/files/[^/]+$")),
-    ({"POST"}, re.compile(r"^/v1/vector_stores/[^/]+/files/[^/]+$")),
-    ({"DELETE"}, re.compile(r"^/v1/vector_stores/[^/]+/files/[^/]+$")),
+    (("GET", "POST"), "/v1/vector_stores/{seg}/files"),
+    (("GET", "POST", "DELETE"), "/v1/vector_stores/{seg}/files/{seg}"),
 
     # vector store file batches
-    ({"POST"}, re.compile(r"^/v1/vector_stores/[^/]+/file_batches$")),
-    ({"GET"}, re.compile(r"^/v1/vector_stores/[^/]+/file_batches/[^/]+$")),
-    ({"POST"}, re.compile(r"^/v1/vector_stores/[^/]+/file_batches/[^/]+/cancel$")),
-    ({"GET"}, re.compile(r"^/v1/vector_stores/[^/]+/file_batches/[^/]+/files$")),
+    (("POST",), "/v1/vector_stores/{seg}/file_batches"),
+    (("GET",), "/v1/vector_stores/{seg}/file_batches/{seg}"),
+    (("POST",), "/v1/vector_stores/{seg}/file_batches/{seg}/cancel"),
+    (("GET",), "/v1/vector_stores/{seg}/file_batches/{seg}/files"),
 
     # ---- Containers (JSON control plane only) ----
-    ({"GET"}, re.compile(r"^/v1/containers$")),
-    ({"POST"}, re.compile(r"^/v1/containers$")),
-    ({"GET"}, re.compile(r"^/v1/containers/[^/]+$")),
-    ({"DELETE"}, re.compile(r"^/v1/containers/[^/]+$")),
+    (("GET", "POST"), "/v1/containers"),
+    (("GET", "DELETE"), "/v1/containers/{seg}"),
 
     # ---- Conversations (JSON) ----
-    ({"POST"}, re.compile(r"^/v1/conversations$")),
-    ({"GET"}, re.compile(r"^/v1/conversations$")),
-    ({"GET"}, re.compile(r"^/v1/conversations/[^/]+$")),
-    ({"POST"}, re.compile(r"^/v1/conversations/[^/]+$")),
-    ({"DELETE"}, re.compile(r"^/v1/conversations/[^/]+$")),
+    (("GET", "POST"), "/v1/conversations"),
+    (("GET", "POST", "DELETE"), "/v1/conversations/{seg}"),
 
     # ---- Files (JSON metadata only; content is binary; create is multipart) ----
-    ({"GET"}, re.compile(r"^/v1/files$")),
-    ({"GET"}, re.compile(r"^/v1/files/[A-Za-z0-9_-]+$")),
-    ({"DELETE"}, re.compile(r"^/v1/files/[A-Za-z0-9_-]+$")),
-    ({"GET"}, re.compile(r"^/v1/files/[A-Za-z0-9_-]+$")),
-    ({"DELETE"}, re.compile(r"^/v1/files/[A-Za-z0-9_-]+$")),
-    
+    (("GET",), "/v1/files"),
+    (("GET", "DELETE"), "/v1/files/{id}"),
+
     # ---- Batches (JSON) ----
-    ({"GET"}, re.compile(r"^/v1/batches$")),
-    ({"POST"}, re.compile(r"^/v1/batches$")),
-    ({"GET"}, re.compile(r"^/v1/batches/[^/]+$")),
-    ({"POST"}, re.compile(r"^/v1/batches/[^/]+/cancel$")),
+    (("GET", "POST"), "/v1/batches"),
+    (("GET",), "/v1/batches/{seg}"),
+    (("POST",), "/v1/batches/{seg}/cancel"),
 )
 
 
+def _compile_policy() -> PathPolicy:
+    """
+    Everything above as one segment trie, built once at import.
+
+    Prefixes block whole segments (`/v1/audio` blocks `/v1/audio/...`, not
+    `/v1/audiobooks`). Nothing allowlisted sat between the two readings, so
+    no decision changed; only a rejected path's stated reason can.
+    """
+    policy = PathPolicy(not_allowed_reason="method/path not allowlisted for /v1/proxy")
+    for path in _BLOCKED_PATHS:
+        policy.block_path(path)
+    for prefix in _BLOCKED_PREFIXES:
+        policy.block_prefix(prefix)
+    for suffix in _BLOCKED_SUFFIXES:
+        policy.block_last_segment(suffix.lstrip("/"))
+    for method, path in _BLOCKED_METHOD_PATHS:
+        policy.block_method_path((method,), path, "multipart endpoint blocked via /v1/proxy")
+    for methods, pattern in _ALLOWLIST:
+        policy.allow(methods, pattern)
+    return policy
+
+
+_POLICY = _compile_policy()
+
+_REPEATED_SLASHES = re.compile(r"/{2,}")
+_ILLEGAL_IN_PATH = re.compile(r"[:#\s]|\.\.")
+
+
 def _normalize_path(path: str) -> str:
     p = (path or "").strip()
     if not p:
@@ -179,16 +197,18 @@ def _normalize_path(path: str) -> str:
     else:
         normalized = "/v1" + p
 
-    while "//" in normalized:
-        normalized = normalized.replace("//", "/")
+    return _REPEATED_SLASHES.sub("/", normalized)
 
-    return normalized
 
-
-def _blocked_reason(method: str, path: str, body: Any) -> Optional[str]:
+def _precheck_reason(path: str, body: Any) -> Optional[str]:
+    """Checks on the request itself, before any rule is consulted."""
     if isinstance(body, dict) and body.get("stream") is True:
         return "stream=true is not allowed via /v1/proxy (use explicit streaming route)"
 
+    # One scan for the common case (a clean path); the checks below only name the problem.
+    if not _ILLEGAL_IN_PATH.search(path):
+        return None
+
     if ":" in path:
         return "':' paths are not allowed via /v1/proxy"
 
@@ -197,42 +217,159 @@ def _blocked_reason(method: str, path: str, body: Any) -> Optional[str]:
     if any(ch.isspace() for ch in path):
         return "path must not contain whitespace"
 
-    if path in _BLOCKED_PATHS:
-        return "path is blocked"
+    return None
 
-    for prefix in _BLOCKED_PREFIXES:
-        if path.startswith(prefix):
-            return f"blocked prefix: {prefix}"
 
-    for suffix in _BLOCKED_SUFFIXES:
-        if path.endswith(suffix):
-            return f"blocked suffix: {suffix}"
+def explain(method: str, path: str, body: Any = None) -> Decision:
+    """Why /v1/proxy would forward or refuse (method, path, body). `path` is normalized."""
+    reason = _precheck_reason(path, body)
+    if reason:
+        return Decision(False, reason, blocked=True)
+    return _POLICY.decide(method, path)
 
-    for (m, rx) in _BLOCKED_METHOD_PATH_REGEX:
-        if method == m and rx.match(path):
-            return "multipart endpoint blocked via /v1/proxy"
 
-    return None
+class ProxyBatchRequest(BaseModel):
+    """Several /v1/proxy envelopes, executed concurrently."""
 
+    model_config = ConfigDict(extra="forbid")
 
-def _is_allowlisted(method: str, path: str) -> bool:
-    return any(method in methods and rx.match(path) for methods, rx in _ALLOWLIST)
+    requests: List[ProxyRequest] = Field(..., min_length=1, description="Proxy envelopes, as for POST /v1/proxy")
+    concurrency: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="Max calls in flight (capped by PROXY_BATCH_CONCURRENCY)",
+    )
+    format: Optional[Literal["json", "ndjson"]] = Field(
+        default=None,
+        description="json: array in input order. ndjson: one line per call, in completion order. "
+        "Defaults to ndjson when Accept asks for application/x-ndjson.",
+    )
 
 
-@router.post("/proxy")
-async def proxy(call: ProxyRequest, request: Request) -> Response:
+def check_proxy_call(call: ProxyRequest) -> Tuple[str, str]:
+    """The envelope's (method, normalized path), or the HTTPException /v1/proxy would raise."""
     method = (call.method or "").strip().upper()
     if method not in _ALLOWED_METHODS:
         raise HTTPException(status_code=400, detail=f"Unsupported method: {call.method}")
 
     path = _normalize_path(call.path)
 
-    reason = _blocked_reason(method, path, call.body)
-    if reason:
-        raise HTTPException(status_code=403, detail={"error": reason})
+    decision = explain(method, path, call.body)
+    if decision.blocked:
+        raise HTTPException(status_code=403, detail={"error": decision.reason})
+    if not decision.allowed:
+        raise HTTPException(status_code=403, detail=decision.reason)
+    return method, path
 
-    if not _is_allowlisted(method, path):
-        raise HTTPException(status_code=403, detail="method/path not allowlisted for /v1/proxy")
+
+def _item_body(raw: bytes) -> Any:
+    try:
+        return json.loads(raw)
+    except (ValueError, UnicodeDecodeError):
+        return raw.decode("utf-8", errors="replace")
+
+
+async def execute_proxy_call(call: ProxyRequest, inbound_headers: Mapping[str, str]) -> Tuple[int, Any]:
+    """
+    Run one envelope as /v1/proxy would and return (status, parsed body).
+
+    Relay-side refusals and transport failures come back as their status with
+    the relay error payload instead of raising, so a caller running many calls
+    can record each outcome. Anything unexpected is logged and becomes a 500
+    for this call alone.
+    """
+    try:
+        method, path = check_proxy_call(call)
+        resp = await forward_openai_method_path(
+            method=method,
+            path=path,
+            query=call.query,
+            json_body=call.body,
+            inbound_headers=inbound_headers,
+        )
+    except HTTPException as exc:
+        detail = exc.detail
+        message = detail.get("error") if isinstance(detail, dict) else detail
+        return exc.status_code, base_error_payload(str(message), exc.status_code)
+    except Exception as exc:
+        logger.exception("Proxy call %s %s failed", call.method, call.path)
+        return 500, base_error_payload(f"Relay error: {type(exc).__name__}", 500)
+    return resp.status_code, _item_body(bytes(getattr(resp, "body", b"")))
+
+
+def wants_ndjson(request: Request, fmt: Optional[str]) -> bool:
+    if fmt is not None:
+        return fmt == "ndjson"
+    return "application/x-ndjson" in (request.headers.get("accept") or "")
+
+
+@router.post("/proxy:batch")
+async def proxy_batch(batch: ProxyBatchRequest, request: Request) -> Response:
+    """
+    Run several /v1/proxy calls concurrently; one round trip for the caller.
+
+    Every envelope gets the same allowlist/blocklist checks as /v1/proxy, and a
+    refused or failed call only fails its own item: each result carries its
+    input `index`, upstream (or relay) `status`, and `body`.
+    """
+    settings = get_settings()
+    max_items = int(getattr(settings, "PROXY_BATCH_MAX_ITEMS", 50) or 50)
+    if len(batch.requests) > max_items:
+        raise HTTPException(status_code=400, detail=f"At most {max_items} requests per batch")
+
+    limit = int(getattr(settings, "PROXY_BATCH_CONCURRENCY", 8) or 8)
+    if batch.concurrency is not None:
+        limit = min(limit, batch.concurrency)
+    gate = asyncio.Semaphore(limit)
+
+    inbound = inherited_headers(request)
+
+    async def run(index: int, call: ProxyRequest) -> Dict[str, Any]:
+        async with gate:
+            status, body = await execute_proxy_call(call, inbound)
+        return {"index": index, "status": status, "body": body}
+
+    tasks = [asyncio.create_task(run(i, call)) for i, call in enumerate(batch.requests)]
+
+    if not wants_ndjson(request, batch.format):
+        return JSONResponse(content=list(await asyncio.gather(*tasks)))
+
+    async def lines() -> AsyncIterator[bytes]:
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield (json.dumps(await done) + "\n").encode("utf-8")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post("/proxy:explain")
+async def proxy_explain(call: ProxyRequest) -> Dict[str, Any]:
+    """
+    What /v1/proxy would do with this envelope, without calling upstream.
+
+    Returns the verdict, the reason, and the allow/block rule that decided it.
+    """
+    method = (call.method or "").strip().upper()
+    if method not in _ALLOWED_METHODS:
+        raise HTTPException(status_code=400, detail=f"Unsupported method: {call.method}")
+    path = _normalize_path(call.path)
+    decision = explain(method, path, call.body)
+    return {
+        "method": method,
+        "path": path,
+        "allowed": decision.allowed,
+        "blocked": decision.blocked,
+        "reason": decision.reason,
+        "rule": decision.rule,
+    }
+
+
+@router.post("/proxy")
+async def proxy(call: ProxyRequest, request: Request) -> Response:
+    method, path = check_proxy_call(call)
 
     return await forward_openai_method_path(
         method=method,
@@ -0,0 +1,369 @@
+"""POST /v1/proxy:chain — a small DAG of proxy calls, run server-side.
+
+Multi-step flows (create a vector store, attach a file batch, poll until it is
+ready, search it) used to be driven by the client one relay call at a time,
+poll loops included. A chain sends the whole flow in one request:
+
+    {
+      "mode": "parallel",
+      "steps": [
+        {"id": "vs", "method": "POST", "path": "/v1/vector_stores", "body": {"name": "kb"}},
+        {"id": "batch", "method": "POST", "path": "/v1/vector_stores/{{vs.id}}/file_batches",
+         "body": {"file_ids": ["file-a", "file-b"]}},
+        {"id": "ready", "wait": {"path": "/v1/vector_stores/{{vs.id}}/file_batches/{{batch.id}}",
+                                 "field": "status", "success": ["completed"], "failure": ["failed", "cancelled"]}},
+        {"id": "hits", "method": "POST", "path": "/v1/vector_stores/{{vs.id}}/search",
+         "body": {"query": "refund policy"}, "depends_on": ["ready"]}
+      ]
+    }
+
+- `{{step.field[0].sub}}` (a leading `$.` is optional) refers to an earlier
+  step's response body. A string that is only a reference becomes the value
+  itself, whatever its JSON type; otherwise the value is spliced in as text.
+  References imply dependencies, and `depends_on` adds ordering without data.
+- Every call, polls included, goes through the /v1/proxy allow/block rules,
+  after references are substituted.
+- `mode` defaults to CHAIN_WAIT_MODE. "sequential" runs steps one at a time in
+  dependency order. "parallel" (or "auto") starts each step as soon as its
+  dependencies finish, bounded by PROXY_BATCH_CONCURRENCY.
+- A failed step skips everything that depends on it; independent branches run on.
+  A reference that resolves to the wrong type (say a number as `path`) fails
+  its step with 400.
+- Wait steps take a concurrency slot only for each poll, not while they sleep,
+  and keep polling through 429 and 5xx answers until their deadline.
+
+Progress streams as NDJSON (step.started / step.progress / step.completed /
+step.failed / step.skipped, then chain.completed) unless `format` is "json",
+which returns only the final summary.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List, Literal, Mapping, Optional, Set
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import AliasChoices, BaseModel, ConfigDict, Field, ValidationError, model_validator
+
+from app.api.forward_openai import inherited_headers
+from app.core.config import get_settings
+from app.routes.proxy import ProxyRequest, execute_proxy_call
+from app.utils.error_handler import base_error_payload
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+router = APIRouter(prefix="/v1", tags=["proxy"])
+
+_STEP_ID = r"[A-Za-z_][A-Za-z0-9_-]*"
+_REF = re.compile(r"\{\{\s*(?:\$\.)?(" + _STEP_ID + r")((?:\.[A-Za-z0-9_-]+|\[\d+\])*)\s*\}\}")
+_ACCESSOR = re.compile(r"\.([A-Za-z0-9_-]+)|\[(\d+)\]")
+
+# Poll answers that mean "try again later", not "the wait failed".
+_RETRYABLE_POLL_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class ChainWait(BaseModel):
+    """Poll a GET path until a field of its body reaches a terminal value."""
+
+    model_config = ConfigDict(extra="forbid")
+
+    path: str = Field(..., description="Path to poll with GET (references allowed)")
+    query: Optional[Dict[str, Any]] = Field(default=None, validation_alias=AliasChoices("query", "params"))
+    field: str = Field(..., description="Where to look in the polled body, e.g. status or file_counts.completed")
+    success: List[Any] = Field(..., min_length=1, description="Values that finish the wait")
+    failure: List[Any] = Field(default_factory=list, description="Values that fail the step at once")
+    interval: float = Field(default=2.0, ge=0.2, description="Seconds between polls")
+    timeout: float = Field(default=120.0, gt=0, description="Seconds before the step fails (capped by CHAIN_MAX_WAIT_SECONDS)")
+
+
+class ChainStep(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    id: str = Field(..., pattern=f"^{_STEP_ID}$")
+    method: Optional[str] = Field(default=None, description="HTTP method of a proxy step")
+    path: Optional[str] = Field(default=None, description="Upstream path of a proxy step")
+    query: Optional[Dict[str, Any]] = Field(default=None, validation_alias=AliasChoices("query", "params"))
+    body: Optional[Any] = Field(default=None, validation_alias=AliasChoices("body", "json", "json_body"))
+    wait: Optional[ChainWait] = None
+    depends_on: List[str] = Field(default_factory=list)
+
+    @model_validator(mode="after")
+    def _one_kind(self) -> "ChainStep":
+        if (self.wait is None) == (self.path is None):
+            raise ValueError("a step has either method/path (a proxy call) or wait (a poll), not both")
+        if self.path is not None and not self.method:
+            raise ValueError("a proxy step needs a method")
+        return self
+
+
+class ChainRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    steps: List[ChainStep] = Field(..., min_length=1)
+    mode: Optional[Literal["sequential", "parallel", "auto"]] = Field(
+        default=None, description="Defaults to CHAIN_WAIT_MODE"
+    )
+    format: Literal["json", "ndjson"] = Field(default="ndjson", description="ndjson progress, or the json summary only")
+
+
+class _StepFailed(Exception):
+    def __init__(self, status: int, body: Any) -> None:
+        super().__init__(status)
+        self.status = status
+        self.body = body
+
+
+def _refs(value: Any) -> Set[str]:
+    if isinstance(value, str):
+        return {m.group(1) for m in _REF.finditer(value)}
+    if isinstance(value, dict):
+        return set().union(*(_refs(v) for v in value.values())) if value else set()
+    if isinstance(value, list):
+        return set().union(*(_refs(v) for v in value)) if value else set()
+    return set()
+
+
+def _lookup(root: Any, accessors: str) -> Any:
+    cur = root
+    for key, index in _ACCESSOR.findall(accessors):
+        if key:
+            if not isinstance(cur, dict) or key not in cur:
+                raise KeyError(key)
+            cur = cur[key]
+        else:
+            if not isinstance(cur, list) or int(index) >= len(cur):
+                raise KeyError(f"[{index}]")
+            cur = cur[int(index)]
+    return cur
+
+
+def _substitute(value: Any, results: Mapping[str, Any]) -> Any:
+    if isinstance(value, dict):
+        return {k: _substitute(v, results) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_substitute(v, results) for v in value]
+    if not isinstance(value, str) or "{{" not in value:
+        return value
+
+    def resolve(m: "re.Match[str]") -> Any:
+        try:
+            return _lookup(results[m.group(1)], m.group(2))
+        except KeyError as exc:
+            raise _StepFailed(400, {"error": {"message": f"Unresolved reference {m.group(0)}: missing {exc}"}}) from exc
+
+    whole = _REF.fullmatch(value.strip())
+    if whole:
+        return resolve(whole)
+    def splice(m: "re.Match[str]") -> str:
+        v = resolve(m)
+        return v if isinstance(v, str) else json.dumps(v)
+
+    return _REF.sub(splice, value)
+
+
+def _proxy_request(**fields: Any) -> ProxyRequest:
+    """A substituted call as a ProxyRequest; a reference of the wrong type fails the step."""
+    try:
+        return ProxyRequest(**fields)
+    except ValidationError as exc:
+        problems = "; ".join(f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in exc.errors())
+        raise _StepFailed(400, {"error": {"message": f"Invalid call after substitution: {problems}"}}) from None
+
+
+def _dependencies(steps: List[ChainStep]) -> Dict[str, Set[str]]:
+    """Each step's prerequisites; 400 on duplicate ids, unknown references or cycles."""
+    ids = [s.id for s in steps]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Chain step ids must be unique")
+
+    deps: Dict[str, Set[str]] = {}
+    for s in steps:
+        needed = set(s.depends_on) | _refs([s.path, s.query, s.body, s.wait.model_dump() if s.wait else None])
+        unknown = needed - set(ids)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Step {s.id!r} refers to unknown steps: {sorted(unknown)}")
+        if s.id in needed:
+            raise HTTPException(status_code=400, detail=f"Step {s.id!r} depends on itself")
+        deps[s.id] = needed
+
+    remaining = {k: set(v) for k, v in deps.items()}
+    while remaining:
+        ready = [k for k, v in remaining.items() if not v]
+        if not ready:
+            raise HTTPException(status_code=400, detail=f"Chain has a dependency cycle among {sorted(remaining)}")
+        for k in ready:
+            del remaining[k]
+        for v in remaining.values():
+            v.difference_update(ready)
+    return deps
+
+
+def _topological(steps: List[ChainStep], deps: Mapping[str, Set[str]]) -> List[ChainStep]:
+    """Dependency order, keeping input order among steps that are ready together."""
+    done: Set[str] = set()
+    out: List[ChainStep] = []
+    while len(out) < len(steps):
+        for s in steps:
+            if s.id not in done and deps[s.id] <= done:
+                out.append(s)
+                done.add(s.id)
+                break
+    return out
+
+
+class _ChainRun:
+    def __init__(self, chain: ChainRequest, inbound: Mapping[str, str]) -> None:
+        settings = get_settings()
+        self.steps = chain.steps
+        self.deps = _dependencies(chain.steps)
+        mode = chain.mode or str(getattr(settings, "CHAIN_WAIT_MODE", "sequential") or "sequential").lower()
+        self.parallel = mode in {"parallel", "auto"}
+        self.inbound = inbound
+        self.max_wait = float(getattr(settings, "CHAIN_MAX_WAIT_SECONDS", 600) or 600)
+        self.gate = asyncio.Semaphore(int(getattr(settings, "PROXY_BATCH_CONCURRENCY", 8) or 8))
+        self.events: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+        self.results: Dict[str, Any] = {}
+        self.summary: Dict[str, Dict[str, Any]] = {}
+        self._done = {s.id: asyncio.Event() for s in chain.steps}
+
+    def emit(self, event: str, step_id: Optional[str] = None, **extra: Any) -> None:
+        out: Dict[str, Any] = {"event": event}
+        if step_id is not None:
+            out["id"] = step_id
+        out.update(extra)
+        self.events.put_nowait(out)
+
+    async def _send(self, call: ProxyRequest) -> Any:
+        # One gate slot per upstream call, so a wait step sleeping between polls holds none.
+        async with self.gate:
+            return await execute_proxy_call(call, self.inbound)
+
+    async def _call(self, call: ProxyRequest) -> Any:
+        status, body = await self._send(call)
+        if status >= 400:
+            raise _StepFailed(status, body)
+        return body
+
+    async def _wait(self, step_id: str, wait: ChainWait) -> Any:
+        call = _proxy_request(
+            method="GET",
+            path=_substitute(wait.path, self.results),
+            query=_substitute(wait.query, self.results),
+        )
+        deadline = time.monotonic() + min(wait.timeout, self.max_wait)
+        attempt = 0
+        while True:
+            attempt += 1
+            status, body = await self._send(call)
+            if status in _RETRYABLE_POLL_STATUS and time.monotonic() + wait.interval <= deadline:
+                # Rate limits and upstream hiccups while polling are retried until the deadline.
+                self.emit("step.progress", step_id, attempt=attempt, status=status)
+                await asyncio.sleep(wait.interval)
+                continue
+            if status >= 400:
+                raise _StepFailed(status, body)
+            try:
+                value = _lookup(body, "." + wait.field if not wait.field.startswith("[") else wait.field)
+            except KeyError:
+                value = None
+            self.emit("step.progress", step_id, attempt=attempt, value=value)
+            if value in wait.success:
+                return body
+            if value in wait.failure:
+                raise _StepFailed(409, body)
+            if time.monotonic() + wait.interval > deadline:
+                raise _StepFailed(504, {"error": {"message": f"{wait.field} was still {value!r} at the wait timeout"}})
+            await asyncio.sleep(wait.interval)
+
+    async def _execute(self, step: ChainStep) -> None:
+        failed_deps = [d for d in self.deps[step.id] if self.summary.get(d, {}).get("state") != "completed"]
+        if failed_deps:
+            self.summary[step.id] = {"state": "skipped", "because": sorted(failed_deps)}
+            self.emit("step.skipped", step.id, because=sorted(failed_deps))
+            return
+
+        started = time.monotonic()
+        self.emit("step.started", step.id)
+        try:
+            if step.wait is not None:
+                body = await self._wait(step.id, step.wait)
+            else:
+                body = await self._call(
+                    _proxy_request(
+                        method=step.method or "",
+                        path=_substitute(step.path, self.results),
+                        query=_substitute(step.query, self.results),
+                        body=_substitute(step.body, self.results),
+                    )
+                )
+        except _StepFailed as exc:
+            self._failed(step.id, started, exc.status, exc.body)
+            return
+        except Exception as exc:
+            logger.exception("Chain step %s failed", step.id)
+            self._failed(step.id, started, 500, base_error_payload(f"Relay error: {type(exc).__name__}", 500))
+            return
+
+        elapsed = int((time.monotonic() - started) * 1000)
+        self.results[step.id] = body
+        self.summary[step.id] = {"state": "completed", "body": body, "elapsed_ms": elapsed}
+        self.emit("step.completed", step.id, body=body, elapsed_ms=elapsed)
+
+    def _failed(self, step_id: str, started: float, status: int, body: Any) -> None:
+        elapsed = int((time.monotonic() - started) * 1000)
+        self.summary[step_id] = {"state": "failed", "status": status, "body": body, "elapsed_ms": elapsed}
+        self.emit("step.failed", step_id, status=status, body=body, elapsed_ms=elapsed)
+
+    async def _execute_when_ready(self, step: ChainStep) -> None:
+        try:
+            await asyncio.gather(*(self._done[d].wait() for d in self.deps[step.id]))
+            await self._execute(step)
+        finally:
+            self._done[step.id].set()
+
+    async def run(self) -> Dict[str, Any]:
+        try:
+            if self.parallel:
+                await asyncio.gather(*(self._execute_when_ready(s) for s in self.steps))
+            else:
+                for step in _topological(self.steps, self.deps):
+                    await self._execute(step)
+            ok = all(v["state"] == "completed" for v in self.summary.values())
+            final = {"event": "chain.completed", "ok": ok, "mode": "parallel" if self.parallel else "sequential"}
+            final["steps"] = {s.id: self.summary[s.id] for s in self.steps}
+            self.events.put_nowait(final)
+            return final
+        finally:
+            self.events.put_nowait(None)
+
+
+@router.post("/proxy:chain")
+async def proxy_chain(chain: ChainRequest, request: Request) -> Response:
+    """Run a DAG of /v1/proxy calls and polls server-side (see module docstring)."""
+    max_steps = int(getattr(get_settings(), "CHAIN_MAX_STEPS", 32) or 32)
+    if len(chain.steps) > max_steps:
+        raise HTTPException(status_code=400, detail=f"At most {max_steps} steps per chain")
+
+    run = _ChainRun(chain, inherited_headers(request))
+
+    if chain.format == "json":
+        return JSONResponse(content=await run.run())
+
+    async def lines() -> AsyncIterator[bytes]:
+        task = asyncio.create_task(run.run())
+        try:
+            while True:
+                event = await run.events.get()
+                if event is None:
+                    break
+                yield (json.dumps(event) + "\n").encode("utf-8")
+            await task
+        finally:
+            task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -19,6 +19,7 @@ from . import (
     images,
     models,
     proxy,
+    proxy_chain,
     responses,
     uploads,
     vector_stores,
@@ -81,6 +82,7 @@ def register_routes(app: _RouterLike) -> None:
     app.include_router(batches.router)        # /v1/batches
 
     # Generic allowlisted proxy LAST
+    app.include_router(proxy_chain.router)    # /v1/proxy:chain
     app.include_router(proxy.router)          # /v1/proxy
 
 
@@ -7,8 +7,11 @@ from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 
+from app.api import job_wait, stream_hub
 from app.api.action_schemas import RESPONSES_BODY
 from app.api.forward_openai import forward_openai_method_path, forward_openai_request
+from app.api.stream_aggregate import aggregate_response_stream, is_aggregate_eligible
+from app.api.stream_replay import replay_enabled, stream_responses_create
 from app.core.config import get_settings
 
 router = APIRouter(prefix="/v1", tags=["responses"])
@@ -21,6 +24,8 @@ async def create_response(request: Request):
     POST /v1/responses
     - Parses JSON body.
     - Injects tools manifest if caller omitted tools and injection is enabled.
+    - Serves stream=true through a replay buffer (resumable via /v1/responses:stream/{id}).
+    - With RESPONSES_AGGREGATE_STREAM, streams non-stream creates upstream and aggregates.
     - Passes through to upstream for non-JSON bodies.
     """
     raw = await request.body()
@@ -31,6 +36,10 @@ async def create_response(request: Request):
     except Exception:
         return await forward_openai_request(request)
     if isinstance(body, dict):
+        if body.get("stream") is True and replay_enabled():
+            return await stream_responses_create(body, inbound_headers=request.headers)
+        if is_aggregate_eligible(body):
+            return await aggregate_response_stream(body, inbound_headers=request.headers)
         return await forward_openai_method_path(
             "POST",
             "/v1/responses",
@@ -44,10 +53,25 @@ async def create_response(request: Request):
 async def retrieve_response(response_id: str, request: Request):
     """
     GET /v1/responses/{response_id}
-    Pure passthrough; required to prevent FastAPI 404 in the relay.
+    - stream=true subscribes through the stream hub (one upstream stream per id).
+    - Bare polls of a response the hub is streaming are served from its snapshot.
+    - Otherwise passthrough; required to prevent FastAPI 404 in the relay.
     """
+    if replay_enabled():
+        if stream_hub.is_stream_request(request):
+            return await stream_hub.subscribe(response_id, request)
+        snapshot = stream_hub.poll_snapshot(response_id, request)
+        if snapshot is not None:
+            return snapshot
     return await forward_openai_request(request)
 
+@router.get("/responses/{response_id}/wait")
+async def wait_response(response_id: str, request: Request):
+    """GET /v1/responses/{response_id}/wait: long-poll a background response (`?timeout=` seconds)."""
+    return await job_wait.wait_for_job(
+        request, upstream_path=f"/v1/responses/{response_id}", terminal=job_wait.RESPONSE_TERMINAL
+    )
+
 @router.post("/responses/{response_id}/cancel")
 async def cancel_response(response_id: str, request: Request):
     """POST /v1/responses/{response_id}/cancel (Passthrough)."""
@@ -1,14 +1,20 @@
 from __future__ import annotations
 
-import base64
+import asyncio
+import json
 from typing import Optional
 
-import httpx
-from fastapi import APIRouter, HTTPException, Request, Response
-from pydantic import BaseModel, ConfigDict, Field
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 
-from app.api.forward_openai import build_outbound_headers, build_upstream_url, forward_openai_method_path, forward_openai_request
-from app.core.http_client import get_async_httpx_client
+from app.api.action_schemas import OCTET_STREAM_BODY, _json_body
+from app.api.forward_openai import forward_openai_method_path, forward_openai_request, inherited_headers
+from app.api.upload_ledger import get_upload_ledger, ledger_enabled
+from app.api.upload_parts import stream_upload
+from app.api.upload_stream import SpooledUpload, post_multipart_upload, spool_base64_field, spool_raw_body
+from app.core.config import get_settings
 
 router = APIRouter(prefix="/v1", tags=["uploads"])
 actions_router = APIRouter(prefix="/v1/actions/uploads", tags=["uploads_actions"])
@@ -19,6 +25,34 @@ async def create_upload(request: Request) -> Response:
     return await forward_openai_request(request)
 
 
+@router.post("/uploads:stream", openapi_extra=OCTET_STREAM_BODY)
+async def create_upload_streamed(
+    request: Request,
+    purpose: str = Query(..., description="Upstream upload purpose"),
+    filename: str = Query(..., description="Original filename"),
+    mime_type: str = Query("application/octet-stream", description="MIME type"),
+    total_bytes: Optional[int] = Query(None, alias="bytes", ge=1, description="File size; defaults to Content-Length"),
+) -> Response:
+    """
+    Whole file in one octet-stream body -> create + concurrent parts + complete.
+
+    Returns the completed File object; see app/api/upload_parts.py.
+    """
+    if total_bytes is None:
+        declared = request.headers.get("content-length")
+        if not (declared and declared.isdigit() and int(declared) > 0):
+            raise HTTPException(status_code=411, detail="Send Content-Length or ?bytes= so the Upload can be created")
+        total_bytes = int(declared)
+    return await stream_upload(
+        request,
+        purpose=purpose,
+        filename=filename,
+        mime_type=mime_type,
+        total_bytes=total_bytes,
+        inbound_headers=inherited_headers(request),
+    )
+
+
 @router.post("/uploads/{upload_id}/parts")
 async def create_upload_part(upload_id: str, request: Request) -> Response:
     return await forward_openai_request(request)
@@ -60,33 +94,18 @@ class ActionsUploadPartRequest(BaseModel):
     filename: str = Field(..., description="Original filename")
     mime_type: str = Field(..., description="MIME type")
     data_base64: str = Field(..., description="Base64-encoded bytes for part data")
+    offset: Optional[int] = Field(
+        default=None, ge=0, description="Byte offset of this part in the file; default: after the last recorded part"
+    )
 
 
 class ActionsUploadCompleteRequest(BaseModel):
     model_config = ConfigDict(extra="forbid")
 
-    part_ids: list[str] = Field(..., description="Ordered list of part IDs")
-
-
-def _filter_response_headers(headers: httpx.Headers) -> dict:
-    strip = {
-        "connection",
-        "keep-alive",
-        "proxy-authenticate",
-        "proxy-authorization",
-        "te",
-        "trailers",
-        "transfer-encoding",
-        "upgrade",
-        "content-length",
-        "content-encoding",
-    }
-    out: dict = {}
-    for k, v in headers.items():
-        if k.lower() in strip:
-            continue
-        out[k] = v
-    return out
+    part_ids: Optional[list[str]] = Field(
+        default=None, description="Ordered list of part IDs; omit to use the parts the relay recorded"
+    )
+    md5: Optional[str] = Field(default=None, description="Optional MD5 of the whole file, checked upstream")
 
 
 @actions_router.post(
@@ -95,56 +114,121 @@ def _filter_response_headers(headers: httpx.Headers) -> dict:
     summary="Actions upload create (JSON)",
 )
 async def actions_create_upload(payload: ActionsUploadCreateRequest, request: Request) -> Response:
-    return await forward_openai_method_path(
+    resp = await forward_openai_method_path(
         "POST",
         "/v1/uploads",
         json_body=payload.model_dump(exclude_none=True),
         inbound_headers=request.headers,
     )
+    created = _json_object(resp)
+    if resp.status_code < 400 and created.get("id") and ledger_enabled():
+        await asyncio.to_thread(get_upload_ledger().record_upload, created)
+    return resp
+
+
+def _json_object(resp: Response) -> dict:
+    try:
+        out = json.loads(resp.body or b"{}")
+    except ValueError:
+        return {}
+    return out if isinstance(out, dict) else {}
+
+
+async def _send_recorded_part(
+    request: Request,
+    upload_id: str,
+    upload: SpooledUpload,
+    *,
+    filename: str,
+    mime_type: str,
+    offset: Optional[int],
+) -> Response:
+    """Forward one part, recording it in the ledger (app/api/upload_ledger.py).
+
+    Ledger calls are sqlite transactions behind a lock, so they run in a worker
+    thread rather than on the event loop.
+    """
+    ledger = get_upload_ledger() if ledger_enabled() else None
+    if ledger is not None:
+        try:
+            offset = await asyncio.to_thread(ledger.reserve_part, upload_id, upload.size, offset)
+        except HTTPException:
+            upload.close()
+            raise
+    sha256 = upload.sha256
+    part_id = None
+    try:
+        resp = await post_multipart_upload(
+            request,
+            f"/v1/uploads/{upload_id}/parts",
+            upload,
+            file_field="data",
+            filename=filename,
+            mime_type=mime_type,
+            what="uploading part",
+        )
+        if resp.status_code < 400:
+            part_id = _json_object(resp).get("id")
+    finally:
+        if ledger is not None:
+            await asyncio.to_thread(ledger.finish_part, upload_id, offset, part_id=part_id, sha256=sha256)
+    if offset is not None:
+        resp.headers["x-relay-part-offset"] = str(offset)
+    return resp
+
+
+def _part_max_bytes() -> int:
+    return int(getattr(get_settings(), "ACTIONS_UPLOAD_PART_MAX_BYTES", 64 * 1024 * 1024))
 
 
 @actions_router.post(
     "/{upload_id}/parts",
     operation_id="actionsUploadsAddPartV1Actions",
     summary="Actions upload part (base64 -> multipart)",
+    openapi_extra=_json_body(ActionsUploadPartRequest.model_json_schema()),
 )
-async def actions_create_upload_part(upload_id: str, payload: ActionsUploadPartRequest, request: Request) -> Response:
-    max_bytes = 10 * 1024 * 1024
+async def actions_create_upload_part(upload_id: str, request: Request) -> Response:
+    # data_base64 is decoded into a spool as the body streams in; only the
+    # small fields go through ActionsUploadPartRequest.
+    upload = await spool_base64_field(request, "data_base64", max_bytes=_part_max_bytes(), label="upload part")
     try:
-        raw = base64.b64decode(payload.data_base64, validate=True)
-    except Exception as exc:
-        raise HTTPException(status_code=400, detail=f"Invalid data_base64: {exc}") from exc
-
-    if not raw:
-        raise HTTPException(status_code=400, detail="Empty upload part is not allowed")
-    if len(raw) > max_bytes:
-        raise HTTPException(status_code=413, detail=f"Upload part too large (>{max_bytes} bytes)")
-
-    upstream_path = f"/v1/uploads/{upload_id}/parts"
-    upstream_url = build_upstream_url(upstream_path, request=request)
-    headers = build_outbound_headers(
-        inbound_headers=request.headers,
-        content_type=None,
-        forward_accept=True,
-        path_hint=upstream_path,
+        payload = ActionsUploadPartRequest.model_validate(upload.fields)
+    except ValidationError as exc:
+        upload.close()
+        raise RequestValidationError(exc.errors(include_url=False)) from exc
+
+    return await _send_recorded_part(
+        request, upload_id, upload, filename=payload.filename, mime_type=payload.mime_type, offset=payload.offset
     )
 
-    client = get_async_httpx_client()
-    files = {"data": (payload.filename, raw, payload.mime_type)}
 
-    try:
-        resp = await client.post(upstream_url, headers=headers, files=files)
-    except httpx.TimeoutException as exc:
-        raise HTTPException(status_code=504, detail="Upstream timeout while uploading part") from exc
-    except httpx.HTTPError as exc:
-        raise HTTPException(status_code=502, detail=f"Upstream HTTP error while uploading part: {exc!r}") from exc
-
-    return Response(
-        content=resp.content,
-        status_code=resp.status_code,
-        media_type=resp.headers.get("content-type"),
-        headers=_filter_response_headers(resp.headers),
-    )
+@actions_router.post(
+    "/{upload_id}/parts:raw",
+    operation_id="actionsUploadsAddPartRawV1Actions",
+    summary="Binary sibling of the Actions upload part wrapper (application/octet-stream body)",
+    openapi_extra=OCTET_STREAM_BODY,
+)
+async def actions_create_upload_part_raw(
+    upload_id: str,
+    request: Request,
+    filename: str = Query("part", description="Filename sent with the part"),
+    mime_type: str = Query("application/octet-stream", description="MIME type sent with the part"),
+    offset: Optional[int] = Query(None, ge=0, description="Byte offset of this part in the file"),
+) -> Response:
+    upload = await spool_raw_body(request, max_bytes=_part_max_bytes(), label="upload part")
+    return await _send_recorded_part(request, upload_id, upload, filename=filename, mime_type=mime_type, offset=offset)
+
+
+@actions_router.get(
+    "/{upload_id}/status",
+    operation_id="actionsUploadsStatusV1Actions",
+    summary="Parts the relay has forwarded for an upload, and where to resume",
+)
+async def actions_upload_status(upload_id: str) -> Response:
+    status = await asyncio.to_thread(get_upload_ledger().status, upload_id) if ledger_enabled() else None
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"No parts recorded for upload {upload_id}")
+    return JSONResponse(status)
 
 
 @actions_router.post(
@@ -155,12 +239,28 @@ async def actions_create_upload_part(upload_id: str, payload: ActionsUploadPartR
 async def actions_complete_upload(
     upload_id: str, payload: ActionsUploadCompleteRequest, request: Request
 ) -> Response:
-    return await forward_openai_method_path(
+    body = payload.model_dump(exclude_none=True)
+    if payload.part_ids is None:
+        status = await asyncio.to_thread(get_upload_ledger().status, upload_id) if ledger_enabled() else None
+        if status is None or not status["part_ids"]:
+            raise HTTPException(status_code=400, detail=f"part_ids is required: no parts recorded for upload {upload_id}")
+        if status["bytes"] is not None and not status["complete"]:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload {upload_id} has {status['next_offset']} of {status['bytes']} bytes; "
+                f"resume at offset {status['next_offset']}",
+            )
+        body["part_ids"] = status["part_ids"]
+
+    resp = await forward_openai_method_path(
         "POST",
         f"/v1/uploads/{upload_id}/complete",
-        json_body=payload.model_dump(exclude_none=True),
+        json_body=body,
         inbound_headers=request.headers,
     )
+    if resp.status_code < 400 and ledger_enabled():
+        await asyncio.to_thread(get_upload_ledger().set_status, upload_id, "completed")
+    return resp
 
 
 @actions_router.post(
@@ -169,12 +269,15 @@ async def actions_complete_upload(
     summary="Actions upload cancel (JSON)",
 )
 async def actions_cancel_upload(upload_id: str, request: Request) -> Response:
-    return await forward_openai_method_path(
+    resp = await forward_openai_method_path(
         "POST",
         f"/v1/uploads/{upload_id}/cancel",
         json_body={},
         inbound_headers=request.headers,
     )
+    if resp.status_code < 400 and ledger_enabled():
+        await asyncio.to_thread(get_upload_ledger().set_status, upload_id, "cancelled")
+    return resp
 
 
 ActionsUploadCreateRequest.model_rebuild()
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from fastapi import APIRouter, Request, Response
 
+from app.api import job_wait
 from app.api.forward_openai import forward_openai_request
 
 router = APIRouter(tags=["vector_stores"])
@@ -37,6 +38,16 @@ async def vector_stores_root_delete(request: Request) -> Response:
     return await _forward(request)
 
 
+# Declared before the {path:path} catch-alls, which would otherwise forward it.
+@router.get("/v1/vector_stores/{vector_store_id}/file_batches/{batch_id}/wait")
+async def vector_store_file_batch_wait(vector_store_id: str, batch_id: str, request: Request) -> Response:
+    return await job_wait.wait_for_job(
+        request,
+        upstream_path=f"/v1/vector_stores/{vector_store_id}/file_batches/{batch_id}",
+        terminal=job_wait.FILE_BATCH_TERMINAL,
+    )
+
+
 # ---- /v1/vector_stores/{path:path} (split methods to avoid duplicate operationId) ----
 @router.get("/v1/vector_stores/{path:path}")
 async def vector_stores_subpaths_get(path: str, request: Request) -> Response:
@@ -8,6 +8,8 @@ from fastapi import APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel, ConfigDict, Field
 
 from app.api.action_schemas import VIDEOS_CREATE_BODY, VIDEOS_REMIX_BODY
+from app.api import content_cache, job_wait
+from app.api.content_cache import cached_content
 from app.api.forward_openai import (
     build_outbound_headers,
     build_upstream_url,
@@ -86,18 +88,30 @@ async def retrieve_video(video_id: str, request: Request) -> Response:
     return await forward_openai_request(request)
 
 
+@router.get("/videos/{video_id}/wait")
+async def wait_video(video_id: str, request: Request) -> Response:
+    """Long-poll a video job until it completes or fails (`?timeout=` seconds)."""
+    info("→ [videos.wait] %s %s", request.method, request.url.path)
+    return await job_wait.wait_for_job(
+        request, upstream_path=f"/v1/videos/{video_id}", terminal=job_wait.VIDEO_TERMINAL
+    )
+
+
 @router.delete("/videos/{video_id}")
 async def delete_video(video_id: str, request: Request) -> Response:
     """Delete a single video job."""
     info("→ [videos.delete] %s %s", request.method, request.url.path)
-    return await forward_openai_request(request)
+    resp = await forward_openai_request(request)
+    if resp.status_code < 400:
+        content_cache.forget(f"videos/{video_id}")
+    return resp
 
 
 @router.get("/videos/{video_id}/content")
 async def download_video_content(video_id: str, request: Request) -> Response:
-    """Download generated content (binary) for a video job."""
+    """Download generated content (binary) for a video job; streamed, Range-aware."""
     info("→ [videos.content] %s %s", request.method, request.url.path)
-    return await forward_openai_request(request)
+    return await cached_content(request, resource=f"videos/{video_id}", upstream_path=f"/v1/videos/{video_id}/content")
 
 
 @router.api_route(
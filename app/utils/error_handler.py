@@ -19,13 +19,14 @@ logger = get_logger(__name__)
 CLIENT_CLOSED_REQUEST_STATUS = 499
 
 
-def _base_error_payload(
+def base_error_payload(
     message: str,
     status: int,
     code: Optional[str] = None,
     param: Optional[str] = None,
     details: Optional[list[dict[str, Any]]] = None,
 ) -> dict[str, Any]:
+    """The relay's own error body, shaped like upstream's `{"error": {...}}`."""
     error: dict[str, Any] = {
         "message": message,
         "type": "relay_error",
@@ -94,7 +95,7 @@ def register_exception_handlers(app: FastAPI) -> None:
         logger.warning("HTTP error", extra={"status_code": exc.status_code, "detail": exc.detail})
         return JSONResponse(
             status_code=exc.status_code,
-            content=_base_error_payload(str(exc.detail), exc.status_code),
+            content=base_error_payload(str(exc.detail), exc.status_code),
         )
 
     @app.exception_handler(RequestValidationError)
@@ -104,7 +105,7 @@ def register_exception_handlers(app: FastAPI) -> None:
         details = _validation_details(errors)
         return JSONResponse(
             status_code=422,
-            content=_base_error_payload(
+            content=base_error_payload(
                 "Validation error",
                 422,
                 # `param` names the first offending field, matching how the OpenAI API
@@ -119,7 +120,7 @@ def register_exception_handlers(app: FastAPI) -> None:
         logger.error("OpenAI API error", extra={"error": str(exc)})
         return JSONResponse(
             status_code=502,
-            content=_base_error_payload(f"Upstream OpenAI error: {exc}", 502),
+            content=base_error_payload(f"Upstream OpenAI error: {exc}", 502),
         )
 
     @app.exception_handler(ClientDisconnect)
@@ -131,7 +132,7 @@ def register_exception_handlers(app: FastAPI) -> None:
         )
         return JSONResponse(
             status_code=CLIENT_CLOSED_REQUEST_STATUS,
-            content=_base_error_payload("Client disconnected", CLIENT_CLOSED_REQUEST_STATUS),
+            content=base_error_payload("Client disconnected", CLIENT_CLOSED_REQUEST_STATUS),
         )
 
     if ExceptionGroupType is not None:
@@ -146,13 +147,13 @@ def register_exception_handlers(app: FastAPI) -> None:
                 )
                 return JSONResponse(
                     status_code=CLIENT_CLOSED_REQUEST_STATUS,
-                    content=_base_error_payload("Client disconnected", CLIENT_CLOSED_REQUEST_STATUS),
+                    content=base_error_payload("Client disconnected", CLIENT_CLOSED_REQUEST_STATUS),
                 )
 
             logger.exception("Unhandled exception group")
             return JSONResponse(
                 status_code=500,
-                content=_base_error_payload("Internal Server Error", 500),
+                content=base_error_payload("Internal Server Error", 500),
             )
 
     @app.exception_handler(Exception)
@@ -165,11 +166,11 @@ def register_exception_handlers(app: FastAPI) -> None:
             )
             return JSONResponse(
                 status_code=CLIENT_CLOSED_REQUEST_STATUS,
-                content=_base_error_payload("Client disconnected", CLIENT_CLOSED_REQUEST_STATUS),
+                content=base_error_payload("Client disconnected", CLIENT_CLOSED_REQUEST_STATUS),
             )
 
         logger.exception("Unhandled server error")
         return JSONResponse(
             status_code=500,
-            content=_base_error_payload("Internal Server Error", 500),
+            content=base_error_payload("Internal Server Error", 500),
         )
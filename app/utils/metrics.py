@@ -0,0 +1,45 @@
+"""Process-wide counters for relay-side optimisations, served at GET /v1/metrics.
+
+Counters are plain named totals (`embeddings.cache.hits`, ...). They are
+cumulative from process start, so a scraper diffs two snapshots for a rate.
+For every `<prefix>.hits` / `<prefix>.misses` pair the snapshot also reports
+the hit rate under `hit_rates[<prefix>]`, which is what dashboards want.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import defaultdict
+from typing import Any, Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+
+
+def incr(name: str, value: float = 1) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+def get(name: str) -> float:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        counters = dict(sorted(_counters.items()))
+    hit_rates: Dict[str, float] = {}
+    for name, hits in counters.items():
+        if not name.endswith(".hits"):
+            continue
+        prefix = name[: -len(".hits")]
+        total = hits + counters.get(f"{prefix}.misses", 0)
+        if total:
+            hit_rates[prefix] = round(hits / total, 4)
+    return {"counters": {k: int(v) if float(v).is_integer() else v for k, v in counters.items()}, "hit_rates": hit_rates}
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
@@ -0,0 +1,196 @@
+"""Method-aware path-segment trie for allow/block decisions.
+
+Rules are registered as path patterns whose segments are literals or one of two
+wildcards, and compiled into a single trie keyed by segment. Each node carries
+method bitmasks, so one walk answers "is METHOD allowed on PATH" for every rule
+at once, and the walk is cached by the path's *shape*: the segment sequence
+with every segment the trie has no literal for replaced by its wildcard class.
+Two paths with the same shape always get the same decision, so the cache stays
+small (bounded by the number of routes, not the number of ids) and exact.
+
+Wildcards:
+- `{id}`  one segment of `[A-Za-z0-9_-]+` (object ids: resp_..., file-...).
+- `{seg}` any one non-empty segment (model names such as `gpt-4.1` need dots).
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+METHODS: Tuple[str, ...] = ("GET", "POST", "PUT", "PATCH", "DELETE")
+_METHOD_BITS: Dict[str, int] = {m: 1 << i for i, m in enumerate(METHODS)}
+
+ID = "{id}"
+SEG = "{seg}"
+
+_ID_RX = re.compile(r"[A-Za-z0-9_-]+")
+
+
+def method_mask(methods: Iterable[str]) -> int:
+    mask = 0
+    for m in methods:
+        mask |= _METHOD_BITS[m.upper()]
+    return mask
+
+
+def _segments(path: str) -> List[str]:
+    return path.split("/")[1:] if path.startswith("/") else path.split("/")
+
+
+@dataclass(frozen=True)
+class Decision:
+    """
+    The verdict for one (method, path).
+
+    `blocked` distinguishes an explicit block rule from "no allow rule
+    matched"; `rule` names the pattern that decided it, when one did.
+    """
+
+    allowed: bool
+    reason: str
+    rule: Optional[str] = None
+    blocked: bool = False
+
+
+@dataclass
+class _Node:
+    literal: Dict[str, "_Node"] = field(default_factory=dict)
+    id: Optional["_Node"] = None
+    seg: Optional["_Node"] = None
+    allow: List[Tuple[int, str]] = field(default_factory=list)
+    block_exact: Optional[Tuple[str, str]] = None
+    block_prefix: Optional[Tuple[str, str]] = None
+    block_methods: List[Tuple[int, str, str]] = field(default_factory=list)
+
+    def child(self, token: str) -> "_Node":
+        if token == ID:
+            self.id = self.id or _Node()
+            return self.id
+        if token == SEG:
+            self.seg = self.seg or _Node()
+            return self.seg
+        return self.literal.setdefault(token, _Node())
+
+
+class PathPolicy:
+    """
+    Allow and block rules for (method, path), compiled into one segment trie.
+
+    Block rules are checked before allow rules, in this order: exact path,
+    path prefix (whole segments), last segment, then method + exact path.
+    Rules may be added only before the first decision; adding one clears the
+    decision cache.
+    """
+
+    def __init__(self, *, not_allowed_reason: str = "method/path not allowlisted", cache_size: int = 1024) -> None:
+        self._not_allowed_reason = not_allowed_reason
+        self._root = _Node()
+        self._literals: Set[str] = set()
+        self._last_segment: Dict[str, str] = {}
+        self._decide_shape = lru_cache(maxsize=cache_size)(self._decide_uncached)
+
+    # ---- building ----
+
+    def _insert(self, pattern: str) -> _Node:
+        node = self._root
+        for token in _segments(pattern):
+            if token not in (ID, SEG):
+                self._literals.add(token)
+            node = node.child(token)
+        self._decide_shape.cache_clear()
+        return node
+
+    def allow(self, methods: Iterable[str], pattern: str) -> None:
+        self._insert(pattern).allow.append((method_mask(methods), pattern))
+
+    def block_path(self, path: str, reason: str = "path is blocked") -> None:
+        self._insert(path).block_exact = (reason, path)
+
+    def block_prefix(self, prefix: str, reason: Optional[str] = None) -> None:
+        self._insert(prefix).block_prefix = (reason or f"blocked prefix: {prefix}", prefix)
+
+    def block_method_path(self, methods: Iterable[str], path: str, reason: str) -> None:
+        self._insert(path).block_methods.append((method_mask(methods), reason, path))
+
+    def block_last_segment(self, segment: str, reason: Optional[str] = None) -> None:
+        self._literals.add(segment)
+        self._last_segment[segment] = reason or f"blocked suffix: /{segment}"
+        self._decide_shape.cache_clear()
+
+    # ---- deciding ----
+
+    def shape(self, path: str) -> Tuple[str, ...]:
+        """`path` with every segment the trie has no literal for replaced by its class."""
+        out = []
+        for s in _segments(path):
+            if s in self._literals:
+                out.append(s)
+            elif _ID_RX.fullmatch(s):
+                out.append(ID)
+            elif s:
+                out.append(SEG)
+            else:
+                out.append("")
+        return tuple(out)
+
+    def decide(self, method: str, path: str) -> Decision:
+        return self._decide_shape(method.upper(), self.shape(path))
+
+    def cache_info(self) -> Any:
+        return self._decide_shape.cache_info()
+
+    def _decide_uncached(self, method: str, shape: Tuple[str, ...]) -> Decision:
+        bit = _METHOD_BITS.get(method, 0)
+
+        # Block rules only ever name literal paths, so they sit on the literal chain.
+        node: Optional[_Node] = self._root
+        chain: List[_Node] = [self._root]
+        for token in shape:
+            node = node.literal.get(token) if node is not None and token not in (ID, SEG) else None
+            if node is None:
+                break
+            chain.append(node)
+        exact = chain[-1] if node is not None else None
+
+        if exact is not None and exact.block_exact is not None:
+            reason, rule = exact.block_exact
+            return Decision(False, reason, rule, blocked=True)
+        for n in chain:
+            if n.block_prefix is not None:
+                reason, rule = n.block_prefix
+                return Decision(False, reason, rule, blocked=True)
+        if shape and shape[-1] in self._last_segment:
+            return Decision(False, self._last_segment[shape[-1]], f"*/{shape[-1]}", blocked=True)
+        if exact is not None:
+            for mask, reason, rule in exact.block_methods:
+                if bit & mask:
+                    return Decision(False, reason, rule, blocked=True)
+
+        for mask, rule in self._terminals(shape):
+            if bit & mask:
+                return Decision(True, "allowlisted", rule)
+        return Decision(False, self._not_allowed_reason)
+
+    def _terminals(self, shape: Sequence[str]) -> List[Tuple[int, str]]:
+        """Allow rules of every node the shape reaches; a literal may also fill a wildcard."""
+        frontier = [self._root]
+        for token in shape:
+            if not token:
+                return []
+            nxt: List[_Node] = []
+            for n in frontier:
+                if token not in (ID, SEG):
+                    lit = n.literal.get(token)
+                    if lit is not None:
+                        nxt.append(lit)
+                if n.id is not None and token != SEG and (token == ID or _ID_RX.fullmatch(token)):
+                    nxt.append(n.id)
+                if n.seg is not None:
+                    nxt.append(n.seg)
+            if not nxt:
+                return []
+            frontier = nxt
+        return [rule for n in frontier for rule in n.allow]
@@ -8,7 +8,7 @@ set -euo pipefail
 #   RELAY_TOKEN    (default: dummy)
 #   DEFAULT_MODEL  (default: gpt-5.1)
 #   BATCH_MAX_WAIT_SECONDS (default: 900)
-#   BATCH_POLL_INTERVAL_SECONDS (default: 3)
+#   BATCH_WAIT_SECONDS (default: 30; per long-poll request, capped by JOB_WAIT_MAX_SECONDS)
 #
 # Notes:
 # - Batches are asynchronous and can queue; short caps often fail spuriously.
@@ -19,7 +19,7 @@ RELAY_TOKEN="${RELAY_TOKEN:-dummy}"
 DEFAULT_MODEL="${DEFAULT_MODEL:-gpt-5.1}"
 
 MAX_WAIT="${BATCH_MAX_WAIT_SECONDS:-900}"
-POLL="${BATCH_POLL_INTERVAL_SECONDS:-3}"
+WAIT="${BATCH_WAIT_SECONDS:-30}"
 
 if [ -z "${OPENAI_API_KEY:-}" ]; then
   echo "ERROR: OPENAI_API_KEY is not set. Upstream calls will fail." >&2
@@ -84,7 +84,7 @@ jq . < "${TMP_DIR}/batch.json"
 BATCH_ID="$(jq -r '.id' <"${TMP_DIR}/batch.json")"
 echo "BATCH_ID=${BATCH_ID}"
 
-echo "== Polling batch status until terminal state (max_wait=${MAX_WAIT}s, poll=${POLL}s) =="
+echo "== Waiting for batch terminal state (max_wait=${MAX_WAIT}s, long-poll=${WAIT}s) =="
 deadline=$(( $(date +%s) + MAX_WAIT ))
 
 terminal="false"
@@ -94,7 +94,8 @@ last_error_id=""
 last_resp=""
 
 while [ "$(date +%s)" -lt "${deadline}" ]; do
-  curl -sS "${RELAY_BASE_URL}/v1/batches/${BATCH_ID}" \
+  # Long-poll: the relay returns as soon as the batch is terminal, or after WAIT seconds.
+  curl -sS "${RELAY_BASE_URL}/v1/batches/${BATCH_ID}/wait?timeout=${WAIT}" \
     -H "Authorization: Bearer ${RELAY_TOKEN}" \
     -D "${TMP_DIR}/batch_status.h" \
     -o "${TMP_DIR}/batch_status.json"
@@ -118,8 +119,6 @@ while [ "$(date +%s)" -lt "${deadline}" ]; do
       break
       ;;
   esac
-
-  sleep "${POLL}"
 done
 
 if [ "${terminal}" != "true" ]; then
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: /v1/proxy allow/block decision, regex scan vs compiled trie.
+
+"before" rebuilds the previous matcher from the same rule tables: every
+allowlist pattern as its own anchored regex, tried one after another, after
+the prefix/suffix/regex block scans. "after" is app.routes.proxy.explain(),
+measured cold (decision cache cleared before every call) and warm.
+
+Run:
+  python scripts/bench_proxy_allowlist.py [--number 20000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import sys
+import timeit
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.routes import proxy
+
+_WILDCARDS = {"{id}": "[A-Za-z0-9_-]+", "{seg}": "[^/]+"}
+
+SAMPLES: List[Tuple[str, str]] = [
+    ("POST", "/v1/responses"),
+    ("GET", "/v1/responses/resp_68a1b2c3d4e5f6"),
+    ("GET", "/v1/models/gpt-4.1-mini"),
+    ("GET", "/v1/vector_stores/vs_abc123/files/file-xyz789"),
+    ("POST", "/v1/vector_stores/vs_abc123/file_batches/vsfb_1/cancel"),
+    ("GET", "/v1/batches/batch_abc123"),
+    ("DELETE", "/v1/files/file-abc123"),
+    ("GET", "/v1/files/file-abc123/content"),
+    ("POST", "/v1/uploads/upload_abc/parts"),
+    ("GET", "/v1/not/a/real/route"),
+]
+
+
+def _legacy_tables() -> Tuple[List[Tuple[Set[str], "re.Pattern[str]"]], Set[Tuple[str, "re.Pattern[str]"]]]:
+    allow = []
+    for methods, pattern in proxy._ALLOWLIST:
+        rx = "^" + "/".join(_WILDCARDS.get(seg, re.escape(seg)) for seg in pattern.split("/")) + "$"
+        for m in methods:  # the old table listed one method per regex
+            allow.append(({m}, re.compile(rx)))
+    blocked = {(m, re.compile("^" + re.escape(p) + "$")) for m, p in proxy._BLOCKED_METHOD_PATHS}
+    return allow, blocked
+
+
+_ALLOW, _BLOCKED_RX = _legacy_tables()
+
+
+def legacy_decide(method: str, path: str) -> bool:
+    reason: Optional[str] = None
+    if ":" in path or ".." in path or "#" in path or any(ch.isspace() for ch in path):
+        reason = "illegal"
+    elif path in proxy._BLOCKED_PATHS:
+        reason = "path"
+    elif any(path.startswith(p) for p in proxy._BLOCKED_PREFIXES):
+        reason = "prefix"
+    elif any(path.endswith(s) for s in proxy._BLOCKED_SUFFIXES):
+        reason = "suffix"
+    elif any(method == m and rx.match(path) for m, rx in _BLOCKED_RX):
+        reason = "multipart"
+    if reason:
+        return False
+    return any(method in methods and rx.match(path) for methods, rx in _ALLOW)
+
+
+def trie_cold(method: str, path: str) -> bool:
+    proxy._POLICY._decide_shape.cache_clear()
+    return proxy.explain(method, path).allowed
+
+
+def trie_warm(method: str, path: str) -> bool:
+    return proxy.explain(method, path).allowed
+
+
+def _run(fn, number: int) -> float:
+    def loop() -> None:
+        for m, p in SAMPLES:
+            fn(m, p)
+
+    best = min(timeit.repeat(loop, number=number, repeat=5))
+    return best / (number * len(SAMPLES)) * 1e9
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--number", type=int, default=20000, help="loops over the sample set per repeat")
+    args = ap.parse_args()
+
+    for m, p in SAMPLES:
+        if legacy_decide(m, p) != trie_warm(m, p):
+            print(f"MISMATCH {m} {p}", file=sys.stderr)
+            return 1
+
+    print(f"{'matcher':<28}{'ns/decision':>12}")
+    for name, fn in (("regex scan (before)", legacy_decide), ("trie, cache cleared", trie_cold), ("trie + decision cache", trie_warm)):
+        print(f"{name:<28}{_run(fn, args.number):>12.0f}")
+    print(f"decision cache: {proxy._POLICY.cache_info()}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
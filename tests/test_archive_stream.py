@@ -0,0 +1,183 @@
+# tests/test_archive_stream.py
+"""GET …/files:archive: many upstream files streamed back as one zip or tar.
+
+Why this exists
+---------------
+The stub serves a container listing, over two pages, plus file contents that
+take a while to download. It records how many downloads are in flight at
+once, so the tests can check that downloads run concurrently but stay within
+ARCHIVE_CONCURRENCY. They also check that the archive opens with the stdlib
+readers, and that a file that cannot be fetched is listed in the error entry
+rather than failing the download.
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import tarfile
+import threading
+import time
+import zipfile
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import archive_stream
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+_CONTAINER_FILES = [
+    {"id": "cfile_1", "path": "/mnt/data/report.csv"},
+    {"id": "cfile_2", "path": "/mnt/data/plot.png"},
+    {"id": "cfile_3", "path": "/mnt/data/out/report.csv"},
+    {"id": "cfile_4", "path": "/mnt/data/../../etc/report.csv"},
+    {"id": "cfile_5", "path": "/mnt/data/big.bin"},
+    {"id": "cfile_gone", "path": "/mnt/data/gone.txt"},
+]
+_FILES = {
+    "file-a": {"filename": "notes.txt", "purpose": "assistants"},
+    "file-b": {"filename": "private.pdf", "purpose": "user_data"},
+}
+
+
+def _content(file_id: str) -> bytes:
+    if file_id == "cfile_5":
+        return bytes(range(256)) * 4096  # 1 MiB
+    return f"contents of {file_id}\n".encode()
+
+
+@pytest.fixture(autouse=True)
+def _archive_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "ARCHIVE_CONCURRENCY", 3, raising=False)
+    monkeypatch.setattr(settings, "ARCHIVE_MAX_FILES", 500, raising=False)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"in_flight": 0, "peak": 0, "content_gets": 0}
+    lock = threading.Lock()
+
+    class _H(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            path, _, query = self.path.partition("?")
+            if path == "/v1/containers/cntr_1/files":
+                # Two pages: the route must follow has_more/after.
+                page = _CONTAINER_FILES[3:] if "after=" in query else _CONTAINER_FILES[:3]
+                self._json(200, {"data": page, "has_more": "after=" not in query, "last_id": page[-1]["id"]})
+            elif path == "/v1/containers/cntr_missing/files":
+                self._json(404, {"error": {"message": "No such container"}})
+            elif path.endswith("/content"):
+                file_id = path.split("/")[-2]
+                if file_id == "cfile_gone":
+                    self._json(404, {"error": {"message": "File not found"}})
+                    return
+                with lock:
+                    state["in_flight"] += 1
+                    state["content_gets"] += 1
+                    state["peak"] = max(state["peak"], state["in_flight"])
+                time.sleep(0.15)
+                with lock:
+                    state["in_flight"] -= 1
+                data = _content(file_id)
+                self.send_response(200)
+                self.send_header("content-type", "application/octet-stream")
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            elif path.startswith("/v1/files/") and path.split("/")[-1] in _FILES:
+                file_id = path.split("/")[-1]
+                self._json(200, {"object": "file", "id": file_id, "bytes": 1, "created_at": 0, **_FILES[file_id]})
+            else:
+                self._json(404, {"error": {"message": "No such file"}})
+
+        def _json(self, code: int, payload: dict) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_container_zip_has_every_file_downloaded_concurrently_within_the_limit(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        r = client.get("/v1/containers/cntr_1/files:archive")
+
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/zip"
+    assert r.headers["content-disposition"] == 'attachment; filename="cntr_1.zip"'
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zf:
+        assert zf.testzip() is None
+        names = zf.namelist()
+        contents = {name: zf.read(name) for name in names}
+
+    # Absolute paths become relative, `..` is dropped, and the clash gets a suffix.
+    assert "mnt/data/report.csv" in names and "etc/report.csv" in names
+    assert contents["mnt/data/big.bin"] == _content("cfile_5")
+    assert sorted(contents[n] for n in names if n.endswith("report.csv")) == sorted(
+        _content(i) for i in ("cfile_1", "cfile_3", "cfile_4")
+    )
+    errors = json.loads(contents[archive_stream.ERRORS_ENTRY])["errors"]
+    assert errors == [{"entry": "cfile_gone", "error": "upstream HTTP 404"}]
+    assert 1 < stub_upstream["peak"] <= 3
+
+
+def test_tar_format_and_bad_format(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        r = client.get("/v1/containers/cntr_1/files:archive?format=tar")
+        bad = client.get("/v1/containers/cntr_1/files:archive?format=rar")
+
+    assert r.status_code == 200 and r.headers["content-type"] == "application/x-tar"
+    with tarfile.open(fileobj=io.BytesIO(r.content)) as tf:
+        members = {m.name: tf.extractfile(m).read() for m in tf.getmembers()}  # type: ignore[union-attr]
+    assert members["mnt/data/plot.png"] == _content("cfile_2")
+    assert members["mnt/data/big.bin"] == _content("cfile_5")
+    assert bad.status_code == 400
+    assert stub_upstream["content_gets"] == 5
+
+
+def test_listing_errors_and_oversized_containers_are_refused_before_streaming(
+    stub_upstream: dict, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    with TestClient(create_app()) as client:
+        missing = client.get("/v1/containers/cntr_missing/files:archive")
+        monkeypatch.setattr(settings, "ARCHIVE_MAX_FILES", 4, raising=False)
+        too_many = client.get("/v1/containers/cntr_1/files:archive")
+
+    assert missing.status_code == 404
+    assert too_many.status_code == 400
+    assert stub_upstream["content_gets"] == 0
+
+
+def test_files_archive_takes_ids_and_lists_refused_files(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        r = client.get("/v1/files:archive?ids=file-a,file-b&ids=file-zzz&ids=file-a")
+        empty = client.get("/v1/files:archive?ids=")
+
+    assert r.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zf:
+        assert zf.read("notes.txt") == _content("file-a")
+        errors = {e["entry"]: e["error"] for e in json.loads(zf.read(archive_stream.ERRORS_ENTRY))["errors"]}
+        assert sorted(zf.namelist()) == [archive_stream.ERRORS_ENTRY, "notes.txt"]
+    assert errors["file-b"] == "refused: purpose 'user_data'"
+    assert "404" in errors["file-zzz"]
+    assert stub_upstream["content_gets"] == 1
+    assert empty.status_code == 400
@@ -0,0 +1,283 @@
+# tests/test_content_cache.py
+"""CONTENT_CACHE_ENABLED: binary downloads served from a disk LRU.
+
+Why this exists
+---------------
+Video, container-file and file downloads never change, but every request
+streamed them from upstream again. The cache keeps them on disk and serves
+them with FileResponse, so Range still works. Concurrent misses share one
+download. The stub counts the downloads it really serves and can be made
+slow, so singleflight, eviction and the integrity checks are each measured
+against upstream traffic.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import content_cache
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+
+def _body(name: str) -> bytes:
+    return (name.encode() * 4000)[:4000]
+
+
+@pytest.fixture(autouse=True)
+def _isolated(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "CONTENT_CACHE_ENABLED", True, raising=False)
+    monkeypatch.setattr(settings, "CONTENT_CACHE_DIR", str(tmp_path / "cache"), raising=False)
+    monkeypatch.setattr(settings, "CONTENT_CACHE_MAX_BYTES", 10_000, raising=False)
+    monkeypatch.setattr(settings, "CONTENT_CACHE_MAX_OBJECT_BYTES", 5_000, raising=False)
+    monkeypatch.setattr(content_cache, "_cache", None)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"downloads": [], "delay": 0.0}
+    lock = threading.Lock()
+
+    class _H(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            path = self.path.split("?")[0]
+            if not path.endswith("/content"):  # the files route's purpose lookup
+                self._send(200, b'{"object": "file", "id": "x", "purpose": "assistants"}', "application/json")
+                return
+            name = path.split("/")[-2]
+            with lock:
+                state["downloads"].append((name, self.headers.get("Range"), self.headers.get("OpenAI-Project")))
+            time.sleep(state["delay"])
+            if name == "missing":
+                self._send(404, b'{"error": {"message": "not ready"}}', "application/json")
+            elif name == "huge":
+                self._send(200, b"h" * 6000, "video/mp4")
+            elif name in ("slow", "unsized"):
+                # No Content-Length: the body ends when the connection closes.
+                self.send_response(200)
+                self.send_header("content-type", "video/mp4")
+                self.end_headers()
+                data = b"s" * 6000 if name == "unsized" else _body(name)
+                self.wfile.write(data[:1000])
+                self.wfile.flush()
+                time.sleep(1.0 if name == "slow" else 0)
+                self.wfile.write(data[1000:])
+            else:
+                self._send(200, _body(name), "video/mp4")
+
+        def _send(self, status: int, data: bytes, content_type: str) -> None:
+            self.send_response(status)
+            self.send_header("content-type", content_type)
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_DELETE(self) -> None:
+            self._send(200, b'{"deleted": true}', "application/json")
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", base, raising=False)
+    monkeypatch.setattr(settings, "openai_base_url", base, raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_second_download_and_ranges_come_from_disk(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        first = client.get("/v1/videos/vid_a/content")
+        second = client.get("/v1/videos/vid_a/content")
+        ranged = client.get("/v1/videos/vid_a/content", headers={"Range": "bytes=10-19"})
+        thumbnail = client.get("/v1/videos/vid_a/content?variant=thumbnail")
+
+    assert first.content == second.content == _body("vid_a")
+    assert (first.headers["x-relay-cache"], second.headers["x-relay-cache"]) == ("miss", "hit")
+    assert second.headers["content-type"] == "video/mp4"
+    assert (ranged.status_code, ranged.content) == (206, _body("vid_a")[10:20])
+    assert ranged.headers["content-range"] == "bytes 10-19/4000"
+    assert thumbnail.headers["x-relay-cache"] == "miss", "each variant is its own entry"
+    assert [d[0] for d in stub_upstream["downloads"]] == ["vid_a", "vid_a"]
+
+
+def test_concurrent_misses_share_one_download(stub_upstream: dict) -> None:
+    stub_upstream["delay"] = 0.3
+    with TestClient(create_app()) as client, ThreadPoolExecutor(6) as pool:
+        results = list(pool.map(lambda _: client.get("/v1/containers/cntr/files/cfile/content"), range(6)))
+
+    assert all(r.status_code == 200 and r.content == _body("cfile") for r in results)
+    assert len(stub_upstream["downloads"]) == 1
+
+
+def test_lru_eviction_and_size_limits(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        for name in ("v1", "v2", "v1", "v3"):  # 4000 bytes each; two fit in 10_000
+            client.get(f"/v1/videos/{name}/content")
+        huge = client.get("/v1/videos/huge/content")
+        client.get("/v1/videos/v1/content")
+        client.get("/v1/videos/v2/content")
+
+    assert huge.status_code == 200 and len(huge.content) == 6000
+    assert "x-relay-cache" not in huge.headers
+    # v2 was least recently used when v3 arrived; v1 survived because it had been re-read.
+    # huge streamed through once without being stored; it was not fetched a second time.
+    assert [d[0] for d in stub_upstream["downloads"]] == ["v1", "v2", "v3", "huge", "v2"]
+
+
+def test_corrupted_entries_are_dropped_and_refetched(monkeypatch: pytest.MonkeyPatch, stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        client.get("/v1/videos/vid_a/content")
+        blob = next(Path(settings.CONTENT_CACHE_DIR).glob("*.bin"))
+        blob.write_bytes(b"short")
+        truncated = client.get("/v1/videos/vid_a/content")
+
+        # Same size, different bytes: only the SHA-256 re-check on reload notices.
+        blob.write_bytes(b"x" * 4000)
+        monkeypatch.setattr(content_cache, "_cache", None)
+        tampered = client.get("/v1/videos/vid_a/content")
+
+    assert truncated.content == tampered.content == _body("vid_a")
+    assert (truncated.headers["x-relay-cache"], tampered.headers["x-relay-cache"]) == ("miss", "miss")
+    assert len(stub_upstream["downloads"]) == 3
+
+
+def test_entries_survive_a_restart(monkeypatch: pytest.MonkeyPatch, stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        client.get("/v1/videos/vid_a/content")
+        monkeypatch.setattr(content_cache, "_cache", None)
+        again = client.get("/v1/videos/vid_a/content")
+    assert again.headers["x-relay-cache"] == "hit"
+    assert not list(Path(settings.CONTENT_CACHE_DIR).glob("*.part"))
+
+
+def test_errors_are_not_cached_and_projects_are_separate(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        assert client.get("/v1/videos/missing/content").status_code == 404
+        assert client.get("/v1/videos/missing/content").status_code == 404
+        client.get("/v1/videos/vid_a/content", headers={"OpenAI-Project": "proj_1"})
+        other = client.get("/v1/videos/vid_a/content", headers={"OpenAI-Project": "proj_2"})
+
+    assert other.headers["x-relay-cache"] == "miss"
+    assert [d[2] for d in stub_upstream["downloads"] if d[0] == "vid_a"] == ["proj_1", "proj_2"]
+
+
+def test_range_miss_is_relayed_and_fills_in_the_background(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        ranged = client.get("/v1/files/file-1/content", headers={"Range": "bytes=0-9"})
+        deadline = time.monotonic() + 5
+        while not list(Path(settings.CONTENT_CACHE_DIR).glob("*.json")) and time.monotonic() < deadline:
+            time.sleep(0.02)
+        hit = client.get("/v1/files/file-1/content")
+        client.delete("/v1/files/file-1")
+        after_delete = client.get("/v1/files/file-1/content")
+
+    assert (ranged.status_code, ranged.content) == (206, _body("file-1")[:10])
+    assert hit.headers["x-relay-cache"] == "hit"
+    assert after_delete.headers["x-relay-cache"] == "miss"
+    assert sorted(d[1] or "" for d in stub_upstream["downloads"]) == ["", "", "bytes=0-9"]
+
+
+def test_disabled_cache_touches_nothing(monkeypatch: pytest.MonkeyPatch, stub_upstream: dict) -> None:
+    monkeypatch.setattr(settings, "CONTENT_CACHE_ENABLED", False, raising=False)
+    with TestClient(create_app()) as client:
+        client.get("/v1/videos/vid_a/content")
+        r = client.get("/v1/videos/vid_a/content")
+    assert "x-relay-cache" not in r.headers and len(stub_upstream["downloads"]) == 2
+    assert not os.path.exists(settings.CONTENT_CACHE_DIR)
+
+
+@pytest.mark.asyncio
+async def test_miss_streams_before_the_download_finishes(stub_upstream: dict) -> None:
+    app = create_app()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/v1/videos/slow/content",
+        "raw_path": b"/v1/videos/slow/content",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"relay")],
+        "client": ("127.0.0.1", 1),
+        "server": ("relay", 80),
+    }
+    started = time.monotonic()
+    first_body: list[float] = []
+    body = bytearray()
+    requested, disconnected = asyncio.Event(), asyncio.Event()
+
+    async def receive() -> dict:
+        if not requested.is_set():
+            requested.set()
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.body" and message.get("body"):
+            if not first_body:
+                first_body.append(time.monotonic() - started)
+            body.extend(message["body"])
+
+    await app(scope, receive, send)
+    disconnected.set()
+
+    assert bytes(body) == _body("slow")
+    assert first_body[0] < 0.8, "the first bytes must not wait for the whole download"
+    assert content_cache.get_content_cache()._entries, "and the object is cached all the same"
+
+
+def test_oversized_object_without_length_is_downloaded_once(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        r = client.get("/v1/videos/unsized/content")
+
+    assert r.status_code == 200 and r.content == b"s" * 6000
+    assert [d[0] for d in stub_upstream["downloads"]] == ["unsized"]
+    assert not list(Path(settings.CONTENT_CACHE_DIR).iterdir()), "nothing is kept, not even the temp file"
+
+
+def test_startup_and_eviction_spare_files_in_use(stub_upstream: dict) -> None:
+    root = Path(settings.CONTENT_CACHE_DIR)
+    root.mkdir(parents=True)
+    fresh_part, stale_part = root / "other-worker.part", root / "crashed.part"
+    fresh_bin, stale_bin = root / ("a" * 64 + ".bin"), root / ("b" * 64 + ".bin")
+    for path in (fresh_part, stale_part, fresh_bin, stale_bin):
+        path.write_bytes(b"x")
+    old = time.time() - 2 * content_cache._ORPHAN_GRACE_SECONDS
+    for path in (stale_part, stale_bin):
+        os.utime(path, (old, old))
+
+    with TestClient(create_app()) as client:
+        client.get("/v1/videos/vid_a/content")
+        cache = content_cache.get_content_cache()
+        key = next(iter(cache._entries))
+        assert cache.pin(key)
+        cache.forget_resource("videos/vid_a")
+        assert os.path.exists(cache.blob_path(key)), "a blob being sent is not unlinked under the response"
+        cache.release(key)
+
+    assert not os.path.exists(cache.blob_path(key))
+    assert fresh_part.exists() and fresh_bin.exists(), "another worker's fill in progress survives startup"
+    assert not stale_part.exists() and not stale_bin.exists()
@@ -0,0 +1,154 @@
+# tests/test_content_ranges.py
+"""Range requests on the binary content routes (app/api/binary_content.py).
+
+Why this exists
+---------------
+The content routes buffered downloads and never advertised Accept-Ranges, so
+a seeking video player re-fetched the whole file on every seek. The
+containers route also copied the outbound header set onto its responses,
+which returned the upstream API key to the caller. The stub can either honour
+Range itself or ignore it and send the whole body. Both must give the client
+the same bytes with correct 206/416 framing. In the second case the relay
+has to stop reading once it has the requested bytes.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections.abc import Iterator
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+_BODY = bytes(range(256)) * 40  # 10240 bytes
+_BIG = 32 * 1024 * 1024
+
+
+@pytest.fixture(autouse=True)
+def _auth_off(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"honour_range": False, "ranges_seen": [], "big_written": 0}
+
+    class _H(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            rng = self.headers.get("Range")
+            state["ranges_seen"].append(rng)
+            if "/videos/video_big/" in self.path:
+                self._big()
+                return
+            if state["honour_range"] and rng:
+                start, end = (int(x) for x in rng.removeprefix("bytes=").split("-"))
+                data = _BODY[start : end + 1]
+                self.send_response(206)
+                self.send_header("content-range", f"bytes {start}-{end}/{len(_BODY)}")
+            else:
+                data = _BODY
+                self.send_response(200)
+            self.send_header("content-type", "video/mp4")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _big(self) -> None:
+            self.send_response(200)
+            self.send_header("content-type", "video/mp4")
+            self.send_header("content-length", str(_BIG))
+            self.end_headers()
+            chunk = b"\0" * 65536
+            try:
+                for _ in range(_BIG // len(chunk)):
+                    self.wfile.write(chunk)
+                    state["big_written"] += len(chunk)
+            except OSError:
+                pass
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", base, raising=False)
+    monkeypatch.setattr(settings, "openai_base_url", base, raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_whole_download_advertises_ranges(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        r = client.get("/v1/videos/video_1/content")
+    assert r.status_code == 200 and r.content == _BODY
+    assert r.headers["accept-ranges"] == "bytes"
+    assert r.headers["content-length"] == str(len(_BODY))
+
+
+@pytest.mark.parametrize("honour_range", [True, False], ids=["upstream-206", "relay-sliced"])
+def test_single_range_is_a_206_either_way(stub_upstream: dict, honour_range: bool) -> None:
+    stub_upstream["honour_range"] = honour_range
+    with TestClient(create_app()) as client:
+        r = client.get("/v1/videos/video_1/content", headers={"Range": "bytes=1000-4999"})
+
+    assert r.status_code == 206
+    assert r.content == _BODY[1000:5000]
+    assert r.headers["content-range"] == f"bytes 1000-4999/{len(_BODY)}"
+    assert r.headers["content-length"] == "4000"
+    assert r.headers["content-type"] == "video/mp4"
+    assert stub_upstream["ranges_seen"] == ["bytes=1000-4999"]
+
+
+def test_multiple_and_suffix_ranges_are_multipart(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        r = client.get("/v1/files/file-x/content", headers={"Range": "bytes=-100, 0-9, 5-19"})
+
+    assert r.status_code == 206
+    assert r.headers["content-type"].startswith("multipart/byteranges; boundary=")
+    assert int(r.headers["content-length"]) == len(r.content)
+    message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {r.headers['content-type']}\r\n\r\n".encode() + r.content)
+    parts = [(p["Content-Range"], p.get_payload(decode=True)) for p in message.iter_parts()]
+    size = len(_BODY)
+    assert parts == [
+        (f"bytes 0-19/{size}", _BODY[:20]),  # 0-9 and 5-19 merged
+        (f"bytes {size - 100}-{size - 1}/{size}", _BODY[-100:]),
+    ]
+
+
+def test_unsatisfiable_range_is_416_and_if_range_gets_the_whole_file(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        past_end = client.get("/v1/videos/video_1/content", headers={"Range": f"bytes={len(_BODY)}-"})
+        if_range = client.get("/v1/videos/video_1/content", headers={"Range": "bytes=0-9", "If-Range": '"etag"'})
+        malformed = client.get("/v1/videos/video_1/content", headers={"Range": "bytes=abc"})
+
+    assert past_end.status_code == 416
+    assert past_end.headers["content-range"] == f"bytes */{len(_BODY)}"
+    assert (if_range.status_code, if_range.content) == (200, _BODY)
+    assert (malformed.status_code, malformed.content) == (200, _BODY)
+
+
+def test_relay_stops_reading_after_the_last_range(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        r = client.get("/v1/videos/video_big/content", headers={"Range": "bytes=0-1023"})
+    assert r.status_code == 206 and len(r.content) == 1024
+    assert stub_upstream["big_written"] < _BIG // 2
+
+
+def test_container_downloads_do_not_return_the_upstream_key(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        r = client.get("/v1/containers/cntr_1/files/cfile_1/content", headers={"Range": "bytes=0-9"})
+    assert r.status_code == 206 and r.content == _BODY[:10]
+    assert "authorization" not in r.headers
@@ -0,0 +1,145 @@
+# tests/test_embedding_batcher.py
+"""Concurrent /v1/embeddings requests coalesced into one upstream call.
+
+Why this exists
+---------------
+The stub records each upstream call and the inputs it carried. It embeds each
+input deterministically and bills one token per character. From that the
+tests check three things. Concurrent requests really are merged. Each caller
+gets back exactly its own vectors. The usage shares add up to what upstream
+billed.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+
+def _vector(item: str) -> list:
+    return [float(len(item)), float(sum(item.encode()) % 101)]
+
+
+@pytest.fixture(autouse=True)
+def _coalesce_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_CACHE_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_COALESCE_ENABLED", True, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_COALESCE_WINDOW_MS", 100, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_COALESCE_MAX_INPUTS", 2048, raising=False)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"calls": []}
+    lock = threading.Lock()
+
+    class _H(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            with lock:
+                state["calls"].append((self.headers.get("OpenAI-Project"), body.get("dimensions"), inputs))
+            if "" in inputs:
+                self._send(400, {"error": {"message": "'$.input' is invalid: empty string"}})
+                return
+            tokens = sum(len(i) for i in inputs)
+            self._send(
+                200,
+                {
+                    "object": "list",
+                    "data": [{"object": "embedding", "index": i, "embedding": _vector(t)} for i, t in enumerate(inputs)],
+                    "model": body["model"],
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                },
+            )
+
+        def _send(self, code: int, payload: dict) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _post_concurrently(client: TestClient, bodies: list, headers: list | None = None) -> list:
+    headers = headers or [{}] * len(bodies)
+    with ThreadPoolExecutor(len(bodies)) as pool:
+        return list(pool.map(lambda b, h: client.post("/v1/embeddings", json=b, headers=h), bodies, headers))
+
+
+def test_concurrent_requests_share_one_upstream_call(stub_upstream: dict) -> None:
+    queries = [f"query number {i}" * (1 + i % 3) for i in range(16)]
+    with TestClient(create_app()) as client:
+        results = _post_concurrently(client, [{"model": "emb", "input": q} for q in queries])
+        stats = client.get("/v1/metrics").json()["counters"]
+
+    assert len(stub_upstream["calls"]) < 4
+    assert sum(len(inputs) for _, _, inputs in stub_upstream["calls"]) == 16
+    for query, r in zip(queries, results, strict=True):
+        assert r.status_code == 200
+        body = r.json()
+        assert body["data"] == [{"object": "embedding", "index": 0, "embedding": _vector(query)}]
+        assert body["usage"]["prompt_tokens"] > 0
+    # Shares are estimates per request but add up to exactly what upstream billed.
+    assert sum(r.json()["usage"]["total_tokens"] for r in results) == sum(len(q) for q in queries)
+    assert any(int(r.headers.get("x-relay-coalesced", 1)) > 1 for r in results)
+    assert stats["embeddings.coalesce.upstream_calls"] == len(stub_upstream["calls"])
+
+
+def test_a_bad_request_does_not_fail_the_batch(stub_upstream: dict) -> None:
+    bodies = [
+        {"model": "emb", "input": ["a", "bb"]},
+        {"model": "emb", "input": ""},
+        {"model": "emb", "input": "ccc"},
+    ]
+    with TestClient(create_app()) as client:
+        good_a, bad, good_c = _post_concurrently(client, bodies)
+
+    assert bad.status_code == 400 and "empty string" in bad.json()["error"]["message"]
+    assert good_a.status_code == good_c.status_code == 200
+    assert [d["embedding"] for d in good_a.json()["data"]] == [_vector("a"), _vector("bb")]
+    assert good_a.json()["usage"]["total_tokens"] == 3
+    assert good_c.json()["data"][0]["embedding"] == _vector("ccc")
+
+
+def test_credentials_and_options_are_never_merged(stub_upstream: dict) -> None:
+    bodies = [
+        {"model": "emb", "input": "x"},
+        {"model": "emb", "input": "y"},
+        {"model": "emb", "input": "z", "dimensions": 2},
+    ]
+    headers = [{"OpenAI-Project": "proj_a"}, {"OpenAI-Project": "proj_b"}, {"OpenAI-Project": "proj_a"}]
+    with TestClient(create_app()) as client:
+        results = _post_concurrently(client, bodies, headers)
+
+    assert all(r.status_code == 200 for r in results)
+    assert sorted(stub_upstream["calls"], key=str) == [
+        ("proj_a", 2, ["z"]),
+        ("proj_a", None, ["x"]),
+        ("proj_b", None, ["y"]),
+    ]
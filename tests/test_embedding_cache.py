@@ -0,0 +1,173 @@
+# tests/test_embedding_cache.py
+"""POST /v1/embeddings with the per-input cache: only misses go upstream.
+
+Why this exists
+---------------
+The stub embeds each input deterministically and bills one token per
+character. It records every input it is sent. From that the tests can tell
+exactly which inputs reached upstream, and check that the merged response
+matches an uncached one in order, indexes and billed usage.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import embedding_cache
+from app.core.config import settings
+from app.main import create_app
+from app.utils import metrics
+
+pytestmark = pytest.mark.unit
+
+
+def _vector(item: object, dimensions: int) -> list:
+    seed = sum(json.dumps(item).encode())
+    return [round((seed * (i + 1) % 997) / 997, 6) for i in range(dimensions)]
+
+
+@pytest.fixture(autouse=True)
+def _cache_settings(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_CACHE_ENABLED", True, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_CACHE_PATH", str(tmp_path / "embeddings.sqlite3"), raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_CACHE_MEMORY_BYTES", 1024 * 1024, raising=False)
+    monkeypatch.setattr(embedding_cache, "_cache", None)
+    metrics.reset()
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"inputs": [], "projects": []}
+
+    class _H(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+            state["projects"].append(self.headers.get("OpenAI-Project"))
+            if body["model"] == "no-such-model":
+                self._send(404, {"error": {"message": "The model does not exist"}})
+                return
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            if inputs and isinstance(inputs[0], int):
+                inputs = [inputs]
+            state["inputs"].extend(inputs)
+            dims = body.get("dimensions") or 4
+            tokens = sum(len(i) for i in inputs)
+            self._send(
+                200,
+                {
+                    "object": "list",
+                    "data": [
+                        {"object": "embedding", "index": i, "embedding": _vector(item, dims)}
+                        for i, item in enumerate(inputs)
+                    ],
+                    "model": body["model"] + "-v1",
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                },
+            )
+
+        def _send(self, code: int, payload: dict) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_only_misses_go_upstream_and_results_merge_in_input_order(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        first = client.post("/v1/embeddings", json={"model": "emb", "input": ["alpha", "beta"]})
+        second = client.post("/v1/embeddings", json={"model": "emb", "input": ["beta", "gamma", "alpha", "gamma"]})
+        third = client.post("/v1/embeddings", json={"model": "emb", "input": "gamma"})
+        stats = client.get("/v1/metrics").json()
+
+    assert first.headers["x-relay-cache"] == "miss"
+    assert second.headers["x-relay-cache"] == "partial"
+    assert third.headers["x-relay-cache"] == "hit"
+    # "gamma" went upstream once, although the second request had it twice.
+    assert stub_upstream["inputs"] == ["alpha", "beta", "gamma"]
+
+    body = second.json()
+    assert [d["index"] for d in body["data"]] == [0, 1, 2, 3]
+    assert [d["embedding"] for d in body["data"]] == [_vector(t, 4) for t in ("beta", "gamma", "alpha", "gamma")]
+    # Billed usage is upstream's, for "gamma" alone.
+    assert body["usage"] == {"prompt_tokens": 5, "total_tokens": 5}
+    assert body["model"] == "emb-v1"
+    assert third.json()["usage"] == {"prompt_tokens": 0, "total_tokens": 0}
+
+    assert stats["counters"]["embeddings.cache.hits"] == 3
+    assert stats["counters"]["embeddings.cache.misses"] == 4
+    assert stats["counters"]["embeddings.cache.bytes_saved"] > 0
+    assert stats["hit_rates"]["embeddings.cache"] == round(3 / 7, 4)
+
+
+def test_sqlite_tier_survives_a_restart_and_keys_include_model_options(
+    stub_upstream: dict, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    with TestClient(create_app()) as client:
+        client.post("/v1/embeddings", json={"model": "emb", "input": [[1, 2, 3], [4, 5]]})
+        # A new process: empty memory tier, same sqlite file.
+        monkeypatch.setattr(embedding_cache, "_cache", None)
+        again = client.post("/v1/embeddings", json={"model": "emb", "input": [4, 5]})
+        other_dims = client.post("/v1/embeddings", json={"model": "emb", "input": [4, 5], "dimensions": 2})
+
+    assert again.headers["x-relay-cache"] == "hit"
+    assert again.json()["data"][0]["embedding"] == _vector([4, 5], 4)
+    assert other_dims.headers["x-relay-cache"] == "miss"
+    assert stub_upstream["inputs"] == [[1, 2, 3], [4, 5], [4, 5]]
+
+
+def test_upstream_errors_relay_unchanged_and_are_not_cached(stub_upstream: dict) -> None:
+    payload = {"model": "no-such-model", "input": "alpha"}
+    with TestClient(create_app()) as client:
+        first = client.post("/v1/embeddings", json=payload)
+        second = client.post("/v1/embeddings", json=payload)
+
+    assert first.status_code == second.status_code == 404
+    assert first.json()["error"]["message"] == "The model does not exist"
+    assert len(stub_upstream["projects"]) == 2
+
+
+def test_disabled_cache_forwards_headers_and_status(stub_upstream: dict, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "EMBEDDINGS_CACHE_ENABLED", False, raising=False)
+    with TestClient(create_app()) as client:
+        ok = client.post("/v1/embeddings", json={"model": "emb", "input": "a"}, headers={"OpenAI-Project": "proj_1"})
+        missing = client.post("/v1/embeddings", json={"model": "no-such-model", "input": "a"})
+
+    assert ok.status_code == 200 and "x-relay-cache" not in ok.headers
+    assert missing.status_code == 404
+    assert stub_upstream["projects"][0] == "proj_1"
+
+
+def test_disk_store_is_trimmed_least_recently_used_first(tmp_path: Path) -> None:
+    cache = embedding_cache.EmbeddingCache(str(tmp_path / "c.sqlite3"), memory_bytes=0, disk_max_bytes=1000)
+    try:
+        cache.put_many({f"k{i}": b"x" * 100 for i in range(8)})
+        cache.get_many(["k0"])  # most recently used now
+        cache.put_many({"k8": b"x" * 100, "k9": b"x" * 100, "k10": b"x" * 100})
+        kept = cache.get_many([f"k{i}" for i in range(11)])
+    finally:
+        cache.close()
+
+    assert len(kept) * 100 <= 900
+    assert "k0" in kept and "k10" in kept and "k1" not in kept
@@ -0,0 +1,142 @@
+# tests/test_embedding_formats.py
+"""/v1/embeddings: base64 upstream, and JSON, base64, raw float32 or .npy out.
+
+Why this exists
+---------------
+The stub behaves like upstream. With `encoding_format: base64` it answers
+with base64 little-endian float32, and otherwise with float arrays. It
+records which format it was asked for and keeps the exact bytes it sent. The
+tests check that the relay always asks for base64, and that a base64 client
+gets those bytes untouched. Every other output format must decode to the same
+float32 matrix.
+"""
+
+from __future__ import annotations
+
+import base64
+import io
+import json
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+_DIMS = 64
+
+
+def _matrix(inputs: list) -> np.ndarray:
+    rows = []
+    for text in inputs:
+        rng = np.random.default_rng(sum(text.encode()))
+        row = rng.standard_normal(_DIMS).astype("<f4")
+        rows.append(row / np.linalg.norm(row))
+    return np.stack(rows).astype("<f4")
+
+
+@pytest.fixture(autouse=True)
+def _format_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_CACHE_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_COALESCE_ENABLED", False, raising=False)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"formats": [], "last_body": b""}
+
+    class _H(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            fmt = body.get("encoding_format", "float")
+            state["formats"].append(fmt)
+            matrix = _matrix(inputs)
+            data = [
+                {
+                    "object": "embedding",
+                    "index": i,
+                    "embedding": base64.b64encode(row.tobytes()).decode() if fmt == "base64" else row.tolist(),
+                }
+                for i, row in enumerate(matrix)
+            ]
+            payload = json.dumps(
+                {"object": "list", "data": data, "model": body["model"], "usage": {"prompt_tokens": 7, "total_tokens": 7}}
+            ).encode()
+            state["last_body"] = payload
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+_INPUTS = ["first document", "second document", "third"]
+
+
+def test_json_outputs_ask_upstream_for_base64(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        floats = client.post("/v1/embeddings", json={"model": "emb", "input": _INPUTS})
+        b64 = client.post("/v1/embeddings", json={"model": "emb", "input": _INPUTS, "encoding_format": "base64"})
+
+    assert stub_upstream["formats"] == ["base64", "base64"]
+    body = floats.json()
+    assert [d["index"] for d in body["data"]] == [0, 1, 2]
+    # Shortest float32 repr: parsing it back gives exactly the upstream float32 values.
+    np.testing.assert_array_equal(np.asarray([d["embedding"] for d in body["data"]], dtype="<f4"), _matrix(_INPUTS))
+    assert body["usage"] == {"prompt_tokens": 7, "total_tokens": 7} and body["model"] == "emb"
+    # A base64 client gets upstream's body byte for byte.
+    assert b64.content == stub_upstream["last_body"]
+
+
+def test_binary_outputs_carry_the_matrix_and_its_metadata(stub_upstream: dict) -> None:
+    expected = _matrix(_INPUTS)
+    payload = {"model": "emb", "input": _INPUTS}
+    with TestClient(create_app()) as client:
+        raw = client.post("/v1/embeddings", json=payload, headers={"Accept": "application/octet-stream"})
+        npy = client.post("/v1/embeddings", json=payload, headers={"Accept": "application/x-npy"})
+        half = client.post("/v1/embeddings?dtype=float16", json=payload, headers={"Accept": "application/x-npy"})
+        int8 = client.post("/v1/embeddings?dtype=int8", json=payload, headers={"Accept": "application/octet-stream"})
+
+    assert raw.headers["content-type"] == "application/octet-stream"
+    assert raw.headers["x-embeddings-shape"] == f"3,{_DIMS}"
+    assert raw.headers["x-embeddings-usage-total-tokens"] == "7"
+    np.testing.assert_array_equal(np.frombuffer(raw.content, dtype="<f4").reshape(3, _DIMS), expected)
+    np.testing.assert_array_equal(np.load(io.BytesIO(npy.content)), expected)
+
+    halves = np.load(io.BytesIO(half.content))
+    assert halves.dtype == np.float16 and np.allclose(halves, expected, atol=1e-3)
+    assert len(int8.content) == 3 * _DIMS and int8.headers["x-embeddings-scale"] == "127"
+    restored = np.frombuffer(int8.content, dtype=np.int8).reshape(3, _DIMS) / 127
+    assert np.abs(restored - expected).max() <= 0.5 / 127 + 1e-6
+
+
+def test_invalid_output_options_are_rejected_before_upstream(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        bad_dtype = client.post(
+            "/v1/embeddings?dtype=int4", json={"model": "emb", "input": "x"}, headers={"Accept": "application/x-npy"}
+        )
+        dtype_on_json = client.post("/v1/embeddings?dtype=int8", json={"model": "emb", "input": "x"})
+        bad_encoding = client.post("/v1/embeddings", json={"model": "emb", "input": "x", "encoding_format": "hex"})
+
+    assert bad_dtype.status_code == dtype_on_json.status_code == bad_encoding.status_code == 400
+    assert stub_upstream["formats"] == []
@@ -0,0 +1,165 @@
+# tests/test_embedding_similarity.py
+"""POST /v1/embeddings:similarity: ranked indexes and scores instead of vectors.
+
+Why this exists
+---------------
+The stub embeds a text as its letter counts over a three-letter alphabet
+("aab" -> [2, 1, 0]), base64-encoded like upstream's. Cosine scores are then
+easy to work out by hand. The tests check the ranking, that top_k truncates,
+and that candidates named by cache id are ranked without being sent upstream
+again.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+import math
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import embedding_cache
+from app.api.embedding_similarity import top_k
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+
+def _embed(text: str) -> np.ndarray:
+    return np.array([text.count(c) for c in "abc"], dtype="<f4")
+
+
+@pytest.fixture(autouse=True)
+def _similarity_settings(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_CACHE_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_COALESCE_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_CACHE_PATH", str(tmp_path / "embeddings.sqlite3"), raising=False)
+    monkeypatch.setattr(embedding_cache, "_cache", None)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"inputs": []}
+
+    class _H(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+            state["inputs"].append(body["input"])
+            data = [
+                {"object": "embedding", "index": i, "embedding": base64.b64encode(_embed(t).tobytes()).decode()}
+                for i, t in enumerate(body["input"])
+            ]
+            payload = json.dumps(
+                {"object": "list", "data": data, "model": body["model"], "usage": {"prompt_tokens": 3, "total_tokens": 3}}
+            ).encode()
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_top_k_matches_a_brute_force_ranking() -> None:
+    rng = np.random.default_rng(7)
+    queries, candidates = rng.standard_normal((5, 32)), rng.standard_normal((400, 32))
+    indexes, scores = top_k(queries, candidates, 8)
+
+    unit = candidates / np.linalg.norm(candidates, axis=1, keepdims=True)
+    for q, query in enumerate(queries):
+        full = unit @ (query / np.linalg.norm(query))
+        np.testing.assert_array_equal(indexes[q], np.argsort(-full)[:8])
+        np.testing.assert_allclose(scores[q], np.sort(full)[::-1][:8], rtol=1e-6)
+
+
+def test_candidates_are_ranked_by_cosine_similarity(stub_upstream: dict) -> None:
+    payload = {"model": "emb", "query": ["aaa", "c"], "candidates": ["b", "ab", "a", "cc"], "top_k": 2}
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/embeddings:similarity", json=payload)
+
+    assert r.status_code == 200
+    body = r.json()
+    assert stub_upstream["inputs"] == [["aaa", "c", "b", "ab", "a", "cc"]]
+    assert body["data"][0]["matches"] == [{"index": 2, "score": 1.0}, {"index": 1, "score": round(1 / math.sqrt(2), 6)}]
+    assert body["data"][1]["query_index"] == 1 and body["data"][1]["matches"][0] == {"index": 3, "score": 1.0}
+    assert body["usage"] == {"prompt_tokens": 3, "total_tokens": 3}
+
+
+def test_cached_candidates_are_ranked_by_id_without_reembedding(
+    stub_upstream: dict, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "EMBEDDINGS_CACHE_ENABLED", True, raising=False)
+    with TestClient(create_app()) as client:
+        first = client.post(
+            "/v1/embeddings:similarity", json={"model": "emb", "query": "a", "candidates": ["bb", "aab", "cab"]}
+        )
+        ids = {m["index"]: m["id"] for m in first.json()["data"][0]["matches"]}
+        again = client.post(
+            "/v1/embeddings:similarity",
+            json={"model": "emb", "query": "bbb", "candidate_ids": [ids[0], ids[1], ids[2]]},
+        )
+        unknown = client.post(
+            "/v1/embeddings:similarity",
+            json={"model": "emb", "query": "a", "candidate_ids": ["0" * 64 + ids[0][64:]]},
+        )
+
+    assert again.status_code == 200
+    assert [m["index"] for m in again.json()["data"][0]["matches"]] == [0, 2, 1]
+    assert again.json()["data"][0]["matches"][0]["id"] == ids[0]
+    # The second call sent only its query upstream.
+    assert stub_upstream["inputs"][1] == ["bbb"]
+    assert unknown.status_code == 404
+
+
+def test_requests_without_candidates_or_with_ids_but_no_cache_are_rejected(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        empty = client.post("/v1/embeddings:similarity", json={"model": "emb", "query": "a"})
+        ids = client.post("/v1/embeddings:similarity", json={"model": "emb", "query": "a", "candidate_ids": ["x"]})
+
+    assert empty.status_code == 400
+    assert ids.status_code == 400
+
+
+def test_candidate_ids_from_another_model_or_width_are_rejected(
+    stub_upstream: dict, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "EMBEDDINGS_CACHE_ENABLED", True, raising=False)
+    with TestClient(create_app()) as client:
+        first = client.post("/v1/embeddings:similarity", json={"model": "emb", "query": "a", "candidates": ["ab"]})
+        candidate_id = first.json()["data"][0]["matches"][0]["id"]
+
+        def rank(**fields: object) -> object:
+            return client.post("/v1/embeddings:similarity", json={"query": "a", "candidate_ids": [candidate_id], **fields})
+
+        other_model = rank(model="emb-2")
+        other_width = rank(model="emb", dimensions=3)
+        bare_key = client.post(
+            "/v1/embeddings:similarity",
+            json={"model": "emb", "query": "a", "candidate_ids": [candidate_id.partition(":")[0]]},
+        )
+        same = rank(model="emb")
+
+    # Same three-wide vectors either way: only the id tells the spaces apart.
+    assert candidate_id.endswith(":0:emb")
+    assert other_model.status_code == other_width.status_code == bare_key.status_code == 400
+    assert "emb-2" in other_model.text
+    assert same.status_code == 200 and same.json()["data"][0]["matches"][0]["id"] == candidate_id
@@ -0,0 +1,141 @@
+# tests/test_embedding_split.py
+"""Oversized /v1/embeddings requests split into parallel, stitched sub-requests.
+
+Why this exists
+---------------
+The stub enforces small per-request limits, the way upstream enforces 2048
+inputs and a token budget. It records the size of every call and how many
+were in flight at once. The tests check that a request over the limits comes
+back as one response, with every index and vector in place and usage summed,
+and that the pieces were sent concurrently but within the configured bound.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api.embedding_split import plan_chunks
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+_STUB_MAX_INPUTS = 10
+
+
+def _vector(item: object) -> list:
+    return [float(len(item)), float(sum(json.dumps(item).encode()) % 101)]  # type: ignore[arg-type]
+
+
+@pytest.fixture(autouse=True)
+def _split_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_CACHE_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_COALESCE_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_SPLIT_MAX_INPUTS", _STUB_MAX_INPUTS, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_SPLIT_MAX_TOKENS", 1000, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_SPLIT_CONCURRENCY", 3, raising=False)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"calls": [], "in_flight": 0, "peak": 0}
+    lock = threading.Lock()
+
+    class _H(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            with lock:
+                state["calls"].append(inputs)
+                state["in_flight"] += 1
+                state["peak"] = max(state["peak"], state["in_flight"])
+            time.sleep(0.1)
+            with lock:
+                state["in_flight"] -= 1
+            tokens = sum(len(i) for i in inputs)
+            if len(inputs) > _STUB_MAX_INPUTS or "reject me" in inputs:
+                self._send(400, {"error": {"message": "Invalid 'input'"}})
+                return
+            self._send(
+                200,
+                {
+                    "object": "list",
+                    "data": [{"object": "embedding", "index": i, "embedding": _vector(t)} for i, t in enumerate(inputs)],
+                    "model": body["model"],
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                },
+            )
+
+        def _send(self, code: int, payload: dict) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_plan_chunks_is_balanced_and_within_limits() -> None:
+    assert plan_chunks([1] * 2100, max_inputs=2048, max_tokens=10**6) == [(0, 1050), (1050, 2100)]
+    assert plan_chunks([5] * 8, max_inputs=100, max_tokens=100) == [(0, 8)]
+    by_tokens = plan_chunks([300, 300, 300, 300, 5000, 10], max_inputs=100, max_tokens=1000)
+    assert all(sum([300, 300, 300, 300, 5000, 10][a:b]) <= 1000 or b - a == 1 for a, b in by_tokens)
+    assert (4, 5) in by_tokens  # the oversized input goes alone
+
+
+def test_large_request_is_split_run_in_parallel_and_stitched(stub_upstream: dict) -> None:
+    inputs = [f"document {i}" for i in range(35)]
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/embeddings", json={"model": "emb", "input": inputs})
+
+    assert r.status_code == 200
+    body = r.json()
+    assert [d["index"] for d in body["data"]] == list(range(35))
+    assert [d["embedding"] for d in body["data"]] == [_vector(t) for t in inputs]
+    assert body["usage"]["total_tokens"] == sum(len(t) for t in inputs)
+    assert r.headers["x-relay-split"] == "4"
+    assert sorted(len(c) for c in stub_upstream["calls"]) == [8, 9, 9, 9]
+    assert stub_upstream["peak"] == 3
+
+
+def test_token_budget_splits_few_long_inputs(stub_upstream: dict) -> None:
+    inputs = ["x" * 1600, "y" * 1600, "z" * 1600]
+    with TestClient(create_app()) as client:
+        text = client.post("/v1/embeddings", json={"model": "emb", "input": inputs})
+        small = client.post("/v1/embeddings", json={"model": "emb", "input": "short"})
+
+    assert text.status_code == 200 and len(text.json()["data"]) == 3
+    # 400 estimated tokens each against a budget of 1000: at most two per call.
+    assert all(len(c) <= 2 for c in stub_upstream["calls"][:-1])
+    assert small.status_code == 200 and "x-relay-split" not in small.headers
+    assert stub_upstream["calls"][-1] == ["short"]
+
+
+def test_a_failed_piece_fails_the_request(stub_upstream: dict) -> None:
+    inputs = [f"document {i}" for i in range(30)]
+    inputs[3] = "reject me"
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/embeddings", json={"model": "emb", "input": inputs})
+
+    assert r.status_code == 400
+    assert r.json()["error"]["message"] == "Invalid 'input'"
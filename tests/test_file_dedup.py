@@ -0,0 +1,177 @@
+# tests/test_file_dedup.py
+"""FILES_DEDUP_ENABLED: identical uploads reuse the existing upstream File.
+
+Why this exists
+---------------
+Pipelines re-upload the same PDFs and batch inputs. Each upload used to create
+a new upstream File and send the bytes again. With dedup on, the relay hashes
+the file and reuses the File it already created for the same bytes, purpose
+and credential. The stub counts the uploads that really happen, and it can
+forget a file behind the relay's back, so reuse, verification and invalidation
+are each checked against what upstream holds.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api.file_dedup import DedupIndex
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture(autouse=True)
+def _isolated(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "FILES_DEDUP_ENABLED", True, raising=False)
+    monkeypatch.setattr(settings, "FILES_DEDUP_PATH", str(tmp_path / "dedup.sqlite3"), raising=False)
+    monkeypatch.setattr(settings, "FILES_DEDUP_VERIFY_SECONDS", 0, raising=False)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"uploads": 0, "gets": 0, "files": set()}
+
+    class _H(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: dict) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self) -> None:
+            self.rfile.read(int(self.headers["content-length"]))
+            state["uploads"] += 1
+            file_id = f"file-{state['uploads']}"
+            state["files"].add(file_id)
+            self._reply(200, {"id": file_id, "object": "file"})
+
+        def do_GET(self) -> None:
+            state["gets"] += 1
+            if state.get("drop_gets"):
+                self.close_connection = True  # no answer at all: a transport error
+                return
+            file_id = self.path.rsplit("/", 1)[-1]
+            if file_id in state["files"]:
+                self._reply(200, {"id": file_id, "object": "file", "status": "processed"})
+            else:
+                self._reply(404, {"error": {"message": "No such File object"}})
+
+        def do_DELETE(self) -> None:
+            file_id = self.path.rsplit("/", 1)[-1]
+            state["files"].discard(file_id)
+            self._reply(200, {"id": file_id, "object": "file", "deleted": True})
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), _H)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _raw(client: TestClient, data: bytes, purpose: str = "assistants") -> object:
+    return client.post(
+        f"/v1/actions/files/upload:raw?purpose={purpose}&filename=doc.pdf",
+        content=data,
+        headers={"content-type": "application/octet-stream"},
+    )
+
+
+def _multipart(client: TestClient, data: bytes) -> object:
+    return client.post("/v1/files", data={"purpose": "batch"}, files={"file": ("in.jsonl", data, "application/jsonl")})
+
+
+def test_same_bytes_and_purpose_reuse_the_file(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        first = _raw(client, b"%PDF same bytes")
+        second = _raw(client, b"%PDF same bytes")
+        other_purpose = _raw(client, b"%PDF same bytes", purpose="user_data")
+        other_bytes = _raw(client, b"%PDF other bytes")
+
+    assert (first.headers["x-relay-dedup"], second.headers["x-relay-dedup"]) == ("miss", "hit")
+    assert second.json()["id"] == first.json()["id"] == "file-1"
+    assert other_purpose.json()["id"] == "file-2" and other_bytes.json()["id"] == "file-3"
+    assert stub_upstream["uploads"] == 3
+    assert stub_upstream["gets"] == 1, "the hit was verified upstream before being returned"
+
+
+def test_multipart_create_file_is_deduplicated_and_delete_invalidates(stub_upstream: dict) -> None:
+    body = b'{"custom_id": "a"}\n'
+    with TestClient(create_app()) as client:
+        assert _multipart(client, body).json()["id"] == "file-1"
+        assert _multipart(client, body).headers["x-relay-dedup"] == "hit"
+        assert client.delete("/v1/files/file-1").status_code == 200
+        assert _multipart(client, body).json()["id"] == "file-2"
+
+    assert stub_upstream["uploads"] == 2
+    assert stub_upstream["gets"] == 1, "after the delete the index had nothing to verify"
+
+
+def test_file_gone_upstream_is_uploaded_again(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        _raw(client, b"bytes")
+        stub_upstream["files"].clear()  # deleted without going through the relay
+        again = _raw(client, b"bytes")
+
+    assert again.json()["id"] == "file-2" and again.headers["x-relay-dedup"] == "miss"
+
+
+def test_a_verify_that_cannot_reach_upstream_uploads_instead(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        _raw(client, b"bytes")
+        stub_upstream["drop_gets"] = True
+        again = _raw(client, b"bytes")
+
+    assert again.status_code == 200, again.text
+    assert again.json()["id"] == "file-2" and again.headers["x-relay-dedup"] == "miss"
+
+
+def test_verified_hits_skip_the_check_within_the_ttl(monkeypatch: pytest.MonkeyPatch, stub_upstream: dict) -> None:
+    monkeypatch.setattr(settings, "FILES_DEDUP_VERIFY_SECONDS", 300, raising=False)
+    with TestClient(create_app()) as client:
+        for _ in range(4):
+            _raw(client, b"bytes")
+    assert (stub_upstream["uploads"], stub_upstream["gets"]) == (1, 0)
+
+
+def test_index_calls_run_off_the_event_loop(monkeypatch: pytest.MonkeyPatch, stub_upstream: dict) -> None:
+    on_loop: list[str] = []
+    for name in ("get", "put", "forget"):
+        original = getattr(DedupIndex, name)
+
+        def wrapper(self: DedupIndex, *args: object, _name: str = name, _original: object = original) -> object:
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(_name)
+            except RuntimeError:
+                pass
+            return _original(self, *args)  # type: ignore[operator]
+
+        monkeypatch.setattr(DedupIndex, name, wrapper)
+
+    body = b'{"custom_id": "b"}\n'
+    with TestClient(create_app()) as client:
+        _multipart(client, body)
+        _multipart(client, body)
+        client.delete("/v1/files/file-1")
+
+    assert on_loop == [], "sqlite index calls must not block the event loop"
@@ -0,0 +1,124 @@
+# tests/test_file_meta_cache.py
+"""The user_data guard on GET /v1/files/{id}/content and its metadata cache.
+
+Why this exists
+---------------
+The guard compared a Starlette Response against `dict`, so it never refused
+anything, and it made a full GET /v1/files/{id} before every download anyway.
+It now reads the purpose from File objects that already passed through the
+relay. On a miss it looks the purpose up while the content stream opens. The
+stub counts metadata and content requests separately. Its metadata handler
+waits for the content request to arrive, which shows that the two really
+overlap rather than running back to back.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import file_meta
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+_FILES = {
+    "file-doc": {"id": "file-doc", "object": "file", "purpose": "assistants", "filename": "doc.txt"},
+    "file-private": {"id": "file-private", "object": "file", "purpose": "user_data", "filename": "me.pdf"},
+}
+
+
+@pytest.fixture(autouse=True)
+def _auth_off(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "FILES_META_CACHE_SECONDS", 600, raising=False)
+    monkeypatch.setattr(file_meta, "_cache", None)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"meta_gets": 0, "content_gets": 0, "overlapped": [], "content_arrived": threading.Event()}
+
+    class _H(BaseHTTPRequestHandler):
+        def _reply(self, status: int, data: bytes, content_type: str = "application/json") -> None:
+            self.send_response(status)
+            self.send_header("content-type", content_type)
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            parts = self.path.strip("/").split("/")  # v1 files [id] [content]
+            if len(parts) == 2:
+                self._reply(200, json.dumps({"object": "list", "data": list(_FILES.values())}).encode())
+            elif len(parts) == 3:
+                state["meta_gets"] += 1
+                state["overlapped"].append(state["content_arrived"].wait(timeout=2))
+                meta = _FILES.get(parts[2])
+                self._reply(200 if meta else 404, json.dumps(meta or {"error": {"message": "No such File"}}).encode())
+            else:
+                state["content_gets"] += 1
+                state["content_arrived"].set()
+                if parts[2] in _FILES:
+                    self._reply(200, b"contents of " + parts[2].encode(), "application/octet-stream")
+                else:
+                    self._reply(404, b'{"error": {"message": "No such File"}}')
+
+        def do_DELETE(self) -> None:
+            self._reply(200, json.dumps({"id": self.path.rsplit("/", 1)[-1], "deleted": True}).encode())
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_listed_files_need_no_metadata_lookup(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        assert client.get("/v1/files").status_code == 200
+        ok = client.get("/v1/files/file-doc/content")
+        refused = client.get("/v1/files/file-private/content")
+
+    assert ok.status_code == 200 and ok.content == b"contents of file-doc"
+    assert refused.status_code == 403
+    assert stub_upstream["meta_gets"] == 0
+    assert stub_upstream["content_gets"] == 1, "a cached user_data file is refused before any download starts"
+
+
+def test_miss_looks_up_alongside_the_download_and_refuses_user_data(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        first = client.get("/v1/files/file-private/content")
+        second = client.get("/v1/files/file-private/content")
+
+    assert (first.status_code, second.status_code) == (403, 403)
+    assert b"contents" not in first.content
+    assert stub_upstream["meta_gets"] == 1, "the lookup's answer is cached"
+    assert stub_upstream["overlapped"] == [True], "the content request was sent while the lookup was in flight"
+
+
+def test_upstream_errors_pass_through_and_delete_drops_the_entry(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        missing = client.get("/v1/files/file-gone/content")
+        client.get("/v1/files/file-doc")
+        client.get("/v1/files/file-doc/content")
+        client.delete("/v1/files/file-doc")
+        client.get("/v1/files/file-doc/content")
+
+    assert missing.status_code == 404
+    assert missing.json()["error"]["message"] == "No such File"
+    # file-gone's lookup, the explicit retrieve, then the lookup after the delete.
+    assert stub_upstream["meta_gets"] == 3
@@ -0,0 +1,179 @@
+# tests/test_image_blobs.py
+"""IMAGES_BLOBS_ENABLED: b64_json image payloads replaced by signed relay URLs.
+
+Why this exists
+---------------
+gpt-image responses carry every image inline as base64. A two-image response
+is several megabytes of JSON, which is over the Action response limit. The
+stub API returns such a document. The tests check that the client gets a
+small body with `url` members, and that the URLs return the exact image bytes
+without the relay key. They also check that a forged or expired link does
+not, and that the streaming rewriter is independent of chunk boundaries.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import image_blobs
+from app.core.config import settings
+from app.main import create_app
+from app.routes import images
+
+pytestmark = pytest.mark.unit
+
+_IMAGES = [b"\x89PNG\r\n\x1a\n" + os.urandom(900_000), b"\xff\xd8\xff\xe0" + os.urandom(700_000)]
+
+
+def _upstream_document(images: list = _IMAGES, escape_slashes: bool = False) -> bytes:
+    items = []
+    for img in images:
+        encoded = base64.b64encode(img).decode()
+        if escape_slashes:
+            encoded = encoded.replace("/", "\\/")
+        items.append('{"revised_prompt": "a \\"b64_json\\": trap", "b64_json": "%s"}' % encoded)
+    return ('{"created": 1, "data": [%s], "output_format": "png"}' % ", ".join(items)).encode()
+
+
+@pytest.fixture(autouse=True)
+def _isolated(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "IMAGES_BLOBS_ENABLED", True, raising=False)
+    monkeypatch.setattr(settings, "IMAGES_BLOBS_DIR", str(tmp_path / "blobs"), raising=False)
+    monkeypatch.setattr(settings, "IMAGES_BLOBS_SIGNING_KEY", "test-signing-key", raising=False)
+    monkeypatch.setattr(settings, "IMAGES_NORMALIZE_ENABLED", False, raising=False)
+    monkeypatch.setattr(images, "_ALLOWED_HOSTS_EXACT", {"127.0.0.1"})
+    monkeypatch.setattr(image_blobs, "_store", None)
+
+
+@pytest.fixture()
+def stub_api(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"status": 200, "paths": []}
+
+    class _H(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            self.rfile.read(int(self.headers.get("content-length") or 0))
+            state["paths"].append(self.path)
+            data = _upstream_document() if state["status"] == 200 else b'{"error": {"message": "bad prompt"}}'
+            self.send_response(state["status"])
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_generation_response_is_small_and_urls_serve_the_images(
+    monkeypatch: pytest.MonkeyPatch, stub_api: dict
+) -> None:
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/images/generations", json={"model": "gpt-image-1", "prompt": "a cat"})
+        body = r.json()
+        # The blob route is reachable without the relay key.
+        monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", True, raising=False)
+        monkeypatch.setattr(settings, "RELAY_KEY", "relay-secret", raising=False)
+        blobs = [client.get(item["url"]) for item in body["data"]]
+        unauthenticated_api = client.post("/v1/images/generations", json={"prompt": "x"})
+
+    assert r.status_code == 200 and len(r.content) < 1000
+    assert r.headers["x-relay-image-blobs"] == "2"
+    assert [sorted(item) for item in body["data"]] == [["revised_prompt", "url"]] * 2
+    assert body["data"][0]["revised_prompt"] == 'a "b64_json": trap'
+    assert body["output_format"] == "png"
+    assert [b.content for b in blobs] == _IMAGES
+    assert [b.headers["content-type"] for b in blobs] == ["image/png", "image/jpeg"]
+    assert blobs[0].headers["cache-control"].startswith("private, max-age=")
+    assert unauthenticated_api.status_code == 401
+
+
+def test_forged_expired_and_unknown_links_are_refused(stub_api: dict) -> None:
+    with TestClient(create_app()) as client:
+        url = client.post("/v1/images/generations", json={"prompt": "a cat"}).json()["data"][0]["url"]
+        blob_id = url.split("/v1/images/blobs/")[1].split("?")[0]
+        past = int(time.time()) - 5
+        forged = client.get(url.replace("sig=", "sig=0"))
+        expired = client.get(f"/v1/images/blobs/{blob_id}?expires={past}&sig={image_blobs.sign(blob_id, past)}")
+        traversal = client.get("/v1/images/blobs/..%2f..%2fetc%2fpasswd?expires=1&sig=x")
+
+    assert forged.status_code == 403
+    assert expired.status_code == 410
+    assert traversal.status_code == 404
+
+
+def test_errors_and_disabled_offload_pass_through(monkeypatch: pytest.MonkeyPatch, stub_api: dict) -> None:
+    with TestClient(create_app()) as client:
+        stub_api["status"] = 400
+        error = client.post("/v1/images/generations", json={"prompt": "a cat"})
+        stub_api["status"] = 200
+        monkeypatch.setattr(settings, "IMAGES_BLOBS_ENABLED", False, raising=False)
+        inline = client.post("/v1/images/generations", json={"prompt": "a cat"})
+
+    assert error.status_code == 400 and error.json()["error"]["message"] == "bad prompt"
+    assert inline.content == _upstream_document()
+    assert not os.path.exists(settings.IMAGES_BLOBS_DIR) or not os.listdir(settings.IMAGES_BLOBS_DIR)
+
+
+def test_json_wrapper_responses_are_offloaded_too(stub_api: dict) -> None:
+    png = base64.b64encode(b"\x89PNG\r\n\x1a\n" + b"input").decode()
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/actions/images/variations", json={"image_base64": png})
+    assert r.status_code == 200 and stub_api["paths"] == ["/v1/images/variations"]
+    assert all("url" in item and "b64_json" not in item for item in r.json()["data"])
+
+
+def test_blob_writes_and_sweeps_run_off_the_event_loop(monkeypatch: pytest.MonkeyPatch, stub_api: dict) -> None:
+    on_loop: list[str] = []
+    for cls, name in ((image_blobs._BlobWriter, "_write"), (image_blobs._BlobWriter, "commit"), (image_blobs.BlobStore, "sweep")):
+        original = getattr(cls, name)
+
+        def watched(self: object, *args: object, _original=original, _name=name, **kwargs: object) -> object:
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(_name)
+            except RuntimeError:
+                pass
+            return _original(self, *args, **kwargs)
+
+        monkeypatch.setattr(cls, name, watched)
+
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/images/generations", json={"model": "gpt-image-1", "prompt": "a cat"})
+
+    assert r.status_code == 200 and r.headers["x-relay-image-blobs"] == "2"
+    assert on_loop == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 65536])
+def test_rewriter_is_independent_of_chunk_boundaries(chunk_size: int) -> None:
+    small = [img[:3000] for img in _IMAGES]
+    document = _upstream_document(small, escape_slashes=True)
+    rewriter = image_blobs._Rewriter(image_blobs.get_blob_store(), lambda blob_id: f"blob:{blob_id}")
+    for i in range(0, len(document), chunk_size):
+        rewriter.feed(document[i : i + chunk_size])
+    out = json.loads(rewriter.finish())
+
+    store = image_blobs.get_blob_store()
+    assert [Path(store.path(item["url"][5:])).read_bytes() for item in out["data"]] == small
+    assert out["created"] == 1 and out["output_format"] == "png"
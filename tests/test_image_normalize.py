@@ -0,0 +1,220 @@
+# tests/test_image_normalize.py
+"""IMAGES_NORMALIZE_ENABLED: edit and variation inputs fixed up before upload.
+
+Why this exists
+---------------
+The JSON wrappers rejected anything that was not already a PNG under 4 MB, so
+a phone photo needed a re-encode and a second attempt. The stub API parses
+each multipart POST and decodes the parts it received with Pillow. That way
+the tests check what upstream actually got: format, dimensions, size and mask
+alpha, from a single request.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import io
+import json
+import os
+import threading
+from collections.abc import Iterator
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import image_normalize
+from app.core.config import settings
+from app.main import create_app
+
+Image = pytest.importorskip("PIL.Image")
+
+pytestmark = pytest.mark.unit
+
+
+def _encode(img: "Image.Image", fmt: str, **kwargs: object) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **kwargs)
+    return buf.getvalue()
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+@pytest.fixture(autouse=True)
+def _auth_off(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "IMAGES_NORMALIZE_ENABLED", True, raising=False)
+    monkeypatch.setattr(image_normalize, "_results", image_normalize._ResultCache())
+
+
+@pytest.fixture()
+def stub_api(monkeypatch: pytest.MonkeyPatch) -> Iterator[list]:
+    posts: list = []
+
+    class _H(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers["content-length"]))
+            head = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+            parts = BytesParser(policy=HTTP).parsebytes(head + body).iter_parts()
+            posts.append(
+                (self.path, {p.get_param("name", header="content-disposition"): p for p in parts})
+            )
+            data = json.dumps({"data": [{"url": "https://example.invalid/out.png"}]}).encode()
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield posts
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _received(part: object) -> tuple:
+    data = part.get_payload(decode=True)  # type: ignore[attr-defined]
+    return data, Image.open(io.BytesIO(data)), part.get_filename()  # type: ignore[attr-defined]
+
+
+def test_jpeg_variation_becomes_a_square_png_in_one_request(stub_api: list) -> None:
+    photo = Image.new("RGB", (1600, 1200), (200, 30, 30))
+    with TestClient(create_app()) as client:
+        r = client.post(
+            "/v1/actions/images/variations",
+            json={"image_base64": _b64(_encode(photo, "JPEG")), "size": "512x512"},
+        )
+
+    assert r.status_code == 200, r.text
+    assert len(stub_api) == 1
+    data, img, filename = _received(stub_api[0][1]["image"])
+    assert data.startswith(b"\x89PNG\r\n\x1a\n") and filename == "image.png"
+    assert (img.format, img.mode, img.size) == ("PNG", "RGBA", (512, 512))
+
+
+def test_large_noisy_photo_is_recompressed_under_the_upstream_limit(stub_api: list) -> None:
+    noise = Image.frombytes("RGB", (2400, 1800), os.urandom(2400 * 1800 * 3))
+    original = _encode(noise, "JPEG", quality=98)
+    assert len(original) > image_normalize.UPSTREAM_MAX_BYTES
+
+    with TestClient(create_app()) as client:
+        r = client.post(
+            "/v1/images/edits",
+            json={"image_base64": _b64(original), "prompt": "p", "model": "gpt-image-1"},
+        )
+
+    assert r.status_code == 200, r.text
+    data, img, _ = _received(stub_api[0][1]["image"])
+    assert len(data) <= image_normalize.UPSTREAM_MAX_BYTES
+    assert max(img.size) <= 1536
+    assert img.size[0] * 3 == img.size[1] * 4, "aspect ratio kept for gpt-image models"
+
+
+def test_opaque_mask_gets_alpha_and_the_image_size(stub_api: list) -> None:
+    image = Image.new("RGB", (800, 600), (10, 120, 10))
+    mask = Image.new("L", (400, 400), 0)
+    mask.paste(255, (0, 0, 200, 400))  # left half white: the area to edit
+    with TestClient(create_app()) as client:
+        r = client.post(
+            "/v1/actions/images/edits",
+            json={
+                "image_base64": _b64(_encode(image, "WEBP")),
+                "mask_base64": _b64(_encode(mask, "JPEG")),
+                "prompt": "p",
+            },
+        )
+
+    assert r.status_code == 200, r.text
+    _, img, _ = _received(stub_api[0][1]["image"])
+    _, received_mask, _ = _received(stub_api[0][1]["mask"])
+    assert img.size == received_mask.size == (512, 512)
+    alpha = received_mask.getchannel("A")
+    # The 800x600 image was centre-cropped; the 400x400 mask was only scaled.
+    assert alpha.getpixel((10, 256)) == 0 and alpha.getpixel((500, 256)) == 255
+
+
+def test_unreadable_input_is_a_400_and_never_reaches_upstream(stub_api: list) -> None:
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/actions/images/variations", json={"image_base64": _b64(b"not an image")})
+    assert r.status_code == 400 and "not a readable image" in r.text
+    assert stub_api == []
+
+
+def test_results_are_cached_by_input_hash(monkeypatch: pytest.MonkeyPatch) -> None:
+    pools = []
+    real_get_pool = image_normalize._get_pool
+
+    def counting_pool() -> object:
+        pools.append(1)
+        return real_get_pool()
+
+    monkeypatch.setattr(image_normalize, "_get_pool", counting_pool)
+    data = _encode(Image.new("RGB", (300, 300), (1, 2, 3)), "JPEG")
+
+    async def run() -> list:
+        return [await image_normalize.normalize(data, square=True, max_side=1024) for _ in range(3)]
+
+    results = asyncio.run(run())
+    assert results[0] == results[1] == results[2] and results[0][1] == (256, 256)
+    assert len(pools) == 1
+
+
+def test_images_over_the_pixel_limit_are_refused_before_decoding(
+    stub_api: list, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "IMAGES_NORMALIZE_MAX_PIXELS", 1_000_000, raising=False)
+    flat = _encode(Image.new("RGB", (2000, 2000), (0, 0, 0)), "PNG")
+    assert len(flat) < 100_000, "small on the wire, 16 MB once decoded"
+
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/actions/images/variations", json={"image_base64": _b64(flat)})
+
+    assert r.status_code == 400 and "2000x2000" in r.text
+    assert stub_api == []
+
+
+def test_a_dead_worker_is_replaced_and_the_job_retried() -> None:
+    data = _encode(Image.new("RGB", (300, 300), (1, 2, 3)), "JPEG")
+
+    async def run() -> tuple:
+        first = await image_normalize.normalize(data, square=True, max_side=1024)
+        pool = image_normalize._get_pool()
+        for process in list(pool._processes.values()):  # type: ignore[attr-defined]
+            process.kill()
+            process.join()
+        image_normalize._results = image_normalize._ResultCache()
+        again = await image_normalize.normalize(data, square=True, max_side=1024)
+        return first, again, pool
+
+    first, again, dead = asyncio.run(run())
+    assert first == again
+    assert image_normalize._pool is not dead
+
+
+def test_a_worker_that_keeps_dying_refuses_the_image(stub_api: list, monkeypatch: pytest.MonkeyPatch) -> None:
+    class _Broken:
+        def submit(self, *args: object) -> None:
+            raise image_normalize.BrokenProcessPool("worker died")
+
+        def shutdown(self, wait: bool = True) -> None:
+            pass
+
+    monkeypatch.setattr(image_normalize, "_get_pool", _Broken)
+    photo = _encode(Image.new("RGB", (300, 300), (1, 2, 3)), "JPEG")
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/actions/images/variations", json={"image_base64": _b64(photo)})
+
+    assert r.status_code == 400 and "worker crashed" in r.text
+    assert stub_api == []
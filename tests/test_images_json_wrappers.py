@@ -0,0 +1,158 @@
+# tests/test_images_json_wrappers.py
+"""The JSON wrappers for /v1/images/edits and /variations: pooled, concurrent, spooled.
+
+Why this exists
+---------------
+Each wrapper call opened a new httpx client for every download and another
+for the upstream POST, so every image edit paid two or three extra TCP
+handshakes. It also fetched the image and the mask one after the other. Two
+keep-alive stubs stand in for the download host and the API. They record
+which client port each request came from and how many downloads overlapped.
+That shows both connection reuse and concurrency directly.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import threading
+import time
+from collections.abc import Iterator
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import SpooledTemporaryFile
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.main import create_app
+from app.routes import images
+
+pytestmark = pytest.mark.unit
+
+_PNG = b"\x89PNG\r\n\x1a\n" + b"image-bytes" * 100
+_MASK = b"\x89PNG\r\n\x1a\n" + b"mask-bytes" * 50
+
+
+@pytest.fixture(autouse=True)
+def _auth_off(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(images, "_ALLOWED_HOSTS_EXACT", {"127.0.0.1"})
+    # Byte-for-byte passthrough of PNGs; normalisation has tests/test_image_normalize.py.
+    monkeypatch.setattr(settings, "IMAGES_NORMALIZE_ENABLED", False, raising=False)
+
+
+def _serve(handler: type[BaseHTTPRequestHandler]) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture()
+def stubs(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"download_ports": set(), "api_ports": set(), "in_flight": 0, "peak": 0, "posts": []}
+    lock = threading.Lock()
+
+    class _Reply(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so reuse is observable
+
+        def _reply(self, status: int, data: bytes, content_type: str) -> None:
+            self.send_response(status)
+            self.send_header("content-type", content_type)
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    class _Downloads(_Reply):
+        def do_GET(self) -> None:
+            state["download_ports"].add(self.client_address[1])
+            with lock:
+                state["in_flight"] += 1
+                state["peak"] = max(state["peak"], state["in_flight"])
+            time.sleep(0.2)
+            with lock:
+                state["in_flight"] -= 1
+            self._reply(200, _MASK if self.path == "/mask.png" else _PNG, "image/png")
+
+    class _Api(_Reply):
+        def do_POST(self) -> None:
+            state["api_ports"].add(self.client_address[1])
+            body = self.rfile.read(int(self.headers["content-length"]))
+            head = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+            parts = BytesParser(policy=HTTP).parsebytes(head + body).iter_parts()
+            state["posts"].append(
+                (self.path, {p.get_param("name", header="content-disposition"): p.get_payload(decode=True) for p in parts})
+            )
+            self._reply(200, json.dumps({"data": [{"url": "https://example.invalid/out.png"}]}).encode(), "application/json")
+
+    downloads, api = _serve(_Downloads), _serve(_Api)
+    state["download_base"] = f"http://127.0.0.1:{downloads.server_port}"
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{api.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        for server in (downloads, api):
+            server.shutdown()
+            server.server_close()
+
+
+def test_edits_fetch_image_and_mask_concurrently_on_pooled_clients(stubs: dict) -> None:
+    base = stubs["download_base"]
+    payload = {"image_url": f"{base}/image.png", "mask_url": f"{base}/mask.png", "prompt": "add a hat"}
+    with TestClient(create_app()) as client:
+        first = client.post("/v1/actions/images/edits", json=payload)
+        second = client.post("/v1/actions/images/edits", json=payload)
+
+    assert (first.status_code, second.status_code) == (200, 200), first.text
+    assert stubs["peak"] == 2, "image and mask downloads overlapped"
+    assert len(stubs["download_ports"]) == 2, "four downloads over two pooled connections"
+    assert len(stubs["api_ports"]) == 1, "both upstream POSTs on one connection"
+    path, fields = stubs["posts"][0]
+    assert path == "/v1/images/edits"
+    assert fields == {"prompt": b"add a hat", "image": _PNG, "mask": _MASK}
+
+
+def test_variations_accept_base64_and_still_require_png(stubs: dict) -> None:
+    with TestClient(create_app()) as client:
+        ok = client.post(
+            "/v1/images/variations", json={"image_base64": base64.b64encode(_PNG).decode(), "n": 2}
+        )
+        jpeg = client.post("/v1/actions/images/variations", json={"image_base64": base64.b64encode(b"\xff\xd8\xff").decode()})
+        bad_mask = client.post(
+            "/v1/actions/images/edits",
+            json={"image_url": f"{stubs['download_base']}/image.png", "mask_base64": "not base64!"},
+        )
+
+    assert ok.status_code == 200
+    assert stubs["posts"][0] == ("/v1/images/variations", {"n": b"2", "image": _PNG})
+    assert jpeg.status_code == 400 and "must be a PNG" in jpeg.text
+    assert bad_mask.status_code == 400 and "Invalid mask_base64" in bad_mask.text
+    assert len(stubs["posts"]) == 1
+
+
+def test_image_spools_are_written_off_the_event_loop(stubs: dict, monkeypatch: pytest.MonkeyPatch) -> None:
+    on_loop: list[int] = []
+
+    class _WatchedSpool(SpooledTemporaryFile):
+        def write(self, data: bytes) -> int:
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(len(data))
+            except RuntimeError:
+                pass
+            return super().write(data)
+
+    monkeypatch.setattr(images, "_new_spool", lambda: _WatchedSpool(max_size=64))
+    base = stubs["download_base"]
+    with TestClient(create_app()) as client:
+        downloaded = client.post("/v1/actions/images/edits", json={"image_url": f"{base}/image.png", "prompt": "p"})
+        decoded = client.post("/v1/actions/images/variations", json={"image_base64": base64.b64encode(_PNG).decode()})
+
+    assert downloaded.status_code == decoded.status_code == 200
+    assert on_loop == [], "a spool past its memory threshold writes to disk"
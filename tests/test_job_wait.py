@@ -0,0 +1,142 @@
+# tests/test_job_wait.py
+"""GET …/wait long-polls: one shared, adaptive upstream poller per job.
+
+Why this exists
+---------------
+Clients waiting on a batch, video, file batch or background response each
+polled upstream in their own loop. The stub counts the GETs it serves per job
+and per project, and reports a job as terminal after a set number of polls.
+That way the tests measure upstream poll volume directly: it should grow with
+the number of jobs, not the number of waiters.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture(autouse=True)
+def _fast_polls(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "JOB_WAIT_POLL_MIN_MS", 20, raising=False)
+    monkeypatch.setattr(settings, "JOB_WAIT_POLL_MAX_MS", 1000, raising=False)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"polls": Counter(), "complete_after": {}, "terminal_status": "completed"}
+    lock = threading.Lock()
+
+    class _H(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            path = self.path.split("?")[0]
+            with lock:
+                state["polls"][(path, self.headers.get("OpenAI-Project"))] += 1
+                seen = state["polls"][(path, self.headers.get("OpenAI-Project"))]
+            if path.endswith("/missing"):
+                self._send(404, {"error": {"message": "No such job"}})
+                return
+            needed = state["complete_after"].get(path, 1)
+            status = state["terminal_status"] if seen >= needed else "in_progress"
+            self._send(200, {"id": path.rsplit("/", 1)[-1], "status": status})
+
+        def _send(self, code: int, payload: dict) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_concurrent_waiters_share_one_poller_and_are_released_together(stub_upstream: dict) -> None:
+    stub_upstream["complete_after"]["/v1/batches/batch_1"] = 5
+    with TestClient(create_app()) as client, ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: client.get("/v1/batches/batch_1/wait?timeout=10"), range(8)))
+
+    assert all(r.status_code == 200 and r.json()["status"] == "completed" for r in results)
+    assert {r.headers["x-relay-wait"] for r in results} == {"terminal"}
+    assert stub_upstream["polls"][("/v1/batches/batch_1", None)] == 5
+
+
+def test_timeout_returns_the_latest_state_and_polling_backs_off_then_stops(stub_upstream: dict) -> None:
+    stub_upstream["complete_after"]["/v1/videos/video_1"] = 10_000
+    with TestClient(create_app()) as client:
+        started = time.monotonic()
+        r = client.get("/v1/videos/video_1/wait?timeout=0.5")
+        elapsed = time.monotonic() - started
+        polls_at_return = stub_upstream["polls"][("/v1/videos/video_1", None)]
+        time.sleep(1.2)
+
+    assert r.status_code == 200 and r.json()["status"] == "in_progress"
+    assert r.headers["x-relay-wait"] == "timeout" and 0.5 <= elapsed < 2
+    # 20 ms doubling: about 5 polls in 0.5 s, where a fixed 20 ms loop makes 25.
+    assert polls_at_return <= 6
+    # With no waiters left the poller makes at most the poll already scheduled.
+    assert stub_upstream["polls"][("/v1/videos/video_1", None)] <= polls_at_return + 1
+
+
+def test_every_job_family_has_a_wait_route(stub_upstream: dict) -> None:
+    stub_upstream["terminal_status"] = "cancelled"
+    paths = {
+        "/v1/videos/video_2/wait": "/v1/videos/video_2",
+        "/v1/vector_stores/vs_1/file_batches/vsfb_1/wait": "/v1/vector_stores/vs_1/file_batches/vsfb_1",
+        "/v1/responses/resp_1/wait": "/v1/responses/resp_1",
+        "/v1/batches/missing/wait": "/v1/batches/missing",
+    }
+    with TestClient(create_app()) as client:
+        results = {path: client.get(f"{path}?timeout=1") for path in paths}
+
+    # A video cannot be cancelled, so that wait runs out; the others are terminal at once.
+    assert results["/v1/videos/video_2/wait"].headers["x-relay-wait"] == "timeout"
+    for path in list(paths)[1:]:
+        assert results[path].headers["x-relay-wait"] == "terminal"
+        assert stub_upstream["polls"][(paths[path], None)] == 1
+    assert results["/v1/batches/missing/wait"].status_code == 404
+
+
+def test_credentials_get_separate_pollers_and_bad_timeouts_are_rejected(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        a = client.get("/v1/batches/batch_2/wait", headers={"OpenAI-Project": "proj_a"})
+        b = client.get("/v1/batches/batch_2/wait", headers={"OpenAI-Project": "proj_b"})
+        bad = client.get("/v1/batches/batch_2/wait?timeout=soon")
+
+    assert a.status_code == b.status_code == 200
+    assert stub_upstream["polls"][("/v1/batches/batch_2", "proj_a")] == 1
+    assert stub_upstream["polls"][("/v1/batches/batch_2", "proj_b")] == 1
+    assert bad.status_code == 400
+
+
+@pytest.mark.parametrize("value", ["nan", "NaN", "inf", "-inf"])
+def test_non_finite_timeouts_are_rejected(stub_upstream: dict, value: str) -> None:
+    with TestClient(create_app()) as client:
+        r = client.get(f"/v1/batches/batch_2/wait?timeout={value}")
+
+    assert r.status_code == 400, "nan would otherwise bypass JOB_WAIT_MAX_SECONDS"
+    assert sum(stub_upstream["polls"].values()) == 0
@@ -0,0 +1,206 @@
+# tests/test_local_embeddings.py
+"""/v1/embeddings with model aliases served locally (EMBEDDINGS_LOCAL_MODELS).
+
+Why this exists
+---------------
+`tiny_model` is a deterministic hashed bag-of-words encoder, plugged in as
+`py:tests.test_local_embeddings:tiny_model`. It records the size of every
+batch it encodes. The tests check that concurrent requests for an alias are
+encoded together and never reach upstream, and that responses keep the
+OpenAI shape and output formats. Other models still go upstream, and a
+sidecar alias is forwarded under its own model name. The sentence-transformers
+path uses a tiny static model built on the fly. It is skipped when the
+`local-embeddings` extra is not installed.
+"""
+
+from __future__ import annotations
+
+import base64
+import io
+import json
+import threading
+import zlib
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import embedding_local
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+_DIMS = 16
+_BATCHES: list = []
+
+
+def _bag_of_words(text: str) -> np.ndarray:
+    row = np.zeros(_DIMS, dtype="<f4")
+    for word in text.lower().split():
+        row[zlib.crc32(word.encode()) % _DIMS] += 1
+    return row / max(float(np.linalg.norm(row)), 1e-12)
+
+
+class _TinyModel:
+    def encode(self, texts: list) -> np.ndarray:
+        _BATCHES.append(len(texts))
+        return np.stack([_bag_of_words(t) for t in texts])
+
+
+def tiny_model() -> _TinyModel:
+    return _TinyModel()
+
+
+@pytest.fixture(autouse=True)
+def _local_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_CACHE_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_COALESCE_ENABLED", False, raising=False)
+    monkeypatch.setattr(
+        settings, "EMBEDDINGS_LOCAL_MODELS", "local/tiny=py:tests.test_local_embeddings:tiny_model", raising=False
+    )
+    monkeypatch.setattr(settings, "EMBEDDINGS_LOCAL_BATCH_WAIT_MS", 200, raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_LOCAL_MAX_BATCH", 64, raising=False)
+    monkeypatch.setattr(embedding_local, "_encoders", {})
+    _BATCHES.clear()
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"models": [], "authorization": []}
+
+    class _H(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+            state["models"].append(body["model"])
+            state["authorization"].append(self.headers.get("authorization"))
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            data = [
+                {"object": "embedding", "index": i, "embedding": base64.b64encode(_bag_of_words(t).tobytes()).decode()}
+                for i, t in enumerate(inputs)
+            ]
+            payload = json.dumps(
+                {"object": "list", "data": data, "model": body["model"], "usage": {"prompt_tokens": 5, "total_tokens": 5}}
+            ).encode()
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state["url"] = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", state["url"], raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_concurrent_local_requests_are_batched_and_never_reach_upstream(stub_upstream: dict) -> None:
+    texts = [["red apple", "green pear"], ["blue sky"], ["red sky at night"], ["apple pie", "pear tart", "sky"]]
+    with TestClient(create_app()) as client, ThreadPoolExecutor(max_workers=4) as pool:
+        responses = list(
+            pool.map(lambda batch: client.post("/v1/embeddings", json={"model": "local/tiny", "input": batch}), texts)
+        )
+        npy = client.post(
+            "/v1/embeddings", json={"model": "local/tiny", "input": "blue sky"}, headers={"Accept": "application/x-npy"}
+        )
+
+    assert stub_upstream["models"] == []
+    # Seven texts from four concurrent requests took fewer than four encode calls.
+    assert sum(_BATCHES[:-1]) == 7 and len(_BATCHES) < 5
+    for batch, r in zip(texts, responses, strict=True):
+        body = r.json()
+        assert r.status_code == 200 and body["object"] == "list" and body["model"] == "local/tiny"
+        assert [d["index"] for d in body["data"]] == list(range(len(batch)))
+        got = np.asarray([d["embedding"] for d in body["data"]], dtype="<f4")
+        np.testing.assert_array_equal(got, np.stack([_bag_of_words(t) for t in batch]))
+        assert body["usage"]["prompt_tokens"] == body["usage"]["total_tokens"] > 0
+    np.testing.assert_array_equal(np.load(io.BytesIO(npy.content)), _bag_of_words("blue sky")[None, :])
+
+
+def test_other_models_go_upstream_and_sidecar_aliases_are_forwarded(
+    stub_upstream: dict, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(
+        settings,
+        "EMBEDDINGS_LOCAL_MODELS",
+        f"local/tiny=py:tests.test_local_embeddings:tiny_model,local/tei={stub_upstream['url']}/v1/embeddings#BAAI/bge-m3",
+        raising=False,
+    )
+    with TestClient(create_app()) as client:
+        remote = client.post("/v1/embeddings", json={"model": "text-embedding-3-small", "input": "blue sky"})
+        sidecar = client.post("/v1/embeddings", json={"model": "local/tei", "input": ["blue sky"]})
+
+    assert remote.status_code == sidecar.status_code == 200
+    assert stub_upstream["models"] == ["text-embedding-3-small", "BAAI/bge-m3"]
+    # The relay's OpenAI key is not sent to the sidecar.
+    assert stub_upstream["authorization"][0] is not None and stub_upstream["authorization"][1] is None
+    assert sidecar.json()["data"][0]["embedding"] == pytest.approx(_bag_of_words("blue sky").tolist())
+    assert _BATCHES == []
+
+
+def test_dimensions_and_unsupported_inputs(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        short = client.post("/v1/embeddings", json={"model": "local/tiny", "input": "red apple pie", "dimensions": 4})
+        tokens = client.post("/v1/embeddings", json={"model": "local/tiny", "input": [1, 2, 3]})
+        too_wide = client.post("/v1/embeddings", json={"model": "local/tiny", "input": "x", "dimensions": 64})
+        ranked = client.post(
+            "/v1/embeddings:similarity",
+            json={"model": "local/tiny", "query": "red apple", "candidates": ["blue sky", "red apple"], "top_k": 1},
+        )
+
+    expected = _bag_of_words("red apple pie")[:4]
+    vector = np.asarray(short.json()["data"][0]["embedding"], dtype="<f4")
+    np.testing.assert_allclose(vector, expected / np.linalg.norm(expected), rtol=1e-6)
+    assert tokens.status_code == too_wide.status_code == 400
+    assert ranked.json()["data"][0]["matches"] == [{"index": 1, "score": 1.0}]
+    assert stub_upstream["models"] == []
+
+
+def test_sentence_transformers_models_load_from_a_path(
+    stub_upstream: dict, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    pytest.importorskip("sentence_transformers")
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import StaticEmbedding
+    from tokenizers import Tokenizer
+    from tokenizers.models import WordLevel
+    from tokenizers.pre_tokenizers import Whitespace
+
+    vocab = {"[UNK]": 0, "red": 1, "apple": 2, "blue": 3, "sky": 4}
+    tokenizer = Tokenizer(WordLevel(vocab, unk_token="[UNK]"))  # noqa: S106
+    tokenizer.pre_tokenizer = Whitespace()
+    weights = np.random.default_rng(3).standard_normal((len(vocab), 8)).astype("<f4")
+    SentenceTransformer(modules=[StaticEmbedding(tokenizer, embedding_weights=weights)]).save(str(tmp_path / "tiny"))
+    monkeypatch.setattr(settings, "EMBEDDINGS_LOCAL_MODELS", f"local/st={tmp_path / 'tiny'}", raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_LOCAL_DEVICE", "cpu", raising=False)
+    monkeypatch.setattr(settings, "EMBEDDINGS_LOCAL_MAX_BATCH", 2, raising=False)
+    passes: list[int] = []
+    real_tokenize = SentenceTransformer.tokenize
+
+    def counting_tokenize(self: SentenceTransformer, texts: list, *args: object, **kwargs: object) -> dict:
+        passes.append(len(texts))  # encode() tokenizes each pass's batch just before running it
+        return real_tokenize(self, texts, *args, **kwargs)
+
+    monkeypatch.setattr(SentenceTransformer, "tokenize", counting_tokenize)
+
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/embeddings", json={"model": "local/st", "input": ["red apple", "blue sky", "red sky"]})
+
+    vectors = np.asarray([d["embedding"] for d in r.json()["data"]], dtype="<f4")
+    assert vectors.shape == (3, 8)
+    assert sorted(passes) == [1, 2], "one merged batch still runs in passes of at most MAX_BATCH rows"
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1.0, rtol=1e-5)
+    assert stub_upstream["models"] == []
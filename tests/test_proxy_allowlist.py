@@ -0,0 +1,113 @@
+# tests/test_proxy_allowlist.py
+"""/v1/proxy allow/block rules compiled into one segment trie.
+
+Why this exists
+---------------
+The proxy used to scan ~60 anchored regexes per call. The rules now live in one
+path-segment trie (app/utils/path_trie.py) with a decision cache keyed by path
+shape. These tests pin the decisions the regex scan made: each allowlist
+pattern is turned back into its regex, and both matchers must agree on every
+path in a combinatorial corpus.
+"""
+
+from __future__ import annotations
+
+import itertools
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.main import create_app
+from app.routes import proxy
+from app.utils.path_trie import PathPolicy
+
+pytestmark = pytest.mark.unit
+
+_WILDCARDS = {"{id}": "[A-Za-z0-9_-]+", "{seg}": "[^/]+"}
+_METHODS = ("GET", "POST", "PUT", "PATCH", "DELETE")
+_SEGMENTS = (
+    "v1", "responses", "compact", "resp_1", "cancel", "input_items", "models", "gpt-4.1",
+    "files", "file-abc", "content", "results", "vector_stores", "search", "file_batches",
+    "containers", "batches", "videos", "images", "edits", "generations", "audio", "audiobooks",
+    "uploads", "moderations", "a.b", "",
+)  # fmt: skip
+
+
+def _regex_decision(method: str, path: str) -> bool:
+    """The previous implementation's logic, rebuilt from the same tables."""
+    if proxy._precheck_reason(path, None):
+        return False
+    if path in proxy._BLOCKED_PATHS or any(path.endswith(s) for s in proxy._BLOCKED_SUFFIXES):
+        return False
+    if any(path == p or path.startswith(p + "/") for p in proxy._BLOCKED_PREFIXES):
+        return False
+    if (method, path) in set(proxy._BLOCKED_METHOD_PATHS):
+        return False
+    for methods, pattern in proxy._ALLOWLIST:
+        rx = "^" + "/".join(_WILDCARDS.get(seg, re.escape(seg)) for seg in pattern.split("/")) + "$"
+        if method in methods and re.match(rx, path):
+            return True
+    return False
+
+
+@pytest.fixture(autouse=True)
+def _auth_off(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+
+
+def test_trie_agrees_with_regex_scan_on_every_corpus_path() -> None:
+    mismatches = []
+    for n in (1, 2, 3):
+        for combo in itertools.product(_SEGMENTS, repeat=n):
+            path = proxy._normalize_path("/v1/" + "/".join(combo))
+            for method in _METHODS:
+                if proxy.explain(method, path).allowed != _regex_decision(method, path):
+                    mismatches.append((method, path))
+    assert mismatches == []
+
+
+@pytest.mark.parametrize(
+    ("method", "path", "allowed"),
+    [
+        ("GET", "/v1/responses/compact", True),  # a literal also fills the {id} wildcard
+        ("POST", "/v1/responses/compact", True),
+        ("GET", "/v1/models/gpt-4.1", True),
+        ("GET", "/v1/files/file.abc", False),  # file ids are [A-Za-z0-9_-]+
+        ("GET", "/v1/models/", False),
+        ("POST", "/v1/files", False),
+        ("GET", "/v1/files/file-abc/content", False),
+        ("GET", "/v1/audio/speech", False),
+        ("PATCH", "/v1/vector_stores/vs_1", True),
+    ],
+)
+def test_representative_decisions(method: str, path: str, allowed: bool) -> None:
+    assert proxy.explain(method, path).allowed is allowed
+
+
+def test_decision_cache_is_keyed_by_shape() -> None:
+    policy = PathPolicy()
+    policy.allow(["GET"], "/v1/files/{id}")
+    for i in range(50):
+        assert policy.decide("GET", f"/v1/files/file-{i}").allowed
+    info = policy.cache_info()
+    assert (info.misses, info.currsize) == (1, 1), "every file id has the same shape"
+
+
+def test_explain_endpoint_names_the_rule_without_calling_upstream() -> None:
+    with TestClient(create_app()) as client:
+        ok = client.post("/v1/proxy:explain", json={"method": "get", "path": "files/file-abc"}).json()
+        blocked = client.post("/v1/proxy:explain", json={"method": "POST", "path": "/v1/uploads/u_1/parts"}).json()
+        missing = client.post("/v1/proxy:explain", json={"method": "PUT", "path": "/v1/batches"}).json()
+
+    assert ok == {
+        "method": "GET",
+        "path": "/v1/files/file-abc",
+        "allowed": True,
+        "blocked": False,
+        "reason": "allowlisted",
+        "rule": "/v1/files/{id}",
+    }
+    assert blocked["blocked"] is True and blocked["reason"] == "blocked prefix: /v1/uploads"
+    assert missing["allowed"] is False and missing["blocked"] is False and missing["rule"] is None
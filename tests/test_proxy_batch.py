@@ -0,0 +1,144 @@
+# tests/test_proxy_batch.py
+"""POST /v1/proxy:batch — many proxy envelopes in one round trip.
+
+Why this exists
+---------------
+Actions and agents that need several independent calls paid one round trip
+to /v1/proxy each. The batch endpoint runs them concurrently under a bound.
+Every item still goes through the proxy's allow/block rules, and one refused
+item fails alone. The stub is threaded and records the peak number of
+requests in flight, so the concurrency bound is measured, not assumed.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.routes import proxy
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+# file id -> seconds the stub takes to answer
+_DELAYS = {"file-slow": 0.6, "file-mid": 0.3, "file-fast": 0.0, "file-extra": 0.3}
+
+
+@pytest.fixture(autouse=True)
+def _auth_off(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state = {"in_flight": 0, "peak": 0, "paths": []}
+    lock = threading.Lock()
+
+    class _H(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            file_id = self.path.rsplit("/", 1)[-1]
+            with lock:
+                state["paths"].append(self.path)
+                state["in_flight"] += 1
+                state["peak"] = max(state["peak"], state["in_flight"])
+            time.sleep(_DELAYS.get(file_id, 0.0))
+            with lock:
+                state["in_flight"] -= 1
+            status = 200 if file_id in _DELAYS else 404
+            payload = json.dumps({"id": file_id, "object": "file"} if status == 200 else {"error": {"message": "nope"}})
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload.encode())
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _get(file_id: str) -> dict:
+    return {"method": "GET", "path": f"/v1/files/{file_id}"}
+
+
+def test_json_results_keep_input_order_and_respect_the_bound(stub_upstream: dict) -> None:
+    batch = {
+        "requests": [
+            _get("file-slow"),
+            _get("file-mid"),
+            {"method": "POST", "path": "/v1/uploads", "body": {}},
+            _get("file-missing"),
+            _get("file-fast"),
+            _get("file-extra"),
+        ],
+        "concurrency": 2,
+    }
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/proxy:batch", json=batch)
+
+    assert r.status_code == 200
+    items = r.json()
+    assert [i["index"] for i in items] == [0, 1, 2, 3, 4, 5]
+    assert [i["status"] for i in items] == [200, 200, 403, 404, 200, 200]
+    assert items[0]["body"]["id"] == "file-slow"
+    assert items[2]["body"]["error"]["message"] == "blocked prefix: /v1/uploads"
+    assert len(stub_upstream["paths"]) == 5, "the refused item must never reach upstream"
+    assert stub_upstream["peak"] == 2, f"expected exactly 2 calls in flight, saw {stub_upstream['peak']}"
+
+
+def test_ndjson_streams_in_completion_order(stub_upstream: dict) -> None:
+    batch = {"requests": [_get("file-slow"), _get("file-mid"), _get("file-fast")], "format": "ndjson"}
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/proxy:batch", json=batch)
+
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines() if line]
+    assert [line["body"]["id"] for line in lines] == ["file-fast", "file-mid", "file-slow"]
+    assert [line["index"] for line in lines] == [2, 1, 0]
+
+
+def test_oversized_batch_is_rejected(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "PROXY_BATCH_MAX_ITEMS", 2, raising=False)
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/proxy:batch", json={"requests": [_get("a"), _get("b"), _get("c")]})
+    assert r.status_code == 400
+
+
+@pytest.mark.parametrize("fmt", ["json", "ndjson"])
+def test_an_unexpected_error_fails_only_its_own_item(
+    stub_upstream: dict, monkeypatch: pytest.MonkeyPatch, fmt: str
+) -> None:
+    real_forward = proxy.forward_openai_method_path
+
+    async def flaky_forward(*args: object, path: str, **kwargs: object) -> object:
+        if path.endswith("file-mid"):
+            raise ValueError("undecodable upstream answer")
+        return await real_forward(*args, path=path, **kwargs)
+
+    monkeypatch.setattr(proxy, "forward_openai_method_path", flaky_forward)
+    batch = {"requests": [_get("file-fast"), _get("file-mid"), _get("file-slow")], "format": fmt}
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/proxy:batch", json=batch)
+
+    assert r.status_code == 200
+    items = r.json() if fmt == "json" else [json.loads(line) for line in r.text.splitlines() if line]
+    by_index = {i["index"]: i for i in items}
+    assert sorted(by_index) == [0, 1, 2], "the stream must not be cut off after the failure"
+    assert [by_index[i]["status"] for i in range(3)] == [200, 500, 200]
+    assert by_index[1]["body"]["error"]["message"] == "Relay error: ValueError"
@@ -0,0 +1,266 @@
+# tests/test_proxy_chain.py
+"""POST /v1/proxy:chain — a DAG of proxy calls and polls in one request.
+
+Why this exists
+---------------
+Flows like "create vector store -> attach file batch -> poll until ready ->
+search" used to cost the client one round trip per call plus its own poll
+loop. The chain runs them server-side, with references between steps.
+CHAIN_WAIT_MODE, which config.py parsed and nothing read, now chooses the
+schedule. The threaded stub records request bodies and the peak number of
+calls in flight, so the difference between the schedules is measured.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.routes import proxy_chain
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture(autouse=True)
+def _auth_off(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"in_flight": 0, "peak": 0, "calls": [], "polls": 0, "flaky": [503, 429]}
+    lock = threading.Lock()
+
+    class _H(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: dict) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _route(self, method: str) -> None:
+            body = json.loads(self.rfile.read(int(self.headers.get("content-length") or 0)) or b"null")
+            with lock:
+                state["calls"].append((method, self.path, body))
+                state["in_flight"] += 1
+                state["peak"] = max(state["peak"], state["in_flight"])
+            try:
+                if method == "POST" and self.path == "/v1/vector_stores":
+                    self._reply(200, {"id": "vs_1", "object": "vector_store"})
+                elif method == "POST" and self.path == "/v1/vector_stores/vs_1/file_batches":
+                    self._reply(200, {"id": "vsfb_1", "status": "in_progress"})
+                elif method == "GET" and self.path == "/v1/vector_stores/vs_1/file_batches/vsfb_1":
+                    state["polls"] += 1
+                    self._reply(200, {"id": "vsfb_1", "status": "completed" if state["polls"] >= 3 else "in_progress"})
+                elif method == "GET" and self.path == "/v1/vector_stores/vs_1/file_batches/vsfb_flaky":
+                    if state["flaky"]:
+                        status = state["flaky"].pop(0)
+                        self._reply(status, {"error": {"message": f"status {status}"}})
+                    else:
+                        self._reply(200, {"id": "vsfb_flaky", "status": "completed"})
+                elif method == "POST" and self.path == "/v1/vector_stores/vs_1/search":
+                    self._reply(200, {"data": [{"file_id": "file-a", "score": 0.9}]})
+                elif method == "GET" and self.path.startswith("/v1/files/file-"):
+                    time.sleep(0.2)
+                    self._reply(200, {"id": self.path.rsplit("/", 1)[-1]})
+                else:
+                    self._reply(404, {"error": {"message": f"no route {self.path}"}})
+            finally:
+                with lock:
+                    state["in_flight"] -= 1
+
+        def do_GET(self) -> None:
+            self._route("GET")
+
+        def do_POST(self) -> None:
+            self._route("POST")
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _events(text: str) -> list[dict]:
+    return [json.loads(line) for line in text.splitlines() if line]
+
+
+def test_vector_store_flow_with_references_and_a_wait(stub_upstream: dict) -> None:
+    chain = {
+        "steps": [
+            {"id": "vs", "method": "POST", "path": "/v1/vector_stores", "body": {"name": "kb"}},
+            {
+                "id": "batch",
+                "method": "POST",
+                "path": "/v1/vector_stores/{{vs.id}}/file_batches",
+                "body": {"file_ids": ["file-a"], "note": "for {{ $.vs.id }}"},
+            },
+            {
+                "id": "ready",
+                "wait": {
+                    "path": "/v1/vector_stores/{{vs.id}}/file_batches/{{batch.id}}",
+                    "field": "status",
+                    "success": ["completed"],
+                    "failure": ["failed"],
+                    "interval": 0.2,
+                },
+            },
+            {
+                "id": "hits",
+                "method": "POST",
+                "path": "/v1/vector_stores/{{vs.id}}/search",
+                "body": {"query": "refunds"},
+                "depends_on": ["ready"],
+            },
+        ]
+    }
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/proxy:chain", json=chain)
+
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    events = _events(r.text)
+    final = events[-1]
+    assert final["event"] == "chain.completed" and final["ok"] is True, final
+    assert final["steps"]["hits"]["body"]["data"][0]["file_id"] == "file-a"
+
+    progress = [e["value"] for e in events if e["event"] == "step.progress"]
+    assert progress == ["in_progress", "in_progress", "completed"]
+
+    batch_call = next(c for c in stub_upstream["calls"] if c[1].endswith("/file_batches"))
+    assert batch_call[2] == {"file_ids": ["file-a"], "note": "for vs_1"}
+    assert stub_upstream["calls"][-1][1] == "/v1/vector_stores/vs_1/search", "search must wait for the poll step"
+
+
+@pytest.mark.parametrize(("mode", "peak"), [("parallel", 3), ("sequential", 1)])
+def test_mode_decides_whether_independent_steps_overlap(
+    monkeypatch: pytest.MonkeyPatch, stub_upstream: dict, mode: str, peak: int
+) -> None:
+    monkeypatch.setattr(settings, "CHAIN_WAIT_MODE", mode, raising=False)
+    chain = {"format": "json", "steps": [{"id": f"f{i}", "method": "GET", "path": f"/v1/files/file-{i}"} for i in range(3)]}
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/proxy:chain", json=chain)
+
+    assert r.json()["ok"] is True and r.json()["mode"] == mode
+    assert stub_upstream["peak"] == peak
+
+
+def test_failed_step_skips_its_dependents_only(stub_upstream: dict) -> None:
+    chain = {
+        "format": "json",
+        "steps": [
+            {"id": "missing", "method": "GET", "path": "/v1/files/nope/content"},
+            {"id": "after", "method": "GET", "path": "/v1/files/file-{{missing.id}}"},
+            {"id": "other", "method": "GET", "path": "/v1/files/file-z"},
+        ],
+    }
+    with TestClient(create_app()) as client:
+        summary = client.post("/v1/proxy:chain", json=chain).json()
+
+    assert summary["ok"] is False
+    assert summary["steps"]["missing"]["status"] == 403, "chain steps get the /v1/proxy block rules"
+    assert summary["steps"]["after"] == {"state": "skipped", "because": ["missing"]}
+    assert summary["steps"]["other"]["state"] == "completed"
+
+
+@pytest.mark.parametrize(
+    "steps",
+    [
+        [{"id": "a", "method": "GET", "path": "/v1/files/{{b.id}}"}, {"id": "b", "method": "GET", "path": "/v1/files/{{a.id}}"}],
+        [{"id": "a", "method": "GET", "path": "/v1/files/{{ghost.id}}"}],
+    ],
+)
+def test_cycles_and_unknown_references_are_rejected_up_front(steps: list[dict]) -> None:
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/proxy:chain", json={"steps": steps})
+    assert r.status_code == 400
+
+
+def test_reference_of_the_wrong_type_fails_only_its_step(stub_upstream: dict) -> None:
+    chain = {
+        "steps": [
+            {"id": "f", "method": "GET", "path": "/v1/files/file-1"},
+            {"id": "bad", "method": "GET", "path": "{{f}}"},
+            {"id": "other", "method": "GET", "path": "/v1/files/file-2"},
+        ]
+    }
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/proxy:chain", json=chain)
+
+    final = _events(r.text)[-1]
+    assert final["event"] == "chain.completed" and final["ok"] is False
+    assert final["steps"]["bad"]["state"] == "failed" and final["steps"]["bad"]["status"] == 400
+    assert final["steps"]["other"]["state"] == "completed"
+
+
+def test_waits_poll_through_rate_limits_without_holding_a_slot(
+    monkeypatch: pytest.MonkeyPatch, stub_upstream: dict
+) -> None:
+    monkeypatch.setattr(settings, "PROXY_BATCH_CONCURRENCY", 1, raising=False)
+    chain = {
+        "mode": "parallel",
+        "steps": [
+            {
+                "id": "ready",
+                "wait": {
+                    "path": "/v1/vector_stores/vs_1/file_batches/vsfb_flaky",
+                    "field": "status",
+                    "success": ["completed"],
+                    "interval": 0.3,
+                },
+            },
+            {"id": "f", "method": "GET", "path": "/v1/files/file-1"},
+        ],
+    }
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/proxy:chain", json=chain)
+
+    events = _events(r.text)
+    assert events[-1]["ok"] is True, events[-1]
+    assert [e.get("status") for e in events if e["event"] == "step.progress"] == [503, 429, None]
+    completed = [e["id"] for e in events if e["event"] == "step.completed"]
+    assert completed == ["f", "ready"], "the file step must not wait for the whole poll loop"
+
+
+def test_an_unexpected_error_fails_only_its_step(stub_upstream: dict, monkeypatch: pytest.MonkeyPatch) -> None:
+    real_call = proxy_chain.execute_proxy_call
+
+    async def flaky_call(call: object, inbound: object) -> object:
+        if call.path.endswith("file-2"):  # type: ignore[attr-defined]
+            raise ValueError("undecodable upstream answer")
+        return await real_call(call, inbound)  # type: ignore[arg-type]
+
+    monkeypatch.setattr(proxy_chain, "execute_proxy_call", flaky_call)
+    chain = {
+        "steps": [
+            {"id": "bad", "method": "GET", "path": "/v1/files/file-2"},
+            {"id": "after", "method": "GET", "path": "/v1/files/{{bad.id}}"},
+            {"id": "other", "method": "GET", "path": "/v1/files/file-1"},
+        ]
+    }
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/proxy:chain", json=chain)
+
+    final = _events(r.text)[-1]
+    assert final["event"] == "chain.completed" and final["ok"] is False
+    assert final["steps"]["bad"]["status"] == 500
+    assert final["steps"]["bad"]["body"]["error"]["message"] == "Relay error: ValueError"
+    assert final["steps"]["after"] == {"state": "skipped", "because": ["bad"]}
+    assert final["steps"]["other"]["state"] == "completed"
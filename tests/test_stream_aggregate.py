@@ -0,0 +1,141 @@
+# tests/test_stream_aggregate.py
+"""Non-stream POST /v1/responses served from an upstream stream.
+
+Why this exists
+---------------
+A non-stream call to a slow reasoning model used to hold a silent upstream
+connection for the whole generation and die at RELAY_TIMEOUT with a 424 while
+the tokens were still billed. With RESPONSES_AGGREGATE_STREAM on, the relay
+asks upstream for a stream, and only the gap between events is timed. The
+caller still gets the plain response object.
+
+Runs against a real HTTP server for the reason given in
+tests/test_containers_file_content.py.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+_MESSAGE = {
+    "id": "msg_1",
+    "type": "message",
+    "role": "assistant",
+    "content": [{"type": "output_text", "text": "slow answer"}],
+}
+
+
+def _event(name: str, **extra: object) -> bytes:
+    return f"event: {name}\ndata: {json.dumps({'type': name, **extra})}\n\n".encode()
+
+
+@pytest.fixture(autouse=True)
+def _auth_off(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"bodies": [], "mode": "ok"}
+
+    class _H(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers.get("content-length") or 0)))
+            state["bodies"].append(body)
+            if not body.get("stream"):
+                payload = json.dumps({"id": "resp_plain", "object": "response"}).encode()
+                self.send_response(200)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+
+            self.send_response(200)
+            self.send_header("content-type", "text/event-stream")
+            self.send_header("openai-processing-ms", "1234")
+            self.end_headers()
+            self.wfile.write(_event("response.created", response={"id": "resp_agg", "status": "in_progress"}))
+            self.wfile.flush()
+            if state["mode"] == "stall":
+                time.sleep(2)
+                return
+            if state["mode"] == "error":
+                self.wfile.write(_event("error", code="server_error", message="boom", param=None))
+                return
+            # Total runtime exceeds the idle timeout; no single gap does.
+            for _ in range(4):
+                time.sleep(0.3)
+                self.wfile.write(_event("response.in_progress", response={"id": "resp_agg"}))
+                self.wfile.flush()
+            self.wfile.write(_event("response.output_item.done", output_index=0, item=_MESSAGE))
+            self.wfile.write(
+                _event("response.completed", response={"id": "resp_agg", "status": "completed", "output": []})
+            )
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), _H)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    monkeypatch.setattr(settings, "RESPONSES_AGGREGATE_STREAM", True, raising=False)
+    monkeypatch.setattr(settings, "RESPONSES_STREAM_IDLE_TIMEOUT", 1, raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_long_generation_is_bounded_by_idle_gap_not_total_time(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/responses", json={"model": "m", "input": "think hard"})
+
+    assert r.status_code == 200, r.text
+    assert r.headers["content-type"].startswith("application/json")
+    assert r.headers.get("openai-processing-ms") == "1234", "upstream headers must survive aggregation"
+    data = r.json()
+    assert data["id"] == "resp_agg" and data["status"] == "completed"
+    assert data["output"] == [_MESSAGE], "output must be rebuilt from output_item.done when the terminal event omits it"
+    assert stub_upstream["bodies"][0]["stream"] is True
+
+
+def test_idle_upstream_still_times_out(stub_upstream: dict) -> None:
+    stub_upstream["mode"] = "stall"
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/responses", json={"model": "m", "input": "x"})
+    assert r.status_code == 424
+
+
+def test_error_event_becomes_error_response(stub_upstream: dict) -> None:
+    stub_upstream["mode"] = "error"
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/responses", json={"model": "m", "input": "x"})
+    assert r.status_code == 500
+    assert r.json()["error"]["message"] == "boom"
+
+
+def test_disabled_or_background_requests_are_forwarded_unchanged(
+    monkeypatch: pytest.MonkeyPatch, stub_upstream: dict
+) -> None:
+    with TestClient(create_app()) as client:
+        bg = client.post("/v1/responses", json={"model": "m", "input": "x", "background": True})
+        monkeypatch.setattr(settings, "RESPONSES_AGGREGATE_STREAM", False, raising=False)
+        off = client.post("/v1/responses", json={"model": "m", "input": "x"})
+
+    assert bg.json()["id"] == "resp_plain" and off.json()["id"] == "resp_plain"
+    assert all("stream" not in b for b in stub_upstream["bodies"])
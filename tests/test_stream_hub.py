@@ -0,0 +1,189 @@
+# tests/test_stream_hub.py
+"""Shared GET /v1/responses/{id}?stream=true subscriptions.
+
+Why this exists
+---------------
+Every watcher of a background response used to open its own upstream stream
+(or poll upstream). The hub opens one upstream stream per response id, and
+subscribers attach to it from their own cursor. The stub counts upstream
+requests, so "one upstream stream" is asserted, not assumed.
+
+Runs against a real HTTP server for the reason given in
+tests/test_containers_file_content.py.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import httpx
+import pytest
+
+from app.api import stream_replay
+from app.api.sse_events import SSEEvent
+from app.api.stream_replay import ReplayStore
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+_RID = "resp_hub"
+
+
+def _event(name: str, seq: int, **extra: object) -> bytes:
+    payload = {"type": name, "sequence_number": seq, **extra}
+    return f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode()
+
+
+_EVENTS = [
+    _event("response.created", 0, response={"id": _RID, "status": "queued", "output": []}),
+    _event("response.in_progress", 1, response={"id": _RID, "status": "in_progress", "output": []}),
+    _event("response.output_text.delta", 2, delta="hi"),
+    _event("response.output_item.done", 3, output_index=0, item={"type": "message", "id": "msg_1"}),
+    _event("response.completed", 4, response={"id": _RID, "status": "completed", "output": []}),
+]
+
+
+@pytest.fixture(autouse=True)
+def _isolated(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(stream_replay, "_store", None)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[list[str]]:
+    seen: list[str] = []
+
+    class _H(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            seen.append(self.path)
+            if not self.path.startswith(f"/v1/responses/{_RID}?"):
+                payload = b'{"error": {"message": "No response found", "type": "invalid_request_error"}}'
+                self.send_response(404)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            self.send_response(200)
+            self.send_header("content-type", "text/event-stream")
+            self.end_headers()
+            for frame in _EVENTS:
+                self.wfile.write(frame)
+                self.wfile.flush()
+                time.sleep(0.1)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), _H)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield seen
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _ids(body: str) -> list[int]:
+    return [int(line[3:].strip()) for line in body.splitlines() if line.startswith("id:")]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_subscribers_share_one_upstream_stream(stub_upstream: list[str]) -> None:
+    transport = httpx.ASGITransport(app=create_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://relay") as client:
+        full, tail = await asyncio.gather(
+            client.get(f"/v1/responses/{_RID}", params={"stream": "true"}),
+            client.get(f"/v1/responses/{_RID}", params={"stream": "true", "starting_after": "2"}),
+        )
+        poll = await client.get(f"/v1/responses/{_RID}")
+
+    assert full.status_code == 200 and tail.status_code == 200
+    assert _ids(full.text) == [0, 1, 2, 3, 4]
+    assert _ids(tail.text) == [3, 4], "each subscriber resumes from its own cursor"
+
+    assert len(stub_upstream) == 1, f"expected one shared upstream stream, upstream saw {stub_upstream}"
+    assert "starting_after" not in stub_upstream[0], "the shared stream must start from the beginning"
+
+    assert poll.json()["status"] == "completed"
+    assert poll.json()["output"] == [{"type": "message", "id": "msg_1"}]
+
+
+@pytest.mark.asyncio
+async def test_non_stream_upstream_answer_passes_through_and_is_not_cached(stub_upstream: list[str]) -> None:
+    transport = httpx.ASGITransport(app=create_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://relay") as client:
+        first = await client.get("/v1/responses/resp_missing", params={"stream": "true"})
+        second = await client.get("/v1/responses/resp_missing", params={"stream": "true"})
+
+    assert first.status_code == 404 and second.status_code == 404
+    assert first.json()["error"]["message"] == "No response found"
+    assert len(stub_upstream) == 2
+
+
+@pytest.mark.asyncio
+async def test_lagging_subscriber_is_disconnected_with_its_cursor() -> None:
+    store = ReplayStore(max_bytes=1 << 20, spill_bytes=1 << 20, ttl_seconds=60)
+    buf = store.create("resp_lag")
+    for i in range(10):
+        buf.append(SSEEvent(lines=[f"data: {i}"], data=str(i)), i)
+
+    frames = [f async for f in buf.frames_after(2, max_lag=5)]
+    assert frames == [b": lagged 7 events; reconnect with Last-Event-ID: 2\n\n"]
+
+    buf.finish()
+    frames = [f async for f in buf.frames_after(2, max_lag=5)]
+    assert len(frames) == 7, "a finished stream is replayed in full; there is nothing left to fall behind"
+
+
+@pytest.mark.asyncio
+async def test_stream_cut_off_upstream_is_not_reused(monkeypatch: pytest.MonkeyPatch) -> None:
+    seen: list[str] = []
+
+    class _H(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            seen.append(self.path)
+            if "stream=true" not in self.path:
+                payload = json.dumps({"id": _RID, "status": "in_progress", "source": "upstream"}).encode()
+                self.send_response(200)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            self.send_response(200)
+            self.send_header("content-type", "text/event-stream")
+            self.end_headers()
+            # The first stream is cut off after two events, before response.completed.
+            for frame in _EVENTS[:2] if len(seen) == 1 else _EVENTS:
+                self.wfile.write(frame)
+                self.wfile.flush()
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), _H)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        transport = httpx.ASGITransport(app=create_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://relay") as client:
+            cut = await client.get(f"/v1/responses/{_RID}", params={"stream": "true"})
+            poll = await client.get(f"/v1/responses/{_RID}")
+            again = await client.get(f"/v1/responses/{_RID}", params={"stream": "true"})
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert _ids(cut.text) == [0, 1]
+    assert poll.json()["source"] == "upstream", "a cut-off snapshot must not answer polls"
+    assert _ids(again.text) == [0, 1, 2, 3, 4], "a new subscriber reopens upstream instead of a truncated replay"
+    assert len(seen) == 3
@@ -0,0 +1,220 @@
+# tests/test_stream_replay.py
+"""Resumable /v1/responses streams.
+
+Why this exists
+---------------
+A client that dropped mid-stream used to lose the generation: the upstream SSE
+stream was tied to its socket. The relay now pumps the upstream stream into a
+replay buffer and stamps each frame with `id: <sequence_number>`, so
+`GET /v1/responses:stream/{id}` with `Last-Event-ID` replays what was missed
+without a second upstream request.
+
+The end-to-end test runs against a real HTTP server on a socket rather than
+`httpx.MockTransport`, for the reason given in tests/test_containers_file_content.py:
+a buffered mock cannot reproduce streaming lifetimes. The stub counts requests,
+so "no new upstream request" is asserted, not assumed.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import stream_replay
+from app.api.sse_events import SSEEvent
+from app.api.stream_replay import ReplayStore
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+_RESPONSE_ID = "resp_replay_test"
+
+
+def _event(name: str, seq: int, **extra: object) -> bytes:
+    payload = {"type": name, "sequence_number": seq, **extra}
+    return f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode()
+
+
+_EVENTS = [
+    _event("response.created", 0, response={"id": _RESPONSE_ID, "status": "in_progress"}),
+    _event("response.output_text.delta", 1, delta="Hel"),
+    _event("response.output_text.delta", 2, delta="lo"),
+    _event("response.output_text.done", 3, text="Hello"),
+    _event("response.completed", 4, response={"id": _RESPONSE_ID, "status": "completed"}),
+]
+
+
+def _ev(text: str) -> SSEEvent:
+    return SSEEvent(lines=[f"data: {text}"], data=text)
+
+
+@pytest.fixture(autouse=True)
+def _isolated(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(stream_replay, "_store", None)
+
+
+@pytest.fixture()
+def stub_upstream() -> Iterator[tuple[str, list[str]]]:
+    seen: list[str] = []
+
+    class _H(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            seen.append(self.path)
+            self.rfile.read(int(self.headers.get("content-length") or 0))
+            self.send_response(200)
+            self.send_header("content-type", "text/event-stream")
+            self.end_headers()
+            # Split frames across writes so the relay has to re-frame them.
+            blob = b"".join(_EVENTS)
+            for i in range(0, len(blob), 37):
+                self.wfile.write(blob[i : i + 37])
+                self.wfile.flush()
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), _H)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}", seen
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _ids(body: str) -> list[int]:
+    return [int(line[3:].strip()) for line in body.splitlines() if line.startswith("id:")]
+
+
+def test_dropped_stream_resumes_from_last_event_id_without_a_new_upstream_call(
+    monkeypatch: pytest.MonkeyPatch, stub_upstream: tuple[str, list[str]]
+) -> None:
+    base, seen = stub_upstream
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", base, raising=False)
+
+    with TestClient(create_app()) as client:
+        first = client.post("/v1/responses:stream", json={"model": "m", "input": "hi"})
+        assert first.status_code == 200
+        assert _ids(first.text) == [0, 1, 2, 3, 4], f"every frame must carry its sequence id: {first.text!r}"
+
+        resumed = client.get(f"/v1/responses:stream/{_RESPONSE_ID}", headers={"Last-Event-ID": "2"})
+        assert resumed.status_code == 200
+        assert _ids(resumed.text) == [3, 4], f"expected only the frames after id 2, got {resumed.text!r}"
+        assert '"text": "Hello"' in resumed.text
+
+        by_query = client.get(f"/v1/responses:stream/{_RESPONSE_ID}?last_event_id=3")
+        assert _ids(by_query.text) == [4]
+
+    assert seen == ["/v1/responses"], f"resuming must not call upstream again; upstream saw {seen}"
+
+
+def test_resume_of_unknown_stream_is_404() -> None:
+    with TestClient(create_app()) as client:
+        r = client.get("/v1/responses:stream/resp_never_seen", headers={"Last-Event-ID": "1"})
+    assert r.status_code == 404
+    assert "resp_never_seen" in r.json()["error"]["message"]
+
+
+@pytest.mark.asyncio
+async def test_spilled_frames_replay_in_order(tmp_path) -> None:
+    store = ReplayStore(max_bytes=1 << 20, spill_bytes=64, ttl_seconds=60, spill_dir=str(tmp_path))
+    buf = store.create("resp_spill")
+    for i in range(20):
+        buf.append(_ev(f"frame-{i}"), i)
+    buf.finish()
+
+    assert buf.spilled, "64-byte spill threshold should have pushed frames to disk"
+    assert buf.mem_bytes <= 64 + len(_ev("frame-19").encode(event_id=19))
+
+    got = [frame async for frame in buf.frames_after(14)]
+    assert [f.split(b"\n", 1)[0] for f in got] == [f"id: {i}".encode() for i in range(15, 20)]
+
+
+@pytest.mark.asyncio
+async def test_spill_files_are_written_off_the_event_loop(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    on_loop: list = []
+    for name in ("_new_spill_file", "_append_frames"):
+        real = getattr(stream_replay, name)
+
+        def checked(*args: object, _real=real, _name=name) -> object:
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(_name)
+            except RuntimeError:
+                pass
+            return _real(*args)
+
+        monkeypatch.setattr(stream_replay, name, checked)
+
+    store = ReplayStore(max_bytes=1 << 20, spill_bytes=64, ttl_seconds=60, spill_dir=str(tmp_path))
+    buf = store.create("resp_spill_thread")
+    for i in range(20):
+        buf.append(_ev(f"frame-{i}"), i)
+        await asyncio.sleep(0)
+    buf.finish()
+    if buf._spill_task is not None:
+        await buf._spill_task
+
+    assert on_loop == []
+    assert list(tmp_path.iterdir()), "frames reached the spill file"
+    got = [frame async for frame in buf.frames_after(-1)]
+    assert [f.split(b"\n", 1)[0] for f in got] == [f"id: {i}".encode() for i in range(20)]
+
+
+@pytest.mark.asyncio
+async def test_memory_bound_evicts_finished_lru_and_spills_live(tmp_path) -> None:
+    store = ReplayStore(max_bytes=300, spill_bytes=10_000, ttl_seconds=60, spill_dir=str(tmp_path))
+    old = store.create("resp_old")
+    for i in range(5):
+        old.append(_ev("x" * 30), i)
+    old.finish()
+
+    live = store.create("resp_live")
+    for i in range(10):
+        live.append(_ev("y" * 30), i)
+
+    assert store.get("resp_old") is None, "the finished, least recently used buffer should be evicted first"
+    assert store.get("resp_live") is live, "a live stream is spilled, never dropped"
+    assert live.spilled
+    assert store.memory_bytes <= 300
+
+
+@pytest.mark.asyncio
+async def test_finished_streams_expire_after_ttl(monkeypatch: pytest.MonkeyPatch) -> None:
+    store = ReplayStore(max_bytes=1 << 20, spill_bytes=1 << 20, ttl_seconds=5)
+    buf = store.create("resp_ttl")
+    buf.append(_ev("x"))
+    buf.finish()
+    assert buf.finished_at is not None
+
+    monkeypatch.setattr(stream_replay.time, "monotonic", lambda: buf.finished_at + 6)
+    assert store.get("resp_ttl") is None
+
+
+@pytest.mark.asyncio
+async def test_reader_follows_live_appends_after_replay() -> None:
+    store = ReplayStore(max_bytes=1 << 20, spill_bytes=1 << 20, ttl_seconds=60)
+    buf = store.create("resp_live_follow")
+    buf.append(_ev("a"), 0)
+
+    async def consume() -> list[bytes]:
+        return [frame async for frame in buf.frames_after(-1)]
+
+    task = asyncio.create_task(consume())
+    await asyncio.sleep(0)
+    buf.append(_ev("b"), 1)
+    await asyncio.sleep(0)
+    buf.append(_ev("c"), 2)
+    buf.finish()
+
+    frames = await asyncio.wait_for(task, timeout=2)
+    assert [f.split(b"\n", 1)[0] for f in frames] == [b"id: 0", b"id: 1", b"id: 2"]
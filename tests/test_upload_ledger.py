@@ -0,0 +1,194 @@
+# tests/test_upload_ledger.py
+"""The part ledger behind /v1/actions/uploads: resume and auto-complete.
+
+Why this exists
+---------------
+A client whose upload through /v1/actions/uploads/{id}/parts was interrupted
+had no way to ask which parts had already gone upstream, so it started over.
+The relay now records every part it forwards in a sqlite ledger. GET .../status
+reports the first missing offset, and /complete can take its part ids from the
+ledger. The stub fails one part on purpose. The tests check that the status
+points the client back at exactly that range, and that /complete sends the ids
+in file order.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api.upload_ledger import UploadLedger
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture(autouse=True)
+def _isolated(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "UPLOAD_LEDGER_PATH", str(tmp_path / "ledger.sqlite3"), raising=False)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    state: dict = {"parts": 0, "fail_next_part": False, "completes": [], "expires_at": int(time.time()) + 3600}
+    lock = threading.Lock()
+
+    class _H(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: dict) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers["content-length"]))
+            if self.path == "/v1/uploads":
+                req = json.loads(body)
+                self._reply(200, {"id": "upload_1", "object": "upload", "status": "pending",
+                                  "expires_at": state["expires_at"], **req})  # fmt: skip
+            elif self.path.endswith("/parts"):
+                with lock:
+                    fail, state["fail_next_part"] = state["fail_next_part"], False
+                    state["parts"] += 1
+                    part_id = f"part_{state['parts']}"
+                if fail:
+                    self._reply(500, {"error": {"message": "upstream hiccup"}})
+                else:
+                    self._reply(200, {"id": part_id, "object": "upload.part"})
+            elif self.path.endswith("/complete"):
+                state["completes"].append(json.loads(body))
+                self._reply(200, {"id": "upload_1", "status": "completed", "file": {"id": "file-1"}})
+            else:
+                self._reply(200, {"id": "upload_1", "status": "cancelled"})
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _create(client: TestClient, size: int) -> None:
+    r = client.post(
+        "/v1/actions/uploads",
+        json={"purpose": "batch", "filename": "in.jsonl", "bytes": size, "mime_type": "application/jsonl"},
+    )
+    assert r.status_code == 200, r.text
+
+
+def _part(client: TestClient, data: bytes, offset: int | None = None) -> object:
+    query = "" if offset is None else f"?offset={offset}"
+    return client.post(
+        f"/v1/actions/uploads/upload_1/parts:raw{query}", content=data, headers={"content-type": "application/octet-stream"}
+    )
+
+
+def test_failed_part_is_reported_and_resume_completes_from_the_ledger(stub_upstream: dict) -> None:
+    chunks = [b"a" * 100, b"b" * 100, b"c" * 50]
+    with TestClient(create_app()) as client:
+        _create(client, 250)
+        assert _part(client, chunks[0]).status_code == 200
+        stub_upstream["fail_next_part"] = True
+        assert _part(client, chunks[1]).status_code == 500
+        # Sent past the gap: recorded, but not part of the resumable prefix.
+        assert _part(client, chunks[2], offset=200).status_code == 200
+
+        status = client.get("/v1/actions/uploads/upload_1/status").json()
+        assert status["next_offset"] == 100
+        assert [(p["offset"], p["status"]) for p in status["parts"]] == [(0, "uploaded"), (100, "failed"), (200, "uploaded")]
+        assert client.post("/v1/actions/uploads/upload_1/complete", json={}).status_code == 409
+        assert stub_upstream["completes"] == []
+
+        r = _part(client, chunks[1], offset=status["next_offset"])
+        assert r.headers["x-relay-part-offset"] == "100"
+        status = client.get("/v1/actions/uploads/upload_1/status").json()
+        assert status["complete"] is True
+        assert status["parts"][1]["sha256"] == hashlib.sha256(chunks[1]).hexdigest()
+
+        r = client.post("/v1/actions/uploads/upload_1/complete", json={})
+        assert r.status_code == 200, r.text
+        assert client.get("/v1/actions/uploads/upload_1/status").json()["status"] == "completed"
+
+    # part_1 went to offset 0, part_3 to 200, and the retry part_4 to 100.
+    assert stub_upstream["completes"] == [{"part_ids": ["part_1", "part_4", "part_3"]}]
+
+
+def test_an_uploaded_offset_cannot_be_overwritten(stub_upstream: dict) -> None:
+    with TestClient(create_app()) as client:
+        _create(client, 200)
+        assert _part(client, b"a" * 100, offset=0).status_code == 200
+        again = _part(client, b"x" * 100, offset=0)
+        status = client.get("/v1/actions/uploads/upload_1/status").json()
+
+    assert again.status_code == 409 and "part_1" in again.text
+    assert stub_upstream["parts"] == 1, "the refused part never reaches upstream"
+    assert [(p["offset"], p["part_id"], p["status"]) for p in status["parts"]] == [(0, "part_1", "uploaded")]
+
+
+def test_base64_parts_are_recorded_too(stub_upstream: dict) -> None:
+    data = b"hello world"
+    with TestClient(create_app()) as client:
+        _create(client, len(data))
+        r = client.post(
+            "/v1/actions/uploads/upload_1/parts",
+            json={"filename": "p", "mime_type": "text/plain", "data_base64": base64.b64encode(data).decode()},
+        )
+        assert r.status_code == 200, r.text
+        status = client.get("/v1/actions/uploads/upload_1/status").json()
+    assert status["complete"] is True and status["part_ids"] == ["part_1"]
+
+
+def test_expired_uploads_are_swept(monkeypatch: pytest.MonkeyPatch, stub_upstream: dict) -> None:
+    monkeypatch.setattr(settings, "UPLOAD_LEDGER_SWEEP_SECONDS", 0, raising=False)
+    stub_upstream["expires_at"] = int(time.time()) - 1
+    with TestClient(create_app()) as client:
+        _create(client, 10)
+        assert client.get("/v1/actions/uploads/upload_1/status").status_code == 404
+
+
+def test_ledger_calls_run_off_the_event_loop(monkeypatch: pytest.MonkeyPatch, stub_upstream: dict) -> None:
+    on_loop: list[str] = []
+
+    def _watch(name: str) -> None:
+        original = getattr(UploadLedger, name)
+
+        def wrapper(self: UploadLedger, *args: object, **kwargs: object) -> object:
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(name)
+            except RuntimeError:
+                pass
+            return original(self, *args, **kwargs)
+
+        monkeypatch.setattr(UploadLedger, name, wrapper)
+
+    for name in ("record_upload", "reserve_part", "finish_part", "status", "set_status"):
+        _watch(name)
+    with TestClient(create_app()) as client:
+        _create(client, 5)
+        assert _part(client, b"hello").status_code == 200
+        assert client.get("/v1/actions/uploads/upload_1/status").status_code == 200
+        assert client.post("/v1/actions/uploads/upload_1/complete", json={}).status_code == 200
+
+    assert on_loop == [], "sqlite ledger calls must not block the event loop"
@@ -0,0 +1,145 @@
+# tests/test_upload_parts.py
+"""POST /v1/uploads:stream — one body in, concurrent Upload parts out.
+
+Why this exists
+---------------
+Large files used to take create, one /parts call per part in sequence, then
+complete, each one relayed separately. The relay now does all three itself from a
+single streamed body. The threaded stub records every part, the peak number in
+flight, and the /complete payload. The tests reassemble the file from the part
+ids in the order the relay sent them, so ordering, retries and the MD5 are all
+checked against what upstream would actually store.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture(autouse=True)
+def _auth_off(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(settings, "UPLOAD_STREAM_PART_BYTES", 256 * 1024, raising=False)
+    monkeypatch.setattr(settings, "UPLOAD_STREAM_CONCURRENCY", 3, raising=False)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict]:
+    # fail_part: "once" makes the second part request a 500, "always" makes every part a 400.
+    state: dict = {"parts": {}, "attempts": 0, "in_flight": 0, "peak": 0, "calls": [], "fail_part": None}
+    lock = threading.Lock()
+
+    class _H(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: dict) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers["content-length"]))
+            with lock:
+                state["calls"].append(self.path)
+            if self.path == "/v1/uploads":
+                state["created"] = json.loads(body)
+                self._reply(200, {"id": "upload_1", "object": "upload", "status": "pending"})
+            elif self.path == "/v1/uploads/upload_1/parts":
+                self._part(body)
+            elif self.path == "/v1/uploads/upload_1/complete":
+                state["complete"] = json.loads(body)
+                self._reply(200, {"id": "upload_1", "status": "completed", "file": {"id": "file-big", "object": "file"}})
+            else:
+                self._reply(200, {"id": "upload_1", "status": "cancelled"})
+
+        def _part(self, body: bytes) -> None:
+            head = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+            data = next(BytesParser(policy=HTTP).parsebytes(head + body).iter_parts()).get_payload(decode=True)
+            with lock:
+                state["attempts"] += 1
+                attempt = state["attempts"]
+                state["in_flight"] += 1
+                state["peak"] = max(state["peak"], state["in_flight"])
+            time.sleep(0.05)
+            with lock:
+                state["in_flight"] -= 1
+            if state["fail_part"] == "always" or (state["fail_part"] == "once" and attempt == 2):
+                self._reply(400 if state["fail_part"] == "always" else 500, {"error": {"message": "bad part"}})
+                return
+            with lock:
+                part_id = f"part_{len(state['parts'])}"
+                state["parts"][part_id] = data
+            self._reply(200, {"id": part_id, "object": "upload.part"})
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _upload(body: bytes, query: str = "purpose=batch&filename=big.jsonl") -> object:
+    with TestClient(create_app()) as client:
+        return client.post(f"/v1/uploads:stream?{query}", content=body, headers={"content-type": "application/octet-stream"})
+
+
+def test_parts_run_concurrently_and_reassemble_in_order(stub_upstream: dict) -> None:
+    stub_upstream["fail_part"] = "once"
+    raw = os.urandom(10 * 256 * 1024 - 17)
+
+    r = _upload(raw)
+
+    assert r.status_code == 200, r.text
+    assert r.json()["id"] == "file-big"
+    assert stub_upstream["created"] == {
+        "purpose": "batch",
+        "filename": "big.jsonl",
+        "bytes": len(raw),
+        "mime_type": "application/octet-stream",
+    }
+    part_ids = stub_upstream["complete"]["part_ids"]
+    assert len(part_ids) == 10
+    assert b"".join(stub_upstream["parts"][p] for p in part_ids) == raw
+    assert stub_upstream["complete"]["md5"] == hashlib.md5(raw, usedforsecurity=False).hexdigest()
+    assert r.headers["x-relay-upload-sha256"] == hashlib.sha256(raw).hexdigest()
+    assert stub_upstream["attempts"] == 11, "the failed part is retried alone"
+    assert 2 <= stub_upstream["peak"] <= 3
+
+
+def test_a_part_that_keeps_failing_cancels_the_upload(stub_upstream: dict) -> None:
+    stub_upstream["fail_part"] = "always"
+    r = _upload(os.urandom(600 * 1024))
+    assert r.status_code == 502
+    assert "cancelled: part" in r.json()["error"]["message"]
+    assert stub_upstream["calls"][-1] == "/v1/uploads/upload_1/cancel"
+    assert "complete" not in stub_upstream
+
+
+def test_short_body_is_rejected_and_cancelled(stub_upstream: dict) -> None:
+    r = _upload(b"x" * 1000, "purpose=batch&filename=a.jsonl&bytes=5000")
+    assert r.status_code == 400
+    assert stub_upstream["calls"][-1] == "/v1/uploads/upload_1/cancel"
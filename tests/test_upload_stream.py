@@ -0,0 +1,181 @@
+# tests/test_upload_stream.py
+"""Actions upload wrappers: streamed base64 decode and the :raw siblings.
+
+Why this exists
+---------------
+`/v1/actions/files/upload` and `/v1/actions/uploads/{id}/parts` used to decode
+the whole data_base64 string at once and let httpx build the multipart body in
+memory, so both were capped at 10 MiB. They now decode into a spool as the body
+arrives and stream the multipart body upstream from it. The stub records
+exactly what reached it, so these tests check the bytes upstream received, not
+what the relay meant to send.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import os
+import threading
+from collections.abc import Iterator
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from tempfile import SpooledTemporaryFile
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import upload_stream
+from app.api.upload_stream import Base64Decoder, JsonFieldScanner
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture(autouse=True)
+def _auth_off(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    # Small enough that the multi-MiB payloads below roll the spool onto disk.
+    monkeypatch.setattr(settings, "UPLOAD_SPOOL_MEMORY_BYTES", 64 * 1024, raising=False)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[list]:
+    received: list = []
+
+    class _H(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers["content-length"]))
+            received.append({"path": self.path, "headers": dict(self.headers), "body": body})
+            payload = json.dumps({"id": "file-1", "object": "file"}).encode()
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), _H)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield received
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _form(call: dict) -> dict:
+    """Parse the multipart body the stub received into {name: (filename, type, bytes)}."""
+    head = f"Content-Type: {call['headers']['Content-Type']}\r\n\r\n".encode()
+    msg = BytesParser(policy=HTTP).parsebytes(head + call["body"])
+    return {
+        part.get_param("name", header="content-disposition"): (
+            part.get_filename(),
+            part.get_content_type(),
+            part.get_payload(decode=True),
+        )
+        for part in msg.iter_parts()
+    }
+
+
+def test_base64_file_upload_reaches_upstream_byte_for_byte(stub_upstream: list) -> None:
+    raw = os.urandom(3 * 1024 * 1024 + 1)
+    # Some encoders escape "/" in JSON strings; the scanner must undo that.
+    b64 = base64.b64encode(raw).decode().replace("/", "\\/")
+    body = '{"purpose": "assistants", "filename": "big.bin", "data_base64": "%s", "mime_type": "application/pdf"}' % b64
+
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/actions/files/upload", content=body, headers={"content-type": "application/json"})
+
+    assert r.status_code == 200, r.text
+    (call,) = stub_upstream
+    assert call["path"] == "/v1/files"
+    assert "Transfer-Encoding" not in call["headers"], "the multipart body has a known length"
+    form = _form(call)
+    assert form["purpose"][2] == b"assistants"
+    assert form["file"][:2] == ("big.bin", "application/pdf")
+    assert form["file"][2] == raw
+
+
+def test_raw_part_upload_sends_the_body_as_the_data_field(stub_upstream: list) -> None:
+    raw = os.urandom(200_000)
+    with TestClient(create_app()) as client:
+        r = client.post(
+            "/v1/actions/uploads/upload_1/parts:raw?filename=chunk-0",
+            content=raw,
+            headers={"content-type": "application/octet-stream"},
+        )
+
+    assert r.status_code == 200, r.text
+    (call,) = stub_upstream
+    assert call["path"] == "/v1/uploads/upload_1/parts"
+    assert _form(call)["data"] == ("chunk-0", "application/octet-stream", raw)
+
+
+def test_spool_writes_run_off_the_event_loop(stub_upstream: list, monkeypatch: pytest.MonkeyPatch) -> None:
+    on_loop: list[int] = []
+
+    class _WatchedSpool(SpooledTemporaryFile):
+        def write(self, data: bytes) -> int:
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(len(data))
+            except RuntimeError:
+                pass
+            return super().write(data)
+
+    monkeypatch.setattr(upload_stream, "_new_spool", lambda: _WatchedSpool(max_size=1024))
+    raw = os.urandom(300_000)
+    with TestClient(create_app()) as client:
+        r = client.post(
+            "/v1/actions/uploads/upload_1/parts:raw?filename=chunk-0",
+            content=raw,
+            headers={"content-type": "application/octet-stream"},
+        )
+        b64 = client.post(
+            "/v1/actions/files/upload",
+            json={"purpose": "x", "filename": "a", "mime_type": "text/plain", "data_base64": base64.b64encode(raw).decode()},
+        )
+
+    assert r.status_code == b64.status_code == 200
+    assert on_loop == [], "a spool past its memory threshold writes to disk"
+
+
+@pytest.mark.parametrize(
+    ("body", "status"),
+    [
+        ({"purpose": "x", "filename": "a", "mime_type": "text/plain", "data_base64": "not-base64!!"}, 400),
+        ({"filename": "a", "mime_type": "text/plain", "data_base64": "QUJD"}, 422),  # no purpose
+        ({"purpose": "x", "filename": "a", "mime_type": "text/plain", "data_base64": ""}, 400),
+        ({"purpose": "x", "filename": "a", "mime_type": "text/plain", "data_base64": "QUJDRA=="}, 413),
+    ],
+)
+def test_bad_uploads_never_reach_upstream(
+    monkeypatch: pytest.MonkeyPatch, stub_upstream: list, body: dict, status: int
+) -> None:
+    monkeypatch.setattr(settings, "ACTIONS_FILE_MAX_BYTES", 3, raising=False)
+    with TestClient(create_app()) as client:
+        r = client.post("/v1/actions/files/upload", json=body)
+    assert r.status_code == status, r.text
+    assert stub_upstream == []
+
+
+def test_scanner_and_decoder_agree_with_json_loads_at_every_split() -> None:
+    raw = bytes(range(256)) * 3
+    doc = json.dumps(
+        {"meta": {"tags": ["a", "b,}"], "n": 1.5}, "data_base64": base64.b64encode(raw).decode(), "purpose": "x\"y"}
+    ).encode()
+    for cut in range(len(doc) + 1):
+        scanner, decoder = JsonFieldScanner("data_base64"), Base64Decoder()
+        out = decoder.feed(scanner.feed(doc[:cut])) + decoder.feed(scanner.feed(doc[cut:]))
+        scanner.close()
+        decoder.close()
+        assert out == raw, cut
+        assert scanner.fields == {"meta": {"tags": ["a", "b,}"], "n": 1.5}, "purpose": 'x"y'}
@@ -0,0 +1,197 @@
+# tests/test_ws_streams.py
+"""WS /v1/responses:ws — many response streams over one socket.
+
+Why this exists
+---------------
+Browsers throttle concurrent SSE connections per host. The WebSocket carries
+several /v1/responses streams at once, each event tagged with the client's
+stream id, with per-stream credit and cancel. Upstream stays SSE: the stub
+below only speaks HTTP, and it records every body it receives.
+
+Runs against a real HTTP server for the reason given in
+tests/test_containers_file_content.py.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.api import stream_hub, stream_replay
+from app.api.ws_streams import _Stream
+from app.core.config import settings
+from app.main import create_app
+
+pytestmark = pytest.mark.unit
+
+
+def _events(rid: str, text: str) -> list[bytes]:
+    out = [("response.created", {"response": {"id": rid, "status": "in_progress"}})]
+    out += [("response.output_text.delta", {"delta": ch}) for ch in text]
+    out.append(("response.completed", {"response": {"id": rid, "status": "completed"}}))
+    return [
+        f"event: {name}\ndata: {json.dumps({'type': name, 'sequence_number': i, **extra})}\n\n".encode()
+        for i, (name, extra) in enumerate(out)
+    ]
+
+
+@pytest.fixture(autouse=True)
+def _isolated(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", False, raising=False)
+    monkeypatch.setattr(stream_replay, "_store", None)
+
+
+@pytest.fixture()
+def stub_upstream(monkeypatch: pytest.MonkeyPatch) -> Iterator[list[dict]]:
+    bodies: list[dict] = []
+
+    class _H(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers.get("content-length") or 0)))
+            bodies.append(body)
+            if body.get("input") == "bad":
+                payload = b'{"error": {"message": "bad input", "type": "invalid_request_error"}}'
+                self.send_response(400)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            self.send_response(200)
+            self.send_header("content-type", "text/event-stream")
+            self.end_headers()
+            slow = body.get("input") == "slow"
+            for frame in _events(f"resp_{body['input']}", "abc" if not slow else "x" * 50):
+                self.wfile.write(frame)
+                self.wfile.flush()
+                if slow:
+                    time.sleep(0.1)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), _H)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(settings, "OPENAI_API_BASE", f"http://127.0.0.1:{server.server_port}", raising=False)
+    try:
+        yield bodies
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _create(sid: str, text: str, **extra: object) -> dict:
+    return {"type": "response.create", "stream_id": sid, "body": {"model": "m", "input": text}, **extra}
+
+
+def test_two_streams_multiplex_over_one_socket(stub_upstream: list[dict]) -> None:
+    with TestClient(create_app()) as client, client.websocket_connect("/v1/responses:ws") as ws:
+        ws.send_json(_create("a", "one"))
+        ws.send_json(_create("b", "two"))
+        ws.send_json(_create("c", "bad"))
+
+        events: dict[str, list[dict]] = {"a": [], "b": []}
+        ended: set[str] = set()
+        error = None
+        while ended != {"a", "b"} or error is None:
+            msg = ws.receive_json()
+            if msg["type"] == "event":
+                events[msg["stream_id"]].append(msg)
+            elif msg["type"] == "stream.end":
+                ended.add(msg["stream_id"])
+            elif msg["type"] == "stream.error":
+                error = msg
+
+    for sid, rid in (("a", "resp_one"), ("b", "resp_two")):
+        assert [m["id"] for m in events[sid]] == [0, 1, 2, 3, 4]
+        assert events[sid][0]["data"]["response"]["id"] == rid, "events must stay on their own stream"
+        assert "".join(m["data"]["delta"] for m in events[sid][1:-1]) == "abc"
+    assert error["stream_id"] == "c" and error["status"] == 400
+    assert error["error"]["error"]["message"] == "bad input"
+    assert all(b["stream"] is True for b in stub_upstream), "upstream must stay SSE"
+
+
+def test_credit_bounds_events_in_flight(stub_upstream: list[dict]) -> None:
+    with TestClient(create_app()) as client, client.websocket_connect("/v1/responses:ws") as ws:
+        ws.send_json(_create("a", "one", credit=2))
+        first = [ws.receive_json() for _ in range(2)]
+        time.sleep(0.3)  # the whole upstream stream has arrived by now
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}, "no event may be sent once credit is spent"
+
+        ws.send_json({"type": "stream.credit", "stream_id": "a", "credit": 10})
+        rest = [ws.receive_json() for _ in range(4)]
+
+    assert [m["id"] for m in first] == [0, 1]
+    assert [m.get("id") for m in rest] == [2, 3, 4, None]
+    assert rest[-1] == {"type": "stream.end", "stream_id": "a"}
+
+
+def test_credit_grants_leave_unlimited_streams_unlimited() -> None:
+    async def deliver() -> None:
+        stream = _Stream(None)
+        stream.grant(1)
+        for _ in range(5):
+            await asyncio.wait_for(stream.take(), 1)
+        assert stream.credit is None
+
+    asyncio.run(deliver())
+
+
+def test_unexpected_failures_reach_the_client_as_stream_errors(
+    stub_upstream: list[dict], monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    async def broken_attach(*args: object, **kwargs: object) -> None:
+        raise RuntimeError("replay store exploded")
+
+    monkeypatch.setattr(stream_hub, "attach", broken_attach)
+    with TestClient(create_app()) as client, client.websocket_connect("/v1/responses:ws") as ws:
+        ws.send_json({"type": "response.resume", "stream_id": "r", "response_id": "resp_x"})
+        error = ws.receive_json()
+        ws.send_json(_create("a", "one"))
+        events = [ws.receive_json() for _ in range(6)]
+
+    assert error == {"type": "stream.error", "stream_id": "r", "status": 500, "error": {"message": "Relay error: RuntimeError"}}
+    assert "replay store exploded" in caplog.text
+    assert events[-1] == {"type": "stream.end", "stream_id": "a"}, "the socket and its other streams carry on"
+
+
+def test_cancel_stops_the_stream_and_its_upstream(stub_upstream: list[dict]) -> None:
+    with TestClient(create_app()) as client, client.websocket_connect("/v1/responses:ws") as ws:
+        ws.send_json(_create("a", "slow"))
+        assert ws.receive_json()["type"] == "event"
+        ws.send_json({"type": "stream.cancel", "stream_id": "a"})
+        msg = ws.receive_json()
+        while msg["type"] == "event":
+            msg = ws.receive_json()
+        assert msg == {"type": "stream.cancelled", "stream_id": "a"}
+
+        assert stream_replay.get_replay_store().get("resp_slow") is None, (
+            "cancelling a stream this socket created must stop the generation"
+        )
+
+
+def test_relay_auth_applies_to_the_socket(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "RELAY_AUTH_ENABLED", True, raising=False)
+    monkeypatch.setattr(settings, "RELAY_KEY", "ws-secret", raising=False)
+    with TestClient(create_app()) as client:
+        with pytest.raises(WebSocketDisconnect) as exc, client.websocket_connect("/v1/responses:ws"):
+            pass
+        assert exc.value.code == 1008
+
+        with client.websocket_connect("/v1/responses:ws?relay_key=ws-secret") as ws:
+            ws.send_json({"type": "ping"})
+            assert ws.receive_json() == {"type": "pong"}
+
+        with client.websocket_connect("/v1/responses:ws", headers={"X-Relay-Key": "ws-secret"}) as ws:
+            ws.send_json({"type": "ping"})
+            assert ws.receive_json() == {"type": "pong"}